@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Contour index of the flux function Ay for 2D field lines
+
+In 2D simulations, the in-plane magnetic field lines are the contours of Ay.
+The index is built once for each frame. The grid cells are bucketed by the
+range of Ay at their four corners, so the cells crossed by one contour level
+are found without scanning the whole grid. The contour segments in these
+cells are calculated with marching squares and linked into lines.
+
+    index = load_contour_index(pic_run, tframe)
+    xs, zs = index.field_line(x0, z0)
+    level = index.separatrix_level()
+    area = index.area_between(level, index.ay.max())
+"""
+from __future__ import print_function
+
+import argparse
+import functools
+import os
+
+import numpy as np
+
+import checkpoint
+import parallel_backend
+import xpoints
+from field_io import read_2d_fields
+from json_functions import read_data_from_json
+from shell_functions import mkdir_p
+
+# The segments in each marching-squares case. The corners v0, v1, v2, v3 are
+# (iz, ix), (iz, ix+1), (iz+1, ix+1), (iz+1, ix), and bit i of the case is
+# set when Ay at vi is larger than the level. The edges e0, e1, e2, e3 are
+# the bottom, right, top and left edges of the cell. The saddle cases 5 and
+# 10 depend on the Ay at the cell center.
+_CASE_SEGMENTS = {1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)],
+                  6: [(0, 2)], 7: [(3, 2)], 8: [(2, 3)], 9: [(0, 2)],
+                  11: [(1, 2)], 12: [(3, 1)], 13: [(0, 1)], 14: [(3, 0)]}
+_SADDLE_SEGMENTS = {(5, False): [(3, 0), (1, 2)],
+                    (5, True): [(0, 1), (2, 3)],
+                    (10, False): [(0, 1), (2, 3)],
+                    (10, True): [(3, 0), (1, 2)]}
+
+
+def _segment_table(center_above):
+    """Segments (pairs of edges) of all cases, -1 for no segment
+    """
+    table = np.full((16, 2, 2), -1, dtype=np.int64)
+    for case, segs in _CASE_SEGMENTS.items():
+        table[case, :len(segs)] = segs
+    for case in [5, 10]:
+        table[case] = _SADDLE_SEGMENTS[(case, center_above)]
+    return table
+
+
+_TABLE_BELOW = _segment_table(False)
+_TABLE_ABOVE = _segment_table(True)
+
+
+class AyContourIndex(object):
+    """Contour index of Ay of one frame
+
+    Args:
+        ay: Ay with shape (nz, nx)
+        x, z: the grid coordinates
+        nbins: number of Ay buckets
+    """
+    _saved = ['ay', 'x', 'z', 'cmin', 'cmax', 'nbins', 'amin', 'bin_width',
+              'bin_offsets', 'bin_cells']
+
+    def __init__(self, ay, x, z, nbins=256):
+        self.ay = np.asarray(ay, dtype=np.float64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.nz, self.nx = self.ay.shape
+        corners = np.stack([self.ay[:-1, :-1], self.ay[:-1, 1:],
+                            self.ay[1:, 1:], self.ay[1:, :-1]])
+        self.cmin = corners.min(axis=0).ravel()
+        self.cmax = corners.max(axis=0).ravel()
+        self.nbins = nbins
+        self.amin = self.cmin.min()
+        self.bin_width = (self.cmax.max() - self.amin) / nbins
+        if self.bin_width == 0:
+            self.bin_width = 1.0
+        ibmin = self._bin(self.cmin)
+        ibmax = self._bin(self.cmax)
+        counts = ibmax - ibmin + 1
+        ntot = counts.sum()
+        cells = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        bins = np.repeat(ibmin, counts) + np.arange(ntot) - starts
+        self.bin_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(bins, minlength=nbins))))
+        self.bin_cells = cells[np.argsort(bins, kind='stable')]
+
+    def _bin(self, level):
+        ibin = ((np.asarray(level) - self.amin) / self.bin_width).astype(np.int64)
+        return np.clip(ibin, 0, self.nbins - 1)
+
+    def cells_at_level(self, level):
+        """The indices of the cells crossed by one contour level
+        """
+        ibin = self._bin(level)
+        cells = self.bin_cells[self.bin_offsets[ibin]:self.bin_offsets[ibin+1]]
+        cond = (self.cmin[cells] <= level) & (self.cmax[cells] > level)
+        return cells[cond]
+
+    def _edge_ids(self, iz, ix, edges):
+        """Global edge ids from the local edges of cells
+
+        The horizontal edges are numbered before the vertical edges.
+        """
+        nh = self.nz * (self.nx - 1)
+        ids = np.empty(len(iz), dtype=np.int64)
+        for edge, dz, dx in [(0, 0, 0), (2, 1, 0)]:
+            cond = edges == edge
+            ids[cond] = (iz[cond] + dz) * (self.nx - 1) + ix[cond] + dx
+        for edge, dz, dx in [(3, 0, 0), (1, 0, 1)]:
+            cond = edges == edge
+            ids[cond] = nh + (iz[cond] + dz) * self.nx + ix[cond] + dx
+        return ids
+
+    def edge_points(self, ids, level):
+        """The positions where a contour level crosses the edges
+        """
+        nh = self.nz * (self.nx - 1)
+        xs = np.empty(len(ids))
+        zs = np.empty(len(ids))
+        hor = ids < nh
+        iz, ix = np.divmod(ids[hor], self.nx - 1)
+        a0 = self.ay[iz, ix]
+        frac = (level - a0) / (self.ay[iz, ix + 1] - a0)
+        xs[hor] = self.x[ix] + frac * (self.x[ix + 1] - self.x[ix])
+        zs[hor] = self.z[iz]
+        iz, ix = np.divmod(ids[~hor] - nh, self.nx)
+        a0 = self.ay[iz, ix]
+        frac = (level - a0) / (self.ay[iz + 1, ix] - a0)
+        xs[~hor] = self.x[ix]
+        zs[~hor] = self.z[iz] + frac * (self.z[iz + 1] - self.z[iz])
+        return xs, zs
+
+    def segments(self, level):
+        """Contour segments of one level
+
+        Returns:
+            (nseg, 2) global ids of the edges at the two ends of the segments
+        """
+        cells = self.cells_at_level(level)
+        iz, ix = np.divmod(cells, self.nx - 1)
+        v0 = self.ay[iz, ix]
+        v1 = self.ay[iz, ix + 1]
+        v2 = self.ay[iz + 1, ix + 1]
+        v3 = self.ay[iz + 1, ix]
+        case = ((v0 > level) * 1 + (v1 > level) * 2 +
+                (v2 > level) * 4 + (v3 > level) * 8)
+        center_above = (v0 + v1 + v2 + v3) * 0.25 > level
+        segs = np.where(center_above[:, None, None], _TABLE_ABOVE[case],
+                        _TABLE_BELOW[case])
+        valid = segs[:, :, 0] >= 0
+        icell = np.repeat(np.arange(len(cells)), 2).reshape(-1, 2)[valid]
+        segs = segs[valid]
+        ea = self._edge_ids(iz[icell], ix[icell], segs[:, 0])
+        eb = self._edge_ids(iz[icell], ix[icell], segs[:, 1])
+        return np.stack([ea, eb], axis=1)
+
+    @staticmethod
+    def _neighbours(segs):
+        """The neighbouring segment end sharing the edge of each segment end
+
+        The ends are numbered as iseg (first end) and iseg + nseg (second
+        end). -1 when the end is on the boundary.
+        """
+        nseg = len(segs)
+        ends = np.concatenate([segs[:, 0], segs[:, 1]])
+        order = np.argsort(ends, kind='stable')
+        same = ends[order[1:]] == ends[order[:-1]]
+        nbr = np.full(2 * nseg, -1, dtype=np.int64)
+        nbr[order[:-1][same]] = order[1:][same]
+        nbr[order[1:][same]] = order[:-1][same]
+        return nbr
+
+    @staticmethod
+    def _walk(segs, nbr, iseg, visited=None):
+        """Link the segments connected to one segment into a line
+
+        Returns:
+            the edge ids along the line
+        """
+        nseg = len(segs)
+        if visited is not None:
+            visited[iseg] = True
+        halves = []
+        for start in [iseg + nseg, iseg]:
+            edges = []
+            iend = start
+            while True:
+                inext = nbr[iend]
+                if inext < 0 or inext % nseg == iseg:
+                    break
+                if visited is not None:
+                    visited[inext % nseg] = True
+                iend = (inext + nseg) % (2 * nseg)
+                edges.append(segs[iend % nseg, iend // nseg])
+            halves.append(edges)
+            if inext >= 0:  # closed line
+                return list(segs[iseg]) + edges + [segs[iseg, 0]]
+        return halves[1][::-1] + list(segs[iseg]) + halves[0]
+
+    def level_at(self, x0, z0):
+        """Ay at one point using bilinear interpolation
+        """
+        fx = np.interp(x0, self.x, np.arange(self.nx))
+        fz = np.interp(z0, self.z, np.arange(self.nz))
+        ix = min(int(fx), self.nx - 2)
+        iz = min(int(fz), self.nz - 2)
+        wx = fx - ix
+        wz = fz - iz
+        return ((1 - wx) * (1 - wz) * self.ay[iz, ix] +
+                wx * (1 - wz) * self.ay[iz, ix + 1] +
+                wx * wz * self.ay[iz + 1, ix + 1] +
+                (1 - wx) * wz * self.ay[iz + 1, ix])
+
+    def field_line(self, x0, z0):
+        """The in-plane field line through one point
+
+        Returns:
+            xs, zs: the points along the line
+        """
+        level = self.level_at(x0, z0)
+        segs = self.segments(level)
+        if len(segs) == 0:
+            return np.asarray([x0]), np.asarray([z0])
+        xa, za = self.edge_points(segs[:, 0], level)
+        xb, zb = self.edge_points(segs[:, 1], level)
+        dist2 = (0.5 * (xa + xb) - x0)**2 + (0.5 * (za + zb) - z0)**2
+        nbr = self._neighbours(segs)
+        edges = self._walk(segs, nbr, int(np.argmin(dist2)))
+        return self.edge_points(np.asarray(edges), level)
+
+    def contours(self, level):
+        """All the contour lines of one level
+
+        Returns:
+            a list of (xs, zs)
+        """
+        segs = self.segments(level)
+        nbr = self._neighbours(segs)
+        visited = np.zeros(len(segs), dtype=bool)
+        lines = []
+        for iseg in range(len(segs)):
+            if visited[iseg]:
+                continue
+            edges = self._walk(segs, nbr, iseg, visited)
+            lines.append(self.edge_points(np.asarray(edges), level))
+        return lines
+
+    def separatrix_level(self):
+        """Ay at the dominant X-point
+
+        The dominant X-point is the saddle of Ay whose level is closest to
+        Ay at the top and bottom boundaries, i.e., the one that has
+        reconnected the most flux.
+
+        Raises:
+            ValueError: when there is no saddle
+        """
+        points = xpoints.find_critical_points(self.ay[None, ...],
+                                              self.x[1] - self.x[0],
+                                              self.z[1] - self.z[0])
+        levels = points["ay"][points["kind"] == xpoints.XPOINT]
+        if len(levels) == 0:
+            raise ValueError("No X-point is found")
+        ay_inflow = 0.5 * (self.ay[0].mean() + self.ay[-1].mean())
+        return levels[np.argmin(np.abs(levels - ay_inflow))]
+
+    def area_above(self, level):
+        """Area of the region with Ay larger than level
+
+        Ay in each cell is split into two linear triangles, and the area is
+        exact for this piecewise-linear Ay.
+        """
+        dx = np.diff(self.x)[None, :]
+        dz = np.diff(self.z)[:, None]
+        cell_area = (dx * dz).ravel() * 0.5
+        v0 = self.ay[:-1, :-1].ravel()
+        v1 = self.ay[:-1, 1:].ravel()
+        v2 = self.ay[1:, 1:].ravel()
+        v3 = self.ay[1:, :-1].ravel()
+        area = 0.0
+        for tri in [(v0, v1, v2), (v0, v2, v3)]:
+            vmin, vmid, vmax = np.sort(np.stack(tri), axis=0)
+            frac = np.zeros(len(vmin))
+            frac[level < vmin] = 1.0
+            cond = (level >= vmin) & (level < vmid)
+            frac[cond] = 1 - ((level - vmin[cond])**2 /
+                              ((vmid[cond] - vmin[cond]) *
+                               (vmax[cond] - vmin[cond])))
+            cond = (level >= vmid) & (level < vmax)
+            frac[cond] = ((vmax[cond] - level)**2 /
+                          ((vmax[cond] - vmin[cond]) *
+                           (vmax[cond] - vmid[cond])))
+            area += np.sum(frac * cell_area)
+        return area
+
+    def area_between(self, level1, level2):
+        """Area of the region with Ay between two levels
+        """
+        level1, level2 = sorted([level1, level2])
+        return self.area_above(level1) - self.area_above(level2)
+
+    def save(self, fname):
+        np.savez(fname, **{key: getattr(self, key) for key in self._saved})
+
+    @classmethod
+    def load(cls, fname):
+        """Load a saved index without building it again
+        """
+        index = cls.__new__(cls)
+        with np.load(fname) as fdata:
+            for key in cls._saved:
+                setattr(index, key, fdata[key])
+        index.nbins = int(index.nbins)
+        index.amin = float(index.amin)
+        index.bin_width = float(index.bin_width)
+        index.nz, index.nx = index.ay.shape
+        return index
+
+
+def contour_index_fname(pic_run, tframe):
+    """File name of the contour index of one frame
+    """
+    fdir = '../data/ay_contours/' + pic_run + '/'
+    return fdir + 'ay_contours_' + str(tframe) + '.npz'
+
+
+def build_contour_index(pic_info, pic_run, tframe, nbins=256):
+    """Build and save the contour index of one frame
+    """
+    kwargs = {"current_time": tframe,
+              "xl": 0, "xr": pic_info.lx_di,
+              "zb": -0.5 * pic_info.lz_di, "zt": 0.5 * pic_info.lz_di}
+    fname = pic_info.run_dir + "data/Ay.gda"
+    x, z, ay = read_2d_fields(pic_info, fname, **kwargs)
+    index = AyContourIndex(ay, x, z, nbins)
+    fname = contour_index_fname(pic_run, tframe)
+    mkdir_p(os.path.dirname(fname))
+    index.save(fname)
+
+
+def build_contour_indices(pic_run, tframes, nbins=256, ncores=None,
+                          ckpt=None):
+    """Build the contour indices of many frames in parallel
+
+    Args:
+        ncores: number of local processes. The default is the number of CPU
+            cores.
+        ckpt: checkpoint.Checkpoint of the frames, whose done frames are
+            skipped
+    """
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    # local processes also under MPI, since it is called by the analyses
+    backend = parallel_backend.LocalBackend(ncores)
+    backend.map(functools.partial(build_contour_index, pic_info, pic_run),
+                tframes, nbins, checkpoint=ckpt)
+
+
+def load_contour_index(pic_run, tframe):
+    """Load the contour index of one frame, building it if needed
+    """
+    fname = contour_index_fname(pic_run, tframe)
+    if not os.path.isfile(fname):
+        build_contour_indices(pic_run, [tframe], ncores=1)
+    return AyContourIndex.load(fname)
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run = 'mime400_Tb_T0_10_weak'
+    parser = argparse.ArgumentParser(description='Contour index of Ay')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--tframe', action="store", default='20', type=int,
+                        help='Time frame')
+    parser.add_argument('--multi_frames', action="store_true", default=False,
+                        help='whether to analyze multiple frames')
+    parser.add_argument('--tstart', action="store", default='0', type=int,
+                        help='starting time frame')
+    parser.add_argument('--tend', action="store", default='40', type=int,
+                        help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
+    parser.add_argument('--nbins', action="store", default='256', type=int,
+                        help='number of Ay buckets')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    if args.multi_frames:
+        tframes = range(args.tstart, args.tend + 1)
+        ckpt = checkpoint.for_frames('ay_contours', args)
+    else:
+        tframes = [args.tframe]
+        ckpt = None
+    build_contour_indices(args.pic_run, tframes, args.nbins, args.ncores,
+                          ckpt)
+
+
+if __name__ == "__main__":
+    main()
@@ -97,7 +97,8 @@ def bulk_energy(pic_info, species, current_time):
         "zstep": 1,
         "is_log": True,
         "vmin": 0.1,
-        "vmax": 10.0
+        "vmax": 10.0,
+        "dpi": 400
     }
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
@@ -127,7 +128,7 @@ def bulk_energy(pic_info, species, current_time):
         vmax = 0.2
     else:
         vmax = 0.8
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": vmax, "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p2, cbar2 = plot_2d_contour(x, z, bulk_ene, ax2, fig, **kwargs_plot)
@@ -150,7 +151,7 @@ def bulk_energy(pic_info, species, current_time):
 
     ys -= height + 0.05
     ax3 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": 0.8}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": 0.8, "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p3, cbar3 = plot_2d_contour(x, z, internal_ene, ax3, fig, **kwargs_plot)
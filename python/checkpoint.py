@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Checkpoints of the long jobs over many frames or ranks
+
+A job is split into units (frames, PIC ranks, tracer files...). The
+completed units are recorded in a journal with their results and the
+partial state of the job, e.g., the partial sums of a reduction. The
+journal is written to a temporary file that is then renamed, so it is
+always complete, and a job that is killed restarts from its last saved
+units with --resume instead of from scratch. The journal is saved at most
+every interval seconds, when the job is done, and when it fails or gets
+SIGTERM, e.g., from the wall-clock limit of SLURM.
+
+    ckpt = checkpoint.Checkpoint('rates_tracer_' + pic_run, params,
+                                 resume=args.resume)
+    with ckpt:
+        state = ckpt.state or initial_state()
+        for ifile, fname in enumerate(fnames):
+            if ckpt.is_done(ifile):
+                continue
+            state = process_file(fname, state)
+            ckpt.record(ifile, state=state)
+
+parallel_backend.map and parallel_backend.reduce take the checkpoint too.
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import pickle
+import signal
+import time
+
+from shell_functions import mkdir_p
+
+CHECKPOINT_DIR = '../data/checkpoints/'
+
+# the command line options of how an analysis is run, which do not change its
+# results
+RUNNER_ARGS = ['multi_frames', 'time_loop', 'ncores', 'mem_fraction',
+               'resume', 'profile']
+
+
+def params_hash(params):
+    """Short hash of the parameters of a job
+    """
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def raise_exit(signum, frame):
+    """Turn SIGTERM into SystemExit, so the journal is saved
+    """
+    raise SystemExit("terminated by signal %d" % signum)
+
+
+class Checkpoint(object):
+    """Journal of the completed units of a job and its partial state
+    """
+
+    def __init__(self, name, params=None, resume=False, interval=60.0,
+                 key=None, ckpt_dir=CHECKPOINT_DIR):
+        """
+        Args:
+            name: the name of the job
+            params: the parameters of the job. The jobs with different
+                parameters have different journals.
+            resume: whether to resume from the journal. Otherwise, the job
+                starts over.
+            interval: the minimum time in seconds between two saves
+            key: function of (job, index) returning the unit of a job of
+                parallel_backend.map or reduce. The default is the job
+                itself when it is a number or a string, or its index.
+            ckpt_dir: directory of the journals
+        """
+        if params is not None:
+            name += '_' + params_hash(params)
+        self.fname = os.path.join(ckpt_dir, name + '.pkl')
+        self.resume = resume
+        self.interval = interval
+        self.key_func = key
+        self.done = {}
+        self.state = None
+        self.last_save = 0
+        self.nrecords = 0
+        self.old_handler = None
+
+    def key(self, job, index):
+        """The unit of a job of a parallel map or reduction
+        """
+        if self.key_func is not None:
+            return self.key_func(job, index)
+        if isinstance(job, (int, float, str)):
+            return job
+        if hasattr(job, 'item') and getattr(job, 'ndim', 1) == 0:
+            return job.item()  # numpy scalar
+        return index
+
+    def open(self):
+        """Load the journal when resuming, or remove it otherwise
+        """
+        self.done = {}
+        self.state = None
+        if self.resume and os.path.isfile(self.fname):
+            with open(self.fname, 'rb') as fh:
+                journal = pickle.load(fh)
+            self.done = journal["done"]
+            self.state = journal["state"]
+            print("Resuming %s: %d units are done" %
+                  (self.fname, len(self.done)))
+        elif os.path.isfile(self.fname):
+            os.remove(self.fname)
+        self.last_save = time.time()
+        self.nrecords = 0
+
+    def save(self):
+        """Write the journal atomically
+        """
+        if not self.nrecords:
+            return
+        mkdir_p(os.path.dirname(self.fname) or '.')
+        journal = {"done": self.done,
+                   "state": self.state,
+                   "time": time.strftime('%Y-%m-%d %H:%M:%S')}
+        tmp_fname = self.fname + '.tmp'
+        with open(tmp_fname, 'wb') as fh:
+            pickle.dump(journal, fh, protocol=2)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp_fname, self.fname)
+        self.last_save = time.time()
+        self.nrecords = 0
+
+    def close(self):
+        """Save the units that are not saved yet
+        """
+        self.save()
+
+    def __enter__(self):
+        self.open()
+        try:
+            self.old_handler = signal.signal(signal.SIGTERM, raise_exit)
+        except ValueError:  # not in the main thread
+            self.old_handler = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.old_handler is not None:
+            signal.signal(signal.SIGTERM, self.old_handler)
+            self.old_handler = None
+        self.close()
+        return False
+
+    def is_done(self, unit):
+        """Whether a unit is completed
+        """
+        return unit in self.done
+
+    def result(self, unit):
+        """The recorded result of a completed unit
+        """
+        return self.done[unit]
+
+    def pending(self, jobs):
+        """Indices of the jobs whose units are not completed
+        """
+        return [i for i, job in enumerate(jobs)
+                if not self.is_done(self.key(job, i))]
+
+    def record(self, unit, result=None, state=None):
+        """Record a completed unit
+
+        Args:
+            unit: the unit
+            result: the result of the unit
+            state: the partial state of the job including this unit. It is
+                kept when it is None.
+        """
+        self.done[unit] = result
+        if state is not None:
+            self.state = state
+        self.nrecords += 1
+        if time.time() - self.last_save >= self.interval:
+            self.save()
+
+
+class NoCheckpoint(object):
+    """Context for the jobs without checkpoints
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+def using(ckpt):
+    """Context of an optional checkpoint
+    """
+    return ckpt if ckpt is not None else NoCheckpoint()
+
+
+def for_frames(name, args, **kwargs):
+    """Checkpoint of the frames of an analysis_multi_frames, resumed with
+    args.resume
+
+    The frames are the units and are left out of the parameters, so a
+    longer run resumes a shorter one. The runner options (RUNNER_ARGS) are
+    left out too. Every frame is saved by default.
+
+    Args:
+        name: name of the analysis
+        args: the command line arguments, with tstart, tend and resume
+        kwargs: the other arguments of Checkpoint
+    """
+    skip = set(RUNNER_ARGS + ['tframe', 'tstart', 'tend'])
+    params = dict((key, value) for key, value in vars(args).items()
+                  if key not in skip)
+    kwargs.setdefault('interval', 0)
+    return Checkpoint(name, params, resume=args.resume, **kwargs)
@@ -917,7 +917,8 @@ def density_ratio(pic_info, current_time):
     ys = 0.9 - height
     fig = plt.figure(figsize=[10, 4])
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0.5, "vmax": 1.5}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0.5, "vmax": 1.5,
+                   "dpi": 300}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, ne / ni, ax1, fig, **kwargs_plot)
@@ -1438,7 +1439,8 @@ def plot_shear(pic_info, species, current_time):
         vmin, vmax = -0.04, 0.04
     else:
         vmin, vmax = -0.02, 0.02
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, bbsigma_new, ax1, fig, **kwargs_plot)
@@ -1473,7 +1475,8 @@ def plot_shear(pic_info, species, current_time):
         vmin, vmax = -0.4, 0.4
     else:
         vmin, vmax = -0.8, 0.8
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p2, cbar2 = plot_2d_contour(x, z, -ppara + pperp, ax2, fig, **kwargs_plot)
@@ -1511,7 +1514,8 @@ def plot_shear(pic_info, species, current_time):
         vmin, vmax = -0.002, 0.002
     else:
         vmin, vmax = -0.004, 0.004
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p3, cbar3 = plot_2d_contour(x, z, pshear_new, ax3, fig, **kwargs_plot)
@@ -1619,7 +1623,8 @@ def plot_compression_only(pic_info, species, current_time):
         vmin, vmax = -0.04, 0.04
     else:
         vmin, vmax = -0.02, 0.02
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, div_u_new, ax1, fig, **kwargs_plot)
@@ -1654,7 +1659,7 @@ def plot_compression_only(pic_info, species, current_time):
         vmax = 0.6
     else:
         vmax = 1.0
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": 0, "vmax": vmax, "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p2, cbar2 = plot_2d_contour(x, z, pscalar, ax2, fig, **kwargs_plot)
@@ -1689,7 +1694,8 @@ def plot_compression_only(pic_info, species, current_time):
         vmin, vmax = -0.004, 0.004
     else:
         vmin, vmax = -0.002, 0.002
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 400}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p3, cbar3 = plot_2d_contour(x, z, pdiv_u_new, ax3, fig, **kwargs_plot)
@@ -2094,7 +2100,8 @@ def plot_div_v(current_time, species):
     kwargs_plot = {"xstep": 1, "zstep": 1}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": vmin, "vmax": vmax,
+                   "dpi": 300}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, div_v, ax1, fig, **kwargs_plot)
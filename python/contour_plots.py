@@ -24,7 +24,9 @@ from scipy.ndimage.filters import generic_filter as gf
 import color_maps as cm
 import colormap.colormaps as cmaps
 import pic_information
+import render_prep
 from energy_conversion import read_data_from_json
+from field_io import read_2d_fields
 from runs_name_path import ApJ_long_paper_runs
 from shell_functions import mkdir_p
 
@@ -42,58 +44,6 @@ font = {
 mpl.rcParams['contour.negative_linestyle'] = 'solid'
 
 
-def read_2d_fields(pic_info, fname, current_time, xl, xr, zb, zt):
-    """Read 2D fields data from file.
-    
-    Args:
-        pic_info: namedtuple for the PIC simulation information.
-        fname: the filename.
-        current_time: current time frame.
-        xl, xr: left and right x position in di (ion skin length).
-        zb, zt: top and bottom z position in di.
-    """
-    print("Reading data from %s" % fname)
-    print("xrange: (%f, %f)" % (xl, xr))
-    print("zrange: (%f, %f)" % (zb, zt))
-    nx = pic_info.nx
-    nz = pic_info.nz
-    x_di = np.copy(pic_info.x_di)
-    z_di = np.copy(pic_info.z_di)
-    dx_di = pic_info.dx_di
-    dz_di = pic_info.dz_di
-    xmin = np.min(x_di)
-    xmax = np.max(x_di)
-    zmin = np.min(z_di)
-    zmax = np.max(z_di)
-    if (xl <= xmin):
-        xl_index = 0
-    else:
-        xl_index = int(math.floor((xl - xmin) / dx_di))
-    if (xr >= xmax):
-        xr_index = nx - 1
-    else:
-        xr_index = int(math.ceil((xr - xmin) / dx_di))
-    if (zb <= zmin):
-        zb_index = 0
-    else:
-        zb_index = int(math.floor((zb - zmin) / dz_di))
-    if (zt >= zmax):
-        zt_index = nz - 1
-    else:
-        zt_index = int(math.ceil((zt - zmin) / dz_di))
-    nx1 = xr_index - xl_index + 1
-    nz1 = zt_index - zb_index + 1
-    fp = np.zeros((nz1, nx1), dtype=np.float32)
-    offset = nx * nz * current_time * 4
-    fdata = np.memmap(fname, dtype='float32',
-                      mode='r', offset=offset,
-                      shape=(nz, nx), order='C')
-    xc = x_di[xl_index:xr_index + 1]
-    zc = z_di[zb_index:zt_index + 1]
-    fp = fdata[zb_index:zt_index + 1, xl_index:xr_index + 1]
-    return (xc, zc, fp)
-
-
 def plot_2d_contour(x, z, field_data, ax, fig, is_cbar=1, **kwargs):
     """Plot contour of 2D fields.
 
@@ -103,6 +53,13 @@ def plot_2d_contour(x, z, field_data, ax, fig, is_cbar=1, **kwargs):
         ax: axes object.
         fig: figure object.
         is_cbar: whether to plot colorbar. Default is yes.
+        decimate: decimation method ('mean' or 'minmax') to reduce the data
+            to the pixel grid of the axes, or False for the full data.
+            Default is 'mean'.
+        dpi: dpi of the saved figure for the decimation, when it is not the
+            dpi of the figure.
+        save_eps: whether the figure is saved as EPS for publication. The
+            data are never decimated then.
     Returns:
         p1: plot object.
         cbar: color bar object.
@@ -119,6 +76,10 @@ def plot_2d_contour(x, z, field_data, ax, fig, is_cbar=1, **kwargs):
         data = field_data
     print("Maximum and minimum of the data: %f %f" %
           (np.max(data), np.min(data)))
+    method = kwargs.get("decimate", "mean")
+    if method and not kwargs.get("save_eps", False):
+        data = render_prep.decimate_for_axes(data, ax, kwargs.get("dpi"),
+                                             method)
     if (kwargs and "vmin" in kwargs and "vmax" in kwargs):
         p1 = ax.imshow(
             data,
@@ -498,7 +459,8 @@ def plot_by(pic_info):
     fig = plt.figure(figsize=[w1, h1])
 
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -1.0, "vmax": 1.0}
+    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -1.0, "vmax": 1.0,
+                   "save_eps": True}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1 = plot_2d_contour(x, z, by1, ax1, fig, is_cbar=0, **kwargs_plot)
@@ -989,7 +951,8 @@ def plot_beta_rho(pic_info):
         "zstep": 2,
         "is_log": True,
         "vmin": 0.01,
-        "vmax": 10
+        "vmax": 10,
+        "save_eps": True
     }
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
@@ -1006,7 +969,7 @@ def plot_beta_rho(pic_info):
 
     ys -= height + 0.15
     ax2 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 2, "zstep": 2}
+    kwargs_plot = {"xstep": 2, "zstep": 2, "save_eps": True}
     p2, cbar2 = plot_2d_contour(x, z, eEB05, ax2, fig, **kwargs_plot)
     # p2.set_cmap(cmaps.magma)
     # p2.set_cmap(cmaps.inferno)
@@ -1392,7 +1355,8 @@ def plot_epara(pic_info, species, current_time):
 
     fig = plt.figure(figsize=[7, 5])
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": 0, "vmax": 0.1}
+    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": 0, "vmax": 0.1,
+                   "save_eps": True}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, eperp, ax1, fig, **kwargs_plot)
@@ -1428,7 +1392,8 @@ def plot_epara(pic_info, species, current_time):
 
     ys -= height + gap
     ax2 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.05, "vmax": 0.05}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.05, "vmax": 0.05,
+                   "save_eps": True}
     p2, cbar2 = plot_2d_contour(x, z, epara, ax2, fig, **kwargs_plot)
     p2.set_cmap(plt.cm.seismic)
     # p2.set_cmap(cmaps.plasma)
@@ -1634,7 +1599,8 @@ def plot_ux(pic_info, species, current_time):
     # ys = 0.92 - height
     fig = plt.figure(figsize=[7, 5])
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -1.0, "vmax": 1.0}
+    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -1.0, "vmax": 1.0,
+                   "save_eps": True}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, ux, ax1, fig, **kwargs_plot)
@@ -1731,7 +1697,8 @@ def plot_uy(pic_info, current_time):
     gap = 0.05
     fig = plt.figure(figsize=[7, 5])
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -0.5, "vmax": 0.5}
+    kwargs_plot = {"xstep": 2, "zstep": 2, "vmin": -0.5, "vmax": 0.5,
+                   "save_eps": True}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, uey, ax1, fig, **kwargs_plot)
@@ -1762,7 +1729,8 @@ def plot_uy(pic_info, current_time):
 
     ys -= height + gap
     ax2 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5,
+                   "save_eps": True}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p2, cbar2 = plot_2d_contour(x, z, uiy, ax2, fig, **kwargs_plot)
@@ -7,33 +7,43 @@ import argparse
 import itertools
 import json
 import math
-import multiprocessing
 
-import h5py
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import palettable
-from matplotlib.colors import LogNorm, SymLogNorm
-from scipy.optimize import curve_fit
-from scipy.special import erf
-from scipy.interpolate import interp1d
 
 import fitting_funcs
 import pic_information
-from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
+import task_runner
+from field_io import read_2d_fields
 from json_functions import read_data_from_json
+from lazy_import import lazy_module
 from shell_functions import mkdir_p
 
-plt.style.use("seaborn-deep")
-mpl.rc('text', usetex=True)
-mpl.rcParams['text.latex.preamble'] = \
-[r"\usepackage{amsmath, bm}",
- r"\DeclareMathAlphabet{\mathsfit}{\encodingdefault}{\sfdefault}{m}{sl}",
- r"\SetMathAlphabet{\mathsfit}{bold}{\encodingdefault}{\sfdefault}{bx}{sl}",
- r"\newcommand{\tensorsym}[1]{\bm{\mathsfit{#1}}}"]
-COLORS = palettable.colorbrewer.qualitative.Set1_9.mpl_colors
+mpl = lazy_module('matplotlib')
+plt = lazy_module('matplotlib.pyplot')
+mcolors = lazy_module('matplotlib.colors')
+palettable = lazy_module('palettable')
+special = lazy_module('scipy.special')
+
+# set by set_plot_style
+COLORS = None
+
+
+def set_plot_style():
+    """Set the style of the plots once per process, when the analyses start,
+    so that --help does not import matplotlib
+    """
+    global COLORS
+    if COLORS is not None:
+        return
+    plt.style.use("seaborn-deep")
+    mpl.rc('text', usetex=True)
+    mpl.rcParams['text.latex.preamble'] = \
+    [r"\usepackage{amsmath, bm}",
+     r"\DeclareMathAlphabet{\mathsfit}{\encodingdefault}{\sfdefault}{m}{sl}",
+     r"\SetMathAlphabet{\mathsfit}{bold}{\encodingdefault}{\sfdefault}{bx}{sl}",
+     r"\newcommand{\tensorsym}[1]{\bm{\mathsfit{#1}}}"]
+    COLORS = palettable.colorbrewer.qualitative.Set1_9.mpl_colors
+
 
 def find_nearest(array, value):
     """Find nearest value in an array
@@ -853,7 +863,7 @@ def analytical_fan(plot_config):
     alpha_tau_h = alpha_tau * 0.5
     exp_atau = math.exp(-alpha_tau)
     exp_atauh = math.exp(-alpha_tau_h)
-    f = ((erf(ene_sqrt) - erf(ene_sqrt * exp_atauh)) / ene +
+    f = ((special.erf(ene_sqrt) - special.erf(ene_sqrt * exp_atauh)) / ene +
          2 * (exp_atauh * np.exp(-ene * exp_atau) - np.exp(-ene)) /
          math.sqrt(math.pi) / ene_sqrt)
     plt.loglog(ene, f)
@@ -1143,7 +1153,7 @@ def rho_bands_2d(plot_config, show_plot=True):
         nmin, nmax = nmins[iband], nmaxs[iband]
         p1 = ax.imshow(nrho + 1E-10,
                        extent=[xmin, xmax, zmin, zmax],
-                       norm = LogNorm(vmin=nmin, vmax=nmax),
+                       norm = mcolors.LogNorm(vmin=nmin, vmax=nmax),
                        cmap=plt.cm.inferno, aspect='auto',
                        origin='lower', interpolation='bicubic')
         ax.contour(x, z, Ay, colors='w', linewidths=0.5)
@@ -1315,7 +1325,7 @@ def rho_bands_3d(plot_config, show_plot=True):
             nrho = nrhos[iband]
             p1 = ax.imshow(nrho[:, yslice//2, :] + 1E-10,
                            extent=[xmin, xmax, zmin, zmax],
-                           norm = LogNorm(vmin=nmin, vmax=nmax),
+                           norm = mcolors.LogNorm(vmin=nmin, vmax=nmax),
                            cmap=plt.cm.inferno, aspect='auto',
                            origin='lower', interpolation='bicubic')
             if iband == 0:
@@ -1384,6 +1394,27 @@ def rho_bands_3d(plot_config, show_plot=True):
             plt.close()
 
 
+def rho_bands_3d_bytes(plot_config):
+    """Memory footprint of rho_bands_3d for one frame
+    """
+    pic_run = "3D-Lx150-bg" + str(plot_config["bg"]) + "-150ppc-2048KNL"
+    ncells = task_runner.pic_grid_size(pic_run)
+    # vdot_kappa at half resolution and 7 bands at a quarter resolution
+    return 4 * ncells // 8 + 7 * 4 * ncells // 64
+
+
+RUNNER = task_runner.TaskRunner(setup=set_plot_style)
+RUNNER.add_task('energetic_rho', energetic_rho,
+                frame_bytes=task_runner.grid_bytes(8, reduce=4),
+                help="whether to plot densities for energetic particles")
+RUNNER.add_task('rho_bands_2d', rho_bands_2d,
+                help=("whether to plot densities if different " +
+                      "energy bands for the 2D simulation"))
+RUNNER.add_task('rho_bands_3d', rho_bands_3d, frame_bytes=rho_bands_3d_bytes,
+                help=("whether to plot densities if different " +
+                      "energy bands for the 3D simulation"))
+
+
 def get_cmd_args():
     """Get command line arguments
     """
@@ -1425,14 +1456,7 @@ def get_cmd_args():
                         help='Multiple particle plot types')
     parser.add_argument('--analytical_fan', action="store_true", default=False,
                         help="whether to calculate Fan's analytical expression")
-    parser.add_argument('--energetic_rho', action="store_true", default=False,
-                        help="whether to plot densities for energetic particles")
-    parser.add_argument('--rho_bands_2d', action="store_true", default=False,
-                        help=("whether to plot densities if different " +
-                              "energy bands for the 2D simulation"))
-    parser.add_argument('--rho_bands_3d', action="store_true", default=False,
-                        help=("whether to plot densities if different " +
-                              "energy bands for the 3D simulation"))
+    RUNNER.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -1453,47 +1477,12 @@ def analysis_single_frames(plot_config, args):
             particle_energization(plot_config)
     elif args.analytical_fan:
         analytical_fan(plot_config)
-    elif args.energetic_rho:
-        energetic_rho(plot_config)
-    elif args.rho_bands_2d:
-        rho_bands_2d(plot_config)
-    elif args.rho_bands_3d:
-        rho_bands_3d(plot_config)
-
-
-def process_input(plot_config, args, tframe):
-    """process one time frame"""
-    plot_config["tframe"] = tframe
-    if args.energetic_rho:
-        energetic_rho(plot_config)
-    elif args.rho_bands_2d:
-        rho_bands_2d(plot_config, show_plot=False)
-    elif args.rho_bands_3d:
-        rho_bands_3d(plot_config, show_plot=False)
-
-
-def analysis_multi_frames(plot_config, args):
-    """Analysis for multiple time frames
-    """
-    tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
-    if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.rho_bands_2d:
-                rho_bands_2d(plot_config, show_plot=False)
-            elif args.rho_bands_3d:
-                rho_bands_3d(plot_config, show_plot=False)
-    else:
-        ncores = multiprocessing.cpu_count()
-        ncores = 8
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
 
 
 def main():
     """business logic for when running this module as the primary one!"""
     args = get_cmd_args()
+    set_plot_style()
     plot_config = {}
     plot_config["pic_run"] = args.pic_run
     plot_config["pic_run_dir"] = args.pic_run_dir
@@ -1503,9 +1492,9 @@ def main():
     plot_config["species"] = args.species
     plot_config["plot_type"] = args.plot_type
     plot_config["bg"] = args.bg
-    if args.multi_frames:
-        analysis_multi_frames(plot_config, args)
-    else:
+    if RUNNER.selected(args):
+        RUNNER.run(plot_config, args)
+    elif not args.multi_frames:
         analysis_single_frames(plot_config, args)
 
 
@@ -5,6 +5,7 @@ Analysis on particle acceleration
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import math
@@ -23,11 +24,12 @@ from scipy.special import erf
 from scipy.interpolate import interp1d, interp2d, RegularGridInterpolator
 from scipy.ndimage.filters import median_filter, gaussian_filter
 
+import checkpoint
 import fitting_funcs
+import parallel_backend
 import pic_information
 from contour_plots import read_2d_fields
 from dolointerpolation import MultilinearInterpolator
-from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
 
@@ -2825,6 +2827,8 @@ def get_cmd_args():
                         help='starting time frame')
     parser.add_argument('--tend', action="store", default='40', type=int,
                         help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
     parser.add_argument('--bg', action="store", default='0.2', type=float,
                         help='Guide field strength')
     parser.add_argument('--threshold', action="store", default='0.001', type=float,
@@ -2939,19 +2943,25 @@ def analysis_multi_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
+    ckpt = checkpoint.for_frames('cori_3d_acc', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.acc_rate:
-                acceleration_rate(plot_config, show_plot=False)
-            elif args.calc_vexb_kappa_2d:
-                calc_vexb_kappa_2d(plot_config)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                if args.acc_rate:
+                    acceleration_rate(plot_config, show_plot=False)
+                elif args.calc_vexb_kappa_2d:
+                    calc_vexb_kappa_2d(plot_config)
+                ckpt.record(tframe)
     else:
         # ncores = multiprocessing.cpu_count()
         ncores = 4
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
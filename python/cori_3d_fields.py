@@ -5,39 +5,56 @@ Fields plot for the Cori 3D runs
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import math
 import multiprocessing
 
-import h5py
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import palettable
-from evtk.hl import gridToVTK, pointsToVTK
-from matplotlib.colors import LogNorm, SymLogNorm
-from mpl_toolkits.mplot3d import Axes3D
-from scipy import signal
-from scipy.optimize import curve_fit
-from scipy.special import erf
-from scipy.interpolate import interp1d, interp2d, RectBivariateSpline
 
+import checkpoint
 import fitting_funcs
+import parallel_backend
 import pic_information
-from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
+import render_prep
+import task_runner
+from field_io import read_2d_fields
 from json_functions import read_data_from_json
+from lazy_import import lazy_module
 from shell_functions import mkdir_p
 
-plt.style.use("seaborn-deep")
-mpl.rc('text', usetex=True)
-mpl.rcParams['text.latex.preamble'] = \
-[r"\usepackage{amsmath, bm}",
- r"\DeclareMathAlphabet{\mathsfit}{\encodingdefault}{\sfdefault}{m}{sl}",
- r"\SetMathAlphabet{\mathsfit}{bold}{\encodingdefault}{\sfdefault}{bx}{sl}",
- r"\newcommand{\tensorsym}[1]{\bm{\mathsfit{#1}}}"]
-COLORS = palettable.colorbrewer.qualitative.Set1_9.mpl_colors
+h5py = lazy_module('h5py')
+mpl = lazy_module('matplotlib')
+plt = lazy_module('matplotlib.pyplot')
+mcolors = lazy_module('matplotlib.colors')
+palettable = lazy_module('palettable')
+vtk = lazy_module('evtk.hl')
+interpolate = lazy_module('scipy.interpolate')
+signal = lazy_module('scipy.signal')
+
+# set by set_plot_style
+COLORS = None
+
+
+def set_plot_style():
+    """Set the style of the plots once per process, when the analyses start,
+    so that --help does not import matplotlib
+    """
+    global COLORS
+    if COLORS is not None:
+        return
+    # registers the 3d projection
+    import mpl_toolkits.mplot3d
+    plt.style.use("seaborn-deep")
+    mpl.rc('text', usetex=True)
+    mpl.rcParams['text.latex.preamble'] = \
+    [r"\usepackage{amsmath, bm}",
+     r"\DeclareMathAlphabet{\mathsfit}{\encodingdefault}{\sfdefault}{m}{sl}",
+     r"\SetMathAlphabet{\mathsfit}{bold}{\encodingdefault}{\sfdefault}{bx}{sl}",
+     r"\newcommand{\tensorsym}[1]{\bm{\mathsfit{#1}}}"]
+    COLORS = palettable.colorbrewer.qualitative.Set1_9.mpl_colors
+
 
 def find_nearest(array, value):
     """Find nearest value in an array
@@ -87,12 +104,19 @@ def plot_jslice(plot_config):
     fdir = '../img/cori_3d/absJ/' + pic_run + '/tframe_' + str(tframe) + '/'
     mkdir_p(fdir)
 
+    def slice_data(jslice, ax):
+        """Keep the current sheets when reducing the slice to the pixels"""
+        if plot_config["full_res"]:
+            return jslice
+        return render_prep.decimate_for_axes(jslice, ax, 200, 'minmax')
+
     for iz in midz:
         print("z-slice %d" % iz)
         fig = plt.figure(figsize=[9, 4])
         rect = [0.10, 0.16, 0.75, 0.8]
         ax = fig.add_axes(rect)
-        p1 = ax.imshow(absj[iz, :, :], extent=[xmin, xmax, ymin, ymax],
+        jslice = slice_data(absj[iz, :, :], ax)
+        p1 = ax.imshow(jslice, extent=[xmin, xmax, ymin, ymax],
                        vmin=jmin, vmax=jmax,
                        cmap=plt.cm.coolwarm, aspect='auto',
                        origin='lower', interpolation='bicubic')
@@ -122,7 +146,8 @@ def plot_jslice(plot_config):
         fig = plt.figure(figsize=[9, 4])
         rect = [0.10, 0.16, 0.75, 0.8]
         ax = fig.add_axes(rect)
-        p1 = ax.imshow(absj[:, iy, :], extent=[xmin, xmax, zmin, zmax],
+        jslice = slice_data(absj[:, iy, :], ax)
+        p1 = ax.imshow(jslice, extent=[xmin, xmax, zmin, zmax],
                        vmin=jmin, vmax=jmax,
                        cmap=plt.cm.coolwarm, aspect='auto',
                        origin='lower', interpolation='bicubic')
@@ -152,7 +177,8 @@ def plot_jslice(plot_config):
         fig = plt.figure(figsize=[7, 5])
         rect = [0.12, 0.16, 0.70, 0.8]
         ax = fig.add_axes(rect)
-        p1 = ax.imshow(absj[:, :, ix], extent=[ymin, ymax, zmin, zmax],
+        jslice = slice_data(absj[:, :, ix], ax)
+        p1 = ax.imshow(jslice, extent=[ymin, ymax, zmin, zmax],
                        vmin=jmin, vmax=jmax,
                        cmap=plt.cm.coolwarm, aspect='auto',
                        origin='lower', interpolation='bicubic')
@@ -292,11 +318,11 @@ def reconnection_layer(plot_config, show_plot=True):
         #                origin='lower', interpolation='bicubic')
         # ax.plot(cs1[:, 0], cs1[:, 1], color='k')
         # ax.plot(cs2[:, 0], cs2[:, 1], color='k')
-        f = interp1d(cs1[:, 0], cs1[:, 1])
+        f = interpolate.interp1d(cs1[:, 0], cs1[:, 1])
         cs1_new[3:-3, 1] = f(cs1_new[3:-3, 0])
         cs1_new[:3] = cs1_new[3]
         cs1_new[-3:] = cs1_new[-4]
-        f = interp1d(cs2[:, 0], cs2[:, 1])
+        f = interpolate.interp1d(cs2[:, 0], cs2[:, 1])
         cs2_new[3:-3, 1] = f(cs2_new[3:-3, 0])
         cs2_new[:3] = cs2_new[3]
         cs2_new[-3:] = cs2_new[-4]
@@ -317,9 +343,9 @@ def reconnection_layer(plot_config, show_plot=True):
 
     X, Y = np.meshgrid(x_di, yr4_di)
     X_new, Y_new = np.meshgrid(x_di, y_di)
-    f = RectBivariateSpline(yr4_di, x_di, cs1_surface)
+    f = interpolate.RectBivariateSpline(yr4_di, x_di, cs1_surface)
     cs1_surface_new = f(y_di, x_di)
-    f = RectBivariateSpline(yr4_di, x_di, cs2_surface)
+    f = interpolate.RectBivariateSpline(yr4_di, x_di, cs2_surface)
     cs2_surface_new = f(y_di, x_di)
 
     # save data
@@ -469,11 +495,11 @@ def convert_layer_vtk(plot_config, show_plot=True):
 
     tindex = tframe * pic_info.fields_interval
     fname = fdir + 'rec_layer_top_' + str(tindex)
-    gridToVTK(fname, xmesh, ymesh, cs1_surface_3d,
-              cellData = {"top" : fdata})
+    vtk.gridToVTK(fname, xmesh, ymesh, cs1_surface_3d,
+                  cellData = {"top" : fdata})
     fname = fdir + 'rec_layer_bottom_' + str(tindex)
-    gridToVTK(fname, xmesh, ymesh, cs2_surface_3d,
-              cellData = {"bottom" : fdata})
+    vtk.gridToVTK(fname, xmesh, ymesh, cs2_surface_3d,
+                  cellData = {"bottom" : fdata})
 
 
 def reconnection_layer_2d(plot_config, show_plot=True):
@@ -535,11 +561,11 @@ def reconnection_layer_2d(plot_config, show_plot=True):
     cs2 = cl.get_paths()[1].vertices
     cs1_new = np.zeros(nx)
     cs2_new = np.zeros(nx)
-    f = interp1d(cs1[:, 0], cs1[:, 1])
+    f = interpolate.interp1d(cs1[:, 0], cs1[:, 1])
     cs1_new[1:-1] = f(x_di[1:-1])
     cs1_new[0] = cs1_new[1]
     cs1_new[-2] = cs1_new[-1]
-    f = interp1d(cs2[:, 0], cs2[:, 1])
+    f = interpolate.interp1d(cs2[:, 0], cs2[:, 1])
     cs2_new[1:-1] = f(x_di[1:-1])
     cs2_new[0] = cs2_new[1]
     cs2_new[-2] = cs2_new[-1]
@@ -2119,7 +2145,7 @@ def ene_dist_vkappa(plot_config, show_plot=True):
     ax1 = fig.add_axes(rect)
     p1 = ax1.imshow(nhigh + 1E-10,
                     extent=[xmin, xmax, zmin, zmax],
-                    norm = LogNorm(vmin=nmin, vmax=nmax),
+                    norm = mcolors.LogNorm(vmin=nmin, vmax=nmax),
                     cmap=plt.cm.plasma, aspect='auto',
                     origin='lower', interpolation='bicubic')
     ax1.tick_params(bottom=True, top=True, left=True, right=True)
@@ -2180,7 +2206,7 @@ def ene_dist_vkappa(plot_config, show_plot=True):
               r'\varepsilon < ' + str(2**iband*10) + r'\varepsilon_\text{th})$')
     p3 = ax3.imshow(nrhos[iband][:, yslice//2, :] + 1E-10,
                     extent=[xmin, xmax, zmin, zmax],
-                    norm = LogNorm(vmin=nmin, vmax=nmax),
+                    norm = mcolors.LogNorm(vmin=nmin, vmax=nmax),
                     cmap=plt.cm.plasma, aspect='auto',
                     origin='lower', interpolation='bicubic')
     ax3.tick_params(bottom=True, top=True, left=True, right=True)
@@ -2626,6 +2652,13 @@ def plot_profile_2d(plot_config, show_plot=True):
         plt.close()
 
 
+RUNNER = task_runner.TaskRunner(setup=set_plot_style)
+# |J| at half resolution
+RUNNER.add_task('jslice', plot_jslice,
+                frame_bytes=task_runner.grid_bytes(1, reduce=2),
+                help='whether to plot slices of current density')
+
+
 def get_cmd_args():
     """Get command line arguments
     """
@@ -2655,8 +2688,9 @@ def get_cmd_args():
                         help='variable name of a field')
     parser.add_argument('--show_plot', action="store_true", default=False,
                         help='whether to show plot')
-    parser.add_argument('--jslice', action="store_true", default=False,
-                        help='whether to plot slices of current density')
+    parser.add_argument('--full_res', action="store_true", default=False,
+                        help=('whether to plot the full-resolution data ' +
+                              'instead of reducing it to the figure pixels'))
     parser.add_argument('--absj_2d', action="store_true", default=False,
                         help='whether to plot the current density of the 2D simulation')
     parser.add_argument('--absj_2d_pub', action="store_true", default=False,
@@ -2715,6 +2749,7 @@ def get_cmd_args():
                         help="whether to the mean value of the non-ideal electric field")
     parser.add_argument('--comp_je', action="store_true", default=False,
                         help="whether to compare current density and electric field")
+    RUNNER.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -2722,9 +2757,7 @@ def analysis_single_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframe = args.tframe
-    if args.jslice:
-        plot_jslice(plot_config)
-    elif args.absj_2d:
+    if args.absj_2d:
         plot_absj_2d(plot_config)
     elif args.absj_2d_pub:
         absj_2d_pub(plot_config)
@@ -2784,6 +2817,7 @@ def analysis_single_frames(plot_config, args):
 
 def process_input(plot_config, args, tframe):
     """process one time frame"""
+    set_plot_style()
     plot_config["tframe"] = tframe
     if args.absj_2d:
         plot_absj_2d(plot_config, show_plot=False)
@@ -2791,8 +2825,6 @@ def process_input(plot_config, args, tframe):
         calc_absj_dist(plot_config)
     elif args.calc_abse_dist:
         calc_abse_dist(plot_config)
-    elif args.jslice:
-        plot_jslice(plot_config)
     elif args.reconnection_layer:
         reconnection_layer(plot_config, show_plot=False)
     elif args.magnetic_flux:
@@ -2809,32 +2841,37 @@ def analysis_multi_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
+    ckpt = checkpoint.for_frames('cori_3d_fields', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.absj_2d:
-                plot_absj_2d(plot_config, show_plot=False)
-            elif args.rho_profile:
-                rho_profile(plot_config, show_plot=False)
-            elif args.absb_profile:
-                absb_profile(plot_config, show_plot=False)
-            elif args.jslice:
-                plot_jslice(plot_config)
-            elif args.reconnection_layer_2d:
-                reconnection_layer_2d(plot_config, show_plot=False)
-            elif args.plot_reconnection_layer:
-                plot_reconnection_layer(plot_config, show_plot=False)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                if args.absj_2d:
+                    plot_absj_2d(plot_config, show_plot=False)
+                elif args.rho_profile:
+                    rho_profile(plot_config, show_plot=False)
+                elif args.absb_profile:
+                    absb_profile(plot_config, show_plot=False)
+                elif args.reconnection_layer_2d:
+                    reconnection_layer_2d(plot_config, show_plot=False)
+                elif args.plot_reconnection_layer:
+                    plot_reconnection_layer(plot_config, show_plot=False)
+                ckpt.record(tframe)
     else:
         ncores = multiprocessing.cpu_count()
         ncores = 8
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
     """business logic for when running this module as the primary one!"""
     args = get_cmd_args()
+    set_plot_style()
     plot_config = {}
     plot_config["pic_run"] = args.pic_run
     plot_config["pic_run_dir"] = args.pic_run_dir
@@ -2844,7 +2881,10 @@ def main():
     plot_config["species"] = args.species
     plot_config["bg"] = args.bg
     plot_config["var"] = args.var
-    if args.multi_frames:
+    plot_config["full_res"] = args.full_res
+    if RUNNER.selected(args):
+        RUNNER.run(plot_config, args)
+    elif args.multi_frames:
         analysis_multi_frames(plot_config, args)
     else:
         analysis_single_frames(plot_config, args)
@@ -5,6 +5,7 @@ Particle tracer for the Cori runs
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import math
@@ -25,10 +26,15 @@ from mpl_toolkits.mplot3d.art3d import Line3DCollection
 from scipy import signal
 from scipy.optimize import curve_fit
 
+import checkpoint
 import fitting_funcs
+import movie_renderer
+import parallel_backend
 import pic_information
+import tracer_store
+import tracer_tag_index
+import tracer_transpose
 from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
 
@@ -72,14 +78,34 @@ def read_particle_data(iptl, particle_tags, pic_info, fh):
     for dset in group:
         dset = str(dset)
         ptl[str(dset)] = read_var(group, dset, sz)
+    tindex = np.arange(sz) * pic_info.tracer_interval
+    return (particle_data(ptl, tindex, pic_info), sz)
 
+
+def read_particle_store(iptl, store, pic_info):
+    """Read particle data from a trajectory store
+
+    Args:
+        iptl: particle index in the store
+        store: tracer_store.TrajectoryStore
+        pic_info: PIC simulation information
+    """
+    ptl = store.by_particle(iptl)
+    return (particle_data(ptl, store.tindex, pic_info), store.nsteps)
+
+
+def particle_data(ptl, tindex, pic_info):
+    """Add the time and the Lorentz factor to the data of one particle,
+    remove the missing data points, and normalize the positions by di
+
+    Args:
+        ptl: the tracer data of the particle over all steps
+        tindex: the time indices of the steps
+        pic_info: PIC simulation information
+    """
     gama = np.sqrt(ptl['Ux']**2 + ptl['Uy']**2 + ptl['Uz']**2 + 1)
-    dtwci = pic_info.dtwci
-    dtwpe = pic_info.dtwpe
-    dt_tracer = pic_info.tracer_interval * dtwpe
-    tfields = np.arange(sz) * dt_tracer
     smime = math.sqrt(pic_info.mime)
-    ptl['t'] = tfields
+    ptl['t'] = tindex * pic_info.dtwpe
     ptl['gamma'] = gama
 
     # Some data points may be zeros
@@ -91,7 +117,7 @@ def read_particle_data(iptl, particle_tags, pic_info, fh):
     ptl['dY'] /= smime
     ptl['dZ'] /= smime
 
-    return (ptl, sz)
+    return ptl
 
 
 def transfer_to_h5part(plot_config):
@@ -134,6 +160,35 @@ def transfer_to_h5part(plot_config):
                 grp.create_dataset(key, (nptl, ), data=ptl_dist[key][index])
 
 
+def transpose_tracer_files(plot_config):
+    """Transpose the qtag-sorted tracer files to trajectory and H5Part files
+
+    Different from transfer_to_h5part, it reads the tracer files directly
+    in blocks of particles x steps, so it works for a large number of tracers.
+
+    Args:
+        plot_config: plot configuration
+    """
+    pic_run = plot_config["pic_run"]
+    pic_run_dir = plot_config["pic_run_dir"]
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    species = plot_config["species"]
+    sname = "electron" if species in ["e", "electron"] else "H"
+    tracer_dir = pic_run_dir + 'tracer/tracer1/'
+    steps = tracer_transpose.get_tracer_steps(tracer_dir, sname)
+    with h5py.File(steps[0][1], 'r') as fh:
+        nptl_tot, = fh[steps[0][2]]['q'].shape
+    nptl = min(plot_config["nptl"], nptl_tot)
+    ptl_index = np.linspace(0, nptl_tot, nptl, endpoint=False).astype(int)
+    fdir = "../data/trajectory/" + pic_run + "/"
+    mkdir_p(fdir)
+    fname_traj = fdir + sname + "s_" + str(nptl) + ".h5p"
+    fname_h5part = fname_traj.replace('.h5p', '.h5part')
+    tracer_transpose.transpose_tracers(steps, fname_traj, fname_h5part,
+                                       ptl_index, dtwpe=pic_info.dtwpe)
+
+
 def adjust_pos(pos, length):
     """Adjust position for periodic boundary conditions
 
@@ -176,11 +231,16 @@ def plot_trajectory(plot_config, show_plot=True):
     picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
     pic_info = read_data_from_json(picinfo_fname)
     qm = -1 if species == 'e' else 1.0/pic_info.mime
-    fname = "../data/trajectory/" + pic_run + "/" + plot_config["traj_file"]
-    fh = h5py.File(fname, 'r')
-    particle_tags = list(fh.keys())
-    nptl = len(particle_tags)
-    ptl, sz = read_particle_data(pindex, particle_tags, pic_info, fh)
+    if plot_config.get("traj_store"):
+        with tracer_store.TrajectoryStore(plot_config["traj_store"]) as store:
+            ptl, sz = read_particle_store(pindex, store, pic_info)
+    else:
+        fname = ("../data/trajectory/" + pic_run + "/" +
+                 plot_config["traj_file"])
+        fh = h5py.File(fname, 'r')
+        particle_tags = list(fh.keys())
+        nptl = len(particle_tags)
+        ptl, sz = read_particle_data(pindex, particle_tags, pic_info, fh)
     smime = math.sqrt(pic_info.mime)
     lx_de = pic_info.lx_di * smime
     ly_de = pic_info.ly_di * smime
@@ -565,37 +625,39 @@ def plot_trajectory_simple(plot_config, show_plot=True):
         plt.close()
 
 
-def plot_trajectory_movie(plot_config, show_plot=True):
-    """Plot particle trajectory for trajectory movie
+class TrajectoryScene(movie_renderer.MovieScene):
+    """Particle trajectory with a marker moving along it
     """
-    pic_run = plot_config["pic_run"]
-    pic_run_dir = plot_config["pic_run_dir"]
-    pindex = plot_config['iptl']
-    species = plot_config['species']
-    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
-    pic_info = read_data_from_json(picinfo_fname)
-    fname = "../data/trajectory/" + pic_run + "/" + plot_config["traj_file"]
-    fh = h5py.File(fname, 'r')
-    particle_tags = list(fh.keys())
-    nptl = len(particle_tags)
-    ptl, sz = read_particle_data(pindex, particle_tags, pic_info, fh)
-    smime = math.sqrt(pic_info.mime)
-    lx_de = pic_info.lx_di * smime
-    ly_de = pic_info.ly_di * smime
-    lz_de = pic_info.lz_di * smime
-    xpos = adjust_pos(ptl['dX'], pic_info.lx_di)
-    ypos = adjust_pos(ptl['dY'], pic_info.ly_di)
-    zpos = adjust_pos(ptl['dZ'], pic_info.lz_di)
-    kene = ptl["gamma"] - 1
-
-    fdir = '../img/cori_3d/tracer_200/' + pic_run + '/'
-    fdir += 'tracer_' + str(pindex) + '/'
-    mkdir_p(fdir)
+    figsize = (12, 12)
+    dpi = 300
+
+    def __init__(self, ptl, xpos, ypos, zpos):
+        self.ptl = ptl
+        self.xpos = xpos
+        self.ypos = ypos
+        self.zpos = zpos
+        self.kene = ptl["gamma"] - 1
+
+    def _add_line(self, ax, xdata, ydata, cdata, norm, cmap):
+        """Line color-coded by cdata and the marker of the current point
+        """
+        points = np.array([xdata, ydata]).T.reshape(-1, 1, 2)
+        segments = np.concatenate([points[:-1], points[1:]], axis=1)
+        lc = LineCollection(segments, cmap=cmap, norm=norm)
+        lc.set_array(cdata)
+        lc.set_linewidth(2)
+        ax.add_collection(lc)
+        marker, = ax.plot([xdata[0]], [ydata[0]], marker='o', markersize=10,
+                          color="k")
+        ax.set_xlim([xdata.min(), xdata.max()])
+        ax.set_ylim([ydata.min(), ydata.max()])
+        ax.tick_params(labelsize=12)
+        return marker
 
-    for tframe in range(sz):
-    # for tframe in range(0, 1):
-        print("Time frame: %d" % tframe)
-        fig = plt.figure(figsize=[12, 12])
+    def setup(self, fig):
+        xpos, ypos, zpos = self.xpos, self.ypos, self.zpos
+        kene = self.kene
+        tptl = self.ptl["t"]
         rect0 = [0.07, 0.48, 0.55, 0.5]
         hgap, vgap = 0.07, 0.01
         ax = fig.add_axes(rect0, projection='3d')
@@ -608,8 +670,8 @@ def plot_trajectory_movie(plot_config, show_plot=True):
         lc.set_array(kene)
         lc.set_linewidth(2)
         ax.add_collection3d(lc)
-        ax.plot([xpos[tframe]], [ypos[tframe]], [zpos[tframe]],
-                marker='o', markersize=10, color="k")
+        self.marker3d, = ax.plot([xpos[0]], [ypos[0]], [zpos[0]],
+                                 marker='o', markersize=10, color="k")
         ax.set_xlim(xpos.min(), xpos.max())
         ax.set_ylim(ypos.min(), ypos.max())
         ax.set_zlim(zpos.min(), zpos.max())
@@ -625,22 +687,9 @@ def plot_trajectory_movie(plot_config, show_plot=True):
         rect[1] += 0.05
         rect[3] -= 0.05
         ax = fig.add_axes(rect)
-        points = np.array([ptl["t"], kene]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([points[:-1], points[1:]], axis=1)
-        # Create a continuous norm to map from data points to colors
-        norm = plt.Normalize(kene.min(), kene.max())
-        lc = LineCollection(segments, cmap='jet', norm=norm)
-        # Set the values used for colormapping
-        lc.set_array(kene)
-        lc.set_linewidth(2)
-        ax.add_collection(lc)
-        ax.plot([ptl["t"][tframe]], [kene[tframe]],
-                marker='o', markersize=10, color="k")
-        ax.set_xlim([ptl["t"].min(), ptl["t"].max()])
-        ax.set_ylim([kene.min(), kene.max()])
+        self.marker_tk = self._add_line(ax, tptl, kene, kene, norm, 'jet')
         ax.set_xlabel('$t\omega_{pe}$', fontsize=16)
         ax.set_ylabel('$\gamma - 1$', fontsize=16)
-        ax.tick_params(labelsize=12)
 
         # xz
         rect = np.copy(rect0)
@@ -648,50 +697,57 @@ def plot_trajectory_movie(plot_config, show_plot=True):
         rect[3] = 0.41
         rect[1] -= rect[3] + vgap
         ax = fig.add_axes(rect)
-        points = np.array([xpos, zpos]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([points[:-1], points[1:]], axis=1)
-        norm = plt.Normalize(kene.min(), kene.max())
-        lc = LineCollection(segments, cmap='jet', norm=norm)
-        lc.set_array(kene)
-        lc.set_linewidth(2)
-        ax.add_collection(lc)
-        ax.plot([xpos[tframe]], [zpos[tframe]],
-                marker='o', markersize=10, color="k")
-        ax.set_xlim([xpos.min(), xpos.max()])
-        ax.set_ylim([zpos.min(), zpos.max()])
+        self.marker_xz = self._add_line(ax, xpos, zpos, kene, norm, 'jet')
         ax.set_xlabel('$x/d_i$', fontsize=16)
         ax.set_ylabel('$z/d_i$', fontsize=16)
-        ax.tick_params(labelsize=12)
 
         # x-gamma
         rect[0] += rect[2] + hgap
         ax = fig.add_axes(rect)
-        points = np.array([xpos, kene]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([points[:-1], points[1:]], axis=1)
         norm = plt.Normalize(-0.1, 0.1)
-        lc = LineCollection(segments, cmap='seismic', norm=norm)
-        lc.set_array(ptl["Vx"])
-        lc.set_linewidth(2)
-        ax.add_collection(lc)
-        ax.plot([xpos[tframe]], [kene[tframe]],
-                marker='o', markersize=10, color="k")
-        ax.set_xlim([xpos.min(), xpos.max()])
-        ax.set_ylim([kene.min(), kene.max()])
+        self.marker_xk = self._add_line(ax, xpos, kene, self.ptl["Vx"],
+                                        norm, 'seismic')
         ax.set_xlabel('$x/d_i$', fontsize=16)
         ax.set_ylabel('$\gamma-1$', fontsize=16)
-        ax.tick_params(labelsize=12)
         text1 = 'Color-coded by ' + '$V_x$'
         ax.text(0.98, 0.05, text1, color='k', fontsize=24,
                 bbox=dict(facecolor='none', alpha=1.0, edgecolor='none', pad=10.0),
                 horizontalalignment='right', verticalalignment='center',
                 transform=ax.transAxes)
 
-        fname = (fdir + species + 'tracer_' + str(pindex) +
-                 '_' + str(tframe) + '.jpg')
-        fig.savefig(fname, dpi=300)
+    def update(self, frame):
+        xpos, ypos, zpos = self.xpos, self.ypos, self.zpos
+        kene = self.kene
+        self.marker3d.set_data_3d([xpos[frame]], [ypos[frame]], [zpos[frame]])
+        self.marker_tk.set_data([self.ptl["t"][frame]], [kene[frame]])
+        self.marker_xz.set_data([xpos[frame]], [zpos[frame]])
+        self.marker_xk.set_data([xpos[frame]], [kene[frame]])
 
-        # plt.show()
-        plt.close()
+
+def plot_trajectory_movie(plot_config, show_plot=True):
+    """Plot particle trajectory for trajectory movie
+    """
+    pic_run = plot_config["pic_run"]
+    pic_run_dir = plot_config["pic_run_dir"]
+    pindex = plot_config['iptl']
+    species = plot_config['species']
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    fname = "../data/trajectory/" + pic_run + "/" + plot_config["traj_file"]
+    fh = h5py.File(fname, 'r')
+    particle_tags = list(fh.keys())
+    nptl = len(particle_tags)
+    ptl, sz = read_particle_data(pindex, particle_tags, pic_info, fh)
+    xpos = adjust_pos(ptl['dX'], pic_info.lx_di)
+    ypos = adjust_pos(ptl['dY'], pic_info.ly_di)
+    zpos = adjust_pos(ptl['dZ'], pic_info.lz_di)
+
+    fdir = '../img/cori_3d/tracer_200/' + pic_run + '/'
+    fdir += 'tracer_' + str(pindex) + '/'
+    mkdir_p(fdir)
+    scene = TrajectoryScene(ptl, xpos, ypos, zpos)
+    movie_name = fdir + species + 'tracer_' + str(pindex) + '.mp4'
+    movie_renderer.render_movie(scene, range(sz), movie_name)
 
 
 def trans_trajectory_vtu(plot_config, show_plot=True):
@@ -1479,6 +1535,46 @@ def get_unique_tracers(plot_config, show_plot=True):
                 group.create_dataset(key, (nptl_new, ), data=ptl_new[key])
 
 
+def extract_tracers_by_tag(plot_config):
+    """Extract the trajectories of randomly selected tracers using tag index
+
+    The tag index of the unsorted tracer files is built when it does not
+    exist, so no qtag-sorted files are needed.
+
+    Args:
+        plot_config: plot configuration
+    """
+    pic_run = plot_config["pic_run"]
+    pic_run_dir = plot_config["pic_run_dir"]
+    species = plot_config["species"]
+    sname = "electron" if species in ["e", "electron"] else "H"
+    tracer_dir = pic_run_dir + 'tracer/tracer2/'
+    index_dir = tracer_dir + 'tag_index_' + sname + '/'
+    # the index directory only appears when the index is complete
+    if not os.path.isdir(index_dir):
+        tracer_tag_index.build_tag_index(tracer_dir, 'tracers.h5p', index_dir,
+                                         subgroup=sname + '_tracer')
+    tag_index = tracer_tag_index.TagIndex(index_dir)
+    fname = tracer_dir + 'T.0/tracers.h5p'
+    with h5py.File(fname, 'r') as fh:
+        qinit = fh['Step#0/' + sname + '_tracer/q'][:]
+    nptl = min(plot_config["nptl"], len(qinit))
+    np.random.seed(0)
+    tags = np.sort(np.random.choice(qinit, nptl, replace=False))
+    with h5py.File(fname, 'r') as fh:
+        dset_names = list(fh['Step#0/' + sname + '_tracer'].keys())
+    ncores = multiprocessing.cpu_count()
+    ptl, found = tag_index.extract(tags, dset_names, ncores=ncores)
+    fdir = "../data/trajectory/" + pic_run + "/"
+    mkdir_p(fdir)
+    fname = fdir + sname + "s_tags_" + str(nptl) + ".h5p"
+    with h5py.File(fname, 'w') as fh:
+        for iptl, tag in enumerate(tags):
+            grp = fh.create_group('Particle#' + str(tag))
+            for dset_name in dset_names:
+                grp.create_dataset(dset_name, data=ptl[dset_name][:, iptl])
+
+
 def get_cmd_args():
     """Get command line arguments
     """
@@ -1502,6 +1598,8 @@ def get_cmd_args():
                         help='starting time frame')
     parser.add_argument('--tend', action="store", default='40', type=int,
                         help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
     parser.add_argument('--bg', action="store", default='0.2', type=float,
                         help='Guide field strength')
     parser.add_argument('--iptl', action="store", default='0', type=int,
@@ -1510,6 +1608,9 @@ def get_cmd_args():
                         help='Total number of particle tracers')
     parser.add_argument('--traj_file', action="store", default='electrons_200.h5p',
                         help='Trajectory file name')
+    parser.add_argument('--traj_store', action="store", default=None,
+                        help='trajectory store built by tracer_store, ' +
+                        'read by plot_traj instead of traj_file')
     parser.add_argument('--tint', action="store", default='20', type=int,
                         help='Number of steps before and after current step ' +
                         'for piecewise trajectory')
@@ -1523,6 +1624,11 @@ def get_cmd_args():
                         help='whether to plot particle trajectory in xz and xgamma format')
     parser.add_argument('--to_h5part', action="store_true", default=False,
                         help='whether to transfer trajectory data into H5Part')
+    parser.add_argument('--transpose_tracers', action="store_true", default=False,
+                        help='whether to transpose tracer files into trajectory ' +
+                        'and H5Part files')
+    parser.add_argument('--extract_tracers', action="store_true", default=False,
+                        help='whether to extract tracers by tags using tag index')
     parser.add_argument('--multi_tracer', action="store_true", default=False,
                         help='whether to analyze multiple tracers')
     parser.add_argument('--traj_movie', action="store_true", default=False,
@@ -1566,6 +1672,8 @@ def analysis_single_frames(plot_config, args):
             plot_trajectory_movie(plot_config)
     elif args.to_h5part:
         transfer_to_h5part(plot_config)
+    elif args.transpose_tracers:
+        transpose_tracer_files(plot_config)
     elif args.trans_traj_vtu:
         trans_trajectory_vtu(plot_config)
     elif args.trans_traj_h5part:
@@ -1582,6 +1690,8 @@ def analysis_single_frames(plot_config, args):
         piecewise_trajectory_cross(plot_config)
     elif args.unique_tracers:
         get_unique_tracers(plot_config)
+    elif args.extract_tracers:
+        extract_tracers_by_tag(plot_config)
 
 
 def process_input(plot_config, args, tframe):
@@ -1593,16 +1703,21 @@ def analysis_multi_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
+    ckpt = checkpoint.for_frames('cori_3d_tracer', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            pass
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                ckpt.record(tframe)
     else:
         ncores = multiprocessing.cpu_count()
         ncores = 8
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
@@ -1616,6 +1731,7 @@ def main():
     plot_config["tend"] = args.tend
     plot_config["species"] = args.species
     plot_config["traj_file"] = args.traj_file
+    plot_config["traj_store"] = args.traj_store
     plot_config["iptl"] = args.iptl
     plot_config["nptl"] = args.nptl
     plot_config["bg"] = args.bg
@@ -5,7 +5,6 @@ import collections
 import math
 import os.path
 import re
-import struct
 import sys
 
 import matplotlib as mpl
@@ -21,6 +20,7 @@ from scipy.interpolate import interp1d
 
 import palettable
 import pic_information
+import vpic_schema
 from pic_information import list_pic_info_dir
 from runs_name_path import *
 from serialize_json import data_to_json, json_to_data
@@ -228,35 +228,24 @@ def read_jdote(pic_info, fname):
     ntf = pic_info.ntf
     dt_fields = pic_info.dt_fields
     dtf_wpe = dt_fields * pic_info.dtwpe / pic_info.dtwci
-    fh = open(fname, 'r')
-    data = fh.read()
-    fh.close()
-    njote = 16  # different kind of data.
-    jdote_data = np.zeros((ntf, njote))
-    index_start = 0
-    index_end = 4
-    for current_time in range(ntf):
-        for i in range(njote):
-            jdote_data[current_time, i], = \
-                    struct.unpack('f', data[index_start:index_end])
-            index_start = index_end
-            index_end += 4
-    jcpara_dote = jdote_data[:, 0]
-    jcperp_dote = jdote_data[:, 1]
-    jmag_dote = jdote_data[:, 2]
-    jgrad_dote = jdote_data[:, 3]
-    jdiagm_dote = jdote_data[:, 4]
-    jpolar_dote = jdote_data[:, 5]
-    jexb_dote = jdote_data[:, 6]
-    jpara_dote = jdote_data[:, 7]
-    jperp_dote = jdote_data[:, 8]
-    jperp1_dote = jdote_data[:, 9]
-    jperp2_dote = jdote_data[:, 10]
-    jqnupara_dote = jdote_data[:, 11]
-    jqnuperp_dote = jdote_data[:, 12]
-    jagy_dote = jdote_data[:, 14]
-    jtot_dote = jdote_data[:, 13]
-    jdivu_dote = jdote_data[:, 15]
+    jdote_data = vpic_schema.read_jdote(fname, ntf).astype(
+        [(name, np.float64) for name in vpic_schema.JDOTE_FIELDS])
+    jcpara_dote = jdote_data['jcpara_dote']
+    jcperp_dote = jdote_data['jcperp_dote']
+    jmag_dote = jdote_data['jmag_dote']
+    jgrad_dote = jdote_data['jgrad_dote']
+    jdiagm_dote = jdote_data['jdiagm_dote']
+    jpolar_dote = jdote_data['jpolar_dote']
+    jexb_dote = jdote_data['jexb_dote']
+    jpara_dote = jdote_data['jpara_dote']
+    jperp_dote = jdote_data['jperp_dote']
+    jperp1_dote = jdote_data['jperp1_dote']
+    jperp2_dote = jdote_data['jperp2_dote']
+    jqnupara_dote = jdote_data['jqnupara_dote']
+    jqnuperp_dote = jdote_data['jqnuperp_dote']
+    jagy_dote = jdote_data['jagy_dote']
+    jtot_dote = jdote_data['jtot_dote']
+    jdivu_dote = jdote_data['jdivu_dote']
     jcpara_dote_int = cumulate_with_time(jcpara_dote, dtf_wpe, ntf)
     jcperp_dote_int = cumulate_with_time(jcperp_dote, dtf_wpe, ntf)
     jmag_dote_int = cumulate_with_time(jmag_dote, dtf_wpe, ntf)
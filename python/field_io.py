@@ -0,0 +1,69 @@
+"""
+Plotting-free readers of the fields data
+
+This module and the other core modules (json_functions, shell_functions,
+vpic_schema, spectrum_engine, fieldline_tracer...) do not import matplotlib
+at import time, so the data-reduction scripts and their worker processes
+start quickly. read_2d_fields is still available from contour_plots.
+"""
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+import instrument
+
+
+@instrument.stage('read_2d_fields')
+def read_2d_fields(pic_info, fname, current_time, xl, xr, zb, zt):
+    """Read 2D fields data from file.
+
+    Args:
+        pic_info: namedtuple for the PIC simulation information.
+        fname: the filename.
+        current_time: current time frame.
+        xl, xr: left and right x position in di (ion skin length).
+        zb, zt: top and bottom z position in di.
+    """
+    print("Reading data from %s" % fname)
+    print("xrange: (%f, %f)" % (xl, xr))
+    print("zrange: (%f, %f)" % (zb, zt))
+    nx = pic_info.nx
+    nz = pic_info.nz
+    x_di = np.copy(pic_info.x_di)
+    z_di = np.copy(pic_info.z_di)
+    dx_di = pic_info.dx_di
+    dz_di = pic_info.dz_di
+    xmin = np.min(x_di)
+    xmax = np.max(x_di)
+    zmin = np.min(z_di)
+    zmax = np.max(z_di)
+    if (xl <= xmin):
+        xl_index = 0
+    else:
+        xl_index = int(math.floor((xl - xmin) / dx_di))
+    if (xr >= xmax):
+        xr_index = nx - 1
+    else:
+        xr_index = int(math.ceil((xr - xmin) / dx_di))
+    if (zb <= zmin):
+        zb_index = 0
+    else:
+        zb_index = int(math.floor((zb - zmin) / dz_di))
+    if (zt >= zmax):
+        zt_index = nz - 1
+    else:
+        zt_index = int(math.ceil((zt - zmin) / dz_di))
+    nx1 = xr_index - xl_index + 1
+    nz1 = zt_index - zb_index + 1
+    fp = np.zeros((nz1, nx1), dtype=np.float32)
+    offset = nx * nz * current_time * 4
+    fdata = np.memmap(fname, dtype='float32',
+                      mode='r', offset=offset,
+                      shape=(nz, nx), order='C')
+    xc = x_di[xl_index:xr_index + 1]
+    zc = z_di[zb_index:zt_index + 1]
+    fp = fdata[zb_index:zt_index + 1, xl_index:xr_index + 1]
+    instrument.add_bytes('gda', fp.nbytes)
+    return (xc, zc, fp)
@@ -1,139 +1,56 @@
+#!/usr/bin/env python3
 """
 Procedures to make movies of the fields.
 """
-import collections
-import math
-import os.path
-import struct
+from __future__ import print_function
 
-import matplotlib as mpl
-import matplotlib.animation as animation
-import matplotlib.pyplot as plt
-import numpy as np
-from matplotlib import rc
-from matplotlib.colors import LogNorm
-from matplotlib.ticker import MaxNLocator
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from mpl_toolkits.mplot3d import Axes3D
+import argparse
 
-import contour_plots
-import pic_information
-from contour_plots import plot_2d_contour, read_2d_fields
+import movie_renderer
+from json_functions import read_data_from_json
 
-rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
-mpl.rc('text', usetex=True)
-mpl.rcParams['text.latex.preamble'] = [r"\usepackage{amsmath}"]
 
-font = {
-    'family': 'serif',
-    #'color'  : 'darkred',
-    'color': 'black',
-    'weight': 'normal',
-    'size': 24,
-}
-
-pic_info = pic_information.get_pic_info('..')
-
-width = 0.8
-height = 0.78
-xs = 0.10
-ys = 0.9 - height
-fig = plt.figure(figsize=[8, 4])
-ax1 = fig.add_axes([xs, ys, width, height])
-filename = '../data/jy.gda'
-
-
-def read_and_plot(ct, filename):
-    """
-    Read 2D field and do contour plot.
-
-    Args:
-        ct: current time frame.
-        filename: the file name including its path.
+def get_cmd_args():
+    """Get command line arguments
     """
-    kwargs = {"current_time": ct, "xl": 0, "xr": 200, "zb": -50, "zt": 50}
-    x, z, num_rho = read_2d_fields(pic_info, filename, **kwargs)
-    x, z, Ay = read_2d_fields(pic_info, "../data/Ay.gda", **kwargs)
-
-    nx, = x.shape
-    nz, = z.shape
-    xmin = np.min(x)
-    xmax = np.max(x)
-    zmin = np.min(z)
-    zmax = np.max(z)
-
-    kwargs_plot = {
-        "xstep": 2,
-        "zstep": 2,
-        "is_log": True,
-        "vmin": -1,
-        "vmax": 1
-    }
-    xstep = kwargs_plot["xstep"]
-    zstep = kwargs_plot["zstep"]
-    data = num_rho[0:nz:zstep, 0:nx:xstep]
-    print "Maximum and minimum of the data: ", np.max(data), np.min(data)
-
-    im1 = ax1.imshow(
-        data,
-        cmap=plt.cm.seismic,
-        extent=[xmin, xmax, zmin, zmax],
-        aspect='auto',
-        origin='lower',
-        vmin=kwargs_plot["vmin"],
-        vmax=kwargs_plot["vmax"],
-        interpolation='bicubic')
-    # norm=LogNorm(vmin=kwargs_plot["vmin"], 
-    #     vmax=kwargs_plot["vmax"]))
-    ax1.contour(
-        x[0:nx:xstep],
-        z[0:nz:zstep],
-        Ay[0:nz:zstep, 0:nx:xstep],
-        colors='black',
-        linewidths=0.5)
-    ax1.set_ylabel(r'$z/d_i$', fontdict=font, fontsize=32)
-    ax1.set_xlabel(r'$x/d_i$', fontdict=font, fontsize=32)
-    ax1.tick_params(labelsize=32)
-
-    t_wci = current_time * pic_info.dt_fields
-    title = r'$t = ' + "{:10.1f}".format(t_wci) + '/\Omega_{ci}$'
-    ax1.set_title(title, fontdict=font, fontsize=32)
-
-    return im1
-
-
-current_time = -1
-
-
-def field_movie(*args):
-    global current_time, cbar1
-    ax1.cla()
-    current_time += 1
-    #im1 = read_and_plot(current_time, filename)
-    # Initialize the plot
-    im1 = read_and_plot(current_time, filename)
-
-    if (current_time == 0):
-        # create an axes on the right side of ax. The width of cax will be 5%
-        # of ax and the padding between cax and ax will be fixed at 0.05 inch.
-        divider = make_axes_locatable(ax1)
-        cax = divider.append_axes("right", size="2%", pad=0.05)
-        cbar = fig.colorbar(im1, cax=cax)
-        cbar.ax.set_ylabel(r'$j_y$', fontdict=font, fontsize=32)
-        cbar.ax.tick_params(labelsize=32)
-    return im1,
-
-
-ani = animation.FuncAnimation(fig, field_movie, frames=40, blit=True)
-mywriter = animation.FFMpegWriter()
-ani.save(
-    'jy.mp4',
-    fps=20,
-    writer=mywriter,
-    bitrate=-1,
-    dpi=200,
-    codec="libx264",
-    extra_args=['-pix_fmt', 'yuv420p'])
-#plt.show()
-
-plt.close()
+    default_pic_run = 'mime25_beta002_bg00'
+    default_pic_run_dir = '../'
+    parser = argparse.ArgumentParser(description='Movies of fields')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--var', action="store", default='jy',
+                        help='field name')
+    parser.add_argument('--label', action="store", default=r'$j_y$',
+                        help='label of the colorbar')
+    parser.add_argument('--vmin', action="store", default=None, type=float,
+                        help='minimum of the colorbar')
+    parser.add_argument('--vmax', action="store", default=None, type=float,
+                        help='maximum of the colorbar')
+    parser.add_argument('--tstart', action="store", default='0', type=int,
+                        help='starting time frame')
+    parser.add_argument('--tend', action="store", default='39', type=int,
+                        help='ending time frame')
+    parser.add_argument('--fps', action="store", default='20', type=int,
+                        help='frames per second')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    picinfo_fname = '../data/pic_info/pic_info_' + args.pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    scene = movie_renderer.FieldScene(pic_info, args.pic_run_dir, args.var,
+                                      args.label, args.vmin, args.vmax)
+    movie_name = '../img/movies/' + args.var + '_' + args.pic_run + '.mp4'
+    tframes = range(args.tstart, args.tend + 1)
+    movie_renderer.render_movie(scene, tframes, movie_name, fps=args.fps,
+                                ncores=args.ncores)
+
+
+if __name__ == "__main__":
+    main()
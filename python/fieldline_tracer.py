@@ -0,0 +1,260 @@
+"""
+Vectorized tracing of many magnetic field lines
+
+All the seeds are advanced together with the 4th-order Runge-Kutta method,
+so the field interpolation at each stage is one numpy operation over the
+active seeds instead of one Python call for each seed. A line stops when it
+leaves the domain, closes on itself, reaches the length cap, or hits a
+magnetic null. The lines that have stopped are dropped from the active set.
+
+The fields are arrays with shape (nz, nx) in 2D or (nz, ny, nx) in 3D. The
+positions are (x, z) or (x, y, z) measured from the lower corner of the
+domain. Each field component can be staggered from the grid nodes by an
+offset in units of cells, e.g., (0, 0.5) for Bx at face centers in 2D.
+
+    lines = trace_field_lines((bx, bz), seeds, (dx, dz),
+                              offsets=((0, 0.5), (0.5, 0)))
+    for xz in split_lines(lines):
+        plt.plot(xz[:, 0], xz[:, 1])
+"""
+import collections
+import itertools
+
+import numpy as np
+
+ACTIVE = 0
+EXIT_DOMAIN = 1
+CLOSED_LOOP = 2
+MAX_LENGTH = 3
+NULL_FIELD = 4
+
+# Ragged output of many field lines. The points of line i are
+# points[offsets[i]:offsets[i+1]] (None when the paths are not recorded).
+# end is the last position of each line, status is one of the constants
+# above, length is the length along the traced path, and integral is the
+# line integral of efields (None when efields is not given).
+FieldLines = collections.namedtuple(
+    'FieldLines', ['points', 'offsets', 'end', 'status', 'length', 'integral'])
+
+
+def interp_staggered(fdata, pos, spacing, offset=None):
+    """Linear interpolation of a staggered field at many positions
+
+    The positions out of the grid use the values at the closest boundary.
+
+    Args:
+        fdata: field data with shape (nz, nx) or (nz, ny, nx)
+        pos: positions with shape (npoints, ndim) in the order of (x, [y,] z)
+        spacing: grid sizes in the order of (x, [y,] z)
+        offset: the location of fdata[0, ..., 0] in cells
+    """
+    ndim = fdata.ndim
+    shape = fdata.shape[::-1]
+    if offset is None:
+        offset = (0, ) * ndim
+    index = []
+    weight = []
+    for idim in range(ndim):
+        fpos = pos[:, idim] / spacing[idim] - offset[idim]
+        fpos = np.clip(fpos, 0, shape[idim] - 1)
+        ipos = np.minimum(fpos.astype(np.int64), max(shape[idim] - 2, 0))
+        index.append(ipos)
+        weight.append(fpos - ipos)
+    fdata_interp = np.zeros(len(pos))
+    for corner in itertools.product((0, 1), repeat=ndim):
+        wcorner = np.ones(len(pos))
+        icorner = []
+        for idim, shift in enumerate(corner):
+            wcorner *= weight[idim] if shift else 1 - weight[idim]
+            icorner.append(np.minimum(index[idim] + shift, shape[idim] - 1))
+        fdata_interp += wcorner * fdata[tuple(icorner[::-1])]
+    return fdata_interp
+
+
+def _field_direction(bfields, pos, spacing, offsets, pdims):
+    """Unit vector along the traced components of the magnetic field
+
+    Returns:
+        direction: (npoints, ndim) unit vectors (zeros at nulls)
+        bvec: (npoints, ncomponents) interpolated field
+        ib: 1/|B| of the traced components (0 at nulls)
+    """
+    bvec = np.stack([interp_staggered(bfield, pos, spacing, offset)
+                     for bfield, offset in zip(bfields, offsets)], axis=1)
+    absb = np.sqrt(np.sum(bvec[:, pdims]**2, axis=1))
+    ib = np.zeros(len(pos))
+    np.divide(1.0, absb, out=ib, where=absb > 0)
+    return bvec[:, pdims] * ib[:, None], bvec, ib
+
+
+def trace_field_lines(bfields,
+                      seeds,
+                      spacing,
+                      offsets=None,
+                      ds=None,
+                      direction=1,
+                      lbounds=None,
+                      ubounds=None,
+                      max_length=None,
+                      max_steps=1000000,
+                      close_dist=None,
+                      min_close_steps=20,
+                      efields=None,
+                      eoffsets=None,
+                      record=True):
+    """Trace the magnetic field lines from many seeds
+
+    In 2D, bfields can include By, i.e., (bx, by, bz). The lines are traced
+    in the x-z plane using the in-plane components, and By only enters the
+    line integral of efields.
+
+    Args:
+        bfields: (bx, bz) or (bx, by, bz) in 2D, (bx, by, bz) in 3D
+        seeds: (nseeds, ndim) starting points in the order of (x, [y,] z)
+        spacing: grid sizes in the order of (x, [y,] z)
+        offsets: the staggering offsets of the field components
+        ds: step size. The default is 0.1 of the cell diagonal.
+        direction: 1 to trace along B and -1 to trace against B
+        lbounds, ubounds: the domain bounds. The default domain is
+            [0, n * spacing] along each axis.
+        max_length: the maximum length of each line. The default is five
+            times the domain size along x.
+        max_steps: the maximum number of steps
+        close_dist: a line is closed when it comes back within close_dist
+            of its seed after min_close_steps steps. The default is the grid
+            size along x. Loop closure is not checked when it is 0.
+        min_close_steps: see close_dist
+        efields: the electric field components in the same order as bfields.
+            When given, the integral of E.B/|B_traced| along the path, i.e.,
+            the integral of E.dl along the field line, is calculated.
+        eoffsets: the staggering offsets of the electric field components
+        record: whether to record the points along the lines
+
+    Returns:
+        FieldLines
+    """
+    ndim = bfields[0].ndim
+    seeds = np.array(seeds, dtype=np.float64).reshape(-1, ndim)
+    nseeds = len(seeds)
+    spacing = np.asarray(spacing, dtype=np.float64)
+    if ndim == 2 and len(bfields) == 3:
+        pdims = [0, 2]
+    else:
+        pdims = list(range(ndim))
+    if offsets is None:
+        offsets = [None] * len(bfields)
+    if efields is not None and eoffsets is None:
+        eoffsets = [None] * len(efields)
+    shape = np.asarray(bfields[0].shape[::-1])
+    if lbounds is None:
+        lbounds = np.zeros(ndim)
+    if ubounds is None:
+        ubounds = shape * spacing
+    lbounds = np.asarray(lbounds, dtype=np.float64)
+    ubounds = np.asarray(ubounds, dtype=np.float64)
+    if ds is None:
+        ds = 0.1 * np.sqrt(np.sum(spacing**2))
+    if max_length is None:
+        max_length = 5 * (ubounds[0] - lbounds[0])
+    if close_dist is None:
+        close_dist = spacing[0]
+    hds = 0.5 * ds
+
+    def field(pos):
+        dvec, bvec, ib = _field_direction(bfields, pos, spacing, offsets,
+                                          pdims)
+        if efields is None:
+            return dvec * direction, None, ib
+        evec = np.stack([interp_staggered(efield, pos, spacing, offset)
+                         for efield, offset in zip(efields, eoffsets)],
+                        axis=1)
+        epara = np.sum(evec * bvec, axis=1) * ib * direction
+        return dvec * direction, epara, ib
+
+    status = np.zeros(nseeds, dtype=np.int32)
+    length = np.zeros(nseeds)
+    end = seeds.copy()
+    integral = None if efields is None else np.zeros(nseeds)
+    iactive = np.arange(nseeds)
+    pos = seeds.copy()
+    ids_list = [iactive]
+    points_list = [seeds.copy()]
+    nstep = 0
+    while len(iactive) > 0 and nstep < max_steps:
+        k1, e1, ib = field(pos)
+        null = ib == 0
+        k2, e2, _ = field(pos + k1 * hds)
+        k3, e3, _ = field(pos + k2 * hds)
+        k4, e4, _ = field(pos + k3 * ds)
+        pos += ds / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        if efields is not None:
+            integral[iactive] += ds / 6 * (e1 + 2 * e2 + 2 * e3 + e4)
+        length[iactive] += ds
+        nstep += 1
+        if record:
+            ids_list.append(iactive)
+            points_list.append(pos.copy())
+
+        stop = np.zeros(len(iactive), dtype=np.int32)
+        outside = np.any((pos < lbounds) | (pos > ubounds), axis=1)
+        stop[length[iactive] >= max_length] = MAX_LENGTH
+        stop[outside] = EXIT_DOMAIN
+        if close_dist > 0 and nstep > min_close_steps:
+            dist2 = np.sum((pos - seeds[iactive])**2, axis=1)
+            stop[dist2 < close_dist**2] = CLOSED_LOOP
+        stop[null] = NULL_FIELD
+        done = stop > 0
+        if np.any(done):
+            status[iactive[done]] = stop[done]
+            end[iactive[done]] = pos[done]
+            iactive = iactive[~done]
+            pos = pos[~done]
+    if len(iactive) > 0:
+        status[iactive] = MAX_LENGTH
+        end[iactive] = pos
+
+    points, offsets_line = None, None
+    if record:
+        ids = np.concatenate(ids_list)
+        order = np.argsort(ids, kind='stable')
+        points = np.concatenate(points_list)[order]
+        counts = np.bincount(ids, minlength=nseeds)
+        offsets_line = np.concatenate(([0], np.cumsum(counts)))
+    return FieldLines(points, offsets_line, end, status, length, integral)
+
+
+def split_lines(lines):
+    """Split the ragged points into a list of (npoints, ndim) arrays
+    """
+    return np.split(lines.points, lines.offsets[1:-1])
+
+
+def bisect_seeds(is_open, v1, v2, tol, nseeds=16):
+    """Find the boundary between closed and open field lines
+
+    The seeds are placed along one coordinate between v1 (closed) and v2
+    (open), and all the seeds of one iteration are traced together. The
+    interval is narrowed by a factor of nseeds + 1 in each iteration instead
+    of 2 for one seed at a time.
+
+    Args:
+        is_open: a function mapping an array of seed coordinates to a boolean
+            array, e.g., whether the lines leave the domain at one side
+        v1, v2: the coordinates of a closed seed and an open seed
+        tol: the tolerance of |v2 - v1|
+        nseeds: number of seeds in each iteration
+
+    Returns:
+        (v1, v2) bracketing the boundary within tol
+    """
+    while abs(v2 - v1) > tol:
+        vseeds = np.linspace(v1, v2, nseeds + 2)[1:-1]
+        flags = np.asarray(is_open(vseeds))
+        if np.any(flags):
+            iopen = np.argmax(flags)
+            v2 = vseeds[iopen]
+            if iopen > 0:
+                v1 = vseeds[iopen - 1]
+        else:
+            v1 = vseeds[-1]
+    return v1, v2
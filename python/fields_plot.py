@@ -24,6 +24,7 @@ import color_maps as cm
 import colormap.colormaps as cmaps
 import palettable
 import pic_information
+import render_prep
 from contour_plots import plot_2d_contour, read_2d_fields
 from energy_conversion import read_data_from_json
 from plasma_params import calc_plasma_parameters
@@ -89,6 +90,20 @@ class PlotMultiplePanels(object):
         else:
             self.is_multi_Ay = False
 
+        if "save_eps" in kwargs:
+            self.save_eps = kwargs["save_eps"]
+        else:
+            self.save_eps = False
+
+        # The fields are reduced to the pixel grid of the JPEG figures,
+        # but not for the EPS figures for publication
+        if self.save_eps:
+            self.decimate = False
+        elif "decimate" in kwargs:
+            self.decimate = kwargs["decimate"]
+        else:
+            self.decimate = 'mean'
+
         self.fig = plt.figure(figsize=self.fig_sizes)
         self.ax = []
         self.im = []
@@ -108,7 +123,9 @@ class PlotMultiplePanels(object):
                     "zstep": self.zstep,
                     "is_log": self.is_logs[ip],
                     "vmin": self.vmin[ip],
-                    "vmax": self.vmax[ip]
+                    "vmax": self.vmax[ip],
+                    "decimate": self.decimate,
+                    "dpi": 200
                 }
                 im1, cbar1 = plot_2d_contour(self.x, self.z, self.fdata[ip],
                                              self.ax1, self.fig,
@@ -221,10 +238,6 @@ class PlotMultiplePanels(object):
             self.ax1d.set_xlabel(r'$x/d_i$', fontdict=font, fontsize=20)
             self.ax1d.set_ylabel(r'Accumulation', fontdict=font, fontsize=20)
 
-        if "save_eps" in kwargs:
-            self.save_eps = kwargs["save_eps"]
-        else:
-            self.save_eps = False
         self.save_figures()
 
     def update_fields(self, ct, fdata, Ay):
@@ -236,7 +249,12 @@ class PlotMultiplePanels(object):
         for j in range(self.nzp):
             for i in range(self.nxp):
                 np = self.nxp * j + i
-                self.im[np].set_data(self.fdata[np])
+                if self.decimate:
+                    self.im[np].set_data(
+                        render_prep.decimate_for_axes(
+                            self.fdata[np], self.ax[np], 200, self.decimate))
+                else:
+                    self.im[np].set_data(self.fdata[np])
                 for coll in self.co[np].collections:
                     coll.remove()
                 self.co[np] = self.ax[np].contour(
@@ -2,6 +2,7 @@
 Analysis procedures for the paper on high mass-ratio
 """
 import argparse
+import functools
 import itertools
 import math
 import multiprocessing
@@ -19,10 +20,13 @@ from scipy import signal
 from scipy.interpolate import interp1d, interp2d
 from scipy.ndimage.filters import median_filter, gaussian_filter
 
+import checkpoint
 import fitting_funcs
+import parallel_backend
 import pic_information
+import spectrum_engine
+import xpoints
 from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
 
@@ -62,18 +66,9 @@ def calc_reconnection_rate(run_dir, run_name):
     """
     picinfo_fname = '../data/pic_info/pic_info_' + run_name + '.json'
     pic_info = read_data_from_json(picinfo_fname)
-    ntf = pic_info.ntf
-    phi = np.zeros(ntf)
-    fname = run_dir + 'data/Ay.gda'
-    for tframe in range(ntf):
-        kwargs = {"current_time": tframe,
-                  "xl": 0, "xr": pic_info.lx_di,
-                  "zb": -pic_info.lz_di*0.1, "zt": pic_info.lz_di*0.1}
-        x, z, Ay = read_2d_fields(pic_info, fname, **kwargs)
-        nz, = z.shape
-        max_ay = np.max(Ay[nz // 2 - 1:nz // 2 + 1, :])
-        min_ay = np.min(Ay[nz // 2 - 1:nz // 2 + 1, :])
-        phi[tframe] = max_ay - min_ay
+    series = xpoints.get_xline_series(run_name, run_dir,
+                                      zwidth=pic_info.lz_di*0.1)
+    phi = series["flux"]
     nk = 3
     # phi = signal.medfilt(phi, kernel_size=nk)
     dtwpe = pic_info.dtwpe
@@ -6783,38 +6778,20 @@ def calc_magnetic_power_spectrum(bg, mime, tframe, const_va):
               "zb": -pic_info.lz_di*0.5, "zt": pic_info.lz_di*0.5}
     components = ['x', 'y', 'z']
     nbins_k = 64
-    fdata = np.zeros(2 * nbins_k + 2)
-    fdata[0] = nbins_k
+    bfields = []
     for comp in components:
         fname = pic_info.run_dir + "data/b" + comp + ".gda"
         x, z, bfield = read_2d_fields(pic_info, fname, **kwargs)
-        lx = np.max(x) - np.min(x)
-        lz = np.max(z) - np.min(z)
-        nx, = x.shape
-        nz, = z.shape
-        bfield_k = np.fft.rfft2(bfield)
-        b2_k = np.absolute(bfield_k)**2
-        dvol = pic_info.dx_di * pic_info.dz_di * pic_info.mime
-        ene_b = np.sum(0.5*bfield**2) * dvol
-
-        xstep = x[1] - x[0]
-        kx = np.fft.fftfreq(nx, xstep)
-        idx = np.argsort(kx)
-        zstep = z[1] - z[0]
-        kz = np.fft.fftfreq(nz, zstep)
-        idz = np.argsort(kz)
-
-        kxs, kzs = np.meshgrid(kx[:nx//2 + 1], kz)
-        ks = np.sqrt(kxs * kxs + kzs * kzs)
-        kmin = 1E-2
-        kmax = np.max(ks)
-        kmin_log, kmax_log = math.log10(kmin), math.log10(kmax)
-        kbins = np.logspace(kmin_log, kmax_log, nbins_k + 1, endpoint=True)
-        power_spect, kbins_edges = np.histogram(ks, bins=kbins,
-                                                weights=b2_k * ks, density=True)
-        power_spect *= ene_b
-        fdata[1:nbins_k+2] = kbins
-        fdata[nbins_k+2:] = power_spect
+        bfields.append(bfield)
+    dvol = pic_info.dx_di * pic_info.dz_di * pic_info.mime
+    kbins, power_spect = spectrum_engine.calc_power_spectrum(
+        bfields, (z[1] - z[0], x[1] - x[0]), nbins=nbins_k, combine=False)
+    fdata = np.zeros(2 * nbins_k + 2)
+    fdata[0] = nbins_k
+    fdata[1:nbins_k+2] = kbins
+    for icomp, comp in enumerate(components):
+        ene_b = np.sum(0.5*bfields[icomp]**2) * dvol
+        fdata[nbins_k+2:] = power_spect[icomp] * ene_b
         fdir = '../data/power_spectrum/' + run_name + '/b' + comp + '/'
         mkdir_p(fdir)
         fname = fdir + 'b' + comp + '_' + str(tframe) + '.gda'
@@ -6850,6 +6827,8 @@ def get_cmd_args():
                         help='Starting time frame')
     parser.add_argument('--tend', action="store", default='30', type=int,
                         help='Ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
     parser.add_argument('--calc_rrate', action="store_true", default=False,
                         help='whether calculating reconnection rate')
     parser.add_argument('--plot_rrate', action="store_true", default=False,
@@ -7075,28 +7054,34 @@ def analysis_multi_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframes = range(args.tstart, args.tend + 1)
+    ckpt = checkpoint.for_frames('high_mass_ratio', args)
     if args.time_loop:
-        for tframe in tframes:
-            plot_config["tframe"] = tframe
-            if args.para_perp:
-                para_perp_energization(args.run_name, args.species,
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                plot_config["tframe"] = tframe
+                if args.para_perp:
+                    para_perp_energization(args.run_name, args.species,
+                                           tframe, show_plot=False)
+                if args.comp_shear:
+                    comp_shear_energization(args.run_name, args.species,
+                                            tframe, show_plot=False)
+                if args.drifts:
+                    drift_energization(args.run_name, args.species,
+                                       tframe, show_plot=False)
+                if args.model_ene:
+                    model_energization(args.run_name, args.species,
                                        tframe, show_plot=False)
-            if args.comp_shear:
-                comp_shear_energization(args.run_name, args.species,
-                                        tframe, show_plot=False)
-            if args.drifts:
-                drift_energization(args.run_name, args.species,
-                                   tframe, show_plot=False)
-            if args.model_ene:
-                model_energization(args.run_name, args.species,
-                                   tframe, show_plot=False)
-            if args.energetic_rho:
-                energetic_rho(plot_config, args.const_va, show_plot=False)
+                if args.energetic_rho:
+                    energetic_rho(plot_config, args.const_va, show_plot=False)
+                ckpt.record(tframe)
     else:
         # ncores = multiprocessing.cpu_count()
         ncores = 16
-        Parallel(n_jobs=ncores)(delayed(process_input)(args, plot_config, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, args, plot_config),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
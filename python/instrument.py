@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Stage timing and I/O instrumentation of the analyses
+
+The wall and CPU time of the stages, the bytes read by each file backend,
+the cache hits and misses, and the peak resident memory are recorded when
+the instrumentation is enabled (--profile of the task runner, or
+PIC_ANALYSIS_PROFILE=1). Otherwise, a stage only checks a flag. The stages
+are nested, and the stats of the worker processes of parallel_backend are
+merged under the stage that runs them, so the report of a job covers all
+its processes. The report is saved as JSON, with a flame-style summary in
+the folded format of flamegraph.pl.
+
+    @instrument.stage('read_fields')
+    def read_fields(...):
+        ...
+        instrument.add_bytes('gda', fdata.nbytes)
+
+    with instrument.stage('fft'):
+        ...
+"""
+from __future__ import print_function
+
+import collections
+import functools
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from shell_functions import mkdir_p
+
+PROFILE_DIR = '../data/profiles/'
+ENV_VAR = 'PIC_ANALYSIS_PROFILE'
+ENABLED = os.environ.get(ENV_VAR, '') not in ['', '0']
+
+try:
+    cpu_time = time.process_time
+except AttributeError:  # Python 2
+    cpu_time = time.clock
+
+# the stats of this process: the stages by their path, the bytes read by
+# the backends, and the cache hits and misses
+STAGES = collections.defaultdict(lambda: [0, 0.0, 0.0])
+IO = collections.defaultdict(lambda: [0, 0])
+CACHES = collections.defaultdict(lambda: [0, 0])
+WATCHED_CACHES = {}
+# the (hits, misses) of the watched caches at the last reset
+CACHE_BASE = {}
+STACK = []
+# the depth of the stack at the last reset, which is the root of the stages
+# recorded since then
+STACK_BASE = [0]
+PEAK_RSS = {"workers": 0}
+
+
+def enable(on=True):
+    """Turn the instrumentation on or off, also for the new subprocesses
+    """
+    global ENABLED
+    ENABLED = on
+    os.environ[ENV_VAR] = '1' if on else '0'
+
+
+def enabled():
+    """Whether the instrumentation is on
+    """
+    return ENABLED
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes
+    """
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, and bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Stage(object):
+    """Context manager and decorator timing a stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if ENABLED:
+            STACK.append(self.name)
+            self.start = (time.time(), cpu_time())
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.start is not None:
+            stats = STAGES[tuple(STACK)]
+            stats[0] += 1
+            stats[1] += time.time() - self.start[0]
+            stats[2] += cpu_time() - self.start[1]
+            STACK.pop()
+            self.start = None
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Stage(name):
+                return func(*args, **kwargs)
+        return timed
+
+
+def stage(name):
+    """A stage (see Stage)
+    """
+    return Stage(name)
+
+
+def add_bytes(backend, nbytes):
+    """Record the bytes read by a file backend, e.g., 'gda' or 'particle'
+    """
+    if ENABLED:
+        stats = IO[backend]
+        stats[0] += 1
+        stats[1] += int(nbytes)
+
+
+def cache_event(name, hit):
+    """Record a hit or a miss of a cache
+    """
+    if ENABLED:
+        CACHES[name][0 if hit else 1] += 1
+
+
+def watch_cache(name, func):
+    """Report the hits and misses of a functools.lru_cache function
+    """
+    WATCHED_CACHES[name] = func
+
+
+def snapshot():
+    """The stats of this process
+    """
+    caches = dict((name, list(stats)) for name, stats in CACHES.items())
+    for name, func in WATCHED_CACHES.items():
+        info = func.cache_info()
+        hits, misses = CACHE_BASE.get(name, (0, 0))
+        stats = caches.setdefault(name, [0, 0])
+        stats[0] += info.hits - hits
+        stats[1] += info.misses - misses
+    base = STACK_BASE[0]
+    return {"stages": [[list(path[base:]), stats[0], stats[1], stats[2]]
+                       for path, stats in STAGES.items() if len(path) > base],
+            "io": dict((name, list(stats)) for name, stats in IO.items()),
+            "caches": caches,
+            "peak_rss": peak_rss()}
+
+
+def reset():
+    """Clear the stats of this process
+    """
+    STAGES.clear()
+    STACK_BASE[0] = len(STACK)
+    IO.clear()
+    CACHES.clear()
+    for name, func in WATCHED_CACHES.items():
+        info = func.cache_info()
+        CACHE_BASE[name] = (info.hits, info.misses)
+    PEAK_RSS["workers"] = 0
+
+
+def merge(stats):
+    """Add the stats of a worker under the current stage
+    """
+    prefix = tuple(STACK)
+    for path, count, wall, cpu in stats["stages"]:
+        total = STAGES[prefix + tuple(path)]
+        total[0] += count
+        total[1] += wall
+        total[2] += cpu
+    for name, (count, nbytes) in stats["io"].items():
+        IO[name][0] += count
+        IO[name][1] += nbytes
+    for name, (hits, misses) in stats["caches"].items():
+        CACHES[name][0] += hits
+        CACHES[name][1] += misses
+    PEAK_RSS["workers"] = max(PEAK_RSS["workers"], stats["peak_rss"])
+
+
+class Collected(object):
+    """A function run by a worker process, returning its stats with its
+    result
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        enable()
+        reset()
+        result = self.func(*args, **kwargs)
+        return result, snapshot()
+
+
+def stage_rows(stats):
+    """The stages of a snapshot with their self times
+
+    Returns:
+        list of (path, count, wall, cpu, self wall time), sorted by path
+    """
+    stages = dict((tuple(path), (count, wall, cpu))
+                  for path, count, wall, cpu in stats["stages"])
+    children = collections.defaultdict(float)
+    for path, (_, wall, _) in stages.items():
+        if len(path) > 1:
+            children[path[:-1]] += wall
+    return [(path, count, wall, cpu, max(wall - children[path], 0.0))
+            for path, (count, wall, cpu) in sorted(stages.items())]
+
+
+def report(job, tstart=None):
+    """Report of the stats of this process and the merged workers
+
+    Args:
+        job: the name of the job
+        tstart: the starting time of the job
+    """
+    stats = snapshot()
+    rows = stage_rows(stats)
+    return {"job": job,
+            "argv": sys.argv,
+            "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "wall": time.time() - tstart if tstart else None,
+            "cpu": cpu_time(),  # of this process
+            "peak_rss": stats["peak_rss"],
+            "peak_rss_workers": PEAK_RSS["workers"],
+            "stages": [{"path": ';'.join(path), "count": count,
+                        "wall": wall, "cpu": cpu, "self": self_time}
+                       for path, count, wall, cpu, self_time in rows],
+            "io": dict((name, {"count": count, "bytes": nbytes})
+                       for name, (count, nbytes) in stats["io"].items()),
+            "caches": dict((name, {"hits": hits, "misses": misses})
+                           for name, (hits, misses)
+                           in stats["caches"].items())}
+
+
+def folded_stacks(rep):
+    """Flame-style lines 'stage;substage microseconds' of the self times
+    """
+    return ['%s %d' % (row["path"], int(row["self"] * 1E6))
+            for row in rep["stages"] if row["self"] > 0]
+
+
+def print_report(rep):
+    """Print the stages, the I/O and the caches of a report
+    """
+    print("%-40s %8s %10s %10s %10s" %
+          ("stage", "count", "wall", "cpu", "self"))
+    for row in rep["stages"]:
+        names = row["path"].split(';')
+        name = '  ' * (len(names) - 1) + names[-1]
+        print("%-40s %8d %9.3fs %9.3fs %9.3fs" %
+              (name, row["count"], row["wall"], row["cpu"], row["self"]))
+    for name, stats in sorted(rep["io"].items()):
+        print("read %-12s %8d files %12.1f MB" %
+              (name, stats["count"], stats["bytes"] / 2.0**20))
+    for name, stats in sorted(rep["caches"].items()):
+        print("cache %-24s %8d hits %8d misses" %
+              (name, stats["hits"], stats["misses"]))
+    print("peak RSS: %.1f MB (workers %.1f MB)" %
+          (rep["peak_rss"] / 2.0**20, rep["peak_rss_workers"] / 2.0**20))
+
+
+def write_report(job, tstart=None, fdir=PROFILE_DIR):
+    """Save the report of a job as JSON and its folded stacks
+
+    Returns:
+        the name of the JSON file
+    """
+    rep = report(job, tstart)
+    mkdir_p(fdir)
+    fname = os.path.join(fdir, job + '_' + time.strftime('%Y%m%d_%H%M%S') +
+                         '_' + str(os.getpid()))
+    with open(fname + '.json', 'w') as fh:
+        json.dump(rep, fh, indent=2)
+    with open(fname + '.folded', 'w') as fh:
+        fh.write('\n'.join(folded_stacks(rep)) + '\n')
+    print_report(rep)
+    print("Profile saved to %s.json" % fname)
+    return fname + '.json'
@@ -0,0 +1,63 @@
+"""
+Lazy imports of the heavy dependencies
+
+scipy submodules, joblib, h5py and matplotlib take from 0.1 to 1 second to
+import each. The core modules bind them with lazy_module, so they are only
+imported when they are used for the first time, and `--help` or a job that
+does not need them does not pay for them. Python 2 has no lazy loader, so
+the modules are imported right away there.
+
+    signal = lazy_module('scipy.signal')
+    joblib = lazy_module('joblib')
+    ...
+    fdata = signal.medfilt2d(fdata)
+"""
+import importlib
+import sys
+
+try:
+    from importlib.machinery import PathFinder
+    from importlib.util import LazyLoader, find_spec, module_from_spec
+except ImportError:
+    LazyLoader = None
+
+# the specs of the lazy packages, to find their submodules without loading
+# them (any attribute access loads a lazy module)
+LAZY_SPECS = {}
+
+
+def lazy_module(name):
+    """A module that is imported at the first access of its attributes
+
+    Args:
+        name: the full name of the module, e.g., scipy.fft
+
+    Raises:
+        ImportError: when the module is not found
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if LazyLoader is None:
+        return importlib.import_module(name)
+    parent, _, child = name.rpartition('.')
+    if parent in LAZY_SPECS and parent in sys.modules:
+        # find_spec would load the lazy parent, e.g., matplotlib for
+        # matplotlib.pyplot
+        path = LAZY_SPECS[parent].submodule_search_locations
+        spec = PathFinder.find_spec(name, path) if path else None
+    else:
+        spec = find_spec(name)
+    if spec is None:
+        raise ImportError("No module named " + name)
+    if spec.submodule_search_locations is not None:
+        LAZY_SPECS[name] = spec
+    loader = LazyLoader(spec.loader)
+    spec.loader = loader
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    if parent:
+        # as the import statement does, so that scipy.fft works as well
+        setattr(sys.modules.get(parent) or importlib.import_module(parent),
+                child, module)
+    return module
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Parallel movie renderer with persistent figures
+
+A movie is described by a scene, which creates the figure and the artists
+once in setup and only updates the artists (set_data, set_array, set_clim,
+set_text) in update for each frame. Each worker process of the pool keeps
+one figure of the scene. The frames are rendered across the pool, and the
+raw RGB frames are piped into ffmpeg in the order of the frames. When
+ffmpeg is not found, the workers save numbered PNG files instead.
+
+    scene = FieldScene(pic_info, run_dir, "jy", r"$j_y$", vmin=-1, vmax=1)
+    render_movie(scene, range(pic_info.ntf), '../img/movies/jy.mp4')
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from field_io import read_2d_fields
+from shell_functions import mkdir_p
+
+# the scene and the figure of a worker process
+_WORKER = {}
+
+
+class MovieScene(object):
+    """Base class of the scenes of movies
+
+    The scene is sent to the worker processes before setup, so it should
+    only hold the configuration and small data until then.
+    """
+    figsize = (8, 4)
+    dpi = 100
+
+    def setup(self, fig):
+        """Create the axes and the artists in fig
+        """
+        raise NotImplementedError
+
+    def update(self, frame):
+        """Update the artists for one frame
+        """
+        raise NotImplementedError
+
+
+class FieldScene(MovieScene):
+    """2D field with the contours of Ay
+    """
+
+    def __init__(self, pic_info, run_dir, var_name, label, vmin=None,
+                 vmax=None, cmap=plt.cm.seismic, box=None, ay_contours=True,
+                 figsize=(8, 4), dpi=200):
+        """
+        Args:
+            pic_info: namedtuple for the PIC simulation information
+            run_dir: the run root directory including the data/*.gda files
+            var_name: the field name, e.g., jy
+            label: the label of the colorbar
+            vmin, vmax: the color limits. The limits of each frame are used
+                when they are None.
+            cmap: the colormap
+            box: the plotted region as {"xl", "xr", "zb", "zt"} in di
+            ay_contours: whether to plot the contours of Ay
+        """
+        self.pic_info = pic_info
+        self.run_dir = run_dir
+        self.var_name = var_name
+        self.label = label
+        self.vmin = vmin
+        self.vmax = vmax
+        self.cmap = cmap
+        if box is None:
+            box = {"xl": 0, "xr": pic_info.lx_di,
+                   "zb": -0.5 * pic_info.lz_di, "zt": 0.5 * pic_info.lz_di}
+        self.box = box
+        self.ay_contours = ay_contours
+        self.figsize = figsize
+        self.dpi = dpi
+        self.contours = None
+
+    def setup(self, fig):
+        self.ax = fig.add_axes([0.10, 0.15, 0.78, 0.75])
+        cax = fig.add_axes([0.89, 0.15, 0.02, 0.75])
+        extent = [self.box["xl"], self.box["xr"],
+                  self.box["zb"], self.box["zt"]]
+        self.im = self.ax.imshow(np.zeros((2, 2)), cmap=self.cmap,
+                                 extent=extent, aspect='auto', origin='lower',
+                                 vmin=self.vmin, vmax=self.vmax,
+                                 interpolation='bicubic')
+        cbar = fig.colorbar(self.im, cax=cax)
+        cbar.ax.set_ylabel(self.label, fontsize=16)
+        self.ax.set_xlabel(r'$x/d_i$', fontsize=16)
+        self.ax.set_ylabel(r'$z/d_i$', fontsize=16)
+        self.title = self.ax.set_title('', fontsize=16)
+
+    def update(self, frame):
+        kwargs = dict(self.box, current_time=frame)
+        fname = self.run_dir + "data/" + self.var_name + ".gda"
+        x, z, fdata = read_2d_fields(self.pic_info, fname, **kwargs)
+        self.im.set_data(fdata)
+        self.im.set_extent([x[0], x[-1], z[0], z[-1]])
+        if self.vmin is None or self.vmax is None:
+            vmin = fdata.min() if self.vmin is None else self.vmin
+            vmax = fdata.max() if self.vmax is None else self.vmax
+            self.im.set_clim(vmin, vmax)
+        if self.ay_contours:
+            if self.contours is not None:
+                for coll in getattr(self.contours, 'collections',
+                                    [self.contours]):
+                    coll.remove()
+            fname = self.run_dir + "data/Ay.gda"
+            x, z, ay = read_2d_fields(self.pic_info, fname, **kwargs)
+            self.contours = self.ax.contour(x, z, ay, colors='k',
+                                            linewidths=0.5)
+        twci = frame * self.pic_info.dt_fields
+        self.title.set_text(r'$t\Omega_{ci} = %0.1f$' % twci)
+
+
+def _init_worker(scene):
+    """Create the figure of the scene in a worker process
+    """
+    plt.switch_backend('Agg')
+    fig = plt.figure(figsize=scene.figsize, dpi=scene.dpi)
+    scene.setup(fig)
+    _WORKER["scene"] = scene
+    _WORKER["fig"] = fig
+
+
+def _render_frame(job):
+    """Render one frame in a worker process
+
+    Returns:
+        (width, height, RGB bytes), or None when the frame is saved into
+        a file
+    """
+    frame, fname = job
+    scene = _WORKER["scene"]
+    fig = _WORKER["fig"]
+    scene.update(frame)
+    if fname:
+        fig.savefig(fname, dpi=scene.dpi)
+        return None
+    fig.canvas.draw()
+    rgba = np.asarray(fig.canvas.buffer_rgba())
+    height, width, _ = rgba.shape
+    return width, height, np.ascontiguousarray(rgba[:, :, :3]).tobytes()
+
+
+def ffmpeg_command(movie_name, width, height, fps):
+    """The ffmpeg command encoding raw RGB frames from stdin
+    """
+    return ['ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-',
+            # yuv420p requires even dimensions
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', movie_name]
+
+
+def encoder_error(encoder, errlog):
+    """The error of an ffmpeg process that has exited with a failure
+
+    Args:
+        encoder: the ffmpeg process
+        errlog: the file receiving the stderr of ffmpeg
+    """
+    errlog.seek(0)
+    message = errlog.read().decode('utf-8', 'replace').strip()
+    return RuntimeError("ffmpeg failed with exit code %d:\n%s" %
+                        (encoder.returncode, message))
+
+
+def render_movie(scene, frames, movie_name, fps=20, ncores=None):
+    """Render the frames of a scene in parallel into a movie
+
+    Args:
+        scene: a MovieScene
+        frames: the frames passed to scene.update
+        movie_name: the file name of the movie
+        fps: frames per second
+        ncores: number of processes
+
+    Returns:
+        the movie name, or the directory of the PNG files when ffmpeg is not
+        found
+    """
+    frames = list(frames)
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    ncores = max(1, min(ncores, len(frames)))
+    mkdir_p(os.path.dirname(movie_name) or '.')
+    use_ffmpeg = shutil.which('ffmpeg') is not None
+    if use_ffmpeg:
+        jobs = [(frame, None) for frame in frames]
+    else:
+        png_dir = os.path.splitext(movie_name)[0] + '/'
+        mkdir_p(png_dir)
+        print("ffmpeg is not found. The frames are saved in " + png_dir)
+        ndigits = len(str(len(frames)))
+        jobs = [(frame, png_dir + str(iframe).zfill(ndigits) + '.png')
+                for iframe, frame in enumerate(frames)]
+    pool = multiprocessing.Pool(ncores, initializer=_init_worker,
+                                initargs=(scene, ))
+    encoder = None
+    # the errors of ffmpeg are kept to report why it failed
+    with tempfile.TemporaryFile() as errlog:
+        try:
+            # imap returns the results in the order of the frames
+            for result in pool.imap(_render_frame, jobs):
+                if result is None:
+                    continue
+                width, height, rgb = result
+                if encoder is None:
+                    cmd = ffmpeg_command(movie_name, width, height, fps)
+                    encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                               stderr=errlog)
+                try:
+                    encoder.stdin.write(rgb)
+                except BrokenPipeError:
+                    # ffmpeg has exited before reading all the frames
+                    encoder.wait()
+                    raise encoder_error(encoder, errlog)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if encoder is not None:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+                encoder.wait()
+        if encoder is not None and encoder.returncode != 0:
+            raise encoder_error(encoder, errlog)
+    return movie_name if use_ffmpeg else png_dir
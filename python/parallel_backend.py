@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Execution backends of the parallel analyses
+
+The same list of jobs runs on the MPI ranks when the script is launched by
+mpirun or srun and mpi4py is available, or on a local process pool
+otherwise. Under MPI, all the ranks run the script, and map and reduce are
+called by all of them with the same jobs. Rank 0 is the master, which hands
+out the indices of the jobs one at a time to the idle workers, so only the
+indices and the results are sent, and the arguments shared by all the jobs
+are never pickled. The results are put back in the order of the jobs, and
+the reductions are done in that order too, so both backends give identical
+results. On the local pool, the shared arguments are pickled for each job,
+unless share is set: their large arrays are then published once in shared
+memory, and the workers attach them (see shared_arrays). With a
+checkpoint.Checkpoint, the completed jobs and the partial reductions are
+recorded, and the jobs that are done are skipped on resume.
+When the instrumentation is on, the stats of the workers are sent back with
+the results and merged into the stats of the master (see instrument).
+
+    backend = parallel_backend.get_backend(ncores)
+    hists = backend.reduce(rank_histogram, ranks, np.add, pic_info, tindex)
+    if backend.is_master:
+        hists.tofile(fname)
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import traceback
+
+import checkpoint
+import instrument
+import shared_arrays
+from lazy_import import lazy_module
+
+joblib = lazy_module('joblib')
+
+# the environment variables set by the MPI launchers
+MPI_ENV_VARS = ['OMPI_COMM_WORLD_SIZE', 'PMI_SIZE', 'PMI_RANK', 'PMIX_RANK',
+                'MV2_COMM_WORLD_SIZE']
+TAG_JOB = 1
+TAG_RESULT = 2
+TAG_STOP = 3
+
+
+def mpi_launched():
+    """Whether the process is started by an MPI launcher
+    """
+    return any(name in os.environ for name in MPI_ENV_VARS)
+
+
+def pending_jobs(jobs, ckpt):
+    """Indices of the jobs that are not done yet
+    """
+    if ckpt is None:
+        return list(range(len(jobs)))
+    return ckpt.pending(jobs)
+
+
+def job_unit(jobs, index, ckpt):
+    """The checkpoint unit of a job
+    """
+    return None if ckpt is None else ckpt.key(jobs[index], index)
+
+
+def ordered_reduce(results, op, total=None, ckpt=None):
+    """Reduce the results in the order they come
+
+    Args:
+        results: iterable of (unit, result)
+        op: function of two results returning their reduction
+        total: the starting value. The default is the first result.
+        ckpt: checkpoint to record the units and the partial reductions
+    """
+    for unit, result in results:
+        total = result if total is None else op(total, result)
+        if ckpt is not None:
+            ckpt.record(unit, state=total)
+    return total
+
+
+def merged_results(results):
+    """The results of instrument.Collected with their stats merged
+    """
+    for result, stats in results:
+        instrument.merge(stats)
+        yield result
+
+
+def start_total(ckpt, initial):
+    """The partial reduction in the checkpoint, or the initial value
+    """
+    if ckpt is not None and ckpt.state is not None:
+        return ckpt.state
+    return initial
+
+
+class LocalBackend(object):
+    """Jobs on a local process pool
+    """
+    rank = 0
+    size = 1
+    is_master = True
+
+    def __init__(self, ncores=None):
+        """
+        Args:
+            ncores: number of processes. The default is the number of CPU
+                cores.
+        """
+        self.ncores = ncores or multiprocessing.cpu_count()
+
+    def registry(self, njobs, share):
+        """Registry of the shared arguments, or None when they are not
+        shared or the jobs run in this process
+        """
+        if not share or self.ncores == 1 or njobs <= 1:
+            return None
+        return shared_arrays.SharedRegistry()
+
+    def imap(self, func, jobs, *args, **kwargs):
+        """Results of func(job, *args) of the jobs, in the order of the jobs
+
+        Args:
+            registry: shared_arrays.SharedRegistry publishing the arrays of
+                args for the workers
+        """
+        if self.ncores == 1 or len(jobs) <= 1:
+            return (func(job, *args) for job in jobs)
+        registry = kwargs.get('registry')
+        if registry is not None:
+            func = shared_arrays.Resolved(func)
+            args = registry.share(args)
+        try:
+            parallel = joblib.Parallel(n_jobs=self.ncores, batch_size=1,
+                                       return_as='generator')
+        except TypeError:  # joblib < 1.3 returns a list
+            parallel = joblib.Parallel(n_jobs=self.ncores, batch_size=1)
+        if not instrument.enabled():
+            return parallel(joblib.delayed(func)(job, *args) for job in jobs)
+        func = instrument.Collected(func)
+        return merged_results(parallel(joblib.delayed(func)(job, *args)
+                                       for job in jobs))
+
+    def map(self, func, jobs, *args, **kwargs):
+        """List of the results of func(job, *args) for all the jobs
+
+        Args:
+            func: function of one job and the shared arguments
+            jobs: list of the jobs
+            args: arguments shared by all the jobs
+            allgather: whether all the ranks get the results (only for MPI)
+            checkpoint: checkpoint.Checkpoint of the jobs
+            share: whether the large arrays of args are put in shared memory
+                instead of being sent with each job
+        """
+        jobs = list(jobs)
+        ckpt = kwargs.get('checkpoint')
+        with checkpoint.using(ckpt):
+            pending = pending_jobs(jobs, ckpt)
+            registry = self.registry(len(pending), kwargs.get('share'))
+            with shared_arrays.using(registry):
+                results = self.imap(func, [jobs[i] for i in pending], *args,
+                                    registry=registry)
+                if ckpt is None:
+                    return list(results)
+                for i, result in zip(pending, results):
+                    ckpt.record(job_unit(jobs, i, ckpt), result)
+            return [ckpt.result(job_unit(jobs, i, ckpt))
+                    for i in range(len(jobs))]
+
+    def reduce(self, func, jobs, op, *args, **kwargs):
+        """Reduction of the results of func(job, *args) in the order of jobs
+
+        Args:
+            func: function of one job and the shared arguments
+            jobs: list of the jobs
+            op: function of two results returning their reduction
+            args: arguments shared by all the jobs
+            initial: the starting value. The default is the first result.
+            allgather: whether all the ranks get the reduction (only for MPI)
+            checkpoint: checkpoint.Checkpoint of the jobs
+            share: whether the large arrays of args are put in shared memory
+        """
+        jobs = list(jobs)
+        ckpt = kwargs.get('checkpoint')
+        with checkpoint.using(ckpt):
+            pending = pending_jobs(jobs, ckpt)
+            registry = self.registry(len(pending), kwargs.get('share'))
+            with shared_arrays.using(registry):
+                results = self.imap(func, [jobs[i] for i in pending], *args,
+                                    registry=registry)
+                # a generator, so the units are recorded as the results come
+                results = ((job_unit(jobs, i, ckpt), result)
+                           for i, result in zip(pending, results))
+                return ordered_reduce(results, op,
+                                      start_total(ckpt, kwargs.get('initial')),
+                                      ckpt)
+
+    def bcast(self, data):
+        """Data of the master on all the ranks
+        """
+        return data
+
+    def barrier(self):
+        """Wait for all the ranks
+        """
+        pass
+
+
+class MPIBackend(object):
+    """Jobs on the MPI ranks with a master/worker dynamic scheduler
+    """
+
+    def __init__(self, comm):
+        """
+        Args:
+            comm: MPI communicator with at least two ranks
+        """
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.is_master = self.rank == 0
+        self.ncores = self.size - 1
+
+    def master(self, pending, on_result):
+        """Hand out the jobs and call on_result(index, result) for each one
+
+        Args:
+            pending: the indices of the jobs to run
+            on_result: function of the index and the result of a job
+
+        Returns:
+            the error message of the first failed job, or None
+        """
+        from mpi4py import MPI
+        status = MPI.Status()
+        njobs = len(pending)
+        next_job = 0
+        running = 0
+        error = None
+        for worker in range(1, self.size):
+            if next_job < njobs:
+                self.comm.send(pending[next_job], dest=worker, tag=TAG_JOB)
+                next_job += 1
+                running += 1
+            else:
+                self.comm.send(None, dest=worker, tag=TAG_STOP)
+        while running:
+            index, result, message, stats = self.comm.recv(
+                source=MPI.ANY_SOURCE, tag=TAG_RESULT, status=status)
+            running -= 1
+            worker = status.Get_source()
+            if stats is not None:
+                instrument.merge(stats)
+            if message is not None:
+                error = error or message
+            else:
+                on_result(index, result)
+            # no new jobs after a failure, but the running ones are drained
+            if next_job < njobs and error is None:
+                self.comm.send(pending[next_job], dest=worker, tag=TAG_JOB)
+                next_job += 1
+                running += 1
+            else:
+                self.comm.send(None, dest=worker, tag=TAG_STOP)
+        return error
+
+    def worker(self, func, jobs, args):
+        """Run the jobs sent by the master until it stops the worker
+        """
+        from mpi4py import MPI
+        status = MPI.Status()
+        while True:
+            index = self.comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+            if status.Get_tag() == TAG_STOP:
+                return
+            stats = None
+            if instrument.enabled():
+                instrument.reset()
+            try:
+                result, message = func(jobs[index], *args), None
+            except Exception:
+                result, message = None, traceback.format_exc()
+            if instrument.enabled():
+                stats = instrument.snapshot()
+            self.comm.send((index, result, message, stats), dest=0,
+                           tag=TAG_RESULT)
+
+    def run(self, func, jobs, args, pending, on_result):
+        """Run the pending jobs, and raise the error of a failed job on all
+        ranks
+        """
+        if self.is_master:
+            error = self.master(pending, on_result)
+        else:
+            self.worker(func, jobs, args)
+            error = None
+        error = self.comm.bcast(error, root=0)
+        if error is not None:
+            raise RuntimeError("a parallel job failed:\n" + error)
+
+    def map(self, func, jobs, *args, **kwargs):
+        """List of the results of func(job, *args) (see LocalBackend.map)
+
+        The results are only on the master, and None on the workers, unless
+        allgather is set. Only the master uses the checkpoint. share is
+        ignored, since the arguments are never sent.
+        """
+        jobs = list(jobs)
+        ckpt = kwargs.get('checkpoint') if self.is_master else None
+        results = [None] * len(jobs)
+
+        def on_result(index, result):
+            results[index] = result
+            if ckpt is not None:
+                ckpt.record(job_unit(jobs, index, ckpt), result)
+
+        with checkpoint.using(ckpt):
+            pending = self.bcast(pending_jobs(jobs, ckpt))
+            self.run(func, jobs, args, pending, on_result)
+            if ckpt is not None:
+                results = [ckpt.result(job_unit(jobs, i, ckpt))
+                           for i in range(len(jobs))]
+        if kwargs.get('allgather'):
+            return self.bcast(results if self.is_master else None)
+        return results if self.is_master else None
+
+    def reduce(self, func, jobs, op, *args, **kwargs):
+        """Reduction of the results in the order of jobs (see
+        LocalBackend.reduce)
+
+        The results that come early are kept until the ones before them
+        are reduced.
+        """
+        jobs = list(jobs)
+        ckpt = kwargs.get('checkpoint') if self.is_master else None
+        state = {"next": 0, "early": {}}
+
+        def on_result(index, result):
+            state["early"][index] = result
+            while (state["next"] < len(pending) and
+                   pending[state["next"]] in state["early"]):
+                index = pending[state["next"]]
+                result = state["early"].pop(index)
+                state["total"] = ordered_reduce(
+                    [(job_unit(jobs, index, ckpt), result)], op,
+                    state["total"], ckpt)
+                state["next"] += 1
+
+        with checkpoint.using(ckpt):
+            state["total"] = start_total(ckpt, kwargs.get('initial'))
+            pending = self.bcast(pending_jobs(jobs, ckpt))
+            self.run(func, jobs, args, pending, on_result)
+        total = state["total"] if self.is_master else None
+        if kwargs.get('allgather'):
+            return self.bcast(total)
+        return total
+
+    def bcast(self, data):
+        """Data of the master on all the ranks
+        """
+        return self.comm.bcast(data, root=0)
+
+    def barrier(self):
+        """Wait for all the ranks
+        """
+        self.comm.Barrier()
+
+
+def get_backend(ncores=None, use_mpi=None):
+    """The MPI backend when the script runs on a few MPI ranks, or the local
+    backend otherwise
+
+    Args:
+        ncores: number of processes of the local backend
+        use_mpi: True to try MPI without a launcher, False to disable it.
+            The default is to use MPI when the process is started by an MPI
+            launcher and mpi4py is available.
+    """
+    if use_mpi is None:
+        use_mpi = mpi_launched()
+    if use_mpi:
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            MPI = None
+        if MPI is not None and MPI.COMM_WORLD.Get_size() > 1:
+            return MPIBackend(MPI.COMM_WORLD)
+        print("MPI is not available. The jobs run on local processes.")
+    return LocalBackend(ncores)
@@ -2,7 +2,6 @@
 Analysis procedures for particle energy spectrum.
 """
 import argparse
-import collections
 import gc
 import math
 import os
@@ -27,7 +26,11 @@ from scipy.interpolate import RectBivariateSpline, RegularGridInterpolator
 from scipy.interpolate import LinearNDInterpolator
 from scipy.ndimage.filters import median_filter, gaussian_filter
 
+import checkpoint
 import palettable
+import parallel_backend
+import shared_arrays
+import vpic_schema
 from contour_plots import read_2d_fields
 from dolointerpolation import MultilinearInterpolator
 from energy_conversion import read_data_from_json
@@ -68,49 +71,7 @@ def read_hydro_header(fh):
     Args:
         fh: file handler.
     """
-    offset = 23  # the size of the boilerplate is 23
-    tmp1 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(6), order='F')
-    offset += 6 * 4
-    tmp2 = np.memmap(
-        fh, dtype='float32', mode='r', offset=offset, shape=(10), order='F')
-    offset += 10 * 4
-    tmp3 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(4), order='F')
-    offset += 4 * 4
-    v0header = collections.namedtuple("v0header", [
-        "version", "type", "nt", "nx", "ny", "nz", "dt", "dx", "dy", "dz",
-        "x0", "y0", "z0", "cvac", "eps0", "damp", "rank", "ndom", "spid",
-        "spqm"
-    ])
-    v0 = v0header(
-        version=tmp1[0],
-        type=tmp1[1],
-        nt=tmp1[2],
-        nx=tmp1[3],
-        ny=tmp1[4],
-        nz=tmp1[5],
-        dt=tmp2[0],
-        dx=tmp2[1],
-        dy=tmp2[2],
-        dz=tmp2[3],
-        x0=tmp2[4],
-        y0=tmp2[5],
-        z0=tmp2[6],
-        cvac=tmp2[7],
-        eps0=tmp2[8],
-        damp=tmp2[9],
-        rank=tmp3[0],
-        ndom=tmp3[1],
-        spid=tmp3[2],
-        spqm=tmp3[3])
-    header_hydro = collections.namedtuple("header_hydro",
-                                          ["size", "ndim", "nc"])
-    tmp4 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(5), order='F')
-    hheader = header_hydro(size=tmp4[0], ndim=tmp4[1], nc=tmp4[2:])
-    offset += 5 * 4
-    return (v0, hheader, offset)
+    return vpic_schema.read_hydro_header(fh)
 
 
 def read_hydro(fname, nx2, ny2, nz2, dsize):
@@ -144,9 +105,9 @@ def read_fields(fname, nx2, ny2, nz2, dsize):
 def read_hydro_velocity_density(fname, nx2, ny2, nz2, dsize):
     """
     """
-    offset = 123 # boilerplate and header size
     nvar = 4
     with open(fname, 'r') as fh:
+        _, _, offset = read_hydro_header(fh)
         fh.seek(offset, os.SEEK_SET)
         fdata = np.fromfile(fh, dtype=np.float32, count=dsize*nvar)
 
@@ -166,9 +127,9 @@ def read_hydro_velocity_density(fname, nx2, ny2, nz2, dsize):
 def read_hydro_four_velocity_density(fname, nx2, ny2, nz2, dsize):
     """
     """
-    offset = 123 # boilerplate and header size
     nvar = 7
     with open(fname, 'r') as fh:
+        _, _, offset = read_hydro_header(fh)
         fh.seek(offset, os.SEEK_SET)
         fdata = np.fromfile(fh, dtype=np.float32, count=dsize*nvar)
 
@@ -1376,10 +1337,35 @@ def interpolation_single_rank(run_dir, rank, pmass, species, tindex,
     return hists
 
 
+def interpolator_arrays(fitting_functions):
+    """The grids and the values of the interpolators
+    """
+    return dict((name, (f.smin, f.smax, f.orders, f.values))
+                for name, f in fitting_functions.items())
+
+
+def interpolation_shared_rank(rank, run_dir, pmass, species, tindex,
+                              interpolators):
+    """interpolation_single_rank with the interpolators of
+    interpolator_arrays, whose values may be shared by the parent
+    """
+    # the Cython interpolation needs writable buffers
+    interpolators = shared_arrays.resolve(interpolators, private=True)
+    fitting_functions = {}
+    for name, (smin, smax, orders, values) in interpolators.items():
+        fitting_functions[name] = MultilinearInterpolator(smin, smax, orders,
+                                                          values)
+    return interpolation_single_rank(run_dir, rank, pmass, species, tindex,
+                                     fitting_functions)
+
+
 def interp_particle_compression_single(run_dir, run_name, tindex,
                                        tindex_pre, tindex_post, species='e',
-                                       use_shifted_eb=False):
+                                       use_shifted_eb=False, ncores=1):
     """Use single field files to interpolate compression effects
+
+    The PIC ranks are spread over the processes, which share the values of
+    the interpolators instead of getting a copy with each rank.
     """
     picinfo_fname = '../data/pic_info/pic_info_' + run_name + '.json'
     pic_info = read_data_from_json(picinfo_fname)
@@ -1814,12 +1800,20 @@ def interp_particle_compression_single(run_dir, run_name, tindex,
     hist_pdivv = np.zeros(nbins - 1) 
 
     ranks = range(nprocs)
-    hists = np.zeros((11, nbins))
-    for rank in ranks:
-        hists += interpolation_single_rank(run_dir, rank, pmass, species, tindex,
-                                           fitting_functions)
-    fname = fdir + 'hists_' + species + '.' + str(tindex) + '.all'
-    hists.tofile(fname)
+    interpolators = interpolator_arrays(fitting_functions)
+    del fitting_functions
+    backend = parallel_backend.get_backend(ncores)
+    # memory-mapped files, so the workers can map them copy-on-write. The
+    # MPI ranks already have the interpolators.
+    with shared_arrays.SharedRegistry(shared_arrays.memmap_dir()) as registry:
+        if isinstance(backend, parallel_backend.LocalBackend):
+            interpolators = registry.share(interpolators)
+        hists = backend.reduce(interpolation_shared_rank, ranks, np.add,
+                               run_dir, pmass, species, tindex, interpolators,
+                               initial=np.zeros((11, nbins)))
+    if backend.is_master:
+        fname = fdir + 'hists_' + species + '.' + str(tindex) + '.all'
+        hists.tofile(fname)
 
 
 def momentum_dist_single_rank(run_dir, rank, pmass, species, tindex,
@@ -2750,6 +2744,9 @@ def get_cmd_args():
                         help='whether to show diagnostic information')
     parser.add_argument('--multi_frames', action="store_true", default=False,
                         help='whether analyzing multiple frames')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames and ranks done by ' +
+                        'the last run')
     return parser.parse_args()
 
 
@@ -2777,6 +2774,7 @@ if __name__ == "__main__":
     single_core = args.single_core
     multi_frames = args.multi_frames
     ncores = multiprocessing.cpu_count()
+    backend = parallel_backend.get_backend(ncores)
     if species == 'e':
         charge = -1.0
         pmass = 1.0
@@ -2808,33 +2806,51 @@ if __name__ == "__main__":
                                    use_shifted_eb=True)
 
     if multi_frames:
+        # the frames done by the last run, from the journal of the master
+        ckpt_name = 'particle_compression_' + run_name + '_' + species
+        ckpt = checkpoint.Checkpoint(ckpt_name, resume=args.resume, interval=0)
+        if backend.is_master:
+            ckpt.open()
+        ckpt.done = backend.bcast(ckpt.done)
         for ct in range(1, ntp):
+            if ckpt.is_done(ct):
+                continue
             print("Time frame: %d of %d" % (ct, ntp))
             tindex = pint * ct
             tindex_pre, tindex_post = get_fields_tindex(tindex, pic_info)
             if single_core:
                 if not args.only_plotting:
-                    Parallel(n_jobs=ncores)(delayed(processInput)(rank) for rank in ranks)
-                    combine_files_single_core(nprocs, run_dir, run_name, species)
-                    p1 = subprocess.Popen([cmd], cwd=run_dir, stdout=open('outfile.out', 'w'),
-                                          stderr=subprocess.STDOUT, shell=True)
-                    p1.wait()
-
-                plot_hist_de_para_perp(nprocs, run_dir, run_name, pic_info,
-                                       tindex, species, if_combine_files,
-                                       if_normalize)
+                    # the PIC ranks are spread over the MPI ranks under mpirun
+                    ranks_ckpt = checkpoint.Checkpoint(
+                        ckpt_name + '_' + str(tindex), resume=args.resume)
+                    backend.map(processInput, ranks, checkpoint=ranks_ckpt)
+                    if backend.is_master:
+                        combine_files_single_core(nprocs, run_dir, run_name, species)
+                        p1 = subprocess.Popen([cmd], cwd=run_dir, stdout=open('outfile.out', 'w'),
+                                              stderr=subprocess.STDOUT, shell=True)
+                        p1.wait()
+
+                if backend.is_master:
+                    plot_hist_de_para_perp(nprocs, run_dir, run_name, pic_info,
+                                           tindex, species, if_combine_files,
+                                           if_normalize)
             else:
                 if not args.only_plotting:
                     interp_particle_compression_single(run_dir, run_name, tindex,
-                                                       tindex_pre, tindex_post, species)
+                                                       tindex_pre, tindex_post, species,
+                                                       ncores=ncores)
                     # fdata = Parallel(n_jobs=ncores, max_nbytes=1e6)\
                     #         (delayed(interpolation_single_rank)
                     #          (run_dir, rank, pmass, species, tindex, fitting_functions)
                     #          for rank in ranks)
                     # save_econv_data(fdata, fdir, species, tindex)
                     # del fitting_functions
-                plot_compression_heating(run_name, tindex, species)
-                plt.close()
+                # only the master has the histograms, which it wrote above
+                if backend.is_master:
+                    plot_compression_heating(run_name, tindex, species)
+                    plt.close()
+            if backend.is_master:
+                ckpt.record(ct)
             gc.collect()
     else:
         if single_core:
@@ -2862,7 +2878,7 @@ if __name__ == "__main__":
                 # hists.tofile(fname)
 
                 ncores = ntp - 1
-                Parallel(n_jobs=ncores)(delayed(processFrames)(ct) for ct in cts)
+                parallel_backend.get_backend(ncores).map(processFrames, cts)
 
                 # ranks = range(36)
                 # fdata = Parallel(n_jobs=ncores)(delayed(interpolation_single_rank)(run_dir, rank,
@@ -27,6 +27,7 @@ from scipy import interpolate, signal
 import color_maps as cm
 import colormap.colormaps as cmaps
 import pic_information
+import vpic_schema
 from contour_plots import plot_2d_contour, read_2d_fields
 from energy_conversion import read_data_from_json
 from shell_functions import mkdir_p
@@ -67,21 +68,8 @@ def read_boilerplate(fh):
     Args:
         fh: file handler
     """
-    offset = 0
-    sizearr = np.memmap(
-        fh, dtype='int8', mode='r', offset=offset, shape=(5), order='F')
-    offset += 5
-    cafevar = np.memmap(
-        fh, dtype='int16', mode='r', offset=offset, shape=(1), order='F')
-    offset += 2
-    deadbeefvar = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(1), order='F')
-    offset += 4
-    realone = np.memmap(
-        fh, dtype='float32', mode='r', offset=offset, shape=(1), order='F')
-    offset += 4
-    doubleone = np.memmap(
-        fh, dtype='float64', mode='r', offset=offset, shape=(1), order='F')
+    vpic_schema.check_boilerplate(
+        np.memmap(fh, dtype=vpic_schema.BOILERPLATE, mode='r', shape=(1))[0])
 
 
 def read_particle_header(fh):
@@ -90,49 +78,7 @@ def read_particle_header(fh):
     Args:
         fh: file handler.
     """
-    offset = 23  # the size of the boilerplate is 23
-    tmp1 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(6), order='F')
-    offset += 6 * 4
-    tmp2 = np.memmap(
-        fh, dtype='float32', mode='r', offset=offset, shape=(10), order='F')
-    offset += 10 * 4
-    tmp3 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(4), order='F')
-    v0header = collections.namedtuple("v0header", [
-        "version", "type", "nt", "nx", "ny", "nz", "dt", "dx", "dy", "dz",
-        "x0", "y0", "z0", "cvac", "eps0", "damp", "rank", "ndom", "spid",
-        "spqm"
-    ])
-    v0 = v0header(
-        version=tmp1[0],
-        type=tmp1[1],
-        nt=tmp1[2],
-        nx=tmp1[3],
-        ny=tmp1[4],
-        nz=tmp1[5],
-        dt=tmp2[0],
-        dx=tmp2[1],
-        dy=tmp2[2],
-        dz=tmp2[3],
-        x0=tmp2[4],
-        y0=tmp2[5],
-        z0=tmp2[6],
-        cvac=tmp2[7],
-        eps0=tmp2[8],
-        damp=tmp2[9],
-        rank=tmp3[0],
-        ndom=tmp3[1],
-        spid=tmp3[2],
-        spqm=tmp3[3])
-    header_particle = collections.namedtuple("header_particle",
-                                             ["size", "ndim", "dim"])
-    offset += 4 * 4
-    tmp4 = np.memmap(
-        fh, dtype='int32', mode='r', offset=offset, shape=(3), order='F')
-    pheader = header_particle(size=tmp4[0], ndim=tmp4[1], dim=tmp4[2])
-    offset += 3 * 4
-    return (v0, pheader, offset)
+    return vpic_schema.read_particle_header(fh)
 
 
 def read_particle_data(fname):
@@ -141,16 +87,7 @@ def read_particle_data(fname):
     Args:
         fname: file name.
     """
-    fh = open(fname, 'r')
-    read_boilerplate(fh)
-    v0, pheader, offset = read_particle_header(fh)
-    nptl = pheader.dim
-    particle_type = np.dtype([('dxyz', np.float32, 3), ('icell', np.int32),
-                              ('u', np.float32, 3), ('q', np.float32)])
-    fh.seek(offset, os.SEEK_SET)
-    data = np.fromfile(fh, dtype=particle_type, count=nptl)
-    fh.close()
-    return (v0, pheader, data)
+    return vpic_schema.read_particle_data(fname)
 
 
 def calc_velocity_distribution(v0,
@@ -23,6 +23,7 @@ from scipy.interpolate import interp1d
 import pic_information
 from energy_conversion import *
 from shell_functions import *
+from tracer_interp import interp_linear_batch, interp_trajectories
 
 rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
 mpl.rc('text', usetex=True)
@@ -106,11 +107,12 @@ def interp_data(sz_new, sz_old, ptl, pic_info, interp_kind='linear'):
     tnew = np.linspace(t[0], t[-1], sz_new)
     dt_new = sz_old * dt / sz_new
 
-    for key in ptl:
-        if key != 't':
-            f = interp1d(t, ptl[key], kind=interp_kind)
-            ptl[key] = f(tnew)
-    ptl['t'] = tnew
+    # Positions are in di and are unwrapped at the periodic boundaries
+    box_sizes = {'dX': pic_info.lx_di,
+                 'dY': pic_info.ly_di,
+                 'dZ': pic_info.lz_di}
+    ptl = interp_trajectories(t, ptl, tnew, interp_kind, box_sizes=box_sizes,
+                              keep_dtype=False)
 
     return ptl
 
@@ -296,7 +298,8 @@ def transfer_to_h5part(particle_tags,
                        filepath,
                        tinterval,
                        species='electrons',
-                       interp_kind='linear'):
+                       interp_kind='linear',
+                       block_size=4096):
     """Transfer current HDF5 file to H5Part format
     
     All particles at the same time step are stored in the same time step
@@ -309,33 +312,27 @@ def transfer_to_h5part(particle_tags,
         tinterval: (# of time points + 1) between original two time points
         species: particle species
         interp_kind: interpolate kind
+        block_size: number of particles read, interpolated and written
+            together
     """
     nptl = len(particle_tags)
     ptl, ntf = read_particle_data(0, particle_tags, pic_info, fh)
     told = np.linspace(0, ntf, ntf, endpoint=False)
     ntf_new = (ntf - 1) * tinterval + 1
     tnew = np.linspace(0, ntf - 1, ntf_new)
-    Ux = np.zeros(ntf_new * nptl, dtype=ptl['Ux'].dtype)
-    Uy = np.zeros(ntf_new * nptl, dtype=ptl['Uy'].dtype)
-    Uz = np.zeros(ntf_new * nptl, dtype=ptl['Uz'].dtype)
-    dX = np.zeros(ntf_new * nptl, dtype=ptl['dX'].dtype)
-    dY = np.zeros(ntf_new * nptl, dtype=ptl['dY'].dtype)
-    dZ = np.zeros(ntf_new * nptl, dtype=ptl['dZ'].dtype)
-    i = np.zeros(ntf_new * nptl, dtype=ptl['i'].dtype)
-    q = np.zeros(ntf_new * nptl, dtype=ptl['q'].dtype)
-    gamma = np.zeros(ntf_new * nptl, dtype=ptl['gamma'].dtype)
-    t = np.zeros(ntf_new * nptl, dtype=ptl['t'].dtype)
+    keys = ['Ux', 'Uy', 'Uz', 'dX', 'dY', 'dZ', 'i', 'q', 'gamma', 't']
     if 'Bx' in ptl:
-        Bx = np.zeros(ntf_new * nptl, dtype=ptl['Bx'].dtype)
-        By = np.zeros(ntf_new * nptl, dtype=ptl['By'].dtype)
-        Bz = np.zeros(ntf_new * nptl, dtype=ptl['Bz'].dtype)
-        Ex = np.zeros(ntf_new * nptl, dtype=ptl['Ex'].dtype)
-        Ey = np.zeros(ntf_new * nptl, dtype=ptl['Ey'].dtype)
-        Ez = np.zeros(ntf_new * nptl, dtype=ptl['Ez'].dtype)
+        keys += ['Bx', 'By', 'Bz', 'Ex', 'Ey', 'Ez']
     if 'Vx' in ptl:
-        Vx = np.zeros(ntf_new * nptl, dtype=ptl['Vx'].dtype)
-        Vy = np.zeros(ntf_new * nptl, dtype=ptl['Vy'].dtype)
-        Vz = np.zeros(ntf_new * nptl, dtype=ptl['Vz'].dtype)
+        keys += ['Vx', 'Vy', 'Vz']
+    dtypes = {key: ptl[key].dtype for key in ptl}
+
+    # The positions are in di. They are unwrapped before the interpolation
+    # and put back into the box afterwards.
+    nx, ny, nz = pic_info.nx, pic_info.ny, pic_info.nz
+    lx, ly, lz = pic_info.lx_di, pic_info.ly_di, pic_info.lz_di
+    box_sizes = {'dX': lx, 'dY': ly, 'dZ': lz}
+    box_lower = {'dX': 0.0, 'dY': -0.5 * ly, 'dZ': -0.5 * lz}
 
     # Additional information besides the original particle data
     additional_info = ''
@@ -348,85 +345,58 @@ def transfer_to_h5part(particle_tags,
     if tinterval > 1:
         additional_info += '_' + interp_kind + '_t' + str(tinterval)
 
-    # Save the interpolated particle data
-    if 'Bx' in ptl:
-        file_name = species + additional_info + '.h5p'
-    else:
-        file_name = species + additional_info + '.h5p'
-    fname = filepath + file_name
-    with h5py.File(fname, 'w') as fh_out:
-        for iptl in range(nptl):
-            print iptl
-            ptl, ntf = read_particle_data(iptl, particle_tags, pic_info, fh)
-            if tinterval > 1:
-                for key in ptl:
-                    f = interp1d(told, ptl[key], kind=interp_kind)
-                    ptl[key] = f(tnew).astype(ptl[key].dtype)
-            grp = fh_out.create_group(particle_tags[iptl])
-            for key in ptl:
-                grp.create_dataset(
-                    key, (ntf_new, ), data=ptl[key], dtype=ptl[key].dtype)
-            Ux[iptl::nptl] = ptl['Ux']
-            Uy[iptl::nptl] = ptl['Uy']
-            Uz[iptl::nptl] = ptl['Uz']
-            dX[iptl::nptl] = ptl['dX']
-            dY[iptl::nptl] = ptl['dY']
-            dZ[iptl::nptl] = ptl['dZ']
-            i[iptl::nptl] = ptl['i']
-            q[iptl::nptl] = ptl['q']
-            gamma[iptl::nptl] = ptl['gamma']
-            t[iptl::nptl] = ptl['t']
-            if 'Bx' in ptl:
-                Bx[iptl::nptl] = ptl['Bx']
-                By[iptl::nptl] = ptl['By']
-                Bz[iptl::nptl] = ptl['Bz']
-                Ex[iptl::nptl] = ptl['Ex']
-                Ey[iptl::nptl] = ptl['Ey']
-                Ez[iptl::nptl] = ptl['Ez']
-            if 'Vx' in ptl:
-                Vx[iptl::nptl] = ptl['Vx']
-                Vy[iptl::nptl] = ptl['Vy']
-                Vz[iptl::nptl] = ptl['Vz']
-
-    nx, ny, nz = pic_info.nx, pic_info.ny, pic_info.nz
-    lx, ly, lz = pic_info.lx_di, pic_info.ly_di, pic_info.lz_di
-    dX *= nx / lx * 0.5
-    dY *= ny / ly * 0.5
-    dZ *= nz / lz * 0.5
-    dY += ny * 0.25
-    dZ += nz * 0.25
-
-    if 'Bx' in ptl:
-        file_name = species + additional_info + '.h5part'
-    else:
-        file_name = species + additional_info + '.h5part'
-    fname = filepath + file_name
-    with h5py.File(fname, 'w') as fh_out:
+    # Both files are written one block of particles at a time, so only one
+    # block is in memory
+    fname = filepath + species + additional_info + '.h5p'
+    fname_h5part = filepath + species + additional_info + '.h5part'
+    with h5py.File(fname, 'w') as fh_out, \
+            h5py.File(fname_h5part, 'w') as fh_part:
+        steps = []
         for tindex in range(0, ntf_new):
-            print tindex
-            grp = fh_out.create_group('Step#' + str(tindex))
-            index = range(tindex * nptl, (tindex + 1) * nptl)
-            grp.create_dataset('Ux', (nptl, ), data=Ux[index])
-            grp.create_dataset('Uy', (nptl, ), data=Uy[index])
-            grp.create_dataset('Uz', (nptl, ), data=Uz[index])
-            grp.create_dataset('dX', (nptl, ), data=dX[index])
-            grp.create_dataset('dY', (nptl, ), data=dY[index])
-            grp.create_dataset('dZ', (nptl, ), data=dZ[index])
-            grp.create_dataset('i', (nptl, ), data=i[index])
-            grp.create_dataset('q', (nptl, ), data=q[index])
-            grp.create_dataset('gamma', (nptl, ), data=gamma[index])
-            grp.create_dataset('t', (nptl, ), data=t[index])
-            if 'Bx' in ptl:
-                grp.create_dataset('Bx', (nptl, ), data=Bx[index])
-                grp.create_dataset('By', (nptl, ), data=By[index])
-                grp.create_dataset('Bz', (nptl, ), data=Bz[index])
-                grp.create_dataset('Ex', (nptl, ), data=Ex[index])
-                grp.create_dataset('Ey', (nptl, ), data=Ey[index])
-                grp.create_dataset('Ez', (nptl, ), data=Ez[index])
-            if 'Vx' in ptl:
-                grp.create_dataset('Vx', (nptl, ), data=Vx[index])
-                grp.create_dataset('Vy', (nptl, ), data=Vy[index])
-                grp.create_dataset('Vz', (nptl, ), data=Vz[index])
+            grp = fh_part.create_group('Step#' + str(tindex))
+            for key in keys:
+                grp.create_dataset(key, (nptl, ), dtype=dtypes[key])
+            steps.append(grp)
+        for p0 in range(0, nptl, block_size):
+            p1 = min(p0 + block_size, nptl)
+            print(p0)
+            ptl_block = {}
+            for iptl in range(p0, p1):
+                ptl, ntf = read_particle_data(iptl, particle_tags, pic_info, fh)
+                for key in ptl:
+                    if key not in ptl_block:
+                        ptl_block[key] = np.zeros((ntf, p1 - p0),
+                                                  dtype=ptl[key].dtype)
+                    ptl_block[key][:, iptl - p0] = ptl[key]
+            if tinterval > 1:
+                # t is linear in time, so linear interpolation is exact
+                tfields = ptl_block.pop('t')
+                ptl_block = interp_trajectories(told, ptl_block, tnew,
+                                                interp_kind,
+                                                box_sizes=box_sizes)
+                for key in box_sizes:
+                    pos = ptl_block[key] - box_lower[key]
+                    pos = np.mod(pos, box_sizes[key]) + box_lower[key]
+                    ptl_block[key] = pos.astype(dtypes[key])
+                ptl_block['t'] = interp_linear_batch(told, tfields,
+                                                     tnew).astype(tfields.dtype)
+            for iptl in range(p0, p1):
+                grp = fh_out.create_group(particle_tags[iptl])
+                for key in ptl_block:
+                    pdata = ptl_block[key][:, iptl - p0]
+                    grp.create_dataset(
+                        key, (ntf_new, ), data=pdata, dtype=pdata.dtype)
+
+            # Positions in the H5Part file are in cells of a half-resolution
+            # grid
+            ptl_block['dX'] *= nx / lx * 0.5
+            ptl_block['dY'] *= ny / ly * 0.5
+            ptl_block['dZ'] *= nz / lz * 0.5
+            ptl_block['dY'] += ny * 0.25
+            ptl_block['dZ'] += nz * 0.25
+            for tindex in range(0, ntf_new):
+                for key in keys:
+                    steps[tindex][key][p0:p1] = ptl_block[key][tindex]
 
 
 def save_reduced_data_in_same_file(rootpath):
@@ -84,7 +84,8 @@ def plot_average_energy(pic_info, species, current_time):
         "zstep": 2,
         "is_log": False,
         "vmin": 0.0,
-        "vmax": vmax
+        "vmax": vmax,
+        "dpi": 300
     }
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
@@ -269,7 +270,7 @@ def number_density_along_cut(current_time, coords, lcorner, weights):
         fig = plt.figure(figsize=[10, 5])
         ax1 = fig.add_axes([xs, ys, width, height])
         # vmax = math.floor(np.max(nrho_band_i) / 0.1 - 1.0) * 0.1
-        kwargs_plot = {"xstep": 1, "zstep": 1, "is_log": False}
+        kwargs_plot = {"xstep": 1, "zstep": 1, "is_log": False, "dpi": 300}
         xstep = kwargs_plot["xstep"]
         zstep = kwargs_plot["zstep"]
         ixs = 0
@@ -311,7 +312,7 @@ def number_density_along_cut(current_time, coords, lcorner, weights):
 
         fig = plt.figure(figsize=[10, 5])
         ax1 = fig.add_axes([xs, ys, width, height])
-        kwargs_plot = {"xstep": 1, "zstep": 1, "is_log": False}
+        kwargs_plot = {"xstep": 1, "zstep": 1, "is_log": False, "dpi": 300}
         xstep = kwargs_plot["xstep"]
         zstep = kwargs_plot["zstep"]
         p1, cbar1 = plot_2d_contour(x[ixs:nx], z, nrho_band_i[:, ixs:nx], ax1,
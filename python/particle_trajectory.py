@@ -796,7 +796,8 @@ def plot_traj(filename, pic_info, species, iptl, mint, maxt):
         "zstep": 2,
         "is_log": False,
         "vmin": -1.0,
-        "vmax": 1.0
+        "vmax": 1.0,
+        "dpi": 300
     }
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
@@ -1097,7 +1098,8 @@ def plot_ptl_traj(filename, pic_info, species, iptl, mint, maxt):
         "zstep": 2,
         "is_log": False,
         "vmin": -1.0,
-        "vmax": 1.0
+        "vmax": 1.0,
+        "dpi": 300
     }
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks of the analyses on synthetic runs
+
+Each case runs one analysis on a synthetic run (see synthetic_run) written
+in the on-disk formats of VPIC, so the benchmarks do not need a production
+run. The cases are swept over the run sizes and the number of workers. The
+wall time of each case is the minimum over a few repeats, and the bytes read
+by the file backends come from instrument, so the reports have the I/O
+rates too. A report can be compared with an earlier one to find the
+regressions.
+
+    python3 perf_benchmark.py --sizes tiny small --workers 1 4
+    python3 perf_benchmark.py --cases fft_spectra --compare old.json
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import fieldline_tracer
+import field_io
+import instrument
+import parallel_backend
+import slab_fft
+import spectrum_engine
+import synthetic_run
+import tracer_bucket
+import vpic_schema
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+# the plotting modules are only loaded by the cases that need them
+combine_energy_spectrum = lazy_module('combine_energy_spectrum')
+
+BENCHMARK_DIR = '../data/benchmarks/'
+FIELD_VARS = ['bx', 'by', 'bz']
+NSEEDS = 256
+SLAB_MEM_BUDGET = 2**26
+
+# a case is a function of the run and the number of workers, and ndims are
+# the dimensions of the runs it supports
+Case = collections.namedtuple('Case', ['name', 'func', 'ndims'])
+CASES = collections.OrderedDict()
+
+
+def case(name, ndims=(2, 3)):
+    """Register a benchmark case
+    """
+    def register(func):
+        CASES[name] = Case(name, func, ndims)
+        return func
+    return register
+
+
+def read_frame(tframe, pic_info, run_dir, var_names):
+    """Read the fields of one frame, and return their sum
+    """
+    pic_box = (0, pic_info.lx_di, -0.5 * pic_info.lz_di, 0.5 * pic_info.lz_di)
+    total = 0.0
+    for var in var_names:
+        _, _, fdata = field_io.read_2d_fields(pic_info,
+                                              run_dir + 'data/' + var + '.gda',
+                                              tframe, *pic_box)
+        total += np.sum(fdata, dtype=np.float64)
+    return total
+
+
+@case('field_read', ndims=(2, ))
+def bench_field_read(run, ncores):
+    """Read the fields of all the frames
+    """
+    pic_info = run["pic_info"]
+    backend = parallel_backend.get_backend(ncores)
+    backend.map(read_frame, range(pic_info.ntf), pic_info, run["run_dir"],
+                run["params"]["variables"])
+
+
+def rank_energy_hist(rank, fbase, ebins):
+    """Histogram of gamma - 1 of the particles of one rank
+    """
+    _, _, ptl = vpic_schema.read_particle_data(fbase + str(rank))
+    u2 = np.sum(ptl['u'].astype(np.float64)**2, axis=1)
+    hist, _ = np.histogram(u2 / (np.sqrt(1.0 + u2) + 1.0), bins=ebins)
+    return hist
+
+
+@case('particle_hist')
+def bench_particle_hist(run, ncores):
+    """Energy spectra of the last particle dump reduced over the ranks
+    """
+    params = run["params"]
+    interval = params["particle_every"] * params["fields_interval"]
+    last = (params["nframes"] - 1) * params["fields_interval"]
+    tindex = (last // interval) * interval
+    ebins = np.logspace(-5, 2, 256)
+    ranks = range(synthetic_run.nranks(params))
+    backend = parallel_backend.get_backend(ncores)
+    for species in ['e', 'h']:
+        fbase = (run["run_dir"] + 'particle/T.' + str(tindex) + '/' +
+                 species + 'particle.' + str(tindex) + '.')
+        backend.reduce(rank_energy_hist, ranks, np.add, fbase, ebins)
+
+
+def combine_frame_spectra(tframe, run_dir, run_name):
+    """Combine the spectra of the zones and ranks of one frame
+    """
+    for species in ['e', 'h']:
+        combine_energy_spectrum.combine_energy_spectrum(run_dir, run_name,
+                                                        tframe, species)
+
+
+@case('spectrum_reduce')
+def bench_spectrum_reduce(run, ncores):
+    """Combine the hydro spectra of all the frames
+    """
+    backend = parallel_backend.get_backend(ncores)
+    backend.map(combine_frame_spectra, range(run["pic_info"].ntf),
+                run["run_dir"], run["run_name"])
+
+
+def tracer_steps(run_dir):
+    """The time indices of the tracer steps of a run
+    """
+    return sorted(int(dir_name[2:])
+                  for dir_name in os.listdir(run_dir + 'tracer/')
+                  if dir_name.startswith('T.'))
+
+
+def sort_tracer_step(tindex, pic_info, meta_data, run_dir):
+    """Sort the tracers of one step by MPI rank
+    """
+    pmin = [np.min(meta_data[name]) for name in ['x0', 'y0', 'z0']]
+    for species in synthetic_run.TRACER_SPECIES:
+        tracer_bucket.bucket_tracer_data(pic_info, pmin, meta_data, tindex,
+                                         species, root_path=run_dir)
+
+
+@case('tracer_sort')
+def bench_tracer_sort(run, ncores):
+    """Bucket the tracers of all the steps by MPI rank
+    """
+    meta_data = synthetic_run.tracer_meta_data(run["params"])
+    backend = parallel_backend.get_backend(ncores)
+    backend.map(sort_tracer_step, tracer_steps(run["run_dir"]),
+                run["pic_info"], meta_data, run["run_dir"])
+
+
+def trace_frame(tframe, pic_info, run_dir, nseeds):
+    """Trace the field lines from seeds across the current sheet
+
+    Returns:
+        the number of lines with each stop status
+    """
+    bfields, (dz, dx) = spectrum_engine.read_frame_fields(
+        pic_info, run_dir, tframe, ['bx', 'bz'])
+    seeds = np.zeros((nseeds, 2))
+    seeds[:, 0] = np.linspace(0, pic_info.lx_di, nseeds, endpoint=False)
+    seeds[:, 1] = np.linspace(0.25, 0.75, nseeds) * pic_info.lz_di
+    lines = fieldline_tracer.trace_field_lines(bfields, seeds, (dx, dz),
+                                               record=False)
+    return np.bincount(lines.status)
+
+
+@case('fieldline_trace', ndims=(2, ))
+def bench_fieldline_trace(run, ncores):
+    """Trace the field lines of all the frames
+    """
+    backend = parallel_backend.get_backend(ncores)
+    backend.map(trace_frame, range(run["pic_info"].ntf), run["pic_info"],
+                run["run_dir"], NSEEDS)
+
+
+@case('fft_spectra', ndims=(2, ))
+def bench_fft_spectra(run, ncores):
+    """Power spectra of the magnetic field of all the frames
+    """
+    spectrum_engine.calc_spectrum_table(run["pic_info"], run["run_dir"],
+                                        range(run["pic_info"].ntf),
+                                        FIELD_VARS, ncores=ncores)
+
+
+@case('slab_fft')
+def bench_slab_fft(run, ncores):
+    """Out-of-core power spectrum of the smoothed magnetic field cubes
+    """
+    params = run["params"]
+    factor = params["smooth_factor"]
+    nyf = factor if params["ny"] > 1 else 1
+    shape = (params["nz"] // factor, params["ny"] // nyf,
+             params["nx"] // factor)
+    dx = params["dx_de"] * factor
+    fnames = [run["run_dir"] + 'data-smooth/' + var + '_0.gda'
+              for var in FIELD_VARS]
+    slab_fft.slab_power_spectrum(fnames, shape, (dx, dx, dx), ncores=ncores,
+                                 mem_budget=SLAB_MEM_BUDGET)
+
+
+def prepare_run(size, run_root):
+    """Write the synthetic run of a size if needed, and load it
+    """
+    run_name = 'synthetic_' + size
+    params = synthetic_run.default_params(*synthetic_run.SIZES[size])
+    run_dir = synthetic_run.make_run(run_name, params, run_root)
+    pic_info = read_data_from_json(synthetic_run.PIC_INFO_DIR + 'pic_info_' +
+                                   run_name + '.json')
+    return {"run_name": run_name,
+            "run_dir": run_dir,
+            "params": synthetic_run.run_params(run_dir),
+            "pic_info": pic_info}
+
+
+def io_bytes(stats):
+    """Total bytes read by the file backends in instrument stats
+    """
+    return sum(nbytes for _, nbytes in stats["io"].values())
+
+
+def time_case(bench, run, ncores, repeat):
+    """Wall times of a case over a few repeats
+
+    Returns:
+        a dictionary with the times, the bytes read in one repeat, and the
+        error of a failed case
+    """
+    times = []
+    nbytes = 0
+    for _ in range(repeat):
+        instrument.reset()
+        tstart = time.time()
+        try:
+            bench.func(run, ncores)
+        except Exception:
+            return {"times": times, "bytes": nbytes, "ok": False,
+                    "error": traceback.format_exc().strip().splitlines()[-1]}
+        times.append(time.time() - tstart)
+        nbytes = io_bytes(instrument.snapshot())
+    return {"times": times, "bytes": nbytes, "ok": True, "error": ""}
+
+
+def run_benchmarks(case_names, sizes, workers, repeat,
+                   run_root=synthetic_run.RUN_ROOT):
+    """Run the cases on the runs of all the sizes with all the workers
+
+    Returns:
+        the report with one result for each case, size and worker count
+    """
+    instrument.enable()
+    results = []
+    for size in sizes:
+        run = prepare_run(size, run_root)
+        ndim = 3 if run["params"]["ny"] > 1 else 2
+        for ncores in workers:
+            for name in case_names:
+                bench = CASES[name]
+                if ndim not in bench.ndims:
+                    continue
+                print("Benchmark %s on %s with %d workers" %
+                      (name, size, ncores))
+                result = time_case(bench, run, ncores, repeat)
+                result.update({"case": name, "size": size,
+                               "grid": synthetic_run.SIZES[size],
+                               "ncores": ncores,
+                               "time": min(result["times"] or [None])})
+                results.append(result)
+    return {"python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.node(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "repeat": repeat,
+            "results": results}
+
+
+def result_key(result):
+    """The case, size and worker count of a result
+    """
+    return (result["case"], result["size"], result["ncores"])
+
+
+def compare_reports(report, old_report, threshold):
+    """Mark the results that are slower than in an old report
+
+    Args:
+        report: the new report
+        old_report: the old report
+        threshold: the relative slowdown of a regression, e.g., 0.1
+
+    Returns:
+        whether there is no regression
+    """
+    old_times = dict((result_key(result), result["time"])
+                     for result in old_report["results"] if result["ok"])
+    passed = True
+    for result in report["results"]:
+        old_time = old_times.get(result_key(result))
+        if not result["ok"] or old_time is None:
+            continue
+        result["ratio"] = result["time"] / old_time
+        result["regression"] = result["ratio"] > 1.0 + threshold
+        passed = passed and not result["regression"]
+    return passed
+
+
+def print_report(report):
+    """Print the results as a table
+    """
+    print("Python %s, numpy %s, %d CPUs on %s" %
+          (report["python"], report["numpy"], report["cpu_count"],
+           report["machine"]))
+    print("%-16s %-9s %7s %10s %10s %10s  %s" %
+          ("case", "size", "workers", "time", "MB", "MB/s", "status"))
+    for result in report["results"]:
+        if not result["ok"]:
+            print("%-16s %-9s %7d %10s %10s %10s  ERROR %s" %
+                  (result["case"], result["size"], result["ncores"], "-",
+                   "-", "-", result["error"]))
+            continue
+        mbytes = result["bytes"] / 2.0**20
+        status = "ok"
+        if "ratio" in result:
+            status = "%s %.2fx" % ("SLOWER" if result["regression"] else "ok",
+                                   result["ratio"])
+        print("%-16s %-9s %7d %9.3fs %10.1f %10.1f  %s" %
+              (result["case"], result["size"], result["ncores"],
+               result["time"], mbytes, mbytes / max(result["time"], 1E-9),
+               status))
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Performance benchmarks')
+    parser.add_argument('--cases', nargs='*', default=list(CASES),
+                        choices=list(CASES), help='benchmark cases')
+    parser.add_argument('--sizes', nargs='*', default=['tiny', 'small'],
+                        choices=sorted(synthetic_run.SIZES),
+                        help='sizes of the synthetic runs')
+    parser.add_argument('--workers', nargs='*', type=int, default=[1, 4],
+                        help='numbers of workers')
+    parser.add_argument('--repeat', action="store", default='3', type=int,
+                        help='number of runs of each case')
+    parser.add_argument('--run_root', action="store",
+                        default=synthetic_run.RUN_ROOT,
+                        help='directory of the synthetic runs')
+    parser.add_argument('--output', action="store", default=None,
+                        help='JSON file of the report')
+    parser.add_argument('--compare', action="store", default=None,
+                        help='JSON report to compare with')
+    parser.add_argument('--threshold', action="store", default='0.1',
+                        type=float, help='relative slowdown of a regression')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    report = run_benchmarks(args.cases, args.sizes, args.workers, args.repeat,
+                            args.run_root)
+    passed = all(result["ok"] for result in report["results"])
+    if args.compare:
+        with open(args.compare, 'r') as fh:
+            passed = compare_reports(report, json.load(fh),
+                                     args.threshold) and passed
+    print_report(report)
+    fname = args.output
+    if fname is None:
+        fname = (BENCHMARK_DIR + 'perf_' + time.strftime('%Y%m%d_%H%M%S') +
+                 '.json')
+    mkdir_p(os.path.dirname(fname) or '.')
+    with open(fname, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    print("Report saved to %s" % fname)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
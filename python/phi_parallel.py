@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Parallel potential on the whole 2D grid
+
+The parallel potential defined by Jan Egedal is the integral of E.dl along
+the magnetic field line from one point to the simulation boundary. The field
+lines from all the grid points (optionally strided) are traced together with
+fieldline_tracer, and the grid points are split into chunks that are traced
+on different processes. The results are saved for each time frame and are
+reused when they exist. The file names have the run directory (hashed) and
+the parameters of the integration, so another run or other parameters do
+not reuse them.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+
+import checkpoint
+import fieldline_tracer
+from field_io import read_2d_fields
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+joblib = lazy_module('joblib')
+
+
+def phi_parallel_chunk(bfields, efields, seeds, spacing, ubounds, ds,
+                       max_length):
+    """Parallel potential from one chunk of seeds
+
+    The potential is 0 for the field lines that do not reach the boundary.
+    """
+    lines = fieldline_tracer.trace_field_lines(bfields, seeds, spacing,
+                                               ds=ds, ubounds=ubounds,
+                                               max_length=max_length,
+                                               close_dist=0,
+                                               efields=efields,
+                                               record=False)
+    phi = lines.integral
+    phi[lines.status != fieldline_tracer.EXIT_DOMAIN] = 0
+    return phi
+
+
+def calc_phi_parallel(pic_info, pic_run_dir, tframe, stride=1, ds=None,
+                      max_length=400.0, chunk_size=4096, ncores=None):
+    """Calculate the parallel potential on the whole grid of one frame
+
+    Args:
+        pic_info: namedtuple for the PIC simulation information
+        pic_run_dir: PIC run directory including the data/*.gda files
+        tframe: time frame
+        stride: the stride of the grid points along x and z
+        ds: step size in di. The default is 0.1 of the cell diagonal.
+        max_length: the lines longer than that (in di) are treated as
+            closed and their potential is 0
+        chunk_size: number of grid points traced together on one process
+        ncores: number of processes
+
+    Returns:
+        x, z: the grid coordinates in di
+        phi: the parallel potential with shape (len(z), len(x))
+    """
+    kwargs = {"current_time": tframe,
+              "xl": 0, "xr": pic_info.lx_di,
+              "zb": -0.5 * pic_info.lz_di, "zt": 0.5 * pic_info.lz_di}
+    fields = {}
+    for var in ["ex", "ey", "ez", "bx", "by", "bz"]:
+        fname = pic_run_dir + "data/" + var + ".gda"
+        x, z, fields[var] = read_2d_fields(pic_info, fname, **kwargs)
+    bfields = (fields["bx"], fields["by"], fields["bz"])
+    efields = (fields["ex"], fields["ey"], fields["ez"])
+    spacing = (pic_info.dx_di, pic_info.dz_di)
+    ubounds = (x[-1] - x[0], z[-1] - z[0])
+    xs = x[::stride] - x[0]
+    zs = z[::stride] - z[0]
+    xgrid, zgrid = np.meshgrid(xs, zs)
+    seeds = np.stack([xgrid.ravel(), zgrid.ravel()], axis=1)
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    nseeds = len(seeds)
+    print("Number of field lines: %d" % nseeds)
+    phis = joblib.Parallel(n_jobs=ncores)(
+        joblib.delayed(phi_parallel_chunk)(bfields, efields,
+                                    seeds[i:i + chunk_size], spacing,
+                                    ubounds, ds, max_length)
+        for i in range(0, nseeds, chunk_size))
+    phi = np.concatenate(phis).reshape(xgrid.shape)
+    return x[::stride], z[::stride], phi
+
+
+def phi_parallel_fname(pic_run, pic_run_dir, tframe, stride=1, ds=None,
+                       max_length=400.0):
+    """File name of the saved parallel potential of one frame
+    """
+    run_hash = hashlib.sha1(
+        os.path.abspath(pic_run_dir).encode('utf-8')).hexdigest()[:8]
+    ds_name = 'auto' if ds is None else '%g' % ds
+    return ('../data/phi_parallel/%s/phi_para_%d_stride%d_ds%s_len%g_%s.dat' %
+            (pic_run, tframe, stride, ds_name, max_length, run_hash))
+
+
+def get_phi_parallel(pic_run, tframe, stride=1, pic_run_dir=None, **kwargs):
+    """Get the parallel potential of one frame, using the saved data if any
+
+    Args:
+        pic_run: PIC run name
+        tframe: time frame
+        stride: the stride of the grid points along x and z
+        pic_run_dir: PIC run directory. pic_info.run_dir when None.
+        kwargs: other arguments of calc_phi_parallel
+    """
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    if pic_run_dir is None:
+        pic_run_dir = pic_info.run_dir
+    fname = phi_parallel_fname(pic_run, pic_run_dir, tframe, stride,
+                               kwargs.get("ds"),
+                               kwargs.get("max_length", 400.0))
+    x = np.asarray(pic_info.x_di)[::stride]
+    z = np.asarray(pic_info.z_di)[::stride]
+    if os.path.isfile(fname):
+        phi = np.fromfile(fname).reshape([len(z), len(x)])
+        return x, z, phi
+    x, z, phi = calc_phi_parallel(pic_info, pic_run_dir, tframe, stride,
+                                  **kwargs)
+    mkdir_p(os.path.dirname(fname))
+    phi.tofile(fname)
+    return x, z, phi
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run = 'mime400_Tb_T0_10_weak'
+    default_pic_run_dir = ('/net/scratch4/xiaocan/reconnection_rate/' +
+                           default_pic_run + '/')
+    parser = argparse.ArgumentParser(description='Parallel potential')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--tframe', action="store", default='20', type=int,
+                        help='Time frame')
+    parser.add_argument('--multi_frames', action="store_true", default=False,
+                        help='whether to analyze multiple frames')
+    parser.add_argument('--tstart', action="store", default='0', type=int,
+                        help='starting time frame')
+    parser.add_argument('--tend', action="store", default='40', type=int,
+                        help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
+    parser.add_argument('--stride', action="store", default='1', type=int,
+                        help='stride of the grid points along x and z')
+    parser.add_argument('--ds', action="store", default=None, type=float,
+                        help='step size in di for field line tracing')
+    parser.add_argument('--max_length', action="store", default='400',
+                        type=float, help='maximum field line length in di')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    if args.multi_frames:
+        tframes = range(args.tstart, args.tend + 1)
+        ckpt = checkpoint.for_frames('phi_parallel', args)
+    else:
+        tframes = [args.tframe]
+        ckpt = None
+    with checkpoint.using(ckpt):
+        for tframe in tframes:
+            if ckpt is not None and ckpt.is_done(tframe):
+                continue
+            print("Time frame: %d" % tframe)
+            _, _, phi = get_phi_parallel(args.pic_run, tframe, args.stride,
+                                         args.pic_run_dir, ds=args.ds,
+                                         max_length=args.max_length,
+                                         ncores=args.ncores)
+            print("Min and max: %f, %f" % (phi.min(), phi.max()))
+            if ckpt is not None:
+                ckpt.record(tframe)
+
+
+if __name__ == "__main__":
+    main()
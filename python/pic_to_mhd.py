@@ -9,7 +9,6 @@ import collections
 import math
 import multiprocessing
 import os.path
-import struct
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -22,6 +21,7 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 from mpl_toolkits.mplot3d import Axes3D
 
 import pic_information
+import vpic_schema
 from contour_plots import read_2d_fields
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
@@ -183,10 +183,7 @@ def save_mhd_config(run_name):
     fpath = run_dir + 'bin_data/'
     mkdir_p(fpath)
     fname = fpath + 'mhd_config.dat'
-    double_data.tofile(fname)
-    f = open(fname, 'a')
-    int_data.tofile(f)
-    f.close()
+    vpic_schema.write_mhd_config(fname, double_data, int_data)
 
 
 def get_cmd_args():
@@ -5,6 +5,7 @@ Particle energy spectrum for runs to determine power-law indices
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import math
@@ -23,12 +24,15 @@ from matplotlib.patches import PathPatch, Path
 from scipy.optimize import curve_fit
 from scipy import signal, stats
 
+import checkpoint
 import fitting_funcs
+import parallel_backend
 import pic_information
 from contour_plots import read_2d_fields
 from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
+from tracer_sweep import GammaKernel, TracerPrefetcher
 
 plt.style.use("seaborn-deep")
 mpl.rc('text', usetex=True)
@@ -38,6 +42,10 @@ mpl.rcParams["text.latex.preamble"] = \
          r"\SetMathAlphabet{\mathsfit}{bold}{\encodingdefault}{\sfdefault}{bx}{sl}" +
          r"\newcommand{\tensorsym}[1]{\bm{\mathsfit{#1}}}")
 COLORS = palettable.colorbrewer.qualitative.Set1_9.mpl_colors
+# the variables of calc_rates_tracer carried from one tracer file to the next
+RATES_TRACER_STATE = ['escaped_all', 'acc_rate_sum', 'acc_rate_esc', 'nptl_acc',
+                      'nptl_esc', 'dnptl_esc', 'ptl_indices', 'ibin_max',
+                      'tstart', 'gamma_avg', 'dgamma']
 
 
 def find_nearest(array, value):
@@ -4803,83 +4811,101 @@ def calc_rates_tracer(plot_config, show_plot=True):
     else:
         tracer_interval = pic_info.tracer_interval
     dee_interval = get_time_interval(pic_run)
-    for ifile, tindex_file in enumerate(tframes):
-        print("File %d of %d" % (ifile, nfiles))
-        if pic_run == "turbulent-sheet3D-mixing-sigma100":
-            fname = tracer_dir + 'T.' + str(tindex_file) + '/' + sname + '_tracer_sorted.h5p'
-        else:
-            fname = tracer_dir + 'T.' + str(tindex_file) + '/' + sname + '_tracer_qtag_sorted.h5p'
-        with h5py.File(fname, 'r') as fh:
-            for istep in range(nsteps_file):
-                tindex = tindex_file + istep * tracer_interval
-                tframe = ifile * nsteps_file + istep
-                if tindex > tmax:
-                    break
-                gname = 'Step#' + str(tindex)
-                group = fh[gname]
-                for dset_name in dset_names:
-                    dset = group[dset_name]
-                    dset.read_direct(ptl[dset_name])
-                gamma = np.sqrt(1.0 + ptl["Ux"]**2 + ptl["Uy"]**2 + ptl["Uz"]**2)
-                ene = gamma - 1
-                cond_escape = ene > (ene_final * threshold)  # Close to final energy
-                # Particle should be energetic in the end
-                # cond_escape = np.logical_and(cond_escape, cond_energetic_final)
-                escaped_new = np.logical_and(cond_escape, np.logical_not(escaped_all))
-                escaped_all = np.logical_or(cond_escape, escaped_all)
-                # Particle in acceleration regions should be energetic.
-                # They cannot not be escaped particles at the same time.
-                cond_energetic = ene > (emin * temp/2)  # Energetic enough
-                # cond_energetic = np.logical_and(cond_energetic, cond_energetic_final)
-                acc_high = np.logical_and(cond_energetic, np.logical_not(escaped_all))
-                dene = ptl["Ux"] * ptl["Ex"] + ptl["Uy"] * ptl["Ey"] + ptl["Uz"] * ptl["Ez"]
-                dene /= gamma
-                for ibin in range(nbins):
-                    cond_bin = np.logical_and(ene > ebins[ibin], ene <= ebins[ibin+1])
-                    cond = np.logical_and(escaped_new, cond_bin)
-                    dnptl_esc[tframe, ibin] = np.sum(cond)
-                    cond = np.logical_and(escaped_all, cond_bin)
-                    nptl_esc[tframe, ibin] = np.sum(cond)
-                    acc_rate_esc[tframe, ibin] = np.sum(dene[cond] / ene[cond]) * pcharge
-                    cond = np.logical_and(acc_high, cond_bin)
-                    nptl_acc[tframe, ibin] = np.sum(cond)
-                    acc_rate_sum[tframe, ibin] = np.sum(dene[cond] / ene[cond]) * pcharge
-
-                # High-energy particles for calculating energy diffusion
-                if tframe % dee_interval == 0:
-                    ibin_max = -1
-                    ptl_indices = np.zeros((nbins, nptl), dtype=bool)
+    # the saved state is only valid for the same tracer files and bins
+    params = {"pic_run": pic_run, "species": species,
+              "tframes": tframes.tolist(), "nsteps_file": nsteps_file,
+              "nptl": nptl, "nframes": nframes, "ebins": ebins.tolist(),
+              "threshold": threshold, "dee_interval": dee_interval}
+    ckpt = checkpoint.Checkpoint('rates_tracer_' + pic_run + '_' + species,
+                                 params,
+                                 resume=plot_config.get("resume", False))
+    with ckpt:
+        if ckpt.state is not None:
+            (escaped_all, acc_rate_sum, acc_rate_esc, nptl_acc, nptl_esc,
+             dnptl_esc, ptl_indices, ibin_max, tstart, gamma_avg,
+             dgamma) = [ckpt.state[name] for name in RATES_TRACER_STATE]
+        for ifile, tindex_file in enumerate(tframes):
+            if ckpt.is_done(int(tindex_file)):
+                continue
+            print("File %d of %d" % (ifile, nfiles))
+            if pic_run == "turbulent-sheet3D-mixing-sigma100":
+                fname = tracer_dir + 'T.' + str(tindex_file) + '/' + sname + '_tracer_sorted.h5p'
+            else:
+                fname = tracer_dir + 'T.' + str(tindex_file) + '/' + sname + '_tracer_qtag_sorted.h5p'
+            with h5py.File(fname, 'r') as fh:
+                for istep in range(nsteps_file):
+                    tindex = tindex_file + istep * tracer_interval
+                    tframe = ifile * nsteps_file + istep
+                    if tindex > tmax:
+                        break
+                    gname = 'Step#' + str(tindex)
+                    group = fh[gname]
+                    for dset_name in dset_names:
+                        dset = group[dset_name]
+                        dset.read_direct(ptl[dset_name])
+                    gamma = np.sqrt(1.0 + ptl["Ux"]**2 + ptl["Uy"]**2 + ptl["Uz"]**2)
+                    ene = gamma - 1
+                    cond_escape = ene > (ene_final * threshold)  # Close to final energy
+                    # Particle should be energetic in the end
+                    # cond_escape = np.logical_and(cond_escape, cond_energetic_final)
+                    escaped_new = np.logical_and(cond_escape, np.logical_not(escaped_all))
+                    escaped_all = np.logical_or(cond_escape, escaped_all)
+                    # Particle in acceleration regions should be energetic.
+                    # They cannot not be escaped particles at the same time.
+                    cond_energetic = ene > (emin * temp/2)  # Energetic enough
+                    # cond_energetic = np.logical_and(cond_energetic, cond_energetic_final)
+                    acc_high = np.logical_and(cond_energetic, np.logical_not(escaped_all))
+                    dene = ptl["Ux"] * ptl["Ex"] + ptl["Uy"] * ptl["Ey"] + ptl["Uz"] * ptl["Ez"]
+                    dene /= gamma
                     for ibin in range(nbins):
-                        ptl_indices[ibin] = np.logical_and(ene > ebins[ibin],
-                                                           ene < ebins[ibin+1])
-                        if np.sum(ptl_indices[ibin]) > 0:
-                            ibin_max = ibin
-                    tstart = tframe
-                    gamma_avg = np.zeros([nbins, dee_interval])
-                    dgamma = np.zeros([nbins, dee_interval])
-                for ibin in range(0, ibin_max+1):
-                    # cond = np.logical_and(np.logical_not(escaped_all), ptl_indices[ibin])
-                    # gamma_selected = gamma[cond]
-                    # if np.sum(cond) > 0:
-                    gamma_selected = gamma[ptl_indices[ibin]]
-                    if len(gamma_selected) > 0:
-                        gamma_avg[ibin, tframe-tstart] = np.mean(gamma_selected)
-                        if len(gamma_selected) == 1:
-                            dgamma[ibin, tframe-tstart] = 0.0
-                        else:
-                            dtmp = np.mean(gamma_selected**2) - gamma_avg[ibin, tframe-tstart]**2
-                            if dtmp > 0:
-                                dgamma[ibin, tframe-tstart] = math.sqrt(dtmp)
-                            else:
+                        cond_bin = np.logical_and(ene > ebins[ibin], ene <= ebins[ibin+1])
+                        cond = np.logical_and(escaped_new, cond_bin)
+                        dnptl_esc[tframe, ibin] = np.sum(cond)
+                        cond = np.logical_and(escaped_all, cond_bin)
+                        nptl_esc[tframe, ibin] = np.sum(cond)
+                        acc_rate_esc[tframe, ibin] = np.sum(dene[cond] / ene[cond]) * pcharge
+                        cond = np.logical_and(acc_high, cond_bin)
+                        nptl_acc[tframe, ibin] = np.sum(cond)
+                        acc_rate_sum[tframe, ibin] = np.sum(dene[cond] / ene[cond]) * pcharge
+
+                    # High-energy particles for calculating energy diffusion
+                    if tframe % dee_interval == 0:
+                        ibin_max = -1
+                        ptl_indices = np.zeros((nbins, nptl), dtype=bool)
+                        for ibin in range(nbins):
+                            ptl_indices[ibin] = np.logical_and(ene > ebins[ibin],
+                                                               ene < ebins[ibin+1])
+                            if np.sum(ptl_indices[ibin]) > 0:
+                                ibin_max = ibin
+                        tstart = tframe
+                        gamma_avg = np.zeros([nbins, dee_interval])
+                        dgamma = np.zeros([nbins, dee_interval])
+                    for ibin in range(0, ibin_max+1):
+                        # cond = np.logical_and(np.logical_not(escaped_all), ptl_indices[ibin])
+                        # gamma_selected = gamma[cond]
+                        # if np.sum(cond) > 0:
+                        gamma_selected = gamma[ptl_indices[ibin]]
+                        if len(gamma_selected) > 0:
+                            gamma_avg[ibin, tframe-tstart] = np.mean(gamma_selected)
+                            if len(gamma_selected) == 1:
                                 dgamma[ibin, tframe-tstart] = 0.0
-
-                if (tframe + 1) % dee_interval == 0 or tindex == tmax:
-                    fdir = '../data/power_law_index/rates_tracer/' + pic_run + '/'
-                    mkdir_p(fdir)
-                    fname = fdir + 'gamma_avg_' + str(tframe//dee_interval) + '.dat'
-                    gamma_avg.tofile(fname)
-                    fname = fdir + 'dgamma_' + str(tframe//dee_interval) + '.dat'
-                    dgamma.tofile(fname)
+                            else:
+                                dtmp = np.mean(gamma_selected**2) - gamma_avg[ibin, tframe-tstart]**2
+                                if dtmp > 0:
+                                    dgamma[ibin, tframe-tstart] = math.sqrt(dtmp)
+                                else:
+                                    dgamma[ibin, tframe-tstart] = 0.0
+
+                    if (tframe + 1) % dee_interval == 0 or tindex == tmax:
+                        fdir = '../data/power_law_index/rates_tracer/' + pic_run + '/'
+                        mkdir_p(fdir)
+                        fname = fdir + 'gamma_avg_' + str(tframe//dee_interval) + '.dat'
+                        gamma_avg.tofile(fname)
+                        fname = fdir + 'dgamma_' + str(tframe//dee_interval) + '.dat'
+                        dgamma.tofile(fname)
+            state = [escaped_all, acc_rate_sum, acc_rate_esc, nptl_acc, nptl_esc,
+                     dnptl_esc, ptl_indices, ibin_max, tstart, gamma_avg, dgamma]
+            ckpt.record(int(tindex_file), state=dict(zip(RATES_TRACER_STATE, state)))
 
     fdir = '../data/power_law_index/rates_tracer/' + pic_run + '/'
     mkdir_p(fdir)
@@ -5524,17 +5550,17 @@ def calc_dee_tracer(plot_config, show_plot=True):
     gamma_avg = np.zeros([nbins, tshift])
     dgamma = np.zeros([nbins, tshift])
     ttracer = np.linspace(1, tshift, tshift) * dtwpe_tracer
+    steps = []
     for tframe in range(tstart, tstart+tshift):
-        print("Time frame %d of %d" % (tframe, nframes))
         tindex = tframe * pic_info.tracer_interval
         fname = tracer_dir + 'T.' + str(tindex) + '/' + sname + '_tracer_qtag_sorted.h5p'
-        with h5py.File(fname, 'r') as fh:
-            gname = 'Step#' + str(tindex)
-            group = fh[gname]
-            for dset_name in ["Ux", "Uy", "Uz"]:
-                dset = group[dset_name]
-                dset.read_direct(ptl[dset_name])
-        gamma = np.sqrt(1 + ptl["Ux"]**2 + ptl["Uy"]**2 + ptl["Uz"]**2)
+        steps.append((tindex, fname, 'Step#' + str(tindex)))
+    kernel = GammaKernel(nptl)
+    for istep, tindex, ptl_step in TracerPrefetcher(steps, kernel.dset_names):
+        tframe = tstart + istep
+        print("Time frame %d of %d" % (tframe, nframes))
+        kernel.process(istep, tindex, ptl_step)
+        gamma = kernel.gamma
         for ibin in range(ibin_max+1):
             gamma_selected = gamma[ptl_indices[ibin]]
             spectra[ibin, tframe-tstart, :], _ = np.histogram(gamma_selected, bins=ebins)
@@ -6481,6 +6507,9 @@ def get_cmd_args():
                         help='whether to plot the scaling of the power-law indices')
     parser.add_argument('--nacc_nesc', action="store_true", default=False,
                         help='plot the number of accelerating and escaped particles')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames or tracer files ' +
+                        'done by the last run')
     return parser.parse_args()
 
 
@@ -6592,19 +6621,25 @@ def analysis_multi_frames(plot_config, args):
     """Analysis for multiple time frames
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
+    ckpt = checkpoint.for_frames('power_law_index', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.calc_vexb_kappa:
-                calc_vexb_kappa(plot_config)
-            elif args.plot_vexb_kappa:
-                plot_vexb_kappa(plot_config, show_plot=False)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                if args.calc_vexb_kappa:
+                    calc_vexb_kappa(plot_config)
+                elif args.plot_vexb_kappa:
+                    plot_vexb_kappa(plot_config, show_plot=False)
+                ckpt.record(tframe)
     else:
         ncores = multiprocessing.cpu_count()
         ncores = 18
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
@@ -6621,6 +6656,7 @@ def main():
     plot_config["vkappa_threshold"] = args.vkappa_threshold
     plot_config["sigma_type"] = args.sigma_type
     plot_config["bg"] = args.bg
+    plot_config["resume"] = args.resume
     if args.multi_frames:
         analysis_multi_frames(plot_config, args)
     else:
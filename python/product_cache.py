@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache and dependency graph of the derived products
+
+A derived product (spectra, bxm tables, exhaust boundaries...) declares
+the parameters in plot_config it depends on, the raw files it reads, and
+the upstream products it needs. Its key is the hash of these, of the
+fingerprints (size and modification time) of the raw files, of the keys of
+the upstream products, and of the source code of its function. The output
+files are stored under ../data/cache/<product>/<key>/ with a manifest, and
+the paths the plotting functions read (e.g., ../data/rate_problem/bxm/...)
+become symbolic links to the cached files. So asking for a product only
+builds it when its inputs, its parameters or its code changed, and an old
+result comes back when the inputs are restored.
+
+    PIPELINE = product_cache.Pipeline()
+    PIPELINE.add_product('bxm', calc_bxm, outputs=bxm_fnames,
+                         raw_inputs=bxm_raw_files,
+                         deps=lambda pc: [('exhaust_boundary', pc)])
+    PIPELINE.build([('bxm', dict(plot_config, tframe=t)) for t in tframes])
+
+The source code of the product function is in the key, but the functions it
+calls are not, so bump version when a change in them affects the product.
+"""
+from __future__ import print_function
+
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+import instrument
+import task_runner
+from shell_functions import mkdir_p
+
+CACHE_DIR = '../data/cache/'
+
+
+class Product(object):
+    """A derived product and how to build it
+    """
+
+    def __init__(self, name, func, outputs, params=('pic_run', 'tframe'),
+                 raw_inputs=None, deps=None, version=0):
+        """
+        Args:
+            name: the name of the product
+            func: the function of plot_config that writes the outputs
+            outputs: function of plot_config returning the output files
+            params: the keys of plot_config the product depends on
+            raw_inputs: function of plot_config returning the raw files
+            deps: function of plot_config returning the upstream products
+                as a list of (name, plot_config)
+            version: version of the code that is not in func itself
+        """
+        self.name = name
+        self.task = task_runner.Task(name, func)
+        self.outputs = outputs
+        self.params = tuple(params)
+        self.raw_inputs = raw_inputs
+        self.deps = deps
+        self.version = version
+        try:
+            source = inspect.getsource(func)
+        except (IOError, OSError, TypeError):
+            source = func.__module__ + '.' + func.__name__
+        self.code_hash = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+class Node(object):
+    """A product for one set of parameters in the dependency graph
+    """
+
+    def __init__(self, product, plot_config, deps, key, manifest):
+        self.product = product
+        self.plot_config = plot_config
+        self.deps = deps
+        self.key = key
+        self.manifest = manifest
+        self.outputs = list(product.outputs(plot_config))
+
+    def __repr__(self):
+        params = ', '.join('%s=%s' % (name, self.plot_config.get(name))
+                           for name in self.product.params)
+        return '%s(%s)' % (self.product.name, params)
+
+
+def file_fingerprint(fname):
+    """Size and modification time of a file, or None when it is missing
+    """
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return [fname, None]
+    return [fname, stat.st_size, int(stat.st_mtime * 1E6)]
+
+
+def build_product(task, plot_config, collect=False):
+    """Build a product in a worker process
+
+    Returns:
+        the stats of the worker when collect is set (see instrument)
+    """
+    print("Building %s" % task.name)
+    if collect:
+        instrument.enable()
+        instrument.reset()
+    task(plot_config, show_plot=False)
+    return instrument.snapshot() if collect else None
+
+
+class Pipeline(object):
+    """Registry of the products and builder of the dependency graph
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.products = {}
+
+    def add_product(self, name, func, outputs, params=('pic_run', 'tframe'),
+                    raw_inputs=None, deps=None, version=0):
+        """Register a product (see Product)
+        """
+        self.products[name] = Product(name, func, outputs, params,
+                                      raw_inputs, deps, version)
+        return self.products[name]
+
+    def node_dir(self, name, key):
+        """Directory of the cached outputs of a node
+        """
+        return os.path.join(self.cache_dir, name, key)
+
+    def resolve(self, name, plot_config, nodes=None):
+        """The node of a product and, recursively, of its upstream products
+
+        Args:
+            name: the product name
+            plot_config: the parameters of the product
+            nodes: nodes already resolved, keyed by (name, parameters)
+        """
+        if nodes is None:
+            nodes = {}
+        product = self.products[name]
+        params = [[key, plot_config.get(key)] for key in product.params]
+        node_id = json.dumps([name, params], sort_keys=True, default=str)
+        if node_id in nodes:
+            return nodes[node_id]
+        deps = []
+        if product.deps is not None:
+            deps = [self.resolve(dep_name, dep_config, nodes)
+                    for dep_name, dep_config in product.deps(plot_config)]
+        raw_inputs = []
+        if product.raw_inputs is not None:
+            raw_inputs = [file_fingerprint(fname)
+                          for fname in product.raw_inputs(plot_config)]
+        manifest = {"product": name,
+                    "params": params,
+                    "version": product.version,
+                    "code": product.code_hash,
+                    "raw_inputs": raw_inputs,
+                    "deps": [[dep.product.name, dep.key] for dep in deps]}
+        key = hashlib.sha1(json.dumps(manifest, sort_keys=True,
+                                      default=str).encode('utf-8'))
+        node = Node(product, plot_config, deps, key.hexdigest(), manifest)
+        nodes[node_id] = node
+        return node
+
+    def cached_files(self, node):
+        """The cached files of the outputs of a node
+        """
+        node_dir = self.node_dir(node.product.name, node.key)
+        return [os.path.join(node_dir, str(i) + '_' + os.path.basename(fname))
+                for i, fname in enumerate(node.outputs)]
+
+    def is_cached(self, node):
+        """Whether the outputs of a node are in the cache
+        """
+        fname = os.path.join(self.node_dir(node.product.name, node.key),
+                             'manifest.json')
+        return (os.path.isfile(fname) and
+                all(os.path.isfile(f) for f in self.cached_files(node)))
+
+    def checkout(self, node):
+        """Link the output files of a node to its cached files
+        """
+        for fname, cached in zip(node.outputs, self.cached_files(node)):
+            fdir = os.path.dirname(fname) or '.'
+            mkdir_p(fdir)
+            target = os.path.relpath(cached, fdir)
+            if os.path.islink(fname) and os.readlink(fname) == target:
+                continue
+            tmp_fname = fname + '.link'
+            if os.path.lexists(tmp_fname):
+                os.remove(tmp_fname)
+            os.symlink(target, tmp_fname)
+            os.rename(tmp_fname, fname)
+
+    def store(self, node):
+        """Move the outputs of a built node into the cache
+        """
+        node_dir = self.node_dir(node.product.name, node.key)
+        mkdir_p(node_dir)
+        for fname, cached in zip(node.outputs, self.cached_files(node)):
+            if not os.path.isfile(fname) or os.path.islink(fname):
+                raise IOError("%s did not write %s" % (node, fname))
+            shutil.move(fname, cached)
+            # read-only, so a writer that does not go through the pipeline
+            # cannot change the cache through the links
+            os.chmod(cached, 0o444)
+        manifest = dict(node.manifest, key=node.key,
+                        outputs=[[fname, cached] for fname, cached in
+                                 zip(node.outputs, self.cached_files(node))],
+                        time=time.strftime('%Y-%m-%d %H:%M:%S'))
+        # the manifest is written last, so a node is only cached when all
+        # its files are in place
+        fname = os.path.join(node_dir, 'manifest.json')
+        with open(fname + '.tmp', 'w') as fh:
+            json.dump(manifest, fh, indent=2, default=str)
+        os.rename(fname + '.tmp', fname)
+        self.checkout(node)
+
+    def prepare(self, node):
+        """Link the outputs of the upstream nodes and remove the links of the
+        outputs before building a node
+
+        The output files of a cached upstream node may still link to the
+        files of other inputs, and the node would read them and be stored
+        under the key of its own inputs. The links of its outputs are
+        removed, otherwise the product would overwrite the cached files of
+        the old inputs through them.
+        """
+        for dep in node.deps:
+            self.checkout(dep)
+        for fname in node.outputs:
+            if os.path.islink(fname):
+                os.remove(fname)
+
+    def plan(self, requests):
+        """The nodes of the requests and the nodes that need to be built
+
+        Args:
+            requests: list of (product name, plot_config)
+
+        Returns:
+            targets: the nodes of the requests
+            missing: the nodes to build, upstream nodes first
+        """
+        nodes = {}
+        targets = [self.resolve(name, plot_config, nodes)
+                   for name, plot_config in requests]
+        missing = []
+        visited = set()
+
+        def visit(node):
+            if id(node) in visited:
+                return
+            visited.add(id(node))
+            for dep in node.deps:
+                visit(dep)
+            cached = self.is_cached(node)
+            instrument.cache_event('products', cached)
+            if not cached:
+                missing.append(node)
+
+        for node in targets:
+            visit(node)
+        return targets, missing
+
+    def build(self, requests, ncores=None):
+        """Build the missing or stale products of the requests
+
+        The nodes are built in parallel as soon as their upstream nodes are
+        ready, and the cached nodes are only linked to their output files.
+
+        Args:
+            requests: list of (product name, plot_config)
+            ncores: number of processes
+
+        Returns:
+            the nodes of the requests
+        """
+        targets, missing = self.plan(requests)
+        print("%d of the products need to be built" % len(missing))
+        if ncores is None:
+            ncores = task_runner.worker_count(0)
+        if ncores <= 1 or len(missing) <= 1:
+            for node in missing:
+                self.prepare(node)
+                build_product(node.product.task, node.plot_config)
+                self.store(node)
+        else:
+            self.build_parallel(missing, ncores)
+        checked = set()
+        for node in targets:
+            self.checkout_all(node, checked)
+        return targets
+
+    def build_parallel(self, missing, ncores):
+        """Build the nodes on a process pool following the dependencies
+        """
+        pending = list(missing)
+        waiting = set(id(node) for node in missing)
+        running = {}
+        with concurrent.futures.ProcessPoolExecutor(ncores) as executor:
+            while pending or running:
+                ready = [node for node in pending
+                         if not any(id(dep) in waiting for dep in node.deps)]
+                for node in ready:
+                    pending.remove(node)
+                    self.prepare(node)
+                    # only the function is sent to the workers
+                    future = executor.submit(build_product, node.product.task,
+                                             node.plot_config,
+                                             instrument.enabled())
+                    running[future] = node
+                if not running:
+                    raise RuntimeError("cyclic dependencies in %s" % pending)
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    stats = future.result()
+                    if stats is not None:
+                        instrument.merge(stats)
+                    self.store(node)
+                    waiting.discard(id(node))
+
+    def checkout_all(self, node, checked):
+        """Link the outputs of a node and its upstream nodes
+        """
+        if id(node) in checked:
+            return
+        checked.add(id(node))
+        for dep in node.deps:
+            self.checkout_all(dep, checked)
+        self.checkout(node)
@@ -5,7 +5,7 @@ Reconnection rate problem
 from __future__ import print_function
 
 import argparse
-import collections
+import functools
 import itertools
 import json
 import math
@@ -24,10 +24,16 @@ from scipy.optimize import curve_fit
 from scipy.ndimage.filters import median_filter, gaussian_filter
 from scipy.special import erf
 
+import ay_contours
+import checkpoint
+import fieldline_tracer
 import fitting_funcs
+import parallel_backend
 import pic_information
+import product_cache
+import vpic_schema
+import xpoints
 from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from pic_information import get_variable_value
 from shell_functions import mkdir_p
@@ -2287,20 +2293,8 @@ def plot_reconnection_rate_2d(plot_config):
     picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
     pic_info = read_data_from_json(picinfo_fname)
     pic_run_dir = pic_info.run_dir
-    ntf = pic_info.ntf
-    phi = np.zeros(ntf)
-    fname = pic_run_dir + 'data/Ay.gda'
-    for tframe in range(ntf):
-        kwargs = {"current_time": tframe,
-                  "xl": 0, "xr": pic_info.lx_di,
-                  "zb": -pic_info.lz_di*0.5, "zt": pic_info.lz_di*0.5}
-        x, z, Ay = read_2d_fields(pic_info, fname, **kwargs)
-        nz, = z.shape
-        # max_ay = np.max(Ay[nz // 2 - 1:nz // 2 + 2, :])
-        # min_ay = np.min(Ay[nz // 2 - 1:nz // 2 + 2, :])
-        max_ay = np.max(Ay[nz // 2, :])
-        min_ay = np.min(Ay[nz // 2, :])
-        phi[tframe] = max_ay - min_ay
+    series = xpoints.get_xline_series(pic_run, pic_run_dir)
+    phi = series["flux"]
     nk = 3
     # phi = signal.medfilt(phi, kernel_size=nk)
     dtwpe = pic_info.dtwpe
@@ -3629,6 +3623,32 @@ def middle_step_rk4(x, z, nx, nz, dx, dz, Bx, Bz):
     return (deltax1, deltaz1, bx, bz)
 
 
+def trace_field_lines(bvec, pic_info, x0, z0, record=True):
+    """Trace many magnetic field lines together
+
+    Args:
+        bvec: magnetic field
+        pic_info: PIC simulation information
+        x0, z0: starting points of field line tracing (in de)
+        record: whether to record the points along the lines
+
+    Returns:
+        fieldline_tracer.FieldLines with z shifted by 0.5 * lz_de
+    """
+    smime = math.sqrt(pic_info.mime)
+    lx_de = pic_info.lx_di * smime
+    lz_de = pic_info.lz_di * smime
+    zmin = -0.5 * lz_de
+    dx_de = pic_info.dx_di * smime
+    dz_de = pic_info.dz_di * smime
+    x0, z0 = np.broadcast_arrays(np.atleast_1d(x0), np.atleast_1d(z0))
+    seeds = np.stack([x0, z0 - zmin], axis=1)
+    return fieldline_tracer.trace_field_lines(
+        (bvec["cbx"], bvec["cbz"]), seeds, (dx_de, dz_de),
+        offsets=((0, 0.5), (0.5, 0)), ubounds=(lx_de, lz_de),
+        record=record)
+
+
 def trace_field_line(bvec, pic_info, x0, z0):
     """Tracer magnetic field line
 
@@ -3637,61 +3657,14 @@ def trace_field_line(bvec, pic_info, x0, z0):
         pic_info: PIC simulation information
         x0, z0: starting point of field line tracing (in de)
     """
-    nz, nx = bvec["cbx"].shape
+    lines = trace_field_lines(bvec, pic_info, x0, z0)
+    xlist = lines.points[:, 0]
+    zlist = lines.points[:, 1]
     smime = math.sqrt(pic_info.mime)
-    lx_de = pic_info.lx_di * smime
-    lz_de = pic_info.lz_di * smime
-    xmin, xmax = 0, lx_de
-    zmin, zmax = -0.5 * lz_de, 0.5 * lz_de
-    xgrid = np.linspace(xmin, xmax, pic_info.nx)
-    zgrid = np.linspace(zmin, zmax, pic_info.nz)
     dx_de = pic_info.dx_di * smime
     dz_de = pic_info.dz_di * smime
-    i = int(x0 / dx_de)
-    k = int((z0 - zmin) / dz_de)
-
-    nstep = 0
-    deltas = math.sqrt(dx_de**2 + dz_de**2) * 0.1
-    hds = deltas * 0.5
-    total_lengh = 0
-    xs = x0
-    zs = z0 - zmin
-    xlist = [xs]
-    zlist = [zs]
-    x, z = xs, zs
-    xcond = x >= xgrid[0] and x <= xgrid[-1]
-    zcond = z >= 0 and z <= zgrid[-1] - zgrid[0]
-    while xcond and zcond and total_lengh < 5 * lx_de:
-        deltax1, deltaz1, _, _ = middle_step_rk4(x, z, nx, nz, dx_de, dz_de,
-                                                 bvec["cbx"], bvec["cbz"])
-        x1 = x + deltax1 * hds
-        z1 = z + deltaz1 * hds
-        deltax2, deltaz2, _, _ = middle_step_rk4(x1, z1, nx, nz, dx_de, dz_de,
-                                                 bvec["cbx"], bvec["cbz"])
-        x2 = x + deltax2 * hds
-        z2 = z + deltaz2 * hds
-        deltax3, deltaz3, _, _ = middle_step_rk4(x2, z2, nx, nz, dx_de, dz_de,
-                                                 bvec["cbx"], bvec["cbz"])
-        x3 = x + deltax3 * deltas
-        z3 = z + deltaz3 * deltas
-        deltax4, deltaz4, bx, bz = middle_step_rk4(x3, z3, nx, nz, dx_de, dz_de,
-                                                   bvec["cbx"], bvec["cbz"])
-        x += deltas/6 * (deltax1 + 2*deltax2 + 2*deltax3 + deltax4)
-        z += deltas/6 * (deltaz1 + 2*deltaz2 + 2*deltaz3 + deltaz4)
-        total_lengh += deltas
-        xlist.append(x)
-        zlist.append(z)
-        nstep += 1
-        length = math.sqrt((x-xs)**2 + (z-zs)**2)
-        if length < dx_de and nstep > 20:
-            break
-        xcond = x >= xgrid[0] and x <= xgrid[-1]
-        zcond = z >= 0 and z <= zgrid[-1] - zgrid[0]
-
-    _, _, bx, bz = middle_step_rk4(xs, zs, nx, nz, dx_de, dz_de,
-                                   bvec["cbx"], bvec["cbz"])
-    xlist = np.asarray(xlist)
-    zlist = np.asarray(zlist)
+    bx = fieldline_tracer.interp_staggered(bvec["cbx"], lines.points[:1],
+                                           (dx_de, dz_de), (0, 0.5))[0]
     return (xlist, zlist, bx)
 
 
@@ -3734,15 +3707,11 @@ def calc_rrate_bflux(plot_config, show_plot=True):
             dset.read_direct(bvec[var])
             bvec[var] = np.squeeze(bvec[var]).T
 
-    z1, z2 = 0, zmax
-    while (z2 - z1) > 0.05 * dz_de:
-        zmid = (z1 + z2) * 0.5
-        # print("Starting z-position: %f" % zmid)
-        xlist, zlist, bx = trace_field_line(bvec, pic_info, 0, zmid)
-        if xlist[-1] > xmax:
-            z2 = zmid
-        else:
-            z1 = zmid
+    def open_top(zseeds):
+        lines = trace_field_lines(bvec, pic_info, 0, zseeds, record=False)
+        return lines.end[:, 0] > xmax
+
+    z1, z2 = fieldline_tracer.bisect_seeds(open_top, 0, zmax, 0.05 * dz_de)
 
     xlist, zlist, _ = trace_field_line(bvec, pic_info, 0, z2)
     # plt.plot(xlist, zlist)
@@ -4341,15 +4310,12 @@ def get_exhaust_boundary(plot_config, show_plot=True):
             bvec[var] = np.squeeze(bvec[var]).T
 
     # Top
-    z1, z2 = 0, zmax
-    while (z2 - z1) > 0.1 * dz_de:
-        zmid = (z1 + z2) * 0.5
-        # print("Starting z-position: %f" % zmid)
-        xlist, zlist, _ = trace_field_line(bvec, pic_info, 0, zmid)
-        if xlist[-1] > xmax:
-            z2 = zmid
-        else:
-            z1 = zmid
+    def open_top(zseeds):
+        lines = trace_field_lines(bvec, pic_info, 0, zseeds, record=False)
+        return lines.end[:, 0] > xmax
+
+    z1, z2 = fieldline_tracer.bisect_seeds(open_top, 0, zmax, 0.1 * dz_de)
+    xlist, zlist, _ = trace_field_line(bvec, pic_info, 0, z1)
     xlist_top, zlist_top, _ = trace_field_line(bvec, pic_info, 0, z2)
     ztop = z2
 
@@ -4368,15 +4334,11 @@ def get_exhaust_boundary(plot_config, show_plot=True):
     xz.tofile(fname)
 
     # Bottom
-    z1, z2 = 0, zmin
-    while (z1 - z2) > 0.1 * dz_de:
-        zmid = (z1 + z2) * 0.5
-        # print("Starting z-position: %f" % zmid)
-        xlist, zlist, _ = trace_field_line(bvec, pic_info, xmax, zmid)
-        if xlist[-1] < xmin:
-            z2 = zmid
-        else:
-            z1 = zmid
+    def open_bottom(zseeds):
+        lines = trace_field_lines(bvec, pic_info, xmax, zseeds, record=False)
+        return lines.end[:, 0] < xmin
+
+    z1, z2 = fieldline_tracer.bisect_seeds(open_bottom, 0, zmin, 0.1 * dz_de)
     xlist_bot, zlist_bot, _ = trace_field_line(bvec, pic_info, xmax, z2)
     zbot = z2
 
@@ -6973,20 +6935,13 @@ def plot_density_fieldline(plot_config, show_plot=True):
     axs[0].plot(xlist_top, zlist_top)
     axs[0].plot(xlist_bot, zlist_bot)
 
-    xmin_di = xmin / smime
-    xmax_di = xmax / smime
-    zmin_di = zmin / smime
-    zmax_di = zmax / smime
-    kwargs = {"current_time": tframe,
-              "xl": xmin_di, "xr": xmax_di,
-              "zb": zmin_di, "zt": zmax_di}
-    fname = pic_run_dir + "data/Ay.gda"
-    x, z, Ay = read_2d_fields(pic_info, fname, **kwargs)
-    xde = x * smime
-    zde = z * smime
+    # the contour lines of Ay from the contour index of the frame, in de
+    index = ay_contours.load_contour_index(pic_run, tframe)
+    lines = [(xl * smime, zl * smime) for xl, zl in index.contours(364)]
     texts = [r"$n_i$", "Along field line"]
 
-    cs = axs[0].contour(xde, zde, Ay, colors='w', linewidths=0.5, levels=[364])
+    for xl, zl in lines:
+        axs[0].plot(xl, zl, color='w', linewidth=0.5)
     axs[0].text(0.02, 0.85, r"$n_i$", color='k', fontsize=16,
                 bbox=dict(facecolor='none', alpha=1.0, edgecolor='none', pad=10.0),
                 horizontalalignment='left', verticalalignment='center',
@@ -6996,17 +6951,13 @@ def plot_density_fieldline(plot_config, show_plot=True):
     axs[0].set_xlim([xmin, xmax])
     axs[0].set_ylim([zmin, zmax])
 
-    xdata = []
-    zdata = []
-    for cl in cs.collections:
-        sz = len(cl.get_paths())
-        for p in cl.get_paths():
-            v = p.vertices
-            xdata.append(v[:, 0])
-            zdata.append(v[:, 1])
-    cond = np.logical_and(xdata[0] > xmin, xdata[0] < xmax)
-    x = xdata[0][cond] - xmin
-    z = zdata[0][cond] - zmin
+    # the line with the most points in the plotted region
+    inside = [(xl > xmin) & (xl < xmax) & (zl >= zmin) & (zl < zmax)
+              for xl, zl in lines]
+    iline = int(np.argmax([np.sum(cond) for cond in inside]))
+    cond = inside[iline]
+    x = lines[iline][0][cond] - xmin
+    z = lines[iline][1][cond] - zmin
     x1 = np.floor(x / dx_de).astype(np.int)
     z1 = np.floor(z / dz_de).astype(np.int)
     x2 = x1 + 1
@@ -10684,16 +10635,8 @@ def read_boilerplate(fh):
     Args:
         fh: file handler
     """
-    offset = 0
-    sizearr = np.memmap(fh, dtype='int8', mode='r', offset=offset, shape=(5), order='F')
-    offset += 5
-    cafevar = np.memmap(fh, dtype='int16', mode='r', offset=offset, shape=(1), order='F')
-    offset += 2
-    deadbeefvar = np.memmap(fh, dtype='int32', mode='r', offset=offset, shape=(1), order='F')
-    offset += 4
-    realone = np.memmap(fh, dtype='float32', mode='r', offset=offset, shape=(1), order='F')
-    offset += 4
-    doubleone = np.memmap(fh, dtype='float64', mode='r', offset=offset, shape=(1), order='F')
+    vpic_schema.check_boilerplate(
+        np.memmap(fh, dtype=vpic_schema.BOILERPLATE, mode='r', shape=(1))[0])
 
 
 def read_particle_header(fh):
@@ -10702,32 +10645,7 @@ def read_particle_header(fh):
     Args:
         fh: file handler.
     """
-    offset = 23  # the size of the boilerplate is 23
-    tmp1 = np.memmap(fh, dtype='int32', mode='r', offset=offset, shape=(6), order='F')
-    offset += 6 * 4
-    tmp2 = np.memmap(fh, dtype='float32', mode='r', offset=offset, shape=(10), order='F')
-    offset += 10 * 4
-    tmp3 = np.memmap(fh, dtype='int32', mode='r', offset=offset, shape=(4), order='F')
-    v0header = collections.namedtuple("v0header",
-                                      ["version", "type", "nt",
-                                       "nx", "ny", "nz", "dt",
-                                       "dx", "dy", "dz",
-                                       "x0", "y0", "z0",
-                                       "cvac", "eps0", "damp",
-                                       "rank", "ndom", "spid", "spqm"])
-    v0 = v0header(version=tmp1[0], type=tmp1[1], nt=tmp1[2],
-                  nx=tmp1[3], ny=tmp1[4], nz=tmp1[5], dt=tmp2[0],
-                  dx=tmp2[1], dy=tmp2[2], dz=tmp2[3],
-                  x0=tmp2[4], y0=tmp2[5], z0=tmp2[6],
-                  cvac=tmp2[7], eps0=tmp2[8], damp=tmp2[9],
-                  rank=tmp3[0], ndom=tmp3[1], spid=tmp3[2], spqm=tmp3[3])
-    header_particle = collections.namedtuple("header_particle",
-                                             ["size", "ndim", "dim"])
-    offset += 4 * 4
-    tmp4 = np.memmap(fh, dtype='int32', mode='r', offset=offset, shape=(3), order='F')
-    pheader = header_particle(size=tmp4[0], ndim=tmp4[1], dim=tmp4[2])
-    offset += 3 * 4
-    return (v0, pheader, offset)
+    return vpic_schema.read_particle_header(fh)
 
 
 def read_particle_data(fname):
@@ -10736,16 +10654,7 @@ def read_particle_data(fname):
     Args:
         fname: file name.
     """
-    fh = open(fname, 'r')
-    read_boilerplate(fh)
-    v0, pheader, offset = read_particle_header(fh)
-    nptl = pheader.dim
-    particle_type = np.dtype([('dxyz', np.float32, 3), ('icell', np.int32),
-                              ('u', np.float32, 3), ('q', np.float32)])
-    fh.seek(offset, os.SEEK_SET)
-    data = np.fromfile(fh, dtype=particle_type, count=nptl)
-    fh.close()
-    return (v0, pheader, data)
+    return vpic_schema.read_particle_data(fname)
 
 
 def calc_velocity_distribution(v0, pheader, ptl, pic_info, corners,
@@ -11085,6 +10994,61 @@ def plot_bx_inflow(plot_config, show_plot=True):
         plt.close()
 
 
+def frame_raw_files(plot_config, hydro=False):
+    """The raw files of one frame read by the derived products
+    """
+    pic_run = plot_config["pic_run"]
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    tindex = pic_info.fields_interval * plot_config["tframe"]
+    fnames = [picinfo_fname,
+              (pic_info.run_dir + "field_hdf5/T." + str(tindex) +
+               "/fields_" + str(tindex) + ".h5")]
+    if hydro:
+        for sname in ["electron", "ion"]:
+            fnames.append(pic_info.run_dir + "hydro_hdf5/T." + str(tindex) +
+                          "/hydro_" + sname + "_" + str(tindex) + ".h5")
+    return fnames
+
+
+def exhaust_boundary_fnames(plot_config):
+    """The exhaust boundaries written by get_exhaust_boundary
+
+    The magnetic flux files it writes are also written by calc_rrate_bflux,
+    so they are not cached.
+    """
+    pic_run = plot_config["pic_run"]
+    tframe = str(plot_config["tframe"])
+    fdir = '../data/rate_problem/exhaust_boundary/' + pic_run + '/'
+    return [fdir + 'xz_top_' + tframe + '.dat',
+            fdir + 'xz_bot_' + tframe + '.dat']
+
+
+def bxm_fnames(plot_config):
+    """The files written by calc_bxm
+    """
+    pic_run = plot_config["pic_run"]
+    tframe = str(plot_config["tframe"])
+    return ['../data/rate_problem/bxm_edr/' + pic_run + '/bxm_' + tframe + '.dat',
+            '../data/rate_problem/bxm/' + pic_run + '/bxm_' + tframe + '.dat']
+
+
+PIPELINE = product_cache.Pipeline()
+PIPELINE.add_product('exhaust_boundary', get_exhaust_boundary,
+                     outputs=exhaust_boundary_fnames,
+                     raw_inputs=frame_raw_files)
+PIPELINE.add_product('bxm', calc_bxm, outputs=bxm_fnames,
+                     raw_inputs=lambda pc: frame_raw_files(pc, hydro=True),
+                     deps=lambda pc: [('exhaust_boundary', pc)])
+
+
+def build_products(name, plot_config, tframes, ncores=None):
+    """Build the missing or stale products of a few frames
+    """
+    requests = [(name, dict(plot_config, tframe=tframe)) for tframe in tframes]
+    PIPELINE.build(requests, ncores)
+
+
 def get_cmd_args():
     """Get command line arguments
     """
@@ -11245,6 +11209,10 @@ def get_cmd_args():
                         help='Compare Bx in the inflow region')
     parser.add_argument('--bx_edr', action="store_true", default=False,
                         help='Plot Bx upstream of the electron diffusion region')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes to build the products')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
     return parser.parse_args()
 
 
@@ -11294,15 +11262,13 @@ def analysis_single_frames(plot_config, args):
             plot_rrate_bflux(plot_config, args.show_plot)
     elif args.open_angle:
         open_angle(plot_config, args.show_plot)
-    elif args.exhaust_boundary:
-        get_exhaust_boundary(plot_config, args.show_plot)
     elif args.inflow_pressure:
         inflow_pressure(plot_config, args.show_plot)
-    elif args.calc_bxm:
-        calc_bxm(plot_config, args.show_plot)
     elif args.calc_bxm_fix:
         calc_bxm_fix(plot_config, args.show_plot)
     elif args.plot_bxm:
+        tframes = range(args.tstart, args.tend + 1)
+        build_products('bxm', plot_config, tframes, args.ncores)
         plot_bxm(plot_config, args.show_plot)
     elif args.plot_bxm_beta:
         plot_bxm_beta(plot_config, args.show_plot)
@@ -11409,10 +11375,6 @@ def process_input(plot_config, args, tframe):
     plot_config["tframe"] = tframe
     if args.rrate_bflux:
         calc_rrate_bflux(plot_config, show_plot=False)
-    elif args.exhaust_boundary:
-        get_exhaust_boundary(plot_config, show_plot=False)
-    elif args.calc_bxm:
-        calc_bxm(plot_config, show_plot=False)
     elif args.calc_bxm_fix:
         calc_bxm_fix(plot_config, show_plot=False)
     elif args.calc_angle:
@@ -11426,82 +11388,86 @@ def analysis_multi_frames(plot_config, args):
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
     nframes = len(tframes)
+    ckpt = checkpoint.for_frames('rate_problem', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.plot_absj:
-                plot_absj(plot_config, show_plot=False)
-            if args.plot_jy:
-                plot_jy(plot_config, show_plot=False)
-            elif args.plot_bfield:
-                plot_bfield(plot_config, show_plot=False)
-            elif args.plot_ptensor:
-                plot_pressure_tensor(plot_config, show_plot=False)
-            elif args.plot_vout:
-                plot_vout(plot_config, show_plot=False)
-            elif args.plot_density:
-                if args.open_boundary:
-                    plot_density(plot_config, args.show_plot)
-                else:
-                    plot_density_cut(plot_config, args.show_plot)
-            elif args.inflow_balance:
-                inflow_balance(plot_config, show_plot=False)
-            elif args.outflow_balance:
-                outflow_balance(plot_config, show_plot=False)
-            elif args.plot_bfield:
-                plot_bfield(plot_config, show_plot=False)
-            elif args.plot_efield:
-                plot_efield(plot_config, show_plot=False)
-            elif args.inflow_pressure:
-                inflow_pressure(plot_config, show_plot=False)
-            elif args.open_angle:
-                open_angle(plot_config, show_plot=False)
-            elif args.calc_bxm:
-                calc_bxm(plot_config, show_plot=False)
-            elif args.plot_bz_xcut:
-                plot_bz_xcut_beta(plot_config, show_plot=False)
-            elif args.plot_bx_zcut:
-                plot_bx_zcut_beta(plot_config, show_plot=False)
-            elif args.plot_p_xcut:
-                plot_pres_xcut_beta(plot_config, show_plot=False)
-            elif args.plot_n_xcut:
-                plot_density_xcut_beta(plot_config, show_plot=False)
-            elif args.plot_pres:
-                plot_pres(plot_config, show_plot=False)
-            elif args.firehose:
-                firehose_parameter(plot_config, show_plot=False)
-            elif args.firehose_zcut:
-                firehose_parameter_zcut(plot_config, show_plot=False)
-            elif args.gradx_p:
-                gradx_pressure(plot_config, show_plot=False)
-            elif args.jxb_x:
-                plot_jxb_x(plot_config, show_plot=False)
-            elif args.rhox:
-                plot_density_xline(plot_config, show_plot=False)
-            elif args.plot_va:
-                plot_alfven_speed(plot_config, show_plot=False)
-            elif args.pres_avg:
-                plot_pres_avg(plot_config, show_plot=False)
-            elif args.fluid_ene_2d:
-                fluid_energization_2d(plot_config, show_plot=False)
-            elif args.comp_ene:
-                compression_energization(plot_config, show_plot=False)
-            elif args.pres_in_cut:
-                plot_pres_inflow_cut(plot_config, show_plot=False)
-            elif args.outflow_heating:
-                outflow_heating_fermi(plot_config, show_plot=False)
-            elif args.pxyz:
-                pxyz_zcut(plot_config, show_plot=False)
-            elif args.bx_inflow:
-                plot_bx_inflow(plot_config, show_plot=False)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                if args.plot_absj:
+                    plot_absj(plot_config, show_plot=False)
+                if args.plot_jy:
+                    plot_jy(plot_config, show_plot=False)
+                elif args.plot_bfield:
+                    plot_bfield(plot_config, show_plot=False)
+                elif args.plot_ptensor:
+                    plot_pressure_tensor(plot_config, show_plot=False)
+                elif args.plot_vout:
+                    plot_vout(plot_config, show_plot=False)
+                elif args.plot_density:
+                    if args.open_boundary:
+                        plot_density(plot_config, args.show_plot)
+                    else:
+                        plot_density_cut(plot_config, args.show_plot)
+                elif args.inflow_balance:
+                    inflow_balance(plot_config, show_plot=False)
+                elif args.outflow_balance:
+                    outflow_balance(plot_config, show_plot=False)
+                elif args.plot_bfield:
+                    plot_bfield(plot_config, show_plot=False)
+                elif args.plot_efield:
+                    plot_efield(plot_config, show_plot=False)
+                elif args.inflow_pressure:
+                    inflow_pressure(plot_config, show_plot=False)
+                elif args.open_angle:
+                    open_angle(plot_config, show_plot=False)
+                elif args.plot_bz_xcut:
+                    plot_bz_xcut_beta(plot_config, show_plot=False)
+                elif args.plot_bx_zcut:
+                    plot_bx_zcut_beta(plot_config, show_plot=False)
+                elif args.plot_p_xcut:
+                    plot_pres_xcut_beta(plot_config, show_plot=False)
+                elif args.plot_n_xcut:
+                    plot_density_xcut_beta(plot_config, show_plot=False)
+                elif args.plot_pres:
+                    plot_pres(plot_config, show_plot=False)
+                elif args.firehose:
+                    firehose_parameter(plot_config, show_plot=False)
+                elif args.firehose_zcut:
+                    firehose_parameter_zcut(plot_config, show_plot=False)
+                elif args.gradx_p:
+                    gradx_pressure(plot_config, show_plot=False)
+                elif args.jxb_x:
+                    plot_jxb_x(plot_config, show_plot=False)
+                elif args.rhox:
+                    plot_density_xline(plot_config, show_plot=False)
+                elif args.plot_va:
+                    plot_alfven_speed(plot_config, show_plot=False)
+                elif args.pres_avg:
+                    plot_pres_avg(plot_config, show_plot=False)
+                elif args.fluid_ene_2d:
+                    fluid_energization_2d(plot_config, show_plot=False)
+                elif args.comp_ene:
+                    compression_energization(plot_config, show_plot=False)
+                elif args.pres_in_cut:
+                    plot_pres_inflow_cut(plot_config, show_plot=False)
+                elif args.outflow_heating:
+                    outflow_heating_fermi(plot_config, show_plot=False)
+                elif args.pxyz:
+                    pxyz_zcut(plot_config, show_plot=False)
+                elif args.bx_inflow:
+                    plot_bx_inflow(plot_config, show_plot=False)
+                ckpt.record(tframe)
     else:
         ncores = multiprocessing.cpu_count()
         ncores = 4
         if ncores > nframes:
             ncores = nframes
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
@@ -11516,6 +11482,14 @@ def main():
     plot_config["species"] = args.species
     plot_config["open_boundary"] = args.open_boundary
     if args.multi_frames:
+        tframes = range(args.tstart, args.tend + 1)
+    else:
+        tframes = [args.tframe]
+    if args.exhaust_boundary:
+        build_products('exhaust_boundary', plot_config, tframes, args.ncores)
+    elif args.calc_bxm:
+        build_products('bxm', plot_config, tframes, args.ncores)
+    elif args.multi_frames:
         analysis_multi_frames(plot_config, args)
     else:
         analysis_single_frames(plot_config, args)
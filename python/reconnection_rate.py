@@ -11,7 +11,9 @@ import palettable
 from scipy import signal
 
 import pic_information
-from contour_plots import plot_2d_contour, read_2d_fields
+import rrate_service
+import xpoints
+from contour_plots import plot_2d_contour
 
 mpl.rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
 mpl.rc('text', usetex=True)
@@ -30,18 +32,9 @@ def calc_reconnection_rate(base_dir):
         base_dir: the directory base.
     """
     pic_info = pic_information.get_pic_info(base_dir)
-    ntf = pic_info.ntf
-    phi = np.zeros(ntf)
-    fname = base_dir + 'data/Ay.gda'
-    for ct in range(ntf):
-        kwargs = {"current_time": ct, "xl": 0, "xr": 200, "zb": -1, "zt": 1}
-        x, z, Ay = read_2d_fields(pic_info, fname, **kwargs)
-        nz, = z.shape
-        # max_ay = np.max(np.sum(Ay[nz/2-1:nz/2+1, :], axis=0)/2)
-        # min_ay = np.min(np.sum(Ay[nz/2-1:nz/2+1, :], axis=0)/2)
-        max_ay = np.max(Ay[nz / 2 - 1:nz / 2 + 1, :])
-        min_ay = np.min(Ay[nz / 2 - 1:nz / 2 + 1, :])
-        phi[ct] = max_ay - min_ay
+    # one vectorized pass over blocks of frames of the band |z| < 1 di
+    series = xpoints.calc_xline_series(pic_info, base_dir, zwidth=1.0)
+    phi = series[:, xpoints.XLINE_COLUMNS.index("flux")]
     nk = 3
     phi = signal.medfilt(phi, kernel_size=nk)
     dtwpe = pic_info.dtwpe
@@ -96,59 +89,36 @@ def plot_reconnection_rate(base_dir):
 def calc_multi_reconnection_rate():
     """Calculate reconnection rate for multiple runs
     """
-    base_dir = '/net/scratch2/xiaocanli/mime25-sigma01-beta02-200-100/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta02.dat')
-
-    base_dir = '/net/scratch2/xiaocanli/mime25-sigma033-beta006-200-100/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta007.dat')
-
-    base_dir = '/scratch3/xiaocanli/sigma1-mime25-beta001/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta002.dat')
-
-    base_dir = '/scratch3/xiaocanli/sigma1-mime25-beta0003-npc200/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta0007.dat')
-
-    base_dir = '/scratch3/xiaocanli/sigma1-mime100-beta001-mustang/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime100_beta002.dat')
-
-    base_dir = '/scratch3/xiaocanli/mime25-guide0-beta001-200-100/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta002_sigma01.dat')
-
-    base_dir = '/scratch3/xiaocanli/mime25-guide0-beta001-200-100-sigma033/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta002_sigma033.dat')
-
-    base_dir = '/net/scratch2/xiaocanli/mime25-sigma1-beta002-200-100-noperturb/'
-    t, rate = calc_reconnection_rate(base_dir)
-    save_reconnection_rate(t, rate, 'rate_mime25_beta002_noperturb.dat')
+    runs = [('mime25_beta02',
+             '/net/scratch2/xiaocanli/mime25-sigma01-beta02-200-100/'),
+            ('mime25_beta007',
+             '/net/scratch2/xiaocanli/mime25-sigma033-beta006-200-100/'),
+            ('mime25_beta002', '/scratch3/xiaocanli/sigma1-mime25-beta001/'),
+            ('mime25_beta0007',
+             '/scratch3/xiaocanli/sigma1-mime25-beta0003-npc200/'),
+            ('mime100_beta002',
+             '/scratch3/xiaocanli/sigma1-mime100-beta001-mustang/'),
+            ('mime25_beta002_sigma01',
+             '/scratch3/xiaocanli/mime25-guide0-beta001-200-100/'),
+            ('mime25_beta002_sigma033',
+             '/scratch3/xiaocanli/mime25-guide0-beta001-200-100-sigma033/'),
+            ('mime25_beta002_noperturb',
+             '/net/scratch2/xiaocanli/mime25-sigma1-beta002-200-100-noperturb/')]
+    rrate_service.update_rrate(runs)
 
 
 def plot_multi_reconnection_rate():
     """Calculate reconnection rate for multiple runs
     """
-    path = '../data/rate/'
-    fname = path + 'rate_mime25_beta002.dat'
-    tf1, rate1 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta002_sigma033.dat'
-    tf2, rate2 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta002_sigma01.dat'
-    tf3, rate3 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta002_noperturb.dat'
-    tf4, rate4 = np.genfromtxt(fname)
-    fname = path + 'rate_mime100_beta002.dat'
-    tf5, rate5 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta0007.dat'
-    tf6, rate6 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta007.dat'
-    tf7, rate7 = np.genfromtxt(fname)
-    fname = path + 'rate_mime25_beta02.dat'
-    tf8, rate8 = np.genfromtxt(fname)
+    rates = rrate_service.read_rrate_table()
+    run_names = ['mime25_beta002', 'mime25_beta002_sigma033',
+                 'mime25_beta002_sigma01', 'mime25_beta002_noperturb',
+                 'mime100_beta002', 'mime25_beta0007', 'mime25_beta007',
+                 'mime25_beta02']
+    ((tf1, rate1), (tf2, rate2), (tf3, rate3), (tf4, rate4),
+     (tf5, rate5), (tf6, rate6), (tf7, rate7), (tf8, rate8)) = \
+            [(rates[run_name]["t"], rates[run_name]["rate"])
+             for run_name in run_names]
 
     if not os.path.isdir('../img/'):
         os.makedirs('../img/')
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Reduce 2D fields to the pixel grid of the output before imshow
+
+The fields are often much larger than the number of pixels of the axes in
+the saved figures, so most of the data is thrown away by the image
+interpolation after it is sent to the renderer. The fields are reduced here
+to about the pixel grid of the axes instead. Each pixel is the mean of a
+block of cells ('mean'), or the extreme of the block that is further from
+the block mean ('minmax'), which keeps thin current sheets and other sharp
+structures visible.
+
+    data = decimate_for_axes(fdata, ax, dpi=200, method='minmax')
+    ax.imshow(data, extent=[xmin, xmax, zmin, zmax], ...)
+"""
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+from lazy_import import lazy_module
+
+mpl = lazy_module('matplotlib')
+
+DECIMATION_METHODS = ('mean', 'minmax')
+
+
+def axes_pixels(ax, dpi=None):
+    """Number of pixels (rows, columns) of the axes in the saved figure
+
+    Args:
+        ax: axes object
+        dpi: dpi of the saved figure. The default is the larger of the
+            figure dpi and savefig.dpi.
+    """
+    fig = ax.get_figure()
+    if dpi is None:
+        dpi = fig.dpi
+        savefig_dpi = mpl.rcParams['savefig.dpi']
+        if savefig_dpi != 'figure':
+            dpi = max(dpi, float(savefig_dpi))
+    bbox = ax.get_position()
+    width, height = fig.get_size_inches()
+    ncol = int(math.ceil(bbox.width * width * dpi))
+    nrow = int(math.ceil(bbox.height * height * dpi))
+    return max(nrow, 1), max(ncol, 1)
+
+
+def block_edges(ncells, nblocks):
+    """Starting indices of nblocks nearly equal blocks of ncells cells
+    """
+    return np.linspace(0, ncells, nblocks + 1).astype(int)[:-1]
+
+
+def decimate(data, shape, method='mean'):
+    """Reduce a 2D array to at most shape by blocks
+
+    The array is split into nearly equal blocks, so its extent is unchanged.
+    A dimension that is already smaller than the target is not reduced.
+
+    Args:
+        data: 2D array
+        shape: the target shape (rows, columns)
+        method: 'mean' for the block mean, or 'minmax' for the block minimum
+            or maximum, whichever is further from the block mean
+
+    Returns:
+        the reduced array, or data itself when it is not larger than shape
+    """
+    if method not in DECIMATION_METHODS:
+        raise ValueError("unknown decimation method: " + str(method))
+    data = np.asarray(data)
+    nrow = min(shape[0], data.shape[0])
+    ncol = min(shape[1], data.shape[1])
+    if (nrow, ncol) == data.shape:
+        return data
+    irow = block_edges(data.shape[0], nrow)
+    icol = block_edges(data.shape[1], ncol)
+    # the reductions are separable, so the blocks are reduced along one
+    # axis after the other
+    counts = np.outer(np.diff(np.append(irow, data.shape[0])),
+                      np.diff(np.append(icol, data.shape[1])))
+    dsum = np.add.reduceat(data, irow, axis=0, dtype=np.float64)
+    dsum = np.add.reduceat(dsum, icol, axis=1)
+    dmean = dsum / counts
+    if method == 'mean':
+        return dmean.astype(data.dtype, copy=False)
+    dmax = np.maximum.reduceat(np.maximum.reduceat(data, irow, axis=0),
+                               icol, axis=1)
+    dmin = np.minimum.reduceat(np.minimum.reduceat(data, irow, axis=0),
+                               icol, axis=1)
+    return np.where(dmax - dmean >= dmean - dmin, dmax, dmin)
+
+
+def decimate_for_axes(data, ax, dpi=None, method='mean', oversample=1):
+    """Reduce a 2D field to the pixel grid of the axes
+
+    Args:
+        data: 2D field data with shape (nz, nx)
+        ax: axes object, which should be placed in the figure already
+        dpi: dpi of the saved figure (see axes_pixels)
+        method: see decimate
+        oversample: number of data points per pixel to keep
+    """
+    nrow, ncol = axes_pixels(ax, dpi)
+    return decimate(data, (nrow * oversample, ncol * oversample), method)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Reconnection rate of many runs with incremental updates
+
+The reconnected flux of each frame is the flux at the dominant X-point
+found by xpoints in the rows around the midplane, the same definition as in
+reconnection_rate.calc_reconnection_rate. Only these rows are read from
+data/Ay.gda. The flux of each run is cached, and only the frames that are
+not in the cache are processed when the curves are regenerated. The frames of all runs are
+split into jobs that run in parallel. The reconnection rates of all runs are
+saved into one table, where the runs of an update replace their old rows and
+the other runs are kept. The cached flux depends on the number of rows, and
+the table on the number of rows and the median filter size, so both are in
+the file names.
+
+    python rrate_service.py --runs_group ApJ_long_paper_runs
+    rates = read_rrate_table()
+    tfields, rate = rates["mime25_beta002"]["t"], rates["mime25_beta002"]["rate"]
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+import pic_information
+import runs_name_path
+import xpoints
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+joblib = lazy_module('joblib')
+signal = lazy_module('scipy.signal')
+
+RATE_DIR = '../data/rate/'
+# the rows around the midplane, enough to locate the X-points in the smoothed
+# Ay
+NROWS = 16
+
+
+def get_run_pic_info(run_name, run_dir):
+    """PIC information from the saved json file or from the run directory
+    """
+    picinfo_fname = '../data/pic_info/pic_info_' + run_name + '.json'
+    if os.path.isfile(picinfo_fname):
+        return read_data_from_json(picinfo_fname)
+    return pic_information.get_pic_info(run_dir, run_name)
+
+
+def count_frames(run_dir, nx, nz):
+    """Number of frames that have been written to data/Ay.gda
+    """
+    fname = run_dir + 'data/Ay.gda'
+    if not os.path.isfile(fname):
+        return 0
+    return os.path.getsize(fname) // (nx * nz * 4)
+
+
+def midplane_flux(run_dir, nx, nz, tframes, nrows=NROWS):
+    """Reconnected flux at the dominant X-point of frames using only the rows
+    around the midplane
+
+    Args:
+        run_dir: the run root directory
+        nx, nz: the grid dimensions
+        tframes: the time frames
+        nrows: number of rows around the midplane
+    """
+    iz0 = nz // 2 - nrows // 2
+    ay = np.zeros((len(tframes), nrows, nx), dtype=np.float32)
+    with open(run_dir + 'data/Ay.gda', 'rb') as fh:
+        for iframe, tframe in enumerate(tframes):
+            fh.seek((tframe * nz + iz0) * nx * 4)
+            ay[iframe] = np.fromfile(fh, dtype=np.float32,
+                                     count=nrows * nx).reshape(nrows, nx)
+    # the flux does not depend on the grid sizes, so the grid is in cells
+    series = xpoints.xline_series(ay, np.arange(nx), np.arange(nrows),
+                                  tframes)
+    return series[:, xpoints.XLINE_COLUMNS.index("flux")]
+
+
+def flux_cache_fname(run_name, nrows=NROWS):
+    """File name of the cached flux of one run
+    """
+    return (RATE_DIR + 'flux_xline_' + run_name + '_nrows' + str(nrows) +
+            '.dat')
+
+
+def table_fname(nrows=NROWS, kernel_size=3):
+    """File name of the table of the reconnection rates
+    """
+    return (RATE_DIR + 'rrate_xline_table_nrows' + str(nrows) + '_kernel' +
+            str(kernel_size) + '.dat')
+
+
+def read_flux_cache(run_name, nrows=NROWS):
+    """Cached flux of one run as (tframes, flux)
+    """
+    fname = flux_cache_fname(run_name, nrows)
+    if not os.path.isfile(fname):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    fdata = np.atleast_2d(np.loadtxt(fname))
+    return fdata[:, 0].astype(np.int64), fdata[:, 1]
+
+
+def calc_rrate(pic_info, flux, kernel_size=3):
+    """Normalized reconnection rate from the reconnected flux
+
+    Args:
+        pic_info: namedtuple for the PIC simulation information
+        flux: reconnected flux of all frames
+        kernel_size: the median filter size. No filter when it is 1.
+    """
+    if kernel_size > 1:
+        flux = signal.medfilt(flux, kernel_size=kernel_size)
+    dtwpe = pic_info.dtwpe
+    dtwce = pic_info.dtwce
+    dtf_wpe = pic_info.dt_fields * dtwpe / pic_info.dtwci
+    rate = np.gradient(flux) / dtf_wpe
+    va = dtwce * math.sqrt(1.0 / pic_info.mime) / dtwpe
+    rate /= pic_info.b0 * va
+    rate[-1] = rate[-2]
+    return rate
+
+
+def update_rrate(runs, ncores=None, nrows=NROWS, kernel_size=3,
+                 frames_per_job=32, recompute=False, fname=None):
+    """Update the reconnection rates of many runs
+
+    Args:
+        runs: a list of (run name, run directory)
+        ncores: number of processes
+        nrows: number of rows around the midplane
+        kernel_size: the median filter size
+        frames_per_job: number of frames in one job
+        recompute: whether to ignore the cached flux
+        fname: the file name of the consolidated table. The default is
+            table_fname(nrows, kernel_size).
+    """
+    pic_infos = {}
+    cached = {}
+    jobs = []
+    for run_name, run_dir in runs:
+        pic_info = get_run_pic_info(run_name, run_dir)
+        pic_infos[run_name] = pic_info
+        if recompute:
+            cached[run_name] = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        else:
+            cached[run_name] = read_flux_cache(run_name, nrows)
+        nframes = count_frames(run_dir, pic_info.nx, pic_info.nz)
+        tframes = np.arange(len(cached[run_name][0]), nframes)
+        print("%s: %d new frames" % (run_name, len(tframes)))
+        for i in range(0, len(tframes), frames_per_job):
+            jobs.append((run_name, run_dir, pic_info.nx, pic_info.nz,
+                         tframes[i:i + frames_per_job]))
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    results = joblib.Parallel(n_jobs=ncores)(
+        joblib.delayed(midplane_flux)(run_dir, nx, nz, tframes, nrows)
+        for _, run_dir, nx, nz, tframes in jobs)
+
+    if fname is None:
+        fname = table_fname(nrows, kernel_size)
+    table = read_rrate_table(fname) if os.path.isfile(fname) else {}
+    mkdir_p(RATE_DIR)
+    for run_name, _ in runs:
+        tframes, flux = cached[run_name]
+        new_frames = [job[4] for job in jobs if job[0] == run_name]
+        new_flux = [result for job, result in zip(jobs, results)
+                    if job[0] == run_name]
+        tframes = np.concatenate([tframes] + new_frames)
+        flux = np.concatenate([flux] + new_flux)
+        np.savetxt(flux_cache_fname(run_name, nrows),
+                   np.stack([tframes, flux], axis=1), fmt='%d %.10e')
+        table.pop(run_name, None)
+        if len(flux) < 2:
+            continue
+        pic_info = pic_infos[run_name]
+        table[run_name] = {"tframe": tframes,
+                           "t": tframes * pic_info.dt_fields,
+                           "flux": flux,
+                           "rate": calc_rrate(pic_info, flux, kernel_size)}
+    with open(fname + '.tmp', 'w') as fh:
+        fh.write("# run tframe t flux rate\n")
+        for run_name, rates in table.items():
+            for row in zip(rates["tframe"], rates["t"], rates["flux"],
+                           rates["rate"]):
+                fh.write("%s %d %.6e %.10e %.10e\n" % ((run_name, ) + row))
+    os.rename(fname + '.tmp', fname)
+
+
+def read_rrate_table(fname=None, nrows=NROWS, kernel_size=3):
+    """Read the consolidated reconnection rate table
+
+    Args:
+        fname: the file name of the table. The default is
+            table_fname(nrows, kernel_size).
+        nrows: number of rows around the midplane
+        kernel_size: the median filter size
+
+    Returns:
+        a dictionary {run name: {"tframe", "t", "flux", "rate"}}
+    """
+    if fname is None:
+        fname = table_fname(nrows, kernel_size)
+    rows = collections.OrderedDict()
+    with open(fname, 'r') as fh:
+        for line in fh:
+            if line.startswith('#'):
+                continue
+            items = line.split()
+            rows.setdefault(items[0], []).append([float(v) for v in items[1:]])
+    rates = collections.OrderedDict()
+    for run_name, fdata in rows.items():
+        fdata = np.asarray(fdata)
+        rates[run_name] = {"tframe": fdata[:, 0].astype(np.int64),
+                           "t": fdata[:, 1],
+                           "flux": fdata[:, 2],
+                           "rate": fdata[:, 3]}
+    return rates
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Reconnection rate of runs')
+    parser.add_argument('--runs', action="store", default=None,
+                        help='comma-separated runs as run_name:run_dir')
+    parser.add_argument('--runs_group', action="store",
+                        default='ApJ_long_paper_runs',
+                        help='function in runs_name_path giving the runs')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    parser.add_argument('--nrows', action="store", default=NROWS, type=int,
+                        help='number of rows around the midplane')
+    parser.add_argument('--kernel_size', action="store", default='3',
+                        type=int, help='median filter size')
+    parser.add_argument('--recompute', action="store_true", default=False,
+                        help='whether to ignore the cached flux')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    if args.runs:
+        runs = [tuple(run.split(':', 1)) for run in args.runs.split(',')]
+    else:
+        base_dirs, run_names = getattr(runs_name_path, args.runs_group)()
+        runs = list(zip(run_names, base_dirs))
+    update_rrate(runs, args.ncores, args.nrows, args.kernel_size,
+                 recompute=args.recompute)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,7 +32,12 @@ Currently handles dictionaries with non-string-keys, tuples, sets,
 numpy arrays, namedtuples, and OrderedDicts.
 """
 
-from collections import Iterable, OrderedDict, namedtuple
+from collections import OrderedDict, namedtuple
+
+try:
+    from collections.abc import Iterable
+except ImportError:  # Python 2
+    from collections import Iterable
 
 import numpy as np
 import simplejson as json
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Read-only arrays shared by the worker processes
+
+The large arrays used by all the jobs of a parallel call (the fields read
+by every rank, the grids of the interpolators, pic_info...) are published
+once by the parent in a registry, which copies them into POSIX shared
+memory, or into memory-mapped files when multiprocessing.shared_memory is
+not available (Python 2) or a directory is given (e.g., a file system seen
+by all the nodes). Only small handles are sent to the workers, which attach
+the arrays by name without a copy. An array is attached once per worker
+process, and the attached arrays are read-only, unless a private view is
+asked for, which is a copy-on-write mapping of the memory-mapped files (for
+the code that needs writable buffers, e.g., the Cython memoryviews of
+dolointerpolation), or a copy of a shared memory segment.
+
+The registry removes its segments when it is closed, also when a job fails
+or the job is killed by SIGTERM (turned into SystemExit as in checkpoint),
+and at the exit of the interpreter as a last resort.
+
+    with shared_arrays.SharedRegistry() as registry:
+        shared = registry.share({"ex": ex, "pic_info": pic_info})
+        Parallel(n_jobs=ncores)(delayed(func)(rank, shared)
+                                for rank in ranks)
+
+    def func(rank, shared):
+        shared = shared_arrays.resolve(shared)
+        ex = shared["ex"]
+
+parallel_backend does this for the shared arguments of map and reduce
+with share=True.
+"""
+from __future__ import print_function
+
+import atexit
+import collections
+import os
+import signal
+import tempfile
+import uuid
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker = shared_memory = None
+
+# the arrays smaller than that are sent with the jobs
+MIN_BYTES = 2**20
+SHM_DIR = '/dev/shm'
+# the attached arrays of the last registries are kept by the workers
+MAX_ATTACHED = 4
+
+SharedArray = collections.namedtuple(
+    'SharedArray', ['token', 'name', 'kind', 'location', 'shape', 'dtype'])
+
+# the registries of this process that are not closed yet
+OPEN_REGISTRIES = []
+# the arrays attached by this process, by registry token and array name
+ATTACHED = collections.OrderedDict()
+# the segments that could not be closed because their arrays are still used
+LINGERING = []
+
+
+def raise_exit(signum, frame):
+    """Turn SIGTERM into SystemExit, so the segments are removed
+    """
+    raise SystemExit("terminated by signal %d" % signum)
+
+
+def memmap_dir():
+    """Directory of the memory-mapped files on this node: /dev/shm, or the
+    temporary directory without it
+    """
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+
+class SharedRegistry(object):
+    """Arrays published by this process for its workers
+    """
+
+    def __init__(self, directory=None, min_bytes=MIN_BYTES):
+        """
+        Args:
+            directory: directory of memory-mapped files. The default is
+                shared memory, or /dev/shm (or the temporary directory)
+                without multiprocessing.shared_memory.
+            min_bytes: the arrays smaller than that are not shared by share
+        """
+        self.token = 'pic_%d_%s' % (os.getpid(), uuid.uuid4().hex[:8])
+        self.directory = directory
+        self.min_bytes = min_bytes
+        self.handles = collections.OrderedDict()
+        self.segments = []
+        self.old_handler = None
+        if directory is None and shared_memory is None:
+            self.directory = memmap_dir()
+        OPEN_REGISTRIES.append(self)
+
+    def publish(self, name, array):
+        """Copy an array into a shared segment
+
+        Args:
+            name: the name of the array in the registry
+            array: numpy array
+
+        Returns:
+            SharedArray, the handle to send to the workers
+        """
+        if name in self.handles:
+            raise KeyError("%s is already published" % name)
+        array = np.asarray(array)
+        if array.dtype.hasobject:
+            raise TypeError("cannot share an array of Python objects")
+        size = max(array.nbytes, 1)
+        if self.directory is None:
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self.segments.append(shm)
+            kind, location = 'shm', shm.name
+            data = np.ndarray(array.shape, array.dtype, buffer=shm.buf)
+        else:
+            location = os.path.join(self.directory,
+                                    self.token + '_' + name + '.dat')
+            self.segments.append(location)
+            kind = 'memmap'
+            data = np.memmap(location, dtype=np.uint8, mode='w+',
+                             shape=(size,))
+            data = data[:array.nbytes].view(array.dtype).reshape(array.shape)
+        data[...] = array
+        if kind == 'memmap':
+            data.base.flush()
+        del data
+        handle = SharedArray(self.token, name, kind, location,
+                             array.shape, array.dtype.str)
+        self.handles[name] = handle
+        return handle
+
+    def share(self, obj, prefix='a'):
+        """Replace the large arrays in obj by their handles
+
+        The arrays are looked for in the lists, tuples, namedtuples and
+        dicts, recursively. The other objects are kept as they are.
+
+        Args:
+            obj: the arguments to send to the workers
+            prefix: the prefix of the names of the arrays
+        """
+        if isinstance(obj, np.ndarray):
+            if obj.nbytes < self.min_bytes or obj.dtype.hasobject:
+                return obj
+            return self.publish(prefix + '_' + str(len(self.handles)), obj)
+        if isinstance(obj, dict):
+            return type(obj)((key, self.share(value, prefix))
+                             for key, value in obj.items())
+        if isinstance(obj, SharedArray):
+            return obj
+        if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+            return type(obj)(*[self.share(value, prefix) for value in obj])
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.share(value, prefix) for value in obj)
+        return obj
+
+    def close(self):
+        """Remove the segments of the registry
+        """
+        while self.segments:
+            segment = self.segments.pop()
+            try:
+                if isinstance(segment, str):
+                    os.remove(segment)
+                else:
+                    segment.close()
+                    segment.unlink()
+            except (OSError, BufferError):
+                pass
+        self.handles.clear()
+        if self in OPEN_REGISTRIES:
+            OPEN_REGISTRIES.remove(self)
+
+    def __enter__(self):
+        try:
+            self.old_handler = signal.signal(signal.SIGTERM, raise_exit)
+        except ValueError:  # not in the main thread
+            self.old_handler = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.old_handler is not None:
+            signal.signal(signal.SIGTERM, self.old_handler)
+            self.old_handler = None
+        self.close()
+        return False
+
+
+@atexit.register
+def close_registries():
+    """Remove the segments of the registries that are not closed
+    """
+    for registry in list(OPEN_REGISTRIES):
+        registry.close()
+
+
+def open_segment(name):
+    """Open a shared memory segment without letting this process remove it
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 registers the segments it opens to the resource tracker,
+    # which removes them when the worker exits (bpo-38119), and the workers
+    # may use the tracker of the parent, so they must not unregister them
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def detach(token):
+    """Drop the arrays of a registry attached by this process
+    """
+    for segment, _ in ATTACHED.pop(token, {}).values():
+        if segment is None:
+            continue
+        try:
+            segment.close()
+        except BufferError:  # the arrays are still used
+            LINGERING.append(segment)
+
+
+def attach(handle, private=False):
+    """The read-only array of a handle
+
+    Args:
+        handle: SharedArray
+        private: whether to get a writable view whose changes are only seen
+            by this process
+    """
+    key = (handle.name, private)
+    arrays = ATTACHED.get(handle.token)
+    if arrays is not None and key in arrays:
+        return arrays[key][1]
+    if arrays is None:
+        while len(ATTACHED) >= MAX_ATTACHED:
+            detach(next(iter(ATTACHED)))
+        arrays = ATTACHED[handle.token] = {}
+    dtype = np.dtype(handle.dtype)
+    shape = tuple(handle.shape)
+    segment = None
+    if int(np.prod(shape)) == 0:
+        data = np.empty(shape, dtype)
+    elif handle.kind == 'memmap':
+        data = np.memmap(handle.location, dtype=dtype,
+                         mode='c' if private else 'r', shape=shape)
+    elif private:
+        data = attach(handle).copy()
+    else:
+        segment = open_segment(handle.location)
+        data = np.ndarray(shape, dtype, buffer=segment.buf)
+    data.flags.writeable = private
+    arrays[key] = (segment, data)
+    return data
+
+
+def resolve(obj, private=False):
+    """Replace the handles in obj by their arrays (the inverse of share)
+
+    Args:
+        obj: the arguments received by the worker
+        private: whether to get writable views (see attach)
+    """
+    if isinstance(obj, SharedArray):
+        return attach(obj, private)
+    if isinstance(obj, dict):
+        return type(obj)((key, resolve(value, private))
+                         for key, value in obj.items())
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return type(obj)(*[resolve(value, private) for value in obj])
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(resolve(value, private) for value in obj)
+    return obj
+
+
+class Resolved(object):
+    """A function run by a worker process with the shared arguments
+    attached
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, job, *args):
+        return self.func(job, *resolve(args))
+
+
+class NoRegistry(object):
+    """Context for the jobs without shared arrays
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+def using(registry):
+    """Context of an optional registry
+    """
+    return registry if registry is not None else NoRegistry()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Out-of-core 3D FFT of large field cubes
+
+The full-resolution 3D cubes do not fit in memory as complex128, so the
+transform is done in two passes with bounded memory:
+
+1. The cube is split into slabs along z. Each slab is read from the file,
+   transformed in x (rfft) and y (fft), and written into a scratch file as
+   complex64. In the scratch file, the (ky, kx) plane is split into blocks,
+   and each block is contiguous along z, which is the transpose.
+2. Each block is read from the scratch file and transformed along z. The
+   power of the modes is reduced into the wave number shells right away,
+   so the full transform is never in memory.
+
+The slabs and the blocks are processed in parallel on different processes.
+The shells are the same as spectrum_engine, so the spectra can be compared
+with the ones from the smoothed data.
+
+    kbins, spect = slab_power_spectrum(fnames, (nz, ny, nx), (dz, dy, dx))
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+import spectrum_engine
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+fft = lazy_module('scipy.fft')
+joblib = lazy_module('joblib')
+
+
+def slab_sizes(shape, ncores, mem_budget):
+    """Number of z planes in one slab and (ky, kx) modes in one block
+
+    Args:
+        shape: the grid shape (nz, ny, nx)
+        ncores: number of processes working at the same time
+        mem_budget: memory budget in bytes of all the processes
+    """
+    nz, ny, nx = shape
+    nkx = nx // 2 + 1
+    mem_core = mem_budget // ncores
+    # the float32 slab, its complex64 transform, and the FFT work space
+    nz_slab = mem_core // (ny * nx * 4 + 2 * ny * nkx * 8)
+    # the complex64 block, its transform, and the float64 power and k
+    nblock = mem_core // (nz * (2 * 8 + 3 * 8))
+    return max(1, min(nz_slab, nz)), max(1, min(nblock, ny * nkx))
+
+
+def transform_slab(fname, shape, scratch, z0, z1, nblock):
+    """Transform one slab in x and y and write it into the scratch file
+    """
+    nz, ny, nx = shape
+    nplane = ny * (nx // 2 + 1)
+    fdata = np.memmap(fname, dtype=np.float32, mode='r', shape=shape)
+    slab = np.array(fdata[z0:z1])
+    slab_k = fft.rfftn(slab, axes=(1, 2)).reshape(z1 - z0, nplane)
+    del fdata, slab
+    fk = np.memmap(scratch, dtype=np.complex64, mode='r+',
+                   shape=(nz * nplane, ))
+    for p0 in range(0, nplane, nblock):
+        p1 = min(p0 + nblock, nplane)
+        # block p0:p1 occupies nz * (p1 - p0) contiguous elements
+        block = fk[nz * p0:nz * p1].reshape(nz, p1 - p0)
+        block[z0:z1] = slab_k[:, p0:p1]
+    fk.flush()
+    del fk
+
+
+def block_wave_numbers(shape, spacing, p0, p1):
+    """Wave numbers of the modes of the block p0:p1 of the (ky, kx) plane
+
+    Returns:
+        ks with shape (nz, p1 - p0)
+    """
+    nz, ny, nx = shape
+    nkx = nx // 2 + 1
+    kz = np.fft.fftfreq(nz, spacing[0])
+    ky = np.fft.fftfreq(ny, spacing[1])
+    kx = np.fft.rfftfreq(nx, spacing[2])
+    iplane = np.arange(p0, p1)
+    kplane2 = ky[iplane // nkx]**2 + kx[iplane % nkx]**2
+    return np.sqrt(kz[:, None]**2 + kplane2[None, :])
+
+
+def reduce_blocks(scratch, shape, spacing, kbins, blocks):
+    """Transform blocks along z and reduce the power into shells
+
+    Returns:
+        the power in the shells without normalization (nbins + 1, ), where
+        the last element collects the modes out of the bins
+    """
+    nz, ny, nx = shape
+    nplane = ny * (nx // 2 + 1)
+    nbins = len(kbins) - 1
+    fk = np.memmap(scratch, dtype=np.complex64, mode='r',
+                   shape=(nz * nplane, ))
+    spect = np.zeros(nbins + 1)
+    for p0, p1 in blocks:
+        block = np.array(fk[nz * p0:nz * p1]).reshape(nz, p1 - p0)
+        block = fft.fft(block, axis=0)
+        power = block.real.astype(np.float64)**2 + block.imag**2
+        ks = block_wave_numbers(shape, spacing, p0, p1)
+        index = spectrum_engine.shell_index(ks.ravel(), kbins)
+        spect += np.bincount(index, weights=(power * ks).ravel(),
+                             minlength=nbins + 1)
+    del fk
+    return spect
+
+
+def slab_power_spectrum(fnames, shape, spacing, nbins=64, kmin=1E-2,
+                        log_bins=True, density=True, ncores=None,
+                        mem_budget=2**32, scratch_dir=None):
+    """Power spectrum of a field in files that do not fit in memory
+
+    Args:
+        fnames: the files of the components, each with float32 data of shape
+        shape: the grid shape (nz, ny, nx)
+        spacing: the grid sizes (dz, dy, dx)
+        nbins, kmin, log_bins: the binning (see spectrum_engine.shell_bins)
+        density: whether to normalize the spectrum as np.histogram does
+        ncores: number of processes
+        mem_budget: memory budget in bytes of all the processes
+        scratch_dir: the directory of the scratch file, which is as large as
+            the input cube. The default is the system temporary directory.
+
+    Returns:
+        kbins: the bin edges
+        spect: the spectrum summed over the components
+    """
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    shape = tuple(shape)
+    nz, ny, nx = shape
+    nplane = ny * (nx // 2 + 1)
+    nz_slab, nblock = slab_sizes(shape, ncores, mem_budget)
+    kbins = spectrum_engine.bin_edges(shape, spacing, nbins, kmin, log_bins)
+    slabs = [(z0, min(z0 + nz_slab, nz)) for z0 in range(0, nz, nz_slab)]
+    blocks = [(p0, min(p0 + nblock, nplane))
+              for p0 in range(0, nplane, nblock)]
+    # spread the blocks over the processes in a round-robin way
+    block_groups = [blocks[i::ncores] for i in range(min(ncores, len(blocks)))]
+    fd, scratch = tempfile.mkstemp(suffix='.fft', dir=scratch_dir)
+    os.close(fd)
+    spect = np.zeros(nbins + 1)
+    try:
+        with open(scratch, 'wb') as fh:
+            fh.truncate(nz * nplane * np.dtype(np.complex64).itemsize)
+        with joblib.Parallel(n_jobs=ncores) as parallel:
+            for fname in fnames:
+                parallel(joblib.delayed(transform_slab)(fname, shape, scratch,
+                                                 z0, z1, nblock)
+                         for z0, z1 in slabs)
+                spects = parallel(joblib.delayed(reduce_blocks)(scratch, shape,
+                                                         spacing, kbins, group)
+                                  for group in block_groups)
+                spect += np.sum(spects, axis=0)
+    finally:
+        os.remove(scratch)
+    spect = spect[:nbins]
+    if density:
+        spect /= np.sum(spect) * np.diff(kbins)
+    return kbins, spect
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run = '3D-Lx150-bg0.2-150ppc-2048KNL'
+    default_pic_run_dir = ('/net/scratch3/xiaocanli/reconnection/Cori_runs/' +
+                           default_pic_run + '/')
+    parser = argparse.ArgumentParser(description='Out-of-core 3D FFT')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--tframe', action="store", default='20', type=int,
+                        help='Time frame')
+    parser.add_argument('--var', action="store", default='b',
+                        help='field name, e.g., b, e, vi, ne')
+    parser.add_argument('--scalar', action="store_true", default=False,
+                        help='whether the field is a scalar')
+    parser.add_argument('--nbins', action="store", default='64', type=int,
+                        help='number of wave number bins')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    parser.add_argument('--mem_budget', action="store", default='4',
+                        type=float, help='memory budget in GB')
+    parser.add_argument('--scratch_dir', action="store", default=None,
+                        help='directory of the scratch file')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    picinfo_fname = '../data/pic_info/pic_info_' + args.pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    tindex = args.tframe * pic_info.fields_interval
+    if args.scalar:
+        var_names = [args.var]
+    else:
+        var_names = [args.var + comp for comp in ['x', 'y', 'z']]
+    fnames = [args.pic_run_dir + "data/" + var + "_" + str(tindex) + ".gda"
+              for var in var_names]
+    shape = (pic_info.nz, pic_info.ny, pic_info.nx)
+    spacing = (pic_info.dz_di, pic_info.dy_di, pic_info.dx_di)
+    kbins, spect = slab_power_spectrum(fnames, shape, spacing, args.nbins,
+                                       ncores=args.ncores,
+                                       mem_budget=int(args.mem_budget * 2**30),
+                                       scratch_dir=args.scratch_dir)
+    fdir = '../data/power_spectrum/' + args.pic_run + '/'
+    mkdir_p(fdir)
+    fname = fdir + args.var + '_full_' + str(args.tframe) + '.dat'
+    spectrum_engine.save_spectrum_table(fname, [args.tframe], kbins,
+                                        spect[None, :])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Batched power spectra of fields for time series of frames
+
+The wave numbers, the shell index of each Fourier mode and the shell
+weights only depend on the grid shape, the grid sizes and the binning, so
+they are calculated once and cached. All the components of a vector field
+are transformed together with one rfftn call, and the shells are reduced
+with np.bincount instead of np.histogram. The frames are processed in
+parallel, on the MPI ranks under mpirun or srun (see parallel_backend), and
+the spectra of all frames are saved into one table.
+
+The wave numbers are 1/wavelength (np.fft.fftfreq), and the spectrum is
+the histogram of |f_k|^2 k over k with density=True, as in the spectra
+calculated before.
+
+For anisotropic turbulence, there are also the 2D spectrum in
+(k_parallel, k_perp) relative to the mean magnetic field and the structure
+function in (l_parallel, l_perp) relative to the local mean field of each
+pair of points, which is sampled randomly.
+
+    kbins, spect = calc_power_spectrum((bx, by, bz), (dz, dx))
+    python spectrum_engine.py --pic_run mime25_beta002_bg00 --var b
+    python spectrum_engine.py --pic_run mime25_beta002_bg00 --var b --sfunc
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import functools
+import math
+import time
+
+import numpy as np
+
+import instrument
+import parallel_backend
+from field_io import read_2d_fields
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+fft = lazy_module('scipy.fft')
+
+# kbins is the bin edges, index is the shell index of each mode of the rfftn
+# output (nbins for the modes out of the bins), weight is the weight of each
+# mode, and width is the bin widths.
+ShellBins = collections.namedtuple('ShellBins',
+                                   ['kbins', 'index', 'weight', 'width'])
+
+
+def bin_edges(shape, spacing, nbins=64, kmin=1E-2, log_bins=True):
+    """The edges of the wave number bins of a grid
+
+    The last edge is the largest wave number of the rfftn modes.
+    """
+    kmax = math.sqrt(sum(np.max(np.abs(np.fft.fftfreq(n, d)))**2
+                         for n, d in zip(shape, spacing)))
+    if log_bins:
+        return np.logspace(math.log10(kmin), math.log10(kmax), nbins + 1)
+    return np.linspace(kmin, kmax, nbins + 1)
+
+
+def shell_index(ks, kbins):
+    """The bin index of wave numbers (len(kbins) - 1 when out of the bins)
+    """
+    nbins = len(kbins) - 1
+    index = np.searchsorted(kbins, ks, side='right') - 1
+    # the right edge of the last bin is included, as in np.histogram
+    index[ks == kbins[-1]] = nbins - 1
+    index[(index < 0) | (index >= nbins)] = nbins
+    return index
+
+
+@functools.lru_cache(maxsize=16)
+def shell_bins(shape, spacing, nbins=64, kmin=1E-2, log_bins=True):
+    """The shell binning of the rfftn modes of a grid
+
+    Args:
+        shape: the grid shape, e.g., (nz, nx) or (nz, ny, nx)
+        spacing: the grid sizes in the same order as shape
+        nbins: number of bins
+        kmin: the lower edge of the first bin
+        log_bins: whether the bins are logarithmic
+    """
+    ndim = len(shape)
+    kaxes = [np.fft.fftfreq(n, d) for n, d in zip(shape[:-1], spacing[:-1])]
+    kaxes.append(np.fft.rfftfreq(shape[-1], spacing[-1]))
+    k2 = np.zeros([len(k) for k in kaxes])
+    for idim, kaxis in enumerate(kaxes):
+        kshape = [1] * ndim
+        kshape[idim] = -1
+        k2 = k2 + kaxis.reshape(kshape)**2
+    ks = np.sqrt(k2).ravel()
+    kbins = bin_edges(shape, spacing, nbins, kmin, log_bins)
+    return ShellBins(kbins, shell_index(ks, kbins), ks, np.diff(kbins))
+
+
+def shell_reduce(power, bins, density=True):
+    """Reduce the power of the Fourier modes into shells
+
+    Args:
+        power: the power with shape (ncomponents, nmodes)
+        bins: ShellBins of the modes
+        density: whether to normalize each spectrum as np.histogram does
+
+    Returns:
+        the spectra with shape (ncomponents, nbins)
+    """
+    ncomp = len(power)
+    nbins = len(bins.width)
+    index = (bins.index + np.arange(ncomp)[:, None] * (nbins + 1)).ravel()
+    spect = np.bincount(index, weights=(power * bins.weight).ravel(),
+                        minlength=ncomp * (nbins + 1))
+    spect = spect.reshape(ncomp, nbins + 1)[:, :nbins]
+    if density:
+        spect /= np.sum(spect, axis=1, keepdims=True) * bins.width
+    return spect
+
+
+def calc_power_spectrum(fields, spacing, nbins=64, kmin=1E-2, log_bins=True,
+                        density=True, combine=True, workers=1):
+    """Power spectrum of the components of one field
+
+    Args:
+        fields: the components, each with shape (nz, nx) or (nz, ny, nx)
+        spacing: the grid sizes in the order of the array axes
+        nbins, kmin, log_bins: the binning (see shell_bins)
+        density: whether to normalize the spectra as np.histogram does
+        combine: whether to sum the power of the components
+        workers: number of threads of the FFT
+
+    Returns:
+        kbins: the bin edges
+        spect: (nbins, ) when combine, otherwise (ncomponents, nbins)
+    """
+    fields = np.asarray(fields)
+    if fields.ndim == len(spacing):
+        fields = fields[None]
+    shape = fields.shape[1:]
+    bins = shell_bins(tuple(shape), tuple(float(d) for d in spacing),
+                      nbins, kmin, log_bins)
+    axes = tuple(range(1, fields.ndim))
+    with instrument.stage('fft'):
+        fields_k = fft.rfftn(fields, axes=axes, workers=workers)
+    with instrument.stage('shell_reduce'):
+        power = (fields_k.real**2 + fields_k.imag**2).reshape(len(fields), -1)
+        if combine:
+            power = np.sum(power, axis=0, keepdims=True)
+        spect = shell_reduce(power, bins, density)
+    return bins.kbins, spect[0] if combine else spect
+
+
+@instrument.stage('read_frame_fields')
+def read_frame_fields(pic_info, pic_run_dir, tframe, var_names):
+    """Read the fields of one frame of a 2D run
+
+    Returns:
+        fields: (len(var_names), nz, nx)
+        spacing: the grid sizes (dz, dx)
+    """
+    box = {"current_time": tframe,
+           "xl": 0, "xr": pic_info.lx_di,
+           "zb": -0.5 * pic_info.lz_di, "zt": 0.5 * pic_info.lz_di}
+    fields = []
+    for var in var_names:
+        fname = pic_run_dir + "data/" + var + ".gda"
+        x, z, fdata = read_2d_fields(pic_info, fname, **box)
+        fields.append(fdata)
+    return np.asarray(fields), (z[1] - z[0], x[1] - x[0])
+
+
+def frame_power_spectrum(pic_info, pic_run_dir, tframe, var_names, **kwargs):
+    """Power spectrum of the fields of one frame
+
+    Args:
+        pic_info: namedtuple for the PIC simulation information
+        pic_run_dir: PIC run directory including the data/*.gda files
+        tframe: time frame
+        var_names: the components, e.g., ["bx", "by", "bz"]
+        kwargs: other arguments of calc_power_spectrum
+    """
+    fields, spacing = read_frame_fields(pic_info, pic_run_dir, tframe,
+                                        var_names)
+    return calc_power_spectrum(fields, spacing, **kwargs)
+
+
+def calc_spectrum_table(pic_info, pic_run_dir, tframes, var_names,
+                        ncores=None, **kwargs):
+    """Power spectra of many frames
+
+    Returns:
+        kbins: the bin edges
+        table: the spectra with shape (nframes, nbins)
+    """
+    kwargs["combine"] = True
+    backend = parallel_backend.get_backend(ncores)
+    func = functools.partial(frame_power_spectrum, pic_info, pic_run_dir,
+                             **kwargs)
+    results = backend.map(func, tframes, var_names, allgather=True)
+    kbins = results[0][0]
+    table = np.stack([spect for _, spect in results])
+    return kbins, table
+
+
+def spectrum_table_fname(pic_run, var_name):
+    """File name of the spectrum table of one variable
+    """
+    return ('../data/power_spectrum/' + pic_run + '/' + var_name +
+            '_table.dat')
+
+
+def save_spectrum_table(fname, tframes, kbins, table):
+    """Save the spectra of many frames
+
+    The first row is the bin edges, and each of the other rows is the time
+    frame followed by the spectrum of that frame.
+    """
+    fdata = np.zeros((len(tframes) + 1, len(kbins)))
+    fdata[0] = kbins
+    fdata[1:, 0] = tframes
+    fdata[1:, 1:] = table
+    np.savetxt(fname, fdata)
+
+
+def read_spectrum_table(fname):
+    """Read the spectra of many frames
+
+    Returns:
+        tframes, kbins, table (nframes, nbins)
+    """
+    fdata = np.atleast_2d(np.loadtxt(fname))
+    return fdata[1:, 0].astype(np.int64), fdata[0], fdata[1:, 1:]
+
+
+def _vector_xyz(vec, ndim):
+    """(x, y, z) components of a vector given in the order of array axes
+
+    The array axes are (z, y, x) in 3D and (z, x) in 2D, where the y
+    component is 0.
+    """
+    if ndim == 3:
+        return vec[2], vec[1], vec[0]
+    return vec[1], np.zeros_like(vec[0]), vec[0]
+
+
+def wave_vector_axes(shape, spacing):
+    """The wave numbers along each array axis of the rfftn modes of a grid
+    """
+    kaxes = [np.fft.fftfreq(n, d) for n, d in zip(shape[:-1], spacing[:-1])]
+    kaxes.append(np.fft.rfftfreq(shape[-1], spacing[-1]))
+    return kaxes
+
+
+instrument.watch_cache('shell_bins', shell_bins)
+
+
+def calc_anisotropic_spectrum(fields, bfields, spacing, nbins=64, kmin=1E-2,
+                              log_bins=True, density=True, chunk_size=2**20,
+                              workers=1):
+    """Power spectrum in (k_parallel, k_perp) relative to the mean field
+
+    The modes are binned in chunks, so the temporary arrays are bounded by
+    chunk_size. As in the isotropic spectra, the modes with k_parallel or
+    k_perp below kmin are not included. Use log_bins=False and kmin=0 to
+    include k_parallel=0.
+
+    Args:
+        fields: the components, each with shape (nz, nx) or (nz, ny, nx)
+        bfields: (bx, by, bz) giving the direction of the mean field
+        spacing: the grid sizes in the order of the array axes
+        nbins, kmin, log_bins: the binning of both k_parallel and k_perp
+        density: whether to normalize the spectrum by its sum and the bin
+            areas
+        chunk_size: number of modes binned together
+        workers: number of threads of the FFT
+
+    Returns:
+        kbins: the bin edges of both k_parallel and k_perp
+        spect: (nbins, nbins) with k_parallel along axis 0
+    """
+    fields = np.asarray(fields)
+    if fields.ndim == len(spacing):
+        fields = fields[None]
+    shape = tuple(fields.shape[1:])
+    spacing = tuple(float(d) for d in spacing)
+    bmean = np.array([np.mean(bfield) for bfield in bfields])
+    bdir = bmean / np.sqrt(np.sum(bmean**2))
+    kaxes = wave_vector_axes(shape, spacing)
+    kshape = tuple(len(kaxis) for kaxis in kaxes)
+    kbins = bin_edges(shape, spacing, nbins, kmin, log_bins)
+    axes = tuple(range(1, fields.ndim))
+    fields_k = fft.rfftn(fields, axes=axes, workers=workers)
+    power = np.sum(fields_k.real**2 + fields_k.imag**2, axis=0).ravel()
+    del fields_k
+    spect = np.zeros((nbins + 1)**2)
+    for i0 in range(0, len(power), chunk_size):
+        i1 = min(i0 + chunk_size, len(power))
+        # the wave vectors of the modes in this chunk only
+        index = np.unravel_index(np.arange(i0, i1), kshape)
+        kx, ky, kz = _vector_xyz([kaxis[i] for kaxis, i in zip(kaxes, index)],
+                                 len(shape))
+        kpara = kx * bdir[0] + ky * bdir[1] + kz * bdir[2]
+        kperp2 = kx**2 + ky**2 + kz**2 - kpara**2
+        ipara = shell_index(np.abs(kpara), kbins)
+        iperp = shell_index(np.sqrt(np.maximum(kperp2, 0)), kbins)
+        spect += np.bincount(ipara * (nbins + 1) + iperp,
+                             weights=power[i0:i1], minlength=(nbins + 1)**2)
+    spect = spect.reshape(nbins + 1, nbins + 1)[:nbins, :nbins]
+    if density:
+        width = np.diff(kbins)
+        spect /= np.sum(spect) * np.outer(width, width)
+    return kbins, spect
+
+
+def structure_function_chunk(fields, bfields, spacing, lbins, npairs, order,
+                             periodic, seed):
+    """Structure function from one chunk of randomly sampled pairs
+
+    Returns:
+        the sums of |df|^order and the numbers of pairs in the
+        (l_parallel, l_perp) bins, both flattened
+    """
+    rng = np.random.default_rng(seed)
+    shape = fields.shape[1:]
+    ndim = len(shape)
+    nbins = len(lbins) - 1
+    spacing = np.asarray(spacing)
+    # log-uniform separations along isotropic directions
+    length = lbins[0] * (lbins[-1] / lbins[0])**rng.random(npairs)
+    direction = rng.standard_normal((ndim, npairs))
+    direction /= np.sqrt(np.sum(direction**2, axis=0))
+    lag = np.rint(length * direction / spacing[:, None]).astype(np.int64)
+    pos1 = np.stack([rng.integers(0, n, npairs) for n in shape])
+    pos2 = pos1 + lag
+    nsize = np.asarray(shape)[:, None]
+    if periodic:
+        pos2 %= nsize
+        valid = np.any(lag != 0, axis=0)
+    else:
+        valid = (np.any(lag != 0, axis=0) &
+                 np.all((pos2 >= 0) & (pos2 < nsize), axis=0))
+    pos1, pos2, lag = pos1[:, valid], pos2[:, valid], lag[:, valid]
+    index1 = (slice(None), ) + tuple(pos1)
+    index2 = (slice(None), ) + tuple(pos2)
+    dfield = np.sqrt(np.sum((fields[index2] - fields[index1])**2, axis=0))
+    blocal = 0.5 * (bfields[index1] + bfields[index2])
+    absb = np.sqrt(np.sum(blocal**2, axis=0))
+    lx, ly, lz = _vector_xyz(lag * spacing[:, None], ndim)
+    lpara = np.abs(lx * blocal[0] + ly * blocal[1] + lz * blocal[2])
+    lpara /= np.where(absb > 0, absb, 1)
+    lperp = np.sqrt(np.maximum(lx**2 + ly**2 + lz**2 - lpara**2, 0))
+    # the separations below lmin are in the first bin
+    ipara = np.clip(np.searchsorted(lbins, lpara, side='right') - 1,
+                    0, nbins - 1)
+    iperp = np.clip(np.searchsorted(lbins, lperp, side='right') - 1,
+                    0, nbins - 1)
+    ibin = (ipara * nbins + iperp)[absb > 0]
+    sums = np.bincount(ibin, weights=dfield[absb > 0]**order,
+                       minlength=nbins**2)
+    counts = np.bincount(ibin, minlength=nbins**2)
+    return sums, counts
+
+
+def structure_function_job(job, fields, bfields, spacing, lbins, order,
+                           periodic):
+    """structure_function_chunk for job = (npairs, seed)
+    """
+    npairs, seed = job
+    return structure_function_chunk(fields, bfields, spacing, lbins, npairs,
+                                    order, periodic, seed)
+
+
+def add_sums(result1, result2):
+    """Add the (sums, counts) of two chunks
+    """
+    return result1[0] + result2[0], result1[1] + result2[1]
+
+
+def calc_structure_function(fields, bfields, spacing, npairs=2**22,
+                            lmin=None, lmax=None, nbins=32, order=2,
+                            chunk_size=2**18, periodic=True, seed=None,
+                            ncores=1):
+    """Structure function in (l_parallel, l_perp) relative to the local field
+
+    The cost is bounded by sampling random pairs of grid points instead of
+    all pairs. The local mean field of a pair is the average of the magnetic
+    field at its two points, so l_parallel and l_perp are measured in the
+    scale-dependent local frame.
+
+    Args:
+        fields: the components, each with shape (nz, nx) or (nz, ny, nx)
+        bfields: (bx, by, bz) on the same grid
+        spacing: the grid sizes in the order of the array axes
+        npairs: number of sampled pairs
+        lmin, lmax: the range of the separations. The default is from the
+            largest grid size to a quarter of the smallest box size.
+        nbins: number of logarithmic bins of both l_parallel and l_perp
+        order: the order of the structure function
+        chunk_size: number of pairs in one chunk
+        periodic: whether the separations wrap around the box. Otherwise,
+            the pairs out of the box are dropped.
+        seed: the random seed
+        ncores: number of local processes. Under MPI, the chunks are spread
+            over the ranks instead.
+
+    Returns:
+        lbins: the bin edges of both l_parallel and l_perp
+        sfunc: (nbins, nbins) mean |df|^order with l_parallel along axis 0.
+            It is NaN in the empty bins.
+        counts: number of pairs in each bin
+    """
+    fields = np.asarray(fields, dtype=np.float64)
+    if fields.ndim == len(spacing):
+        fields = fields[None]
+    bfields = np.asarray(bfields, dtype=np.float64)
+    shape = fields.shape[1:]
+    if lmin is None:
+        lmin = max(spacing)
+    if lmax is None:
+        lmax = 0.25 * min(n * d for n, d in zip(shape, spacing))
+    lbins = np.logspace(math.log10(lmin), math.log10(lmax), nbins + 1)
+    nchunks = max(1, int(math.ceil(npairs / chunk_size)))
+    seeds = np.random.SeedSequence(seed).spawn(nchunks)
+    sizes = [min(chunk_size, npairs - i * chunk_size) for i in range(nchunks)]
+    backend = parallel_backend.get_backend(ncores)
+    sums, counts = backend.reduce(structure_function_job,
+                                  list(zip(sizes, seeds)), add_sums, fields,
+                                  bfields, spacing, lbins, order, periodic,
+                                  allgather=True, share=True)
+    sfunc = np.full(nbins**2, np.nan)
+    np.divide(sums, counts, out=sfunc, where=counts > 0)
+    return (lbins, sfunc.reshape(nbins, nbins),
+            counts.reshape(nbins, nbins))
+
+
+def save_2d_spectrum(fname, bins, fdata):
+    """Save a 2D spectrum or structure function as [nbins, bins, fdata]
+    """
+    nbins = len(bins) - 1
+    np.concatenate(([nbins], bins, np.ravel(fdata))).tofile(fname)
+
+
+def read_2d_spectrum(fname):
+    """Read a 2D spectrum or structure function
+
+    Returns:
+        bins, fdata (nbins, nbins)
+    """
+    fdata = np.fromfile(fname)
+    nbins = int(fdata[0])
+    bins = fdata[1:nbins + 2]
+    return bins, fdata[nbins + 2:].reshape(nbins, nbins)
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run = 'mime25_beta002_bg00'
+    parser = argparse.ArgumentParser(description='Power spectra of fields')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store", default=None,
+                        help='PIC run directory')
+    parser.add_argument('--var', action="store", default='b',
+                        help='field name, e.g., b, e, vi, ne')
+    parser.add_argument('--scalar', action="store_true", default=False,
+                        help='whether the field is a scalar')
+    parser.add_argument('--tstart', action="store", default='0', type=int,
+                        help='starting time frame')
+    parser.add_argument('--tend', action="store", default='40', type=int,
+                        help='ending time frame')
+    parser.add_argument('--nbins', action="store", default='64', type=int,
+                        help='number of wave number bins')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='number of processes')
+    parser.add_argument('--aniso', action="store_true", default=False,
+                        help='whether to calculate (k_parallel, k_perp) spectra')
+    parser.add_argument('--sfunc', action="store_true", default=False,
+                        help='whether to calculate structure functions in ' +
+                        'the local field frame')
+    parser.add_argument('--npairs', action="store", default='4194304',
+                        type=int, help='number of pairs for structure functions')
+    parser.add_argument('--profile', action="store_true", default=False,
+                        help='whether to save the time and I/O report')
+    return parser.parse_args()
+
+
+def spectra(args):
+    """Calculate the spectra requested on the command line
+    """
+    picinfo_fname = '../data/pic_info/pic_info_' + args.pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    pic_run_dir = args.pic_run_dir or pic_info.run_dir
+    if args.scalar:
+        var_names = [args.var]
+    else:
+        var_names = [args.var + comp for comp in ['x', 'y', 'z']]
+    tframes = np.arange(args.tstart, args.tend + 1)
+    fdir = '../data/power_spectrum/' + args.pic_run + '/'
+    backend = parallel_backend.get_backend(args.ncores)
+    if args.aniso or args.sfunc:
+        if backend.is_master:
+            mkdir_p(fdir)
+        bnames = ["bx", "by", "bz"]
+        for tframe in tframes:
+            if backend.is_master:
+                print("Time frame: %d" % tframe)
+            bfields, spacing = read_frame_fields(pic_info, pic_run_dir,
+                                                 tframe, bnames)
+            if var_names == bnames:
+                fields = bfields
+            else:
+                fields, _ = read_frame_fields(pic_info, pic_run_dir, tframe,
+                                              var_names)
+            if args.aniso and backend.is_master:
+                kbins, spect = calc_anisotropic_spectrum(fields, bfields,
+                                                         spacing, args.nbins)
+                fname = fdir + args.var + '_aniso_' + str(tframe) + '.dat'
+                save_2d_spectrum(fname, kbins, spect)
+            if args.sfunc:
+                lbins, sfunc, _ = calc_structure_function(
+                    fields, bfields, spacing, args.npairs, seed=tframe,
+                    ncores=args.ncores)
+                if backend.is_master:
+                    fname = fdir + args.var + '_sfunc_' + str(tframe) + '.dat'
+                    save_2d_spectrum(fname, lbins, sfunc)
+        return
+    kbins, table = calc_spectrum_table(pic_info, pic_run_dir, tframes,
+                                       var_names, ncores=args.ncores,
+                                       nbins=args.nbins)
+    if backend.is_master:
+        fname = spectrum_table_fname(args.pic_run, args.var)
+        mkdir_p(fdir)
+        save_spectrum_table(fname, tframes, kbins, table)
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    if args.profile:
+        instrument.enable()
+    tstart = time.time()
+    spectra(args)
+    if args.profile and parallel_backend.get_backend().is_master:
+        instrument.write_report('spectrum_engine_' + args.pic_run, tstart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Startup time of the core modules and the command line scripts
+
+Each module is imported in a fresh interpreter with `-X importtime`, and each
+script is run with `--help`. The heavy modules that are loaded at the end
+are reported. The core modules should not import the heavy
+dependencies (matplotlib, palettable, h5py, joblib and the large scipy
+submodules) at import time; they use lazy_import.lazy_module instead. The
+benchmark fails when a module is over the time budget or imports one of the
+heavy dependencies.
+
+    python3 startup_benchmark.py --budget 0.3
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from shell_functions import mkdir_p
+
+CORE_MODULES = ['shell_functions', 'lazy_import', 'instrument', 'field_io',
+                'vpic_schema', 'spectrum_engine', 'slab_fft',
+                'fieldline_tracer', 'tracer_interp', 'xpoints', 'ay_contours',
+                'phi_parallel', 'rrate_service', 'render_prep',
+                'tracer_bucket']
+SCRIPTS = ['spectrum_engine.py', 'slab_fft.py', 'xpoints.py',
+           'ay_contours.py', 'phi_parallel.py', 'rrate_service.py',
+           'cori_3d.py', 'cori_3d_fields.py']
+HEAVY_MODULES = ['matplotlib', 'palettable', 'h5py', 'joblib', 'scipy.fft',
+                 'scipy.signal', 'scipy.ndimage', 'scipy.interpolate',
+                 'scipy.optimize']
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# print the heavy modules that are loaded at the end of the command. The
+# lazy modules that are not used yet are still _LazyModule.
+REPORT_HEAVY = """
+import sys
+heavy = [name for name in %r if name in sys.modules and
+         type(sys.modules[name]).__name__ != '_LazyModule']
+print('HEAVY:' + ','.join(heavy))
+"""
+RUN_SCRIPT = """
+import runpy
+import sys
+sys.argv = [%r, '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+"""
+
+
+def run_time(cmd, repeat):
+    """Minimum wall time of a command over a few runs
+
+    Returns:
+        (time in seconds, stdout and stderr of the last run, return code)
+    """
+    tmin = float('inf')
+    for _ in range(repeat):
+        tstart = time.time()
+        proc = subprocess.Popen(cmd, cwd=CODE_DIR, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        tmin = min(tmin, time.time() - tstart)
+    return (tmin, out.decode('utf-8', 'replace'),
+            err.decode('utf-8', 'replace'), proc.returncode)
+
+
+def parse_importtime(err):
+    """Modules and their cumulative import times from -X importtime
+
+    Returns:
+        a dictionary from the module names to (time in seconds, depth),
+        where depth is 0 for the modules imported by the command itself
+    """
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            tcum = int(cumulative) * 1E-6
+        except ValueError:  # the title line
+            continue
+        # the names are indented by two spaces for each level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (tcum, depth)
+    return times
+
+
+def last_line(err):
+    """The last line of the error message that is not from -X importtime
+    """
+    lines = [line for line in err.splitlines()
+             if line.strip() and not line.startswith('import time:')]
+    return lines[-1] if lines else ""
+
+
+def heavy_imports(out):
+    """The heavy dependencies that are loaded from the output of REPORT_HEAVY
+    """
+    for line in out.splitlines():
+        if line.startswith('HEAVY:'):
+            return [name for name in line[len('HEAVY:'):].split(',') if name]
+    return []
+
+
+def module_startup(module, baseline, repeat):
+    """Import time of one module in a fresh interpreter
+    """
+    source = 'import ' + module + '\n' + REPORT_HEAVY % HEAVY_MODULES
+    cmd = [sys.executable, '-X', 'importtime', '-c', source]
+    tmin, out, err, code = run_time(cmd, repeat)
+    import_times = parse_importtime(err)
+    # the direct dependencies of the module
+    heaviest = sorted(((t, name) for name, (t, depth) in import_times.items()
+                       if depth == 1), reverse=True)[:5]
+    return {"name": module,
+            "time": tmin - baseline,
+            "ok": code == 0,
+            "error": last_line(err) if code else "",
+            "heavy": heavy_imports(out),
+            "heaviest": [[name, t] for t, name in heaviest]}
+
+
+def script_startup(script, baseline, repeat):
+    """Time of `script --help` in a fresh interpreter
+    """
+    source = RUN_SCRIPT % script + REPORT_HEAVY % HEAVY_MODULES
+    tmin, out, err, code = run_time([sys.executable, '-c', source], repeat)
+    return {"name": script + " --help",
+            "time": tmin - baseline,
+            "ok": code == 0,
+            "error": last_line(err) if code else "",
+            "heavy": heavy_imports(out),
+            "heaviest": []}
+
+
+def startup_report(modules, scripts, budget, repeat=3):
+    """Startup times of the modules and the scripts
+
+    Returns:
+        a dictionary with the results and whether all of them pass
+    """
+    baseline, _, _, _ = run_time([sys.executable, '-c', 'pass'], repeat)
+    results = [module_startup(module, baseline, repeat) for module in modules]
+    results += [script_startup(script, baseline, repeat) for script in scripts]
+    for result in results:
+        result["passed"] = (result["ok"] and not result["heavy"] and
+                            result["time"] <= budget)
+    return {"python": sys.version.split()[0],
+            "baseline": baseline,
+            "budget": budget,
+            "results": results,
+            "passed": all(result["passed"] for result in results)}
+
+
+def print_report(report):
+    """Print the startup times as a table
+    """
+    print("Python %s, interpreter startup %0.3fs, budget %0.3fs" %
+          (report["python"], report["baseline"], report["budget"]))
+    for result in report["results"]:
+        if not result["ok"]:
+            status = "ERROR " + result["error"]
+        elif result["heavy"]:
+            status = "HEAVY " + ",".join(result["heavy"])
+        elif result["time"] > report["budget"]:
+            status = "SLOW"
+        else:
+            status = "ok"
+        print("%-28s %8.3fs  %s" % (result["name"], result["time"], status))
+        for name, tcum in result["heaviest"]:
+            print("    %-24s %8.3fs" % (name, tcum))
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('--modules', nargs='*', default=CORE_MODULES,
+                        help='modules to import')
+    parser.add_argument('--scripts', nargs='*', default=SCRIPTS,
+                        help='scripts to run with --help')
+    parser.add_argument('--budget', action="store", default='0.5',
+                        type=float, help='time budget in seconds')
+    parser.add_argument('--repeat', action="store", default='3', type=int,
+                        help='number of runs of each command')
+    parser.add_argument('--output', action="store", default=None,
+                        help='JSON file of the report')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    report = startup_report(args.modules, args.scripts, args.budget,
+                            args.repeat)
+    print_report(report)
+    if args.output:
+        mkdir_p(os.path.dirname(args.output) or '.')
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
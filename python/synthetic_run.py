@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+"""
+Synthetic VPIC runs for testing and benchmarking the analyses
+
+A synthetic run has the files of a real VPIC run in their on-disk formats,
+so the analyses read it in the same way:
+
+* info, the deck, the Makefile and rundata/energies for pic_information
+* data/<var>.gda with all the fields frames
+* data-smooth/<var>_<tindex>.gda cubes smoothed and reduced by a factor
+* particle/T.<tindex>/{e,h}particle.<tindex>.<rank> dumps with the VPIC
+  boilerplate and headers (see vpic_schema)
+* hydro/T.<tindex>/spectrum-{e,H}hydro.<tindex>.<rank> zone spectra
+* tracer/T.<tindex>/<species>_tracer_{reduced,qtag_sorted}.h5p and the
+  grid metadata of the tracers
+
+The fields are a Harris current sheet with a magnetic island and power-law
+turbulence, so the field lines close and the spectra have a slope. The data
+is random but reproducible from the seed. The PIC information is saved in
+../data/pic_info/ as for the real runs.
+
+    python3 synthetic_run.py --size small --run_name synthetic_small
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+import vpic_schema
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+h5py = lazy_module('h5py')
+
+RUN_ROOT = '../data/synthetic_runs/'
+PIC_INFO_DIR = '../data/pic_info/'
+# (nx, ny, nz) of the preset sizes
+SIZES = {"tiny": (64, 1, 32),
+         "small": (256, 1, 128),
+         "medium": (1024, 1, 512),
+         "large": (4096, 1, 2048),
+         "small3d": (128, 64, 64),
+         "medium3d": (256, 128, 128)}
+FIELD_VARS = ['bx', 'by', 'bz', 'ex', 'ey', 'ez', 'absB', 'jy', 'ne', 'ni']
+TRACER_DSETS = ['dX', 'dY', 'dZ', 'Ux', 'Uy', 'Uz', 'i', 'q']
+TRACER_EMF = ['Ex', 'Ey', 'Ez', 'Bx', 'By', 'Bz']
+TRACER_SPECIES = ['electron', 'ion']
+MANIFEST = 'synthetic.json'
+
+
+def default_params(nx, ny, nz, **kwargs):
+    """Parameters of a synthetic run
+
+    Args:
+        nx, ny, nz: the grid size. ny is 1 for a 2D run.
+        kwargs: the parameters to change (see the dictionary below)
+    """
+    params = {"nx": nx, "ny": ny, "nz": nz,
+              # MPI topology, so that each rank has at least 32 cells
+              "topology": [max(1, nx // 64), max(1, ny // 32),
+                           max(1, nz // 64)],
+              "nframes": 4,
+              "fields_interval": 64,  # in time steps
+              "particle_every": 2,  # fields frames between particle dumps
+              "tracer_every": 4,  # tracer steps in a fields interval
+              "nppc": 4,  # particles per cell of each species
+              "ntracer": 2**12,
+              "mime": 25.0,
+              "dx_de": 0.5,
+              "ti_te": 1.0,
+              "vthe": 0.1,
+              "b0": 1.0,
+              "guide_field": 0.0,
+              "island": 0.1,  # the amplitude of the island
+              "noise": 0.05,  # the amplitude of the turbulence
+              "spectral_index": 5.0 / 3.0,
+              "smooth_factor": 2,
+              "zone_size": 16,  # cells of a spectrum zone
+              "nbins_spect": 800,
+              "emin_spect": 1E-5,
+              "emax_spect": 1E3,
+              "variables": FIELD_VARS,
+              "seed": 0}
+    for key in kwargs:
+        if key not in params:
+            raise ValueError("unknown parameter %s" % key)
+    params.update(kwargs)
+    for n, ntop in zip([nx, ny, nz], params["topology"]):
+        if n % ntop:
+            raise ValueError("the topology %s does not divide the grid %s" %
+                             (params["topology"], [nx, ny, nz]))
+    if 'ex' not in params["variables"]:
+        # pic_information counts the frames in data/ex.gda
+        params["variables"] = ['ex'] + list(params["variables"])
+    return params
+
+
+def time_units(params):
+    """The time steps in 1/wpe, 1/wce and 1/wci
+
+    dt*wci is a power of two, so the output intervals in the deck are exact.
+    """
+    dtwci = 2.0**-8
+    dtwce = dtwci * params["mime"]
+    dtwpe = dtwce  # wpe/wce = 1
+    return dtwpe, dtwce, dtwci
+
+
+def grid_coords(params):
+    """The cell centers in de along x, y, z
+    """
+    dx = params["dx_de"]
+    x = (np.arange(params["nx"]) + 0.5) * dx
+    y = (np.arange(params["ny"]) - params["ny"] / 2.0 + 0.5) * dx
+    z = (np.arange(params["nz"]) - params["nz"] / 2.0 + 0.5) * dx
+    return x, y, z
+
+
+def domain_size(params):
+    """(Lx, Ly, Lz) in de
+    """
+    return [n * params["dx_de"]
+            for n in [params["nx"], params["ny"], params["nz"]]]
+
+
+def local_grid(params):
+    """The number of cells of each rank along x, y, z
+    """
+    return [n // ntop for n, ntop in
+            zip([params["nx"], params["ny"], params["nz"]],
+                params["topology"])]
+
+
+def rank_corner(params, rank):
+    """The lower corner of the domain of a rank in de
+    """
+    tx, ty, _ = params["topology"]
+    irank = [rank % tx, (rank // tx) % ty, rank // (tx * ty)]
+    lsize = domain_size(params)
+    lmin = [0.0, -0.5 * lsize[1], -0.5 * lsize[2]]
+    return [l0 + i * nl * params["dx_de"]
+            for l0, i, nl in zip(lmin, irank, local_grid(params))]
+
+
+def nranks(params):
+    """Total number of MPI ranks
+    """
+    tx, ty, tz = params["topology"]
+    return tx * ty * tz
+
+
+def write_info(run_dir, params):
+    """Write the info file, the deck, the Makefile and the energies
+    """
+    dtwpe, dtwce, dtwci = time_units(params)
+    mime = params["mime"]
+    dx = params["dx_de"]
+    lx, ly, lz = [l / math.sqrt(mime) for l in domain_size(params)]
+    vthe = params["vthe"]
+    vthi = vthe * math.sqrt(params["ti_te"] / mime)
+    fields_interval = params["fields_interval"]
+    zone = params["zone_size"]
+    # the order of the lines is the order in which read_pic_info looks for
+    # them
+    info = [("sigma", params["b0"]**2),
+            ("Ti/Te", params["ti_te"]),
+            ("Te", vthe**2),
+            ("Ti", vthe**2 * params["ti_te"]),
+            ("wpe/wce", 1.0),
+            ("mi/me", mime),
+            ("Lx/di", lx), ("Ly/di", ly), ("Lz/di", lz),
+            ("nx", params["nx"]), ("ny", params["ny"]), ("nz", params["nz"]),
+            ("courant", 0.7),
+            ("nproc", nranks(params)),
+            ("nppc", params["nppc"]),
+            ("b0", params["b0"]),
+            ("Ne", params["nppc"] * params["nx"] * params["ny"] *
+             params["nz"]),
+            ("dt*wpe", dtwpe), ("dt*wce", dtwce), ("dt*wci", dtwci),
+            ("energies_interval", fields_interval // 4),
+            ("dx/de", dx), ("dy/de", dx), ("dz/de", dx),
+            ("dx/rhoi", dx / (vthi * mime)), ("dx/rhoe", dx / vthe),
+            ("dx/debye", dx / vthe),
+            ("n0", 1.0),
+            ("vthi/c", vthi), ("vthe/c", vthe),
+            ("restart_interval", 100 * fields_interval),
+            ("fields_interval", fields_interval),
+            ("ehydro_interval", fields_interval),
+            ("Hhydro_interval", fields_interval),
+            ("eparticle_interval", params["particle_every"] * fields_interval),
+            ("Hparticle_interval", params["particle_every"] * fields_interval),
+            ("quota_check_interval", 100),
+            ("particle_tracing", 1),
+            ("tracer_interval", fields_interval // params["tracer_every"]),
+            ("tracer_pass1_interval", fields_interval),
+            ("tracer_pass2_interval", fields_interval),
+            ("Ntracer", params["ntracer"]),
+            ("emf_at_tracer", 1),
+            ("hydro_at_tracer", 0),
+            ("dump_traj_directly", 0),
+            ("num_tracer_fields_add", 0),
+            ("emax_band", params["emax_spect"]),
+            ("emin_band", params["emin_spect"]),
+            ("nbands", 10),
+            ("emax_spect", params["emax_spect"]),
+            ("emin_spect", params["emin_spect"]),
+            ("nbins", params["nbins_spect"]),
+            ("nx_zone", zone), ("ny_zone", zone if params["ny"] > 1 else 1),
+            ("nz_zone", zone),
+            ("stride_particle_dump", 1),
+            ("vtheb/c", vthe), ("vthib/c", vthi)]
+    with open(run_dir + 'info', 'w') as fh:
+        fh.write("***** Synthetic run *****\n")
+        for name, value in info:
+            fh.write("%s = %s\n" % (name, repr(value)))
+
+    deck_name = 'synthetic.cxx'
+    with open(run_dir + 'Makefile', 'w') as fh:
+        fh.write("# synthetic run\n")
+        fh.write("vpic " + deck_name + "\n")
+    tx, ty, tz = params["topology"]
+    deck = ["begin_globals {",
+            "  int fields_interval;",
+            "};",
+            "",
+            "begin_initialization {",
+            "  double wci = 1.0;",
+            "  double dt = %r;" % dtwci,
+            "  double topology_x = %d;" % tx,
+            "  double topology_y = %d;" % ty,
+            "  double topology_z = %d;" % tz,
+            "  int interval = int(%r/(wci*dt));" % (fields_interval * dtwci),
+            "  int eparticle_interval = %d*interval;" %
+            params["particle_every"],
+            "  int ehydro_interval = interval;",
+            "}"]
+    with open(run_dir + deck_name, 'w') as fh:
+        fh.write("\n".join(deck) + "\n")
+
+    # step, electric and magnetic energies, and ion and electron energies
+    energy_interval = fields_interval // 4
+    nsteps = (params["nframes"] - 1) * fields_interval
+    steps = np.arange(0, nsteps + 1, energy_interval)
+    frac = steps / float(max(nsteps, 1))
+    ncells = params["nx"] * params["ny"] * params["nz"] * dx**3
+    ene_b = 0.5 * params["b0"]**2 * ncells * (1.0 - 0.2 * frac)
+    ene_k = 1.5 * vthe**2 * params["nppc"] * ncells * (1.0 + frac)
+    energies = np.zeros((len(steps), 9))
+    energies[:, 0] = steps
+    energies[:, 1:4] = 1E-3 * ene_b[:, None]
+    energies[:, 4] = 0.9 * ene_b
+    energies[:, 5] = 0.05 * ene_b
+    energies[:, 6] = 0.05 * ene_b
+    energies[:, 7] = ene_k * mime * params["ti_te"] / (1 + params["ti_te"])
+    energies[:, 8] = ene_k / (1 + params["ti_te"])
+    mkdir_p(run_dir + 'rundata')
+    np.savetxt(run_dir + 'rundata/energies', energies,
+               header="Energies\nstep ex ey ez bx by bz ki ke\n")
+
+
+def turbulence(rng, shape, spacing, index):
+    """Random field with a power-law spectrum k^-index and unit rms
+    """
+    kaxes = [np.fft.fftfreq(n, d) for n, d in zip(shape[:-1], spacing[:-1])]
+    kaxes.append(np.fft.rfftfreq(shape[-1], spacing[-1]))
+    k2 = np.zeros([len(k) for k in kaxes])
+    for idim, kaxis in enumerate(kaxes):
+        kshape = [1] * len(shape)
+        kshape[idim] = -1
+        k2 = k2 + kaxis.reshape(kshape)**2
+    k2.flat[0] = np.inf
+    # the spectrum is integrated over the shells, so |f_k|^2 k^(ndim-1)
+    # goes as k^-index
+    amp = k2**(-0.25 * (index + len(shape) - 1))
+    phase = np.exp(2j * np.pi * rng.random_sample(k2.shape))
+    fdata = np.fft.irfftn(amp * phase, s=shape, axes=range(len(shape)))
+    fdata /= np.sqrt(np.mean(fdata**2))
+    return fdata.astype(np.float32)
+
+
+def frame_fields(params, tframe):
+    """The fields of one frame
+
+    Returns:
+        a dictionary from the variable names to (nz, ny, nx) arrays
+    """
+    rng = np.random.RandomState([params["seed"], tframe])
+    x, y, z = grid_coords(params)
+    lx, _, lz = domain_size(params)
+    shape = (params["nz"], params["ny"], params["nx"])
+    spacing = (params["dx_de"], ) * 3
+    zz = z[:, None, None]
+    xx = x[None, None, :]
+    b0 = params["b0"]
+    half_thickness = math.sqrt(params["mime"])  # one di
+    # the island grows with time
+    psi0 = params["island"] * b0 * (1.0 + tframe / float(params["nframes"]))
+    kx, kz = 2 * math.pi / lx, math.pi / lz
+    # Ay = -L ln cosh(z/L) + amp cos(kx x) cos(kz z)
+    amp = psi0 / kz
+    fields = {}
+    fields["bx"] = (b0 * np.tanh(zz / half_thickness) +
+                    amp * kz * np.cos(kx * xx) * np.sin(kz * zz))
+    fields["bz"] = -amp * kx * np.sin(kx * xx) * np.cos(kz * zz)
+    fields["by"] = np.full_like(fields["bx"], params["guide_field"] * b0)
+    for var in ['bx', 'by', 'bz']:
+        fields[var] = fields[var] + params["noise"] * b0 * turbulence(
+            rng, shape, spacing, params["spectral_index"])
+    erec = 0.1 * b0 * params["vthe"]
+    for var in ['ex', 'ey', 'ez']:
+        fields[var] = 0.1 * erec * turbulence(rng, shape, spacing,
+                                              params["spectral_index"])
+    fields["ey"] += erec
+    fields["absB"] = np.sqrt(fields["bx"]**2 + fields["by"]**2 +
+                             fields["bz"]**2)
+    dx = params["dx_de"]
+    fields["jy"] = (np.gradient(fields["bx"], dx, axis=0) -
+                    np.gradient(fields["bz"], dx, axis=2))
+    density = 1.0 / np.cosh(zz / half_thickness)**2 + 0.2
+    fields["ne"] = np.broadcast_to(density, shape) * (
+        1.0 + 0.01 * rng.standard_normal(shape))
+    fields["ni"] = fields["ne"] * (1.0 + 0.001 * rng.standard_normal(shape))
+    return dict((var, np.asarray(fields[var], dtype=np.float32))
+                for var in params["variables"])
+
+
+def smooth_cube(fdata, factor):
+    """Average the cells of a (nz, ny, nx) array in blocks of factor^ndim
+    """
+    nz, ny, nx = fdata.shape
+    fy = factor if ny > 1 else 1
+    return fdata.reshape(nz // factor, factor, ny // fy, fy,
+                         nx // factor, factor).mean(axis=(1, 3, 5))
+
+
+def write_fields(run_dir, params):
+    """Write data/<var>.gda and data-smooth/<var>_<tindex>.gda
+    """
+    mkdir_p(run_dir + 'data')
+    mkdir_p(run_dir + 'data-smooth')
+    fhs = dict((var, open(run_dir + 'data/' + var + '.gda', 'wb'))
+               for var in params["variables"])
+    try:
+        for tframe in range(params["nframes"]):
+            tindex = tframe * params["fields_interval"]
+            fields = frame_fields(params, tframe)
+            for var, fdata in fields.items():
+                fdata.tofile(fhs[var])
+                fsmooth = smooth_cube(fdata, params["smooth_factor"])
+                fsmooth.astype(np.float32).tofile(
+                    run_dir + 'data-smooth/' + var + '_' + str(tindex) +
+                    '.gda')
+    finally:
+        for fh in fhs.values():
+            fh.close()
+
+
+def dump_header(params, rank, tindex, array_header, species_id):
+    """The headers of a dump file of one rank (see vpic_schema)
+    """
+    dtwpe, _, _ = time_units(params)
+    header = np.zeros(1, dtype=vpic_schema.file_dtype(array_header))
+    # packed byte by byte as WRITE_HEADER_V0 does, so the readers are checked
+    # against the VPIC layout rather than against their own schema
+    header['boilerplate'] = np.frombuffer(
+        struct.pack('<5bHIfd', 8, 2, 4, 4, 8, 0xcafe, 0xdeadbeef, 1.0, 1.0),
+        dtype=vpic_schema.BOILERPLATE)
+    v0 = header['v0']
+    v0['version'] = 0
+    v0['type'] = 3 if array_header is vpic_schema.PARTICLE_ARRAY_HEADER else 2
+    v0['nt'] = tindex
+    v0['nx'], v0['ny'], v0['nz'] = local_grid(params)
+    v0['dt'] = dtwpe
+    v0['dx'] = v0['dy'] = v0['dz'] = params["dx_de"]
+    v0['x0'], v0['y0'], v0['z0'] = rank_corner(params, rank)
+    v0['cvac'] = 1.0
+    v0['eps0'] = 1.0
+    v0['rank'] = rank
+    v0['ndom'] = nranks(params)
+    v0['spid'] = species_id
+    v0['spqm'] = -1.0 if species_id == 0 else 1.0 / params["mime"]
+    return header
+
+
+def rank_particles(params, rank, tindex, species):
+    """The particles of one rank and one species
+
+    The momenta are Maxwellian with a small power-law tail.
+    """
+    rng = np.random.RandomState([params["seed"], tindex, rank,
+                                 0 if species == 'e' else 1])
+    nxl, nyl, nzl = local_grid(params)
+    ncells = nxl * nyl * nzl
+    nptl = ncells * params["nppc"]
+    ptl = np.zeros(nptl, dtype=vpic_schema.PARTICLE)
+    # the cells are 1-based with the ghost cells
+    ix = rng.randint(1, nxl + 1, nptl)
+    iy = rng.randint(1, nyl + 1, nptl)
+    iz = rng.randint(1, nzl + 1, nptl)
+    ptl['icell'] = ix + (nxl + 2) * (iy + (nyl + 2) * iz)
+    ptl['dxyz'] = rng.uniform(-1, 1, (nptl, 3))
+    vth = params["vthe"]
+    if species != 'e':
+        vth *= math.sqrt(params["ti_te"] / params["mime"])
+    ptl['u'] = rng.normal(0, vth, (nptl, 3))
+    tail = rng.random_sample(nptl) < 0.01
+    ntail = np.count_nonzero(tail)
+    if ntail:
+        # gamma - 1 with a power-law index of 2 above 10 vth^2
+        ene = 10 * vth**2 * (1.0 - rng.random_sample(ntail))**-1.0
+        umag = np.sqrt(ene * (ene + 2))
+        direction = rng.standard_normal((ntail, 3))
+        direction /= np.sqrt(np.sum(direction**2, axis=1))[:, None]
+        ptl['u'][tail] = umag[:, None] * direction
+    ptl['q'] = params["dx_de"]**3 / params["nppc"]
+    return ptl
+
+
+def write_particles(run_dir, params):
+    """Write particle/T.<tindex>/{e,h}particle.<tindex>.<rank>
+    """
+    interval = params["particle_every"] * params["fields_interval"]
+    last = (params["nframes"] - 1) * params["fields_interval"]
+    for tindex in range(0, last + 1, interval):
+        fdir = run_dir + 'particle/T.' + str(tindex) + '/'
+        mkdir_p(fdir)
+        for species_id, species in enumerate(['e', 'h']):
+            for rank in range(nranks(params)):
+                ptl = rank_particles(params, rank, tindex, species)
+                header = dump_header(params, rank, tindex,
+                                     vpic_schema.PARTICLE_ARRAY_HEADER,
+                                     species_id)
+                header['array']['size'] = vpic_schema.PARTICLE.itemsize
+                header['array']['ndim'] = 1
+                header['array']['dim'] = len(ptl)
+                fname = (fdir + species + 'particle.' + str(tindex) + '.' +
+                         str(rank))
+                with open(fname, 'wb') as fh:
+                    header.tofile(fh)
+                    ptl.tofile(fh)
+
+
+def zone_spectra(params, rng, nzone, vth, ebins):
+    """Particle counts in the energy bins of the zones of one rank
+
+    Returns:
+        (nzone, nbins) float32 array
+    """
+    ene = 0.5 * (ebins[1:] + ebins[:-1])
+    dene = np.diff(ebins)
+    temp = vth**2 * (1.0 + 0.2 * rng.random_sample((nzone, 1)))
+    fmaxwell = np.sqrt(ene) * np.exp(-ene / temp) / temp**1.5
+    ftail = 1E-3 * (ene / (10 * temp))**-2.0 / temp
+    ftail[:, ene < 10 * vth**2] = 0.0
+    zone_cells = params["zone_size"]**(2 if params["ny"] == 1 else 3)
+    fdata = (fmaxwell + ftail) * dene * params["nppc"] * zone_cells
+    return fdata.astype(np.float32)
+
+
+def write_spectra(run_dir, params):
+    """Write hydro/T.<tindex>/spectrum-{e,H}hydro.<tindex>.<rank>
+
+    The energy bins are logarithmic between emin_spect and emax_spect, as
+    in combine_energy_spectrum.
+    """
+    nxl, nyl, nzl = local_grid(params)
+    zone = params["zone_size"]
+    nzone = (max(1, nxl // zone) * max(1, nyl // zone) *
+             max(1, nzl // zone))
+    elog = np.logspace(math.log10(params["emin_spect"]),
+                       math.log10(params["emax_spect"]),
+                       params["nbins_spect"] + 1)
+    for tframe in range(params["nframes"]):
+        tindex = tframe * params["fields_interval"]
+        fdir = run_dir + 'hydro/T.' + str(tindex) + '/'
+        mkdir_p(fdir)
+        for species in ['e', 'H']:
+            vth = params["vthe"]
+            if species == 'H':
+                vth *= math.sqrt(params["ti_te"] / params["mime"])
+            for rank in range(nranks(params)):
+                rng = np.random.RandomState([params["seed"], tindex, rank])
+                fdata = zone_spectra(params, rng, nzone, vth, elog)
+                fdata.tofile(fdir + 'spectrum-' + species + 'hydro.' +
+                             str(tindex) + '.' + str(rank))
+
+
+def tracer_meta_data(params):
+    """The tracer meta data as from tracer_reduce.get_meta_data
+    """
+    ncpu = nranks(params)
+    corners = np.asarray([rank_corner(params, rank) for rank in range(ncpu)])
+    nxl, nyl, nzl = local_grid(params)
+    dx = params["dx_de"]
+    return {'np_local': np.zeros(ncpu, dtype=np.int32),
+            'x0': corners[:, 0], 'y0': corners[:, 1], 'z0': corners[:, 2],
+            'grid_size_mpi': [nxl * dx, nyl * dx, nzl * dx],
+            'grid_size': [dx, dx, dx],
+            'grid_dims': [nxl, nyl, nzl]}
+
+
+def tracer_step(params, species, tstep):
+    """The tracers of one species at one tracer step
+
+    The tracers stream along x with random momenta.
+
+    Returns:
+        a dictionary of the datasets sorted by the tags
+    """
+    rng = np.random.RandomState([params["seed"], 7, tstep])
+    ntracer = params["ntracer"]
+    vth = params["vthe"]
+    if species != 'electron':
+        vth *= math.sqrt(params["ti_te"] / params["mime"])
+    init = np.random.RandomState([params["seed"], 7,
+                                  0 if species == 'electron' else 1])
+    lsize = domain_size(params)
+    lmin = [0.0, -0.5 * lsize[1], -0.5 * lsize[2]]
+    pos0 = init.random_sample((3, ntracer))
+    ux = init.normal(0, vth, ntracer)
+    ptl = {}
+    ptl['Ux'] = ux + 0.1 * vth * rng.standard_normal(ntracer)
+    for name in ['Uy', 'Uz']:
+        ptl[name] = (init.normal(0, vth, ntracer) +
+                     0.1 * vth * rng.standard_normal(ntracer))
+    dtwpe, _, _ = time_units(params)
+    tinterval = params["fields_interval"] // params["tracer_every"]
+    shift = ux * tstep * tinterval * dtwpe
+    dx = params["dx_de"]
+    nxl, nyl, nzl = local_grid(params)
+    tops = params["topology"]
+    icell = np.zeros(ntracer, dtype=np.int32)
+    strides = [1, nxl + 2, (nxl + 2) * (nyl + 2)]
+    for idim, name in enumerate(['dX', 'dY', 'dZ']):
+        pos = pos0[idim] * lsize[idim]
+        if idim == 0:
+            pos = np.mod(pos + shift, lsize[0])
+        ptl[name] = (lmin[idim] + pos).astype(np.float32)
+        # the cell in the local domain with the ghost cells
+        nl = [nxl, nyl, nzl][idim]
+        icell_global = np.minimum((pos / dx).astype(np.int64),
+                                  nl * tops[idim] - 1)
+        icell += ((icell_global % nl + 1) * strides[idim]).astype(np.int32)
+    ptl['i'] = icell
+    ptl['q'] = np.arange(1, ntracer + 1, dtype=np.int32)
+    for name in TRACER_EMF:
+        ptl[name] = 0.01 * rng.standard_normal(ntracer).astype(np.float32)
+    ptl['Bx'] += np.tanh(ptl['dZ'] / math.sqrt(params["mime"]))
+    for name in ['Ux', 'Uy', 'Uz']:
+        ptl[name] = ptl[name].astype(np.float32)
+    return ptl
+
+
+def write_tracers(run_dir, params):
+    """Write the tracer files of all the tracer steps
+
+    Each file has one Step#<tindex> group. In <species>_tracer_reduced.h5p,
+    the tracers are in a random order as dumped by the ranks, and in
+    <species>_tracer_qtag_sorted.h5p, they are sorted by their tags.
+    """
+    tinterval = params["fields_interval"] // params["tracer_every"]
+    last = (params["nframes"] - 1) * params["fields_interval"]
+    meta_data = tracer_meta_data(params)
+    for tstep, tindex in enumerate(range(0, last + 1, tinterval)):
+        fdir = run_dir + 'tracer/T.' + str(tindex) + '/'
+        mkdir_p(fdir)
+        gname = 'Step#' + str(tindex)
+        for species in TRACER_SPECIES:
+            ptl = tracer_step(params, species, tstep)
+            fname = fdir + species + '_tracer_qtag_sorted.h5p'
+            with h5py.File(fname, 'w') as fh:
+                grp = fh.create_group(gname)
+                for name in TRACER_DSETS + TRACER_EMF:
+                    grp.create_dataset(name, data=ptl[name])
+            rng = np.random.RandomState([params["seed"], 11, tstep])
+            order = rng.permutation(params["ntracer"])
+            fname = fdir + species + '_tracer_reduced.h5p'
+            with h5py.File(fname, 'w') as fh:
+                grp = fh.create_group(gname)
+                for name in TRACER_DSETS:
+                    grp.create_dataset(name, data=ptl[name][order])
+            if tindex == 0:
+                fname = fdir + 'grid_metadata_' + species + '_tracer.h5p'
+                with h5py.File(fname, 'w') as fh:
+                    grp = fh.create_group(gname)
+                    for idim, name in enumerate(['x', 'y', 'z']):
+                        grp.create_dataset('d' + name, (1, ),
+                                           data=meta_data['grid_size'][idim])
+                        grp.create_dataset('n' + name, (1, ),
+                                           data=meta_data['grid_dims'][idim])
+                        grp.create_dataset(name + '0',
+                                           data=meta_data[name + '0'])
+                    grp.create_dataset('np_local',
+                                       data=meta_data['np_local'])
+
+
+def save_pic_info(run_dir, run_name):
+    """Save the PIC information of a run in ../data/pic_info/
+    """
+    import pic_information
+    from serialize_json import data_to_json
+    pic_info = pic_information.get_pic_info(run_dir, run_name)
+    mkdir_p(PIC_INFO_DIR)
+    fname = PIC_INFO_DIR + 'pic_info_' + run_name + '.json'
+    with open(fname, 'w') as fh:
+        json.dump(data_to_json(pic_info), fh)
+    return pic_info
+
+
+def run_params(run_dir):
+    """The parameters of an existing synthetic run, or None
+    """
+    fname = run_dir + MANIFEST
+    if not os.path.isfile(fname):
+        return None
+    with open(fname, 'r') as fh:
+        return json.load(fh)
+
+
+def make_run(run_name, params, run_root=RUN_ROOT, force=False):
+    """Write a synthetic run unless it exists with the same parameters
+
+    Args:
+        run_name: the name of the run
+        params: the parameters from default_params
+        run_root: the directory of the runs
+        force: whether to write the run even when it exists
+
+    Returns:
+        the run directory
+    """
+    run_dir = run_root + run_name + '/'
+    # through a JSON round trip, so tuples compare equal to lists
+    params = json.loads(json.dumps(params))
+    if not force and run_params(run_dir) == params:
+        print("%s exists" % run_dir)
+        return run_dir
+    print("Writing the synthetic run %s" % run_dir)
+    mkdir_p(run_dir)
+    if os.path.isfile(run_dir + MANIFEST):
+        os.remove(run_dir + MANIFEST)
+    write_info(run_dir, params)
+    write_fields(run_dir, params)
+    write_particles(run_dir, params)
+    write_spectra(run_dir, params)
+    write_tracers(run_dir, params)
+    save_pic_info(run_dir, run_name)
+    # the manifest is written last, so an interrupted run is written again
+    with open(run_dir + MANIFEST, 'w') as fh:
+        json.dump(params, fh, indent=2)
+    return run_dir
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Synthetic VPIC run')
+    parser.add_argument('--size', action="store", default='small',
+                        choices=sorted(SIZES), help='preset grid size')
+    parser.add_argument('--grid', nargs=3, type=int, default=None,
+                        help='grid size nx ny nz instead of the preset')
+    parser.add_argument('--run_name', action="store", default=None,
+                        help='run name (synthetic_<size> by default)')
+    parser.add_argument('--run_root', action="store", default=RUN_ROOT,
+                        help='directory of the synthetic runs')
+    parser.add_argument('--nframes', action="store", default='4', type=int,
+                        help='number of fields frames')
+    parser.add_argument('--nppc', action="store", default='4', type=int,
+                        help='number of particles per cell of each species')
+    parser.add_argument('--ntracer', action="store", default='4096',
+                        type=int, help='number of tracers of each species')
+    parser.add_argument('--seed', action="store", default='0', type=int,
+                        help='random seed')
+    parser.add_argument('--force', action="store_true", default=False,
+                        help='whether to write the run even when it exists')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    grid = args.grid or SIZES[args.size]
+    run_name = args.run_name
+    if run_name is None:
+        run_name = 'synthetic_' + ('x'.join(str(n) for n in grid)
+                                   if args.grid else args.size)
+    params = default_params(*grid, nframes=args.nframes, nppc=args.nppc,
+                            ntracer=args.ntracer, seed=args.seed)
+    make_run(run_name, params, args.run_root, args.force)
+
+
+if __name__ == "__main__":
+    main()
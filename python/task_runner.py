@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Shared runner of the frame-by-frame analyses
+
+An analysis is registered as a named task with a function of plot_config,
+which analyzes the frame plot_config["tframe"]. The runner provides the
+command line flags of the tasks, the frame ranges, and the parallel
+execution. The number of worker processes is limited by the estimated
+memory footprint of one frame, and the (task, frame) jobs are dispatched
+one at a time to the free workers, so the slow frames and the fast frames
+of different tasks are balanced dynamically. Under mpirun or srun, the jobs
+are spread over the MPI ranks instead (see parallel_backend). With
+--resume, the (task, frame) jobs completed by a killed run are skipped.
+With --profile, the time of the tasks, the bytes read and the peak memory
+of all the processes are saved in a report (see instrument).
+
+    RUNNER = task_runner.TaskRunner()
+    RUNNER.add_task('jslice', plot_jslice, help='plot slices of |J|',
+                    frame_bytes=task_runner.grid_bytes(4, reduce=2))
+    ...
+    parser = task_runner.common_parser('Analysis for Cori 3D runs',
+                                       default_pic_run, default_pic_run_dir)
+    RUNNER.add_arguments(parser)
+    args = parser.parse_args()
+    RUNNER.run(task_runner.plot_config_from_args(args, RUNNER), args)
+
+A script with its own argparse and dispatchers can be migrated one task at
+a time: the migrated tasks are registered, RUNNER.add_arguments adds their
+flags to the existing parser, and RUNNER.run is called when
+RUNNER.selected(args) is not empty.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import inspect
+import multiprocessing
+import os
+import time
+
+import checkpoint
+import instrument
+import parallel_backend
+from json_functions import read_data_from_json
+
+# the arguments of common_parser that are not copied into plot_config
+RUNNER_ARGS = checkpoint.RUNNER_ARGS
+
+
+class Task(object):
+    """An analysis that is done frame by frame
+    """
+
+    def __init__(self, name, func, frame_bytes=0, help='', setup=None):
+        """
+        Args:
+            name: the name of the task, which is also its command line flag
+            func: the function of plot_config. If it has a show_plot
+                argument, it is set to False for multiple frames.
+            frame_bytes: the estimated memory footprint in bytes for one
+                frame, or a function of plot_config returning it
+            help: the help message of the command line flag
+            setup: function called before the task in each process, e.g.,
+                to set the style of the plots
+        """
+        self.name = name
+        self.func = func
+        self.frame_bytes = frame_bytes
+        self.help = help
+        self.setup = setup
+        try:
+            params = inspect.signature(func).parameters
+        except AttributeError:  # Python 2
+            params = inspect.getargspec(func).args
+        self.has_show_plot = 'show_plot' in params
+
+    def memory(self, plot_config):
+        """Estimated memory footprint in bytes for one frame
+        """
+        if callable(self.frame_bytes):
+            return int(self.frame_bytes(plot_config))
+        return int(self.frame_bytes)
+
+    def __call__(self, plot_config, show_plot=None):
+        if self.setup is not None:
+            self.setup()
+        with instrument.stage(self.name):
+            if self.has_show_plot and show_plot is not None:
+                return self.func(plot_config, show_plot=show_plot)
+            return self.func(plot_config)
+
+
+def available_memory():
+    """Available memory of the node in bytes, or None when it is unknown
+    """
+    try:
+        with open('/proc/meminfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_count(frame_bytes, ncores=None, mem_fraction=0.8):
+    """Number of workers that fit in memory
+
+    Args:
+        frame_bytes: the memory footprint in bytes of one frame
+        ncores: the maximum number of workers. The default is the number of
+            CPU cores.
+        mem_fraction: the fraction of the available memory to use
+    """
+    if not ncores:
+        ncores = multiprocessing.cpu_count()
+    mem = available_memory()
+    if frame_bytes > 0 and mem is not None:
+        ncores = min(ncores, int(mem * mem_fraction // frame_bytes))
+    return max(1, ncores)
+
+
+def pic_grid_size(pic_run):
+    """Number of grid cells of a PIC run from its saved PIC information
+    """
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    return pic_info.nx * pic_info.ny * pic_info.nz
+
+
+def grid_bytes(nvars, reduce=1, itemsize=4):
+    """Footprint of nvars fields of plot_config["pic_run"]
+
+    Args:
+        nvars: number of fields in memory at the same time
+        reduce: the fields are reduced by this factor in each dimension,
+            e.g., 2 for data-smooth
+        itemsize: bytes of one value
+
+    Returns:
+        a function of plot_config to be used as the frame_bytes of a task
+    """
+    def frame_bytes(plot_config):
+        ncells = pic_grid_size(plot_config["pic_run"])
+        return nvars * itemsize * ncells // reduce**3
+    return frame_bytes
+
+
+def run_job(job, plot_config):
+    """Run one task for one frame in a worker process
+
+    Args:
+        job: (task, tframe)
+        plot_config: the parameters shared by all the jobs
+    """
+    task, tframe = job
+    plot_config = dict(plot_config, tframe=tframe)
+    print("%s: time frame %d" % (task.name, tframe))
+    task(plot_config, show_plot=False)
+
+
+def job_unit(job, index):
+    """The checkpoint unit of a (task, tframe) job
+    """
+    task, tframe = job
+    return (task.name, int(tframe))
+
+
+class TaskRunner(object):
+    """Registry and runner of the tasks of a script
+    """
+
+    def __init__(self, setup=None):
+        """
+        Args:
+            setup: function called before each task in each process (see
+                Task)
+        """
+        self.tasks = collections.OrderedDict()
+        self.setup = setup
+
+    def add_task(self, name, func, frame_bytes=0, help=''):
+        """Register a task (see Task)
+        """
+        self.tasks[name] = Task(name, func, frame_bytes, help, self.setup)
+        return self.tasks[name]
+
+    def task(self, name, frame_bytes=0, help=''):
+        """Decorator version of add_task
+        """
+        def register(func):
+            self.add_task(name, func, frame_bytes, help)
+            return func
+        return register
+
+    def add_arguments(self, parser):
+        """Add the flags of the tasks and the runner options to a parser
+
+        The options of common_parser, which most scripts have already, are
+        not added here.
+        """
+        group = parser.add_argument_group('tasks')
+        for task in self.tasks.values():
+            group.add_argument('--' + task.name, action="store_true",
+                               default=False, help=task.help)
+        parser.add_argument('--ncores', action="store", default=None,
+                            type=int, help='maximum number of processes')
+        parser.add_argument('--mem_fraction', action="store", default='0.8',
+                            type=float,
+                            help='fraction of the available memory to use')
+        parser.add_argument('--resume', action="store_true", default=False,
+                            help='whether to skip the frames done by the ' +
+                            'last run')
+        parser.add_argument('--profile', action="store_true", default=False,
+                            help='whether to save the time and I/O report')
+
+    def selected(self, args):
+        """The tasks selected on the command line
+        """
+        return [task for name, task in self.tasks.items()
+                if getattr(args, name, False)]
+
+    def run(self, plot_config, args):
+        """Run the selected tasks, and save the report with args.profile
+        """
+        if args.profile:
+            instrument.enable()
+        tstart = time.time()
+        with instrument.stage('tasks'):
+            self.run_frames(plot_config, args)
+        if instrument.enabled() and parallel_backend.get_backend().is_master:
+            names = sorted(task.name for task in self.selected(args))
+            instrument.write_report('tasks_' + '_'.join(names), tstart)
+
+    def run_frames(self, plot_config, args):
+        """Run the selected tasks for the frames
+
+        The tasks are run for args.tframe, or for args.tstart to args.tend
+        when args.multi_frames is set, either in a loop (args.time_loop) or
+        in parallel. Under MPI, only the master runs the single frames and
+        the time loops. The completed jobs are recorded in a checkpoint, so
+        they are skipped with args.resume.
+        """
+        tasks = self.selected(args)
+        if not tasks:
+            print("No task is selected. The tasks are: --" +
+                  ", --".join(self.tasks))
+            return
+        backend = parallel_backend.get_backend(args.ncores)
+        if not args.multi_frames:
+            if backend.is_master:
+                plot_config = dict(plot_config, tframe=args.tframe)
+                for task in tasks:
+                    task(plot_config)
+            return
+        tframes = range(args.tstart, args.tend + 1)
+        jobs = [(task, tframe) for task in tasks for tframe in tframes]
+        # the frames are in the units, so a longer run resumes a shorter one
+        params = dict((key, value) for key, value in plot_config.items()
+                      if key not in ['tframe', 'tstart', 'tend'])
+        name = 'tasks_' + '_'.join(sorted(task.name for task in tasks))
+        ckpt = checkpoint.Checkpoint(name, params, resume=args.resume,
+                                     key=job_unit)
+        if args.time_loop:
+            if backend.is_master:
+                with ckpt:
+                    for i in ckpt.pending(jobs):
+                        run_job(jobs[i], plot_config)
+                        ckpt.record(job_unit(jobs[i], i))
+            return
+        memory = dict((task.name, task.memory(plot_config)) for task in tasks)
+        ncores = worker_count(max(memory.values()), args.ncores,
+                              args.mem_fraction)
+        backend = parallel_backend.get_backend(ncores)
+        # the tasks with the largest frames first, so the small ones fill
+        # the gaps at the end
+        jobs.sort(key=lambda job: memory[job[0].name], reverse=True)
+        if backend.is_master:
+            print("Running %d jobs on %d processes" %
+                  (len(jobs), backend.ncores))
+        backend.map(run_job, jobs, plot_config, checkpoint=ckpt)
+
+
+def common_parser(description, default_pic_run, default_pic_run_dir):
+    """Parser with the arguments shared by the analysis scripts
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--species', action="store",
+                        default="e", help='Particle species')
+    parser.add_argument('--tframe', action="store", default='20', type=int,
+                        help='Time frame')
+    parser.add_argument('--multi_frames', action="store_true", default=False,
+                        help='whether to analyze multiple frames')
+    parser.add_argument('--time_loop', action="store_true", default=False,
+                        help='whether to use a time loop to analyze multiple frames')
+    parser.add_argument('--tstart', action="store", default='0', type=int,
+                        help='starting time frame')
+    parser.add_argument('--tend', action="store", default='40', type=int,
+                        help='ending time frame')
+    return parser
+
+
+def plot_config_from_args(args, runner=None):
+    """plot_config with the arguments that are not runner options or tasks
+    """
+    skip = set(RUNNER_ARGS)
+    if runner is not None:
+        skip.update(runner.tasks)
+    return dict((key, value) for key, value in vars(args).items()
+                if key not in skip)
@@ -247,7 +247,8 @@ def plot_jy_multi():
     gap = 0.05
     fig = plt.figure(figsize=[7, 5])
     ax1 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5,
+                   "dpi": 300}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p1, cbar1 = plot_2d_contour(x, z, jy1, ax1, fig, **kwargs_plot)
@@ -267,7 +268,8 @@ def plot_jy_multi():
 
     ys -= height + gap
     ax2 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -0.5, "vmax": 0.5,
+                   "dpi": 300}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p2, cbar2 = plot_2d_contour(x, z, jy2, ax2, fig, **kwargs_plot)
@@ -287,7 +289,8 @@ def plot_jy_multi():
 
     ys -= height + gap
     ax3 = fig.add_axes([xs, ys, width, height])
-    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -1.0, "vmax": 1.0}
+    kwargs_plot = {"xstep": 1, "zstep": 1, "vmin": -1.0, "vmax": 1.0,
+                   "dpi": 300}
     xstep = kwargs_plot["xstep"]
     zstep = kwargs_plot["zstep"]
     p3, cbar3 = plot_2d_contour(x, z, jy3, ax3, fig, **kwargs_plot)
@@ -0,0 +1,205 @@
+"""
+Plotting-free bucketed sort of the reduced particle tracers by MPI rank
+
+It is split from tracer_reduce, which imports matplotlib, so the sort runs
+in the benchmarks and in worker processes without the plotting modules.
+The functions are still available from tracer_reduce.
+"""
+from __future__ import print_function
+
+import numpy as np
+
+from lazy_import import lazy_module
+
+h5py = lazy_module('h5py')
+
+
+def get_tracer_mpi_rank(pos, pmin, meta_data, pic_info):
+    """Get the MPI rank of each tracer from its position
+
+    Args:
+        pos: tracer positions as a list of [dX, dY, dZ]
+        pmin: the minimum of the domain along each axis
+        meta_data: tracer meta data from get_meta_data
+        pic_info: PIC simulation information
+    """
+    tops = [pic_info.topology_x, pic_info.topology_y, pic_info.topology_z]
+    mpi_rank = np.zeros(pos[0].shape, dtype=np.int32)
+    stride = 1
+    for idim in range(3):
+        iproc = ((pos[idim] - pmin[idim]) //
+                 meta_data['grid_size_mpi'][idim]).astype(np.int32)
+        np.clip(iproc, 0, tops[idim] - 1, out=iproc)
+        mpi_rank += iproc * stride
+        stride *= tops[idim]
+    return mpi_rank
+
+
+def local_tracer_position(pos, icell, idim, pmin, meta_data, pic_info):
+    """Transfer global tracer positions to the offsets in the local cell
+
+    The offsets are in [-1, 1] as in the VPIC particle data
+
+    Args:
+        pos: tracer positions along one axis
+        icell: cell indices of the tracers (including ghost cells)
+        idim: 0, 1, 2 for x, y, z
+        pmin: the minimum of the domain along each axis
+        meta_data: tracer meta data from get_meta_data
+        pic_info: PIC simulation information
+    """
+    tops = [pic_info.topology_x, pic_info.topology_y, pic_info.topology_z]
+    dl_mpi = meta_data['grid_size_mpi'][idim]
+    dl = meta_data['grid_size'][idim]
+    nx, ny, nz = meta_data['grid_dims']
+    nl = meta_data['grid_dims'][idim]
+    nx1 = nx + 2
+    ny1 = ny + 2
+    if idim == 0:
+        ip = icell % nx1
+    elif idim == 1:
+        ip = (icell % (nx1 * ny1)) // nx1
+    else:
+        ip = icell // (nx1 * ny1)
+    iproc = (pos - pmin[idim]) // dl_mpi
+    np.clip(iproc, 0, tops[idim] - 1, out=iproc)
+    dpos = ((pos - iproc * dl_mpi - pmin[idim]) / dl - ip + 1) * 2 - 1
+    dpos = dpos.astype(np.float32)
+    dpos[(dpos < -1) & (ip == nl)] = 1.0
+    dpos[(dpos > 1) & (ip == 1)] = -1.0
+    return dpos
+
+
+def tracer_bucket_index(mpi_rank, ncpu, chunk_size=2**22):
+    """Get the destination of each tracer when bucketed by MPI rank
+
+    This is a stable counting sort. The counts are from np.bincount, the
+    offsets are the prefix-sum of the counts, and the destinations are
+    assigned chunk by chunk, so only small argsorts are needed.
+
+    Args:
+        mpi_rank: the MPI rank of each tracer
+        ncpu: total number of MPI ranks
+        chunk_size: number of tracers in each chunk
+
+    Returns:
+        dest: the destination index of each tracer
+        np_local: number of tracers in each MPI rank
+    """
+    nptl, = mpi_rank.shape
+    np_local = np.bincount(mpi_rank, minlength=ncpu)
+    cursor = np.zeros(ncpu, dtype=np.int64)
+    cursor[1:] = np.cumsum(np_local[:-1])
+    dest = np.empty(nptl, dtype=np.int64)
+    for istart in range(0, nptl, chunk_size):
+        iend = min(istart + chunk_size, nptl)
+        rank_chunk = mpi_rank[istart:iend]
+        counts = np.bincount(rank_chunk, minlength=ncpu)
+        order = np.argsort(rank_chunk, kind='stable')
+        rank_sorted = rank_chunk[order]
+        # position of each tracer inside its bucket in this chunk
+        bucket_start = np.zeros(ncpu, dtype=np.int64)
+        bucket_start[1:] = np.cumsum(counts[:-1])
+        ipos = np.arange(iend - istart) - bucket_start[rank_sorted]
+        dest[istart + order] = cursor[rank_sorted] + ipos
+        cursor += counts
+    return dest, np_local.astype(np.int32)
+
+
+def bucket_tracer_data(pic_info,
+                       pmin,
+                       meta_data,
+                       ct,
+                       species,
+                       root_path='../../',
+                       chunk_size=2**22):
+    """Sort tracer data by MPI rank with a bucketed (counting) sort
+
+    It is an alternative of sort_tracer_data for large number of tracers.
+    Only the MPI rank of each tracer and the destination indices are kept
+    for all tracers. The datasets are then scattered one column at a time
+    into preallocated datasets, so the memory is bounded by about one column.
+
+    Args:
+        pic_info: PIC simulation information
+        pmin: the minimum of the domain along each axis
+        meta_data: tracer meta data from get_meta_data
+        ct: time step
+        species: particle species
+        root_path: the root path of the PIC run
+        chunk_size: number of tracers read in each chunk
+    """
+    fpath = root_path + 'tracer/T.' + str(ct) + '/'
+    fname_reduced = fpath + species + '_tracer_reduced.h5p'
+    gname = 'Step#' + str(ct)
+    ncpu = pic_info.topology_x * pic_info.topology_y * pic_info.topology_z
+    fname_sorted = fpath + species + '_tracer_reduced_sorted.h5p'
+    with h5py.File(fname_reduced, 'r') as fh_in:
+        group = fh_in[gname]
+        nptl, = group['q'].shape
+        mpi_rank = np.empty(nptl, dtype=np.int32)
+        for istart in range(0, nptl, chunk_size):
+            iend = min(istart + chunk_size, nptl)
+            pos = [group[var][istart:iend] for var in ['dX', 'dY', 'dZ']]
+            mpi_rank[istart:iend] = get_tracer_mpi_rank(pos, pmin,
+                                                        meta_data, pic_info)
+        dest, np_local = tracer_bucket_index(mpi_rank, ncpu, chunk_size)
+        del mpi_rank
+
+        with h5py.File(fname_sorted, 'w') as fh_out:
+            grp = fh_out.create_group(gname)
+            for var in ['dX', 'dY', 'dZ', 'Ux', 'Uy', 'Uz', 'i', 'q']:
+                dset_in = group[var]
+                if var in ['dX', 'dY', 'dZ']:
+                    dtype = np.float32
+                else:
+                    dtype = dset_in.dtype
+                dset_out = grp.create_dataset(var, (nptl, ), dtype=dtype)
+                fdata = np.empty(nptl, dtype=dtype)
+                for istart in range(0, nptl, chunk_size):
+                    iend = min(istart + chunk_size, nptl)
+                    fchunk = dset_in[istart:iend]
+                    if var in ['dX', 'dY', 'dZ']:
+                        idim = ['dX', 'dY', 'dZ'].index(var)
+                        icell = group['i'][istart:iend]
+                        fchunk = local_tracer_position(fchunk, icell, idim,
+                                                       pmin, meta_data,
+                                                       pic_info)
+                    fdata[dest[istart:iend]] = fchunk
+                dset_out.write_direct(fdata)
+                del fdata
+
+    grid_size = meta_data['grid_size']
+    grid_dims = meta_data['grid_dims']
+    fname = fpath + 'grid_metadata_' + species + '_tracer_reduced.h5p'
+    with h5py.File(fname, 'w') as fh:
+        grp = fh.create_group(gname)
+        grp.create_dataset('dx', (1, ), data=grid_size[0])
+        grp.create_dataset('dy', (1, ), data=grid_size[1])
+        grp.create_dataset('dz', (1, ), data=grid_size[2])
+        grp.create_dataset('nx', (1, ), data=grid_dims[0])
+        grp.create_dataset('ny', (1, ), data=grid_dims[1])
+        grp.create_dataset('nz', (1, ), data=grid_dims[2])
+        grp.create_dataset('x0', (ncpu, ), data=meta_data['x0'])
+        grp.create_dataset('y0', (ncpu, ), data=meta_data['y0'])
+        grp.create_dataset('z0', (ncpu, ), data=meta_data['z0'])
+        grp.create_dataset('np_local', (ncpu, ), data=np_local)
+
+
+def bucket_tracer_steps(pic_info,
+                        pmin,
+                        meta_data,
+                        cts,
+                        species,
+                        root_path='../../',
+                        chunk_size=2**22):
+    """Sort tracer data for multiple time steps in one process
+
+    Args:
+        cts: the time steps to process
+        The others are the same as bucket_tracer_data
+    """
+    for ct in cts:
+        print("Time step: %d" % ct)
+        bucket_tracer_data(pic_info, pmin, meta_data, ct, species,
+                           root_path, chunk_size)
@@ -0,0 +1,109 @@
+"""
+Vectorized time interpolation of particle trajectories
+
+The trajectories of all particles and all variables are interpolated
+together. The data are (steps x particles) arrays, and all the columns
+share the same time axis, so one set of interpolation weights (linear) or
+one spline with precomputed coefficients along the time axis (cubic) is
+used for all of them.
+"""
+import numpy as np
+
+from lazy_import import lazy_module
+
+interpolate = lazy_module('scipy.interpolate')
+
+
+def adjust_pos_batch(pos, length, axis=0):
+    """Adjust positions for periodic boundary conditions
+
+    It is the vectorized version of adjust_pos for many particles. A particle
+    is treated as crossing the boundary when it moves more than 0.1 * length
+    in one step.
+
+    Args:
+        pos: the positions along one axis. The time axis is given by axis.
+        length: the box size along that axis
+        axis: the time axis
+    """
+    pos = np.moveaxis(np.asarray(pos), axis, 0)
+    dpos = np.diff(pos, axis=0)
+    shift = np.zeros(dpos.shape)
+    shift[dpos < -0.1 * length] = length
+    shift[dpos > 0.1 * length] = -length
+    pos_b = np.array(pos, dtype=np.float64)
+    pos_b[1:] += np.cumsum(shift, axis=0)
+    return np.moveaxis(pos_b, 0, axis)
+
+
+def interp_linear_batch(t, fdata, tnew):
+    """Linear interpolation along the first axis of fdata
+
+    Args:
+        t: the original time points (sorted)
+        fdata: data with shape (len(t), ...)
+        tnew: the new time points within [t[0], t[-1]]
+    """
+    nt = len(t)
+    index = np.searchsorted(t, tnew, side='right') - 1
+    index = np.clip(index, 0, nt - 2)
+    weight = (tnew - t[index]) / (t[index + 1] - t[index])
+    weight = weight.reshape((-1, ) + (1, ) * (fdata.ndim - 1))
+    return fdata[index] * (1 - weight) + fdata[index + 1] * weight
+
+
+def interp_trajectories(t, ptl, tnew, interp_kind='linear', box_sizes=None,
+                        block_size=65536, keep_dtype=True):
+    """Interpolate the trajectories of many particles in time
+
+    Args:
+        t: the original time points
+        ptl: a dictionary of (len(t), nptl) arrays (or 1D arrays for a single
+            particle). All variables are interpolated except 't'.
+        tnew: the new time points
+        interp_kind: 'linear' or 'cubic'. The cubic spline is the same as
+            the one in scipy.interpolate.interp1d with kind='cubic'.
+        box_sizes: a dictionary of the box sizes for the positions that
+            need to be adjusted for periodic boundaries, e.g.,
+            {'dX': lx, 'dY': ly}
+        block_size: number of particles interpolated together
+        keep_dtype: whether to cast the results to the original data types.
+            Otherwise, the results are float64.
+
+    Returns:
+        a dictionary of the interpolated data
+    """
+    keys = [key for key in ptl if key != 't']
+    single = np.ndim(ptl[keys[0]]) == 1
+    fdata = {key: np.asarray(ptl[key]).reshape(len(t), -1) for key in keys}
+    nt, nptl = fdata[keys[0]].shape
+    nvar = len(keys)
+    ptl_new = {}
+    for key in keys:
+        dtype = fdata[key].dtype
+        if not keep_dtype or (box_sizes and key in box_sizes):
+            dtype = np.float64
+        ptl_new[key] = np.empty((len(tnew), nptl), dtype=dtype)
+    # Only one block of particles is converted to float64 at a time
+    for p0 in range(0, nptl, block_size):
+        p1 = min(p0 + block_size, nptl)
+        block = np.empty((nt, nvar, p1 - p0))
+        for ikey, key in enumerate(keys):
+            block[:, ikey] = fdata[key][:, p0:p1]
+            if box_sizes and key in box_sizes:
+                block[:, ikey] = adjust_pos_batch(block[:, ikey],
+                                                  box_sizes[key])
+        if interp_kind == 'linear':
+            fnew = interp_linear_batch(t, block, tnew)
+        elif interp_kind == 'cubic':
+            spline = interpolate.make_interp_spline(t, block, k=3, axis=0)
+            fnew = spline(tnew)
+        else:
+            raise ValueError("Unsupported interpolation kind: " + interp_kind)
+        for ikey, key in enumerate(keys):
+            ptl_new[key][:, p0:p1] = fnew[:, ikey]
+    if single:
+        ptl_new = {key: ptl_new[key][:, 0] for key in ptl_new}
+    if 't' in ptl:
+        ptl_new['t'] = np.asarray(tnew)
+    return ptl_new
@@ -19,8 +19,10 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 from mpl_toolkits.mplot3d import Axes3D
 
 import pic_information
-from particle_emf import read_var
 from shell_functions import *
+from tracer_bucket import (bucket_tracer_data, bucket_tracer_steps,
+                           get_tracer_mpi_rank, local_tracer_position,
+                           tracer_bucket_index)
 
 rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
 mpl.rc('text', usetex=True)
@@ -35,6 +37,20 @@ font = {
 }
 
 
+def read_var(group, dset_name, sz):
+    """Read data from a HDF5 group
+
+    Args:
+        group: one HDF5 group
+        var: the dataset name
+        sz: the size of the data
+    """
+    dset = group[dset_name]
+    fdata = np.zeros(sz, dtype=dset.dtype)
+    dset.read_direct(fdata)
+    return fdata
+
+
 def read_var_single(group, dset_name):
     """Read only a single data point from a HDF5 group
     """
@@ -200,9 +216,11 @@ if __name__ == "__main__":
     pmin = [xmin, ymin, zmin]
     cts = range(4394, 16615, 13)
 
-    def processInput(ct):
-        print ct
-        sort_tracer_data(pic_info, pmin, meta_data, ct, 'electron', root_dir)
-
+    # Each process deals with a group of time steps, so the tracer data of
+    # only one step is in the memory of each process.
     num_cores = multiprocessing.cpu_count()
-    Parallel(n_jobs=num_cores)(delayed(processInput)(ct) for ct in cts)
+    cts_groups = [cts[i::num_cores] for i in range(num_cores)]
+    Parallel(n_jobs=num_cores)(
+        delayed(bucket_tracer_steps)(pic_info, pmin, meta_data, cts_group,
+                                     'electron', root_dir)
+        for cts_group in cts_groups)
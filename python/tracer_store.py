@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Dual-layout chunked trajectory store for particle tracers
+
+Each tracer variable is saved as one 2D (step x particle) chunked HDF5
+dataset. The chunk shape is chosen so that both "all particles at one step"
+and "one particle over all steps" read a modest number of chunks. The
+particles can optionally be stored in the order of their tags, so the
+particles with neighbouring tags are in the same chunks.
+
+    store = TrajectoryStore(fname)
+    ptl = store.by_step(100, ['Ux', 'Uy', 'Uz'])
+    traj = store.by_particle([0, 10, 20])
+    traj = store.by_tag(tags)
+"""
+from __future__ import print_function
+
+import argparse
+import math
+
+import h5py
+import numpy as np
+
+from tracer_transpose import get_tracer_steps, read_hyperslabs
+
+
+def get_chunk_shape(nsteps, nptl, itemsize, chunk_bytes=2**20,
+                    row_cache_bytes=2**30):
+    """Get the chunk shape (steps x particles) for both access patterns
+
+    The number of steps in a chunk is about the square root of the number
+    of elements in a chunk, so the read amplification is balanced for the
+    two access patterns. It is reduced when one row of chunks (all particles
+    over the steps of a chunk) does not fit in row_cache_bytes, so a sweep
+    over steps reads each chunk only once.
+
+    Args:
+        nsteps: number of steps
+        nptl: number of particles
+        itemsize: number of bytes of one data point
+        chunk_bytes: targeted number of bytes of one chunk
+        row_cache_bytes: the maximum size of one row of chunks
+    """
+    chunk_size = max(1, chunk_bytes // itemsize)
+    csteps = 2**int(math.log(math.sqrt(chunk_size), 2))
+    while csteps > 1 and csteps * nptl * itemsize > row_cache_bytes:
+        csteps //= 2
+    csteps = min(csteps, nsteps)
+    cptls = min(max(1, chunk_size // csteps), nptl)
+    return (csteps, cptls)
+
+
+def build_trajectory_store(steps,
+                           fname_store,
+                           dset_names=None,
+                           sort_by_tag=False,
+                           chunk_bytes=2**20,
+                           mem_budget=2**30):
+    """Build a trajectory store from step-major tracer files
+
+    Args:
+        steps: the tracer steps from tracer_transpose.get_tracer_steps
+        fname_store: the file name of the store
+        dset_names: the datasets to store. All datasets when None.
+        sort_by_tag: whether to store the particles in the order of tags
+        chunk_bytes: targeted number of bytes of one chunk
+        mem_budget: memory budget in bytes for the data buffer
+    """
+    _, fname0, gname0 = steps[0]
+    with h5py.File(fname0, 'r') as fh:
+        group = fh[gname0]
+        if dset_names is None:
+            dset_names = list(group.keys())
+        dtypes = {name: group[name].dtype for name in dset_names}
+        nptl, = group[dset_names[0]].shape
+        tags = group['q'][:]
+    nsteps = len(steps)
+    if sort_by_tag:
+        ptl_order = np.argsort(tags, kind='stable')
+    else:
+        ptl_order = np.arange(nptl)
+    tags = tags[ptl_order]
+
+    itemsize = max(dtype.itemsize for dtype in dtypes.values())
+    chunks = get_chunk_shape(nsteps, nptl, itemsize, chunk_bytes)
+    csteps, cptls = chunks
+    # particle block is a multiple of the chunk size, so that every
+    # write covers full chunks
+    nptl_block = mem_budget // (csteps * itemsize * len(dset_names))
+    nptl_block = max(cptls, nptl_block // cptls * cptls)
+    print("Chunk shape (steps x particles): %d x %d" % chunks)
+
+    with h5py.File(fname_store, 'w') as fh_out:
+        fh_out.attrs['sort_by_tag'] = sort_by_tag
+        fh_out.create_dataset('tindex', data=[step[0] for step in steps])
+        fh_out.create_dataset('tags', data=tags)
+        fh_out.create_dataset('ptl_order', data=ptl_order)
+        if not sort_by_tag:
+            fh_out.create_dataset('tag_order',
+                                  data=np.argsort(tags, kind='stable'))
+        for name in dset_names:
+            fh_out.create_dataset(name, (nsteps, nptl), dtype=dtypes[name],
+                                  chunks=chunks)
+        for s0 in range(0, nsteps, csteps):
+            s1 = min(s0 + csteps, nsteps)
+            print("Steps %d-%d of %d" % (s0, s1, nsteps))
+            for p0 in range(0, nptl, nptl_block):
+                p1 = min(p0 + nptl_block, nptl)
+                if sort_by_tag:
+                    index = ptl_order[p0:p1]
+                    isort = np.argsort(index)
+                    index_sorted = index[isort]
+                fdata = {name: np.empty((s1 - s0, p1 - p0), dtype=dtypes[name])
+                         for name in dset_names}
+                for istep in range(s0, s1):
+                    _, fname, gname = steps[istep]
+                    with h5py.File(fname, 'r') as fh:
+                        group = fh[gname]
+                        for name in dset_names:
+                            if sort_by_tag:
+                                fdata[name][istep - s0, isort] = \
+                                        read_hyperslabs(group[name], index_sorted)
+                            else:
+                                fdata[name][istep - s0] = group[name][p0:p1]
+                for name in dset_names:
+                    fh_out[name][s0:s1, p0:p1] = fdata[name]
+
+
+class TrajectoryStore(object):
+    """Query interface of a trajectory store
+
+    Args:
+        fname: the file name of the store
+        cache_bytes: HDF5 chunk cache size. The default can hold one row
+            of chunks, so consecutive by_step calls read each chunk once.
+    """
+    def __init__(self, fname, cache_bytes=2**30):
+        self.fh = h5py.File(fname, 'r', rdcc_nbytes=cache_bytes,
+                            rdcc_nslots=1000003)
+        self.tindex = self.fh['tindex'][:]
+        self.tags = self.fh['tags'][:]
+        self.sort_by_tag = bool(self.fh.attrs['sort_by_tag'])
+        if self.sort_by_tag:
+            self.tag_order = None
+        else:
+            self.tag_order = self.fh['tag_order'][:]
+        self.dset_names = [name for name in self.fh
+                           if self.fh[name].ndim == 2]
+        self.nsteps, self.nptl = self.fh[self.dset_names[0]].shape
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def step_index(self, tindex):
+        """Get the step index from a tracer time index
+
+        Raises:
+            KeyError: when the time index is not in the store
+        """
+        istep = int(np.searchsorted(self.tindex, tindex))
+        if istep == self.nsteps or self.tindex[istep] != tindex:
+            raise KeyError("Time index not found: %d" % tindex)
+        return istep
+
+    def by_step(self, istep, dset_names=None):
+        """All particles at one step (or a slice of steps)
+
+        Args:
+            istep: step index or a slice of step indices
+            dset_names: the variables to read. All variables when None.
+        """
+        if dset_names is None:
+            dset_names = self.dset_names
+        return {name: self.fh[name][istep] for name in dset_names}
+
+    def iter_steps(self, dset_names=None, istart=0, iend=None):
+        """Iterate over steps, reading one row of chunks at a time
+
+        Yields:
+            (step index, dictionary of the particle data at the step)
+        """
+        if dset_names is None:
+            dset_names = self.dset_names
+        if iend is None:
+            iend = self.nsteps
+        csteps = self.fh[dset_names[0]].chunks[0]
+        s0 = istart
+        while s0 < iend:
+            s1 = min(s0 - s0 % csteps + csteps, iend)
+            block = self.by_step(slice(s0, s1), dset_names)
+            for istep in range(s0, s1):
+                yield istep, {name: block[name][istep - s0]
+                              for name in dset_names}
+            s0 = s1
+
+    def by_particle(self, iptl, dset_names=None, max_gap=None):
+        """Particles (in the order of the store) over all steps
+
+        Args:
+            iptl: one particle index or an array of indices
+            dset_names: the variables to read. All variables when None.
+            max_gap: the maximum gap for merging the reads of two particles,
+                which is the chunk size along the particle axis by default.
+
+        Returns:
+            dictionary of (nsteps,) or (nsteps, nparticles) arrays
+        """
+        if dset_names is None:
+            dset_names = self.dset_names
+        if np.isscalar(iptl):
+            return {name: self.fh[name][:, iptl] for name in dset_names}
+        iptl = np.asarray(iptl)
+        isort = np.argsort(iptl)
+        index = iptl[isort]
+        if max_gap is None:
+            max_gap = self.fh[dset_names[0]].chunks[1]
+        splits, = np.where(np.diff(index) > max_gap)
+        starts = np.concatenate(([0], splits + 1))
+        ends = np.concatenate((splits + 1, [len(index)]))
+        ptl = {}
+        for name in dset_names:
+            dset = self.fh[name]
+            fdata = np.empty((self.nsteps, len(index)), dtype=dset.dtype)
+            for istart, iend in zip(starts, ends):
+                i0 = index[istart]
+                i1 = index[iend - 1] + 1
+                fdata[:, isort[istart:iend]] = \
+                        dset[:, i0:i1][:, index[istart:iend] - i0]
+            ptl[name] = fdata
+        return ptl
+
+    def tag_to_index(self, tags):
+        """Get the particle indices in the store from particle tags
+
+        Returns -1 for the tags that are not in the store.
+        """
+        tags = np.atleast_1d(tags)
+        if self.sort_by_tag:
+            sorted_tags = self.tags
+        else:
+            sorted_tags = self.tags[self.tag_order]
+        pos = np.searchsorted(sorted_tags, tags)
+        pos[pos == len(sorted_tags)] = 0
+        found = sorted_tags[pos] == tags
+        if not self.sort_by_tag:
+            pos = self.tag_order[pos]
+        return np.where(found, pos, -1)
+
+    def by_tag(self, tags, dset_names=None):
+        """Particles with given tags over all steps
+
+        Raises:
+            KeyError: when some of the tags are not in the store
+        """
+        index = self.tag_to_index(tags)
+        if np.any(index < 0):
+            raise KeyError("Tags not found: %s" % str(np.atleast_1d(tags)[index < 0]))
+        if np.isscalar(tags):
+            return self.by_particle(int(index[0]), dset_names)
+        return self.by_particle(index, dset_names)
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run_dir = ('/net/scratch3/xiaocan/reconnection/Cori_runs/' +
+                           '3D-Lx150-bg0.2-150ppc-2048KNL-tracking/')
+    parser = argparse.ArgumentParser(description='Build trajectory store')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--tracer_dir', action="store",
+                        default='tracer/tracer1/',
+                        help='tracer directory relative to pic_run_dir')
+    parser.add_argument('--species', action="store",
+                        default="e", help='Particle species')
+    parser.add_argument('--fname_store', action="store",
+                        default=None, help='file name of the store')
+    parser.add_argument('--sort_by_tag', action="store_true", default=False,
+                        help='whether to store particles in the order of tags')
+    parser.add_argument('--mem_budget', action="store", default='1.0',
+                        type=float, help='memory budget in GB')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    sname = "electron" if args.species in ["e", "electron"] else "H"
+    tracer_dir = args.pic_run_dir + args.tracer_dir
+    steps = get_tracer_steps(tracer_dir, sname)
+    fname_store = args.fname_store
+    if fname_store is None:
+        fname_store = tracer_dir + sname + '_trajectory_store.h5'
+    build_trajectory_store(steps, fname_store, sort_by_tag=args.sort_by_tag,
+                           mem_budget=int(args.mem_budget * 2**30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Streaming sweep over tracer steps with prefetching
+
+A kernel declares the datasets it needs. Only these datasets are read, and
+the next step is read on a background thread while the current step is
+processed, so the file system and numpy are busy at the same time. The
+kernels keep their float64 accumulators and temporary arrays and update
+them in place.
+
+    kernel = WparaWperpKernel(gamma0, sigma_e)
+    steps = get_tracer_steps(tracer_dir, 'electron')
+    sweep_tracer_steps(steps, kernel, callback=save_data)
+"""
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+import instrument
+
+
+class TracerPrefetcher(object):
+    """Iterate over tracer steps while prefetching the next step
+
+    Two sets of buffers are used in turn. The data yielded at one step is
+    overwritten two steps later, so it should be copied if it is needed
+    beyond the current step.
+
+    Args:
+        steps: a list of (tindex, file name, group name) from
+            tracer_transpose.get_tracer_steps
+        dset_names: the datasets to read
+        prefetch: whether to read the next step on a background thread
+    """
+    def __init__(self, steps, dset_names, prefetch=True):
+        self.steps = steps
+        self.dset_names = dset_names
+        self.prefetch = prefetch
+        self.fh = None
+
+    def _read(self, istep, buf):
+        _, fname, gname = self.steps[istep]
+        if self.fh is None or self.fh.filename != fname:
+            if self.fh is not None:
+                self.fh.close()
+            self.fh = h5py.File(fname, 'r')
+        group = self.fh[gname]
+        for name in self.dset_names:
+            dset = group[name]
+            if name not in buf or buf[name].shape != dset.shape:
+                buf[name] = np.empty(dset.shape, dtype=dset.dtype)
+            dset.read_direct(buf[name])
+            instrument.add_bytes('h5p', buf[name].nbytes)
+        return buf
+
+    def _close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        nsteps = len(self.steps)
+        buffers = [{}, {}]
+        try:
+            if not self.prefetch:
+                for istep in range(nsteps):
+                    ptl = self._read(istep, buffers[0])
+                    yield istep, self.steps[istep][0], ptl
+                return
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(self._read, 0, buffers[0])
+                for istep in range(nsteps):
+                    ptl = future.result()
+                    if istep + 1 < nsteps:
+                        future = executor.submit(self._read, istep + 1,
+                                                 buffers[(istep + 1) % 2])
+                    yield istep, self.steps[istep][0], ptl
+        finally:
+            self._close()
+
+
+def sweep_tracer_steps(steps, kernel, callback=None, prefetch=True):
+    """Sweep over tracer steps with one kernel
+
+    Args:
+        steps: a list of (tindex, file name, group name)
+        kernel: an object with a dset_names attribute and a method
+            process(istep, tindex, ptl)
+        callback: a function callback(istep, tindex, kernel) called after
+            each step, e.g., for saving the accumulated data
+        prefetch: whether to read the next step on a background thread
+    """
+    for istep, tindex, ptl in TracerPrefetcher(steps, kernel.dset_names,
+                                               prefetch):
+        print("Time index: %d" % tindex)
+        kernel.process(istep, tindex, ptl)
+        if callback is not None:
+            callback(istep, tindex, kernel)
+
+
+class GammaKernel(object):
+    """Lorentz factor of all particles at each step
+
+    Args:
+        nptl: number of particles
+    """
+    dset_names = ['Ux', 'Uy', 'Uz']
+
+    def __init__(self, nptl):
+        self.gamma = np.zeros(nptl)
+        self.tmp = np.zeros(nptl)
+
+    def process(self, istep, tindex, ptl):
+        np.square(ptl['Ux'], out=self.gamma)
+        np.square(ptl['Uy'], out=self.tmp)
+        self.gamma += self.tmp
+        np.square(ptl['Uz'], out=self.tmp)
+        self.gamma += self.tmp
+        self.gamma += 1.0
+        np.sqrt(self.gamma, out=self.gamma)
+
+
+class WparaWperpKernel(GammaKernel):
+    """Energization due to parallel and perpendicular electric fields
+
+    The work done by the parallel and perpendicular electric fields
+    (-v.E_para and -v.E_perp per unit time) is accumulated for each particle.
+    The accumulated work is also saved when the particle energy gain
+    first crosses sigma_e/2.
+
+    Attributes:
+        dene_para, dene_perp: (4, nptl) accumulated work. The first three
+            rows are the x, y, z components and the last row is the sum.
+        dene_para_cross, dene_perp_cross: the accumulated work when the
+            energy gain crosses sigma_e/2
+        dgamma: energy gain at current step
+        cross_half_sigmae: whether the energy gain has crossed sigma_e/2
+            before the current step
+
+    Args:
+        gamma0: initial Lorentz factor
+        sigma_e: magnetization parameter
+        cond_include: only these particles are checked for the crossing
+    """
+    dset_names = ['Ux', 'Uy', 'Uz', 'Ex', 'Ey', 'Ez', 'Bx', 'By', 'Bz']
+
+    def __init__(self, gamma0, sigma_e, cond_include=None):
+        nptl, = gamma0.shape
+        super(WparaWperpKernel, self).__init__(nptl)
+        self.gamma0 = gamma0
+        self.sigma_e = sigma_e
+        self.cond_include = cond_include
+        self.dene_para = np.zeros([4, nptl])
+        self.dene_perp = np.zeros([4, nptl])
+        self.dene_para_cross = np.zeros([4, nptl])
+        self.dene_perp_cross = np.zeros([4, nptl])
+        self.dgamma = np.zeros(nptl)
+        self.dgamma_pre = np.zeros(nptl)
+        self.cross_half_sigmae = gamma0 > sigma_e * 0.5
+        self.cond = np.zeros(nptl, dtype=bool)
+        self.ib2 = np.zeros(nptl)
+        self.edotb = np.zeros(nptl)
+        self.epara = np.zeros(nptl)
+        self.vel = np.zeros(nptl)
+        self.work = np.zeros(nptl)
+
+    def process(self, istep, tindex, ptl):
+        # The crossing at the previous step is only recorded now, so that
+        # callbacks see cross_half_sigmae before the current step.
+        np.logical_or(self.cond, self.cross_half_sigmae,
+                      out=self.cross_half_sigmae)
+        super(WparaWperpKernel, self).process(istep, tindex, ptl)
+        np.subtract(self.gamma, self.gamma0, out=self.dgamma)
+        np.square(ptl['Bx'], out=self.ib2)
+        np.square(ptl['By'], out=self.tmp)
+        self.ib2 += self.tmp
+        np.square(ptl['Bz'], out=self.tmp)
+        self.ib2 += self.tmp
+        np.reciprocal(self.ib2, out=self.ib2)
+        np.multiply(ptl['Ex'], ptl['Bx'], out=self.edotb)
+        np.multiply(ptl['Ey'], ptl['By'], out=self.tmp)
+        self.edotb += self.tmp
+        np.multiply(ptl['Ez'], ptl['Bz'], out=self.tmp)
+        self.edotb += self.tmp
+        for icomp, comp in enumerate(['x', 'y', 'z']):
+            np.multiply(self.edotb, ptl['B' + comp], out=self.epara)
+            self.epara *= self.ib2
+            np.divide(ptl['U' + comp], self.gamma, out=self.vel)
+            np.multiply(self.vel, self.epara, out=self.work)
+            self.dene_para[icomp] -= self.work
+            np.subtract(ptl['E' + comp], self.epara, out=self.epara)
+            np.multiply(self.vel, self.epara, out=self.work)
+            self.dene_perp[icomp] -= self.work
+        np.sum(self.dene_para[:3], axis=0, out=self.dene_para[3])
+        np.sum(self.dene_perp[:3], axis=0, out=self.dene_perp[3])
+
+        # Has not crossed previously but crossed at this time step
+        half_sigmae = 0.5 * self.sigma_e
+        np.less(self.dgamma_pre, half_sigmae, out=self.cond)
+        self.cond &= self.dgamma > half_sigmae
+        self.cond &= np.logical_not(self.cross_half_sigmae)
+        if self.cond_include is not None:
+            self.cond &= self.cond_include
+        self.dene_para_cross[:, self.cond] = self.dene_para[:, self.cond]
+        self.dene_perp_cross[:, self.cond] = self.dene_perp[:, self.cond]
+        self.dgamma_pre[:] = self.dgamma
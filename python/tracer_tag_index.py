@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Persistent tag index for finding tracers across steps
+
+For each tracer file T.<tindex>/<fname> and each Step# group in it, the
+index saves the sorted particle tags, the positions of the tags in the
+tracer file, and a sparse fence array including every block_size-th sorted
+tag. A lookup only reads the fence arrays and the small blocks of sorted
+tags including the requested tags, so extracting a few hundred trajectories
+does not need to read or argsort the full tag arrays.
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+
+import h5py
+import numpy as np
+from joblib import Parallel, delayed
+
+from shell_functions import mkdir_p
+from tracer_transpose import read_hyperslabs
+
+
+def get_tracer_files(tracer_dir, fname):
+    """Get the tracer files in all T.* directories sorted by time index
+
+    Args:
+        tracer_dir: the directory including T.* directories
+        fname: the file name of the tracer file in each T.* directory
+    """
+    tracer_files = []
+    for dir_name in os.listdir(tracer_dir):
+        if not dir_name.startswith('T.'):
+            continue
+        fpath = tracer_dir + dir_name + '/' + fname
+        if os.path.isfile(fpath):
+            tracer_files.append((int(dir_name[2:]), fpath))
+    tracer_files.sort()
+    return tracer_files
+
+
+def build_file_index(fname, fname_index, subgroup=None, block_size=4096):
+    """Build the tag index of one tracer file
+
+    Args:
+        fname: tracer file name
+        fname_index: index file name
+        subgroup: the subgroup in the Step# group including the particle
+            data, e.g., "electron_tracer" in tracers.h5p
+        block_size: number of sorted tags between two fences
+    """
+    with h5py.File(fname, 'r') as fh, h5py.File(fname_index, 'w') as fh_out:
+        fh_out.attrs['fname'] = fname
+        fh_out.attrs['block_size'] = block_size
+        for gname in fh:
+            if not gname.startswith('Step#'):
+                continue
+            gpath = gname if subgroup is None else gname + '/' + subgroup
+            tags = fh[gpath]['q'][:]
+            pos = np.argsort(tags, kind='stable')
+            if len(tags) < 2**31:
+                pos = pos.astype(np.int32)
+            tags = tags[pos]
+            grp = fh_out.create_group(gname)
+            grp.attrs['gpath'] = gpath
+            grp.create_dataset('tags', data=tags)
+            grp.create_dataset('pos', data=pos)
+            grp.create_dataset('fence', data=tags[::block_size])
+
+
+def build_tag_index(tracer_dir, fname, index_dir, subgroup=None,
+                    block_size=4096, ncores=None):
+    """Build the tag index of all tracer files in parallel
+
+    The index files are built in a temporary directory, which is renamed to
+    index_dir when all of them are done, so an existing index_dir is always
+    complete, also when a build is killed.
+
+    Args:
+        tracer_dir: the directory including T.* directories
+        fname: the file name of the tracer file in each T.* directory
+        index_dir: the directory for the index files
+        subgroup: the subgroup in the Step# group including the particle data
+        block_size: number of sorted tags between two fences
+        ncores: number of processes
+    """
+    index_dir = index_dir.rstrip('/')
+    tmp_dir = index_dir + '.tmp'
+    if os.path.isdir(tmp_dir):  # left by a killed build
+        shutil.rmtree(tmp_dir)
+    mkdir_p(tmp_dir)
+    tracer_files = get_tracer_files(tracer_dir, fname)
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    Parallel(n_jobs=ncores)(
+        delayed(build_file_index)(fpath,
+                                  tmp_dir + '/T.' + str(tindex) + '.h5',
+                                  subgroup, block_size)
+        for tindex, fpath in tracer_files)
+    if os.path.isdir(index_dir):
+        shutil.rmtree(index_dir)
+    os.rename(tmp_dir, index_dir)
+
+
+def lookup_step(grp, tags, block_size):
+    """Find the positions of tags in one step
+
+    Args:
+        grp: the Step# group in the index file
+        tags: the particle tags to find
+        block_size: number of sorted tags between two fences
+
+    Returns:
+        the positions of the tags in the tracer file, -1 when not found
+    """
+    positions = np.full(len(tags), -1, dtype=np.int64)
+    dset_tags = grp['tags']
+    ntot, = dset_tags.shape
+    if ntot == 0 or len(tags) == 0:  # no particles in the step
+        return positions
+    fence = grp['fence'][:]
+    iblock = np.searchsorted(fence, tags, side='right') - 1
+    iblock[iblock < 0] = 0
+    # Read all the required blocks of sorted tags and positions
+    blocks = np.unique(iblock)
+    index = (blocks[:, None] * block_size + np.arange(block_size)).ravel()
+    index = index[index < ntot]
+    tags_sel = read_hyperslabs(dset_tags, index, max_gap=1)
+    ipos = np.searchsorted(tags_sel, tags)
+    ipos[ipos == len(tags_sel)] = 0
+    found = tags_sel[ipos] == tags
+    pos_sel = read_hyperslabs(grp['pos'], index, max_gap=1)
+    positions[found] = pos_sel[ipos[found]]
+    return positions
+
+
+class TagIndex(object):
+    """Query interface of the tag index
+
+    Args:
+        index_dir: the directory including the index files
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.steps = []
+        for fname in os.listdir(index_dir):
+            if not fname.startswith('T.'):
+                continue
+            fname_index = index_dir + fname
+            with h5py.File(fname_index, 'r') as fh:
+                fname_tracer = fh.attrs['fname']
+                for gname in fh:
+                    self.steps.append((int(gname[5:]), fname_index,
+                                       fname_tracer, gname,
+                                       fh[gname].attrs['gpath']))
+        self.steps.sort()
+        self.tindex = np.asarray([step[0] for step in self.steps])
+
+    def lookup_file(self, fname_index, tags):
+        """Find the tags in all steps of one index file
+
+        Returns:
+            a dictionary {step group name: positions}
+        """
+        tags = np.asarray(tags)
+        positions = {}
+        with h5py.File(fname_index, 'r') as fh:
+            block_size = fh.attrs['block_size']
+            for gname in fh:
+                positions[gname] = lookup_step(fh[gname], tags, block_size)
+        return positions
+
+    def lookup(self, tags, ncores=1):
+        """Find the tags in all steps
+
+        Args:
+            tags: particle tags
+            ncores: number of processes
+
+        Returns:
+            positions with shape (nsteps, ntags), -1 when not found
+        """
+        fnames = sorted(set(step[1] for step in self.steps))
+        if ncores > 1:
+            results = Parallel(n_jobs=ncores)(
+                delayed(self.lookup_file)(fname, tags) for fname in fnames)
+        else:
+            results = [self.lookup_file(fname, tags) for fname in fnames]
+        file_positions = dict(zip(fnames, results))
+        positions = np.empty((len(self.steps), len(tags)), dtype=np.int64)
+        for istep, step in enumerate(self.steps):
+            positions[istep] = file_positions[step[1]][step[3]]
+        return positions
+
+    def extract_file(self, fname_tracer, steps, positions, dset_names):
+        """Read the selected tracers in the steps of one tracer file
+        """
+        ptl = {name: [] for name in dset_names}
+        with h5py.File(fname_tracer, 'r') as fh:
+            for step, pos in zip(steps, positions):
+                group = fh[step[4]]
+                found = pos >= 0
+                isort = np.argsort(pos[found])
+                pos_sorted = pos[found][isort]
+                for name in dset_names:
+                    dset = group[name]
+                    fdata = np.zeros(len(pos), dtype=dset.dtype)
+                    if len(pos_sorted) > 0:
+                        fdata_found = np.empty(len(pos_sorted),
+                                               dtype=dset.dtype)
+                        fdata_found[isort] = read_hyperslabs(dset, pos_sorted)
+                        fdata[found] = fdata_found
+                    ptl[name].append(fdata)
+        return ptl
+
+    def extract(self, tags, dset_names, ncores=1):
+        """Extract the trajectories of the particles with given tags
+
+        Args:
+            tags: particle tags
+            dset_names: the variables to read
+            ncores: number of processes
+
+        Returns:
+            ptl: a dictionary of (nsteps, ntags) arrays. Data points are
+                zeros when the particles are not found
+            found: (nsteps, ntags) boolean array
+        """
+        positions = self.lookup(tags, ncores)
+        fnames = []
+        for step in self.steps:
+            if step[2] not in fnames:
+                fnames.append(step[2])
+        jobs = []
+        for fname in fnames:
+            isteps = [istep for istep, step in enumerate(self.steps)
+                      if step[2] == fname]
+            jobs.append((fname, isteps))
+        if ncores > 1:
+            results = Parallel(n_jobs=ncores)(
+                delayed(self.extract_file)(fname,
+                                           [self.steps[i] for i in isteps],
+                                           positions[isteps], dset_names)
+                for fname, isteps in jobs)
+        else:
+            results = [self.extract_file(fname,
+                                         [self.steps[i] for i in isteps],
+                                         positions[isteps], dset_names)
+                       for fname, isteps in jobs]
+        ptl = {}
+        for name in dset_names:
+            dtype = results[0][name][0].dtype
+            ptl[name] = np.zeros(positions.shape, dtype=dtype)
+            for (_, isteps), result in zip(jobs, results):
+                ptl[name][isteps] = result[name]
+        return ptl, positions >= 0
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run_dir = ('/net/scratch3/xiaocan/reconnection/Cori_runs/' +
+                           '3D-Lx150-bg0.2-150ppc-2048KNL-tracking/')
+    parser = argparse.ArgumentParser(description='Build tracer tag index')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--tracer_dir', action="store",
+                        default='tracer/tracer2/',
+                        help='tracer directory relative to pic_run_dir')
+    parser.add_argument('--tracer_file', action="store",
+                        default='tracers.h5p',
+                        help='tracer file name in each T.* directory')
+    parser.add_argument('--subgroup', action="store",
+                        default='electron_tracer',
+                        help='subgroup in the Step# group ("" for none)')
+    parser.add_argument('--index_dir', action="store", default=None,
+                        help='directory for the index files')
+    parser.add_argument('--ncores', action="store", default='8', type=int,
+                        help='number of processes')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    tracer_dir = args.pic_run_dir + args.tracer_dir
+    index_dir = args.index_dir
+    if index_dir is None:
+        index_dir = tracer_dir + 'tag_index/'
+    subgroup = args.subgroup if args.subgroup else None
+    build_tag_index(tracer_dir, args.tracer_file, index_dir, subgroup,
+                    ncores=args.ncores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Out-of-core transpose of particle tracer data
+
+The tracer files are saved in a step-major layout, i.e., all particles at
+one time step are in the group Step#<tindex> of
+T.<tindex_file>/<species>_tracer_qtag_sorted.h5p. Trajectory analyses need
+a particle-major layout, i.e., one group Particle#<tag> for each particle.
+This module transposes the data in blocks of particles x steps, which are
+sized to a memory budget. Each dataset is read with large contiguous
+hyperslabs. Both a H5Part file (selected particles at each step, which can
+be loaded into ParaView) and a per-tag trajectory file are written in the
+same pass.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+
+import h5py
+import numpy as np
+
+from shell_functions import mkdir_p
+
+
+def get_tracer_steps(tracer_dir, sname, fname_suffix='_tracer_qtag_sorted.h5p',
+                     nsteps_file=None):
+    """Get all the tracer steps and the files including them
+
+    Args:
+        tracer_dir: the directory including T.* directories
+        sname: species name (electron, H)
+        fname_suffix: tracer file name after the species name
+        nsteps_file: only the first nsteps_file steps of each file are
+            included if it is given
+
+    Returns:
+        a list of (tindex, file name, group name) sorted by tindex
+    """
+    steps = []
+    for dir_name in os.listdir(tracer_dir):
+        if not dir_name.startswith('T.'):
+            continue
+        fname = tracer_dir + dir_name + '/' + sname + fname_suffix
+        if not os.path.isfile(fname):
+            continue
+        with h5py.File(fname, 'r') as fh:
+            tindices = sorted(int(gname[5:]) for gname in fh
+                              if gname.startswith('Step#'))
+        for tindex in tindices[:nsteps_file]:
+            steps.append((tindex, fname, 'Step#' + str(tindex)))
+    steps.sort()
+    return steps
+
+
+def get_block_size(nptl, nsteps, nbytes, mem_budget, min_ptl_block=1024):
+    """Get the block size (particles x steps) for a memory budget
+
+    All the steps of a particle block are preferred, so each trajectory is
+    written in one shot. If not even min_ptl_block particles fit in the
+    memory budget, the steps are split into blocks instead.
+
+    Args:
+        nptl: number of particles
+        nsteps: number of steps
+        nbytes: number of bytes of one particle at one step (all variables)
+        mem_budget: memory budget in bytes for the data block
+        min_ptl_block: minimum number of particles in each block
+    """
+    nptl_block = mem_budget // (nsteps * nbytes)
+    if nptl_block >= min(min_ptl_block, nptl):
+        return min(nptl_block, nptl), nsteps
+    nptl_block = min(min_ptl_block, nptl)
+    nsteps_block = max(1, mem_budget // (nptl_block * nbytes))
+    return nptl_block, min(nsteps_block, nsteps)
+
+
+def read_hyperslabs(dset, index, max_gap=4096):
+    """Read data at sorted indices using contiguous hyperslabs
+
+    The indices are split where the gap between neighbours is larger
+    than max_gap. Each piece is read as one contiguous hyperslab.
+
+    Args:
+        dset: HDF5 dataset
+        index: sorted indices
+        max_gap: the maximum gap for merging two hyperslabs
+    """
+    splits, = np.where(np.diff(index) > max_gap)
+    starts = np.concatenate(([0], splits + 1))
+    ends = np.concatenate((splits + 1, [len(index)]))
+    fdata = np.empty(len(index), dtype=dset.dtype)
+    for istart, iend in zip(starts, ends):
+        i0 = index[istart]
+        i1 = index[iend - 1] + 1
+        fdata[istart:iend] = dset[i0:i1][index[istart:iend] - i0]
+    return fdata
+
+
+def transpose_tracers(steps,
+                      fname_traj,
+                      fname_h5part,
+                      ptl_index=None,
+                      dset_names=None,
+                      mem_budget=2**30,
+                      dtwpe=None):
+    """Transpose step-major tracer data to trajectories and H5Part
+
+    Args:
+        steps: the tracer steps from get_tracer_steps
+        fname_traj: output trajectory file (one group for each particle)
+        fname_h5part: output H5Part file (one group for each step)
+        ptl_index: the indices of the selected particles. All particles are
+            selected when it is None.
+        dset_names: the datasets to transpose. All datasets when None.
+        mem_budget: memory budget in bytes for each block
+        dtwpe: the time interval in 1/wpe for each tracer time index. When
+            it is given, time t and Lorentz factor gamma are saved too.
+    """
+    tindex0, fname0, gname0 = steps[0]
+    with h5py.File(fname0, 'r') as fh:
+        group = fh[gname0]
+        if dset_names is None:
+            dset_names = list(group.keys())
+        dtypes = {name: group[name].dtype for name in dset_names}
+        nptl_tot, = group[dset_names[0]].shape
+        if ptl_index is None:
+            ptl_index = np.arange(nptl_tot)
+        ptl_index = np.sort(np.asarray(ptl_index))
+        tags = read_hyperslabs(group['q'], ptl_index)
+    nptl = len(ptl_index)
+    nsteps = len(steps)
+    tindices = np.asarray([step[0] for step in steps])
+    add_derived = dtwpe is not None
+    out_dtypes = dict(dtypes)
+    if add_derived:
+        out_dtypes['gamma'] = np.dtype(np.float32)
+        out_dtypes['t'] = np.dtype(np.float32)
+    nbytes = sum(dtype.itemsize for dtype in dtypes.values())
+    nptl_block, nsteps_block = get_block_size(nptl, nsteps, nbytes, mem_budget)
+    print("Number of particles and steps: %d, %d" % (nptl, nsteps))
+    print("Block size (particles x steps): %d x %d" %
+          (nptl_block, nsteps_block))
+
+    fh_traj = h5py.File(fname_traj, 'w')
+    fh_h5part = h5py.File(fname_h5part, 'w')
+    traj_groups = [fh_traj.create_group('Particle#' + str(tag))
+                   for tag in tags]
+    h5part_groups = []
+    for istep in range(nsteps):
+        grp = fh_h5part.create_group('Step#' + str(istep))
+        for name in out_dtypes:
+            grp.create_dataset(name, (nptl, ), dtype=out_dtypes[name])
+        h5part_groups.append(grp)
+    full_steps = nsteps_block == nsteps
+    if not full_steps:
+        for grp in traj_groups:
+            for name in out_dtypes:
+                grp.create_dataset(name, (nsteps, ), dtype=out_dtypes[name])
+
+    block = {name: np.empty((nsteps_block, nptl_block), dtype=dtypes[name])
+             for name in dset_names}
+    for p0 in range(0, nptl, nptl_block):
+        p1 = min(p0 + nptl_block, nptl)
+        index = ptl_index[p0:p1]
+        for s0 in range(0, nsteps, nsteps_block):
+            s1 = min(s0 + nsteps_block, nsteps)
+            print("Particles %d-%d, steps %d-%d" % (p0, p1, s0, s1))
+            fh = None
+            for istep in range(s0, s1):
+                _, fname, gname = steps[istep]
+                if fh is None or fh.filename != fname:
+                    if fh is not None:
+                        fh.close()
+                    fh = h5py.File(fname, 'r')
+                group = fh[gname]
+                for name in dset_names:
+                    block[name][istep - s0, :p1 - p0] = \
+                            read_hyperslabs(group[name], index)
+            fh.close()
+            bdata = {name: block[name][:s1 - s0, :p1 - p0]
+                     for name in dset_names}
+            if add_derived:
+                bdata['gamma'] = np.sqrt(1.0 + bdata['Ux'].astype(np.float64)**2 +
+                                         bdata['Uy']**2 + bdata['Uz']**2)
+                bdata['gamma'] = bdata['gamma'].astype(np.float32)
+                tblock = (tindices[s0:s1] * dtwpe).astype(np.float32)
+                bdata['t'] = np.repeat(tblock[:, None], p1 - p0, axis=1)
+            for istep in range(s0, s1):
+                grp = h5part_groups[istep]
+                for name in bdata:
+                    grp[name][p0:p1] = bdata[name][istep - s0]
+            for iptl in range(p0, p1):
+                grp = traj_groups[iptl]
+                for name in bdata:
+                    fdata = bdata[name][:, iptl - p0]
+                    if full_steps:
+                        grp.create_dataset(name, data=fdata)
+                    else:
+                        grp[name][s0:s1] = fdata
+    fh_traj.close()
+    fh_h5part.close()
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run_dir = ('/net/scratch3/xiaocan/reconnection/Cori_runs/' +
+                           '3D-Lx150-bg0.2-150ppc-2048KNL-tracking/')
+    parser = argparse.ArgumentParser(description='Transpose tracer data')
+    parser.add_argument('--pic_run_dir', action="store",
+                        default=default_pic_run_dir, help='PIC run directory')
+    parser.add_argument('--tracer_dir', action="store",
+                        default='tracer/tracer1/',
+                        help='tracer directory relative to pic_run_dir')
+    parser.add_argument('--species', action="store",
+                        default="e", help='Particle species')
+    parser.add_argument('--output_dir', action="store",
+                        default='../data/trajectory/',
+                        help='output directory')
+    parser.add_argument('--nptl', action="store", default='0', type=int,
+                        help='number of particles to select (0 for all)')
+    parser.add_argument('--ptl_stride', action="store", default='1', type=int,
+                        help='stride when selecting particles')
+    parser.add_argument('--mem_budget', action="store", default='1.0',
+                        type=float, help='memory budget in GB')
+    parser.add_argument('--dtwpe', action="store", default=None, type=float,
+                        help='time interval in 1/wpe of one tracer time index')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    sname = "electron" if args.species in ["e", "electron"] else "H"
+    tracer_dir = args.pic_run_dir + args.tracer_dir
+    steps = get_tracer_steps(tracer_dir, sname)
+    with h5py.File(steps[0][1], 'r') as fh:
+        nptl_tot, = fh[steps[0][2]]['q'].shape
+    ptl_index = np.arange(0, nptl_tot, args.ptl_stride)
+    if args.nptl > 0:
+        ptl_index = ptl_index[:args.nptl]
+    mkdir_p(args.output_dir)
+    fname_traj = args.output_dir + sname + '_traj.h5p'
+    fname_h5part = args.output_dir + sname + '_traj.h5part'
+    transpose_tracers(steps, fname_traj, fname_h5part, ptl_index,
+                      mem_budget=int(args.mem_budget * 2**30),
+                      dtwpe=args.dtwpe)
+
+
+if __name__ == "__main__":
+    main()
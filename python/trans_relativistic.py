@@ -5,6 +5,7 @@ Particle energy spectrum for runs to determine power-law indices
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import math
@@ -19,13 +20,16 @@ import palettable
 from matplotlib.colors import LogNorm, SymLogNorm
 from scipy.optimize import curve_fit
 
+import checkpoint
 import fitting_funcs
+import parallel_backend
 import pic_information
 from contour_plots import read_2d_fields
-from joblib import Parallel, delayed
 from json_functions import read_data_from_json
 from pic_information import get_variable_value
 from shell_functions import mkdir_p
+from tracer_sweep import WparaWperpKernel, sweep_tracer_steps
+from tracer_transpose import get_tracer_steps
 
 plt.style.use("seaborn-deep")
 mpl.rc('text', usetex=True)
@@ -1049,8 +1053,6 @@ def calc_wpara_wperp(plot_config, show_plot=True):
     half_thickness_cs, _ = get_variable_value('L/de', 0, content)
 
     tracer_dir = pic_run_dir + 'tracer/tracer1/'
-    nframes = len(os.listdir(tracer_dir))
-    # nframes = 20
     plot_interval = plot_config["plot_interval"]
 
     if species in ["e", "electron"]:
@@ -1070,17 +1072,7 @@ def calc_wpara_wperp(plot_config, show_plot=True):
             dset = str(dset)
             ptl[str(dset)] = read_var(group, dset, nptl)
 
-    gamma0 = np.zeros(nptl)
-    dgamma = np.zeros(nptl)
-    dgamma_pre = np.zeros(nptl)
-    dgamma_pos = np.zeros(nptl)
-    dene_para = np.zeros([4, nptl])
-    dene_perp = np.zeros([4, nptl])
-    dene_para_cross = np.zeros([4, nptl])
-    dene_perp_cross = np.zeros([4, nptl])
-
     gamma0 = np.sqrt(1.0 + ptl["Ux"]**2 + ptl["Uy"]**2 + ptl["Uz"]**2)
-    cross_half_sigmae = gamma0 > sigma_e * 0.5
     cond_exclude_cs = np.abs(ptl["dZ"]) > half_thickness_cs
 
     fdir = '../data/trans_relativistic/wpara_wperp/' + pic_run + '/'
@@ -1090,77 +1082,30 @@ def calc_wpara_wperp(plot_config, show_plot=True):
         fdir += 'all/'
     mkdir_p(fdir)
 
-    for tframe in range(nframes):
-        print("Time frame %d of %d" % (tframe, nframes))
-        tindex0 = tframe * pic_info.tracer_interval * plot_config["nsteps"]
-        fname = (tracer_dir + 'T.' + str(tindex0) + '/' +
-                 sname + '_tracer_qtag_sorted.h5p')
-        fh = h5py.File(fname, 'r')
-        for step in range(plot_config["nsteps"]):
-            tindex = step * pic_info.tracer_interval + tindex0
-            print("Time index: %d" % tindex)
-            gname = 'Step#' + str(tindex)
-            if not gname in fh:
-                break
-            group = fh[gname]
-            ptl = {}
-            for dset in group:
-                dset = str(dset)
-                ptl[str(dset)] = read_var(group, dset, nptl)
-            ux = ptl["Ux"]
-            uy = ptl["Uy"]
-            uz = ptl["Uz"]
-            gamma = np.sqrt(1.0 + ux**2 + uy**2 + uz**2)
-            dgamma = gamma - gamma0
-            dgamma_pos = np.copy(dgamma)
-            ib2 = 1.0 / (ptl["Bx"]**2 + ptl["By"]**2 + ptl["Bz"]**2)
-            edotb = ptl["Ex"] * ptl["Bx"] + ptl["Ey"] * ptl["By"] + ptl["Ez"] * ptl["Bz"]
-            eparax = edotb * ptl["Bx"] * ib2
-            eparay = edotb * ptl["By"] * ib2
-            eparaz = edotb * ptl["Bz"] * ib2
-            eperpx = ptl["Ex"] - eparax
-            eperpy = ptl["Ey"] - eparay
-            eperpz = ptl["Ez"] - eparaz
-            igamma = 1.0 / gamma
-            vx = ux * igamma
-            vy = uy * igamma
-            vz = uz * igamma
-            dene_para[0, :] += -vx * eparax
-            dene_para[1, :] += -vy * eparay
-            dene_para[2, :] += -vz * eparaz
-            dene_para[3, :] = np.sum(dene_para[:3, :], axis=0)
-            dene_perp[0, :] += -vx * eperpx
-            dene_perp[1, :] += -vy * eperpy
-            dene_perp[2, :] += -vz * eperpz
-            dene_perp[3, :] = np.sum(dene_perp[:3, :], axis=0)
-            dene_para *= dtwpe_tracer
-            dene_perp *= dtwpe_tracer
-            cond = np.logical_and(dgamma_pre < 0.5 * sigma_e, dgamma_pos > 0.5 * sigma_e)
-            cond = np.logical_and(cond, np.logical_not(cross_half_sigmae))
-            if plot_config["exclude_cs"]:
-                cond = np.logical_and(cond, cond_exclude_cs)
-            dene_para_cross[:, cond] = dene_para[:, cond]
-            dene_perp_cross[:, cond] = dene_perp[:, cond]
-            dgamma_pre = np.copy(dgamma_pos)
+    if plot_config["exclude_cs"]:
+        kernel = WparaWperpKernel(gamma0, sigma_e, cond_exclude_cs)
+    else:
+        kernel = WparaWperpKernel(gamma0, sigma_e)
 
-            istep = tindex // pic_info.tracer_interval
-            if istep % plot_interval == 0:
-                fname = fdir + 'wpara_cross_' + str(istep) + '.dat'
-                dene_para_cross.tofile(fname)
-                fname = fdir + 'wperp_cross_' + str(istep) + '.dat'
-                dene_perp_cross.tofile(fname)
-                fname = fdir + 'wpara_' + str(istep) + '.dat'
-                dene_para.tofile(fname)
-                fname = fdir + 'wperp_' + str(istep) + '.dat'
-                dene_perp.tofile(fname)
-                fdata = cross_half_sigmae.astype(int)
-                fname = fdir + 'cross_half_sigma_' + str(istep) + '.dat'
-                fdata.tofile(fname)
-
-            cross_half_sigmae = np.logical_or(cond, cross_half_sigmae)
-            dene_para /= dtwpe_tracer
-            dene_perp /= dtwpe_tracer
-        fh.close()
+    def save_data(step, tindex, kernel):
+        """Save the accumulated energization every plot_interval steps"""
+        istep = tindex // pic_info.tracer_interval
+        if istep % plot_interval == 0:
+            fname = fdir + 'wpara_cross_' + str(istep) + '.dat'
+            (kernel.dene_para_cross * dtwpe_tracer).tofile(fname)
+            fname = fdir + 'wperp_cross_' + str(istep) + '.dat'
+            (kernel.dene_perp_cross * dtwpe_tracer).tofile(fname)
+            fname = fdir + 'wpara_' + str(istep) + '.dat'
+            (kernel.dene_para * dtwpe_tracer).tofile(fname)
+            fname = fdir + 'wperp_' + str(istep) + '.dat'
+            (kernel.dene_perp * dtwpe_tracer).tofile(fname)
+            fdata = kernel.cross_half_sigmae.astype(int)
+            fname = fdir + 'cross_half_sigma_' + str(istep) + '.dat'
+            fdata.tofile(fname)
+
+    steps = get_tracer_steps(tracer_dir, sname,
+                             nsteps_file=plot_config["nsteps"])
+    sweep_tracer_steps(steps, kernel, callback=save_data)
 
 
 def plot_wpara_wperp(plot_config, show_plot=True):
@@ -1803,17 +1748,7 @@ def calc_wpara_wperp_1st(plot_config, show_plot=True):
             dset = str(dset)
             ptl[str(dset)] = read_var(group, dset, nptl)
 
-    gamma0 = np.zeros(nptl)
-    dgamma = np.zeros(nptl)
-    dgamma_pre = np.zeros(nptl)
-    dgamma_pos = np.zeros(nptl)
-    dene_para = np.zeros([4, nptl])
-    dene_perp = np.zeros([4, nptl])
-    dene_para_cross = np.zeros([4, nptl])
-    dene_perp_cross = np.zeros([4, nptl])
-
     gamma0 = np.sqrt(1.0 + ptl["Ux"]**2 + ptl["Uy"]**2 + ptl["Uz"]**2)
-    cross_half_sigmae = gamma0 > sigma_e * 0.5
     cond_exclude_cs = np.abs(ptl["dZ"]) > half_thickness_cs
 
     fdir = pic_run_dir + 'wpara_wperp_1st_pass/'
@@ -1826,70 +1761,40 @@ def calc_wpara_wperp_1st(plot_config, show_plot=True):
     tindex0 = tframe * tracer_file_interval
     fname = (tracer_dir + 'T.' + str(tindex0) + '/' +
              sname + '_tracer_qtag_sorted.h5p')
-    fh = h5py.File(fname, 'r')
-    nframes_in_file = len(fh)
-    for iframe in range(nframes_in_file):
-        tindex = iframe * tracer_interval + tindex0
-        print("Time index: %d" % tindex)
-        gname = 'Step#' + str(tindex)
-        if not gname in fh:  # only possible for the last tracer directory
-            break
-        group = fh[gname]
-        ptl = {}
-        for dset in group:
-            dset = str(dset)
-            ptl[str(dset)] = read_var(group, dset, nptl)
-        ux = ptl["Ux"]
-        uy = ptl["Uy"]
-        uz = ptl["Uz"]
-        gamma = np.sqrt(1.0 + ux**2 + uy**2 + uz**2)
-        dgamma = gamma - gamma0
-        dgamma_pos = np.copy(dgamma)
-        ib2 = 1.0 / (ptl["Bx"]**2 + ptl["By"]**2 + ptl["Bz"]**2)
-        edotb = ptl["Ex"] * ptl["Bx"] + ptl["Ey"] * ptl["By"] + ptl["Ez"] * ptl["Bz"]
-        eparax = edotb * ptl["Bx"] * ib2
-        eparay = edotb * ptl["By"] * ib2
-        eparaz = edotb * ptl["Bz"] * ib2
-        eperpx = ptl["Ex"] - eparax
-        eperpy = ptl["Ey"] - eparay
-        eperpz = ptl["Ez"] - eparaz
-        igamma = 1.0 / gamma
-        vx = ux * igamma
-        vy = uy * igamma
-        vz = uz * igamma
-        dene_para[0, :] += -vx * eparax
-        dene_para[1, :] += -vy * eparay
-        dene_para[2, :] += -vz * eparaz
-        dene_para[3, :] = np.sum(dene_para[:3, :], axis=0)
-        dene_perp[0, :] += -vx * eperpx
-        dene_perp[1, :] += -vy * eperpy
-        dene_perp[2, :] += -vz * eperpz
-        dene_perp[3, :] = np.sum(dene_perp[:3, :], axis=0)
-        # Has not crossed previously but crossed at this time step
-        cond = np.logical_and(dgamma_pre < 0.5 * sigma_e, dgamma_pos > 0.5 * sigma_e)
-        cond = np.logical_and(cond, np.logical_not(cross_half_sigmae))
-        if plot_config["exclude_cs"]:
-            cond = np.logical_and(cond, cond_exclude_cs)
-        dene_para_cross[:, cond] = dene_para[:, cond]
-        dene_perp_cross[:, cond] = dene_perp[:, cond]
-        dgamma_pre = np.copy(dgamma_pos)
+    steps = []
+    with h5py.File(fname, 'r') as fh:
+        nframes_in_file = len(fh)
+        for iframe in range(nframes_in_file):
+            tindex = iframe * tracer_interval + tindex0
+            gname = 'Step#' + str(tindex)
+            if not gname in fh:  # only possible for the last tracer directory
+                break
+            steps.append((tindex, fname, gname))
+    if plot_config["exclude_cs"]:
+        kernel = WparaWperpKernel(gamma0, sigma_e, cond_exclude_cs)
+    else:
+        kernel = WparaWperpKernel(gamma0, sigma_e)
 
+    def save_data(iframe, tindex, kernel):
+        """Save the accumulated energization every plot_interval steps"""
         iframe_g = tindex // tracer_interval
         plot_interval = plot_config["plot_interval"]
         if iframe_g % plot_interval == 0 or iframe == nframes_in_file - 1:
             fname = fdir + "wpara_wperp_" + sname + "_" + str(tindex).zfill(6) + '.h5'
             with h5py.File(fname, 'w') as fh_out:
                 fh_out.create_dataset('wpara_cross', (nptl, ),
-                                      data=dene_para_cross[3, :]*dtwpe_tracer)
+                                      data=kernel.dene_para_cross[3, :]*dtwpe_tracer)
                 fh_out.create_dataset('wperp_cross', (nptl, ),
-                                      data=dene_perp_cross[3, :]*dtwpe_tracer)
-                fh_out.create_dataset('wpara', (nptl, ), data=dene_para[3, :]*dtwpe_tracer)
-                fh_out.create_dataset('wperp', (nptl, ), data=dene_perp[3, :]*dtwpe_tracer)
-                fh_out.create_dataset('dgamma', (nptl, ), data=dgamma)
-                fdata = cross_half_sigmae.astype(int)
+                                      data=kernel.dene_perp_cross[3, :]*dtwpe_tracer)
+                fh_out.create_dataset('wpara', (nptl, ),
+                                      data=kernel.dene_para[3, :]*dtwpe_tracer)
+                fh_out.create_dataset('wperp', (nptl, ),
+                                      data=kernel.dene_perp[3, :]*dtwpe_tracer)
+                fh_out.create_dataset('dgamma', (nptl, ), data=kernel.dgamma)
+                fdata = kernel.cross_half_sigmae.astype(int)
                 fh_out.create_dataset('cross_half_sigmae', (nptl, ), data=fdata)
-        cross_half_sigmae = np.logical_or(cond, cross_half_sigmae)
-    fh.close()
+
+    sweep_tracer_steps(steps, kernel, callback=save_data)
 
 
 def calc_wpara_wperp_2nd(plot_config, show_plot=True):
@@ -2390,6 +2295,10 @@ def get_cmd_args():
                         help='starting time frame')
     parser.add_argument('--tend', action="store", default='40', type=int,
                         help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
+    parser.add_argument('--ncores', action="store", default=None, type=int,
+                        help='maximum number of processes')
     parser.add_argument('--plot_interval', action="store", default='100', type=int,
                         help='plot only for every plot_interval frames')
     parser.add_argument('--nsteps', action="store", default='1', type=int,
@@ -2501,19 +2410,24 @@ def analysis_multi_frames(plot_config, args):
     """
     tframes = range(plot_config["tstart"], plot_config["tend"] + 1)
     nframes = len(tframes)
+    ckpt = checkpoint.for_frames('trans_relativistic', args)
     if args.time_loop:
-        for tframe in tframes:
-            print("Time frame: %d" % tframe)
-            plot_config["tframe"] = tframe
-            if args.plot_absj:
-                plot_absj(plot_config, show_plot=False)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                print("Time frame: %d" % tframe)
+                plot_config["tframe"] = tframe
+                if args.plot_absj:
+                    plot_absj(plot_config, show_plot=False)
+                ckpt.record(tframe)
     else:
-        ncores = multiprocessing.cpu_count()
-        ncores = 36
+        ncores = args.ncores or multiprocessing.cpu_count()
         if ncores > nframes:
             ncores = nframes
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
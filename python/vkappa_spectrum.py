@@ -4,6 +4,7 @@
 from __future__ import print_function
 
 import argparse
+import functools
 import itertools
 import json
 import multiprocessing
@@ -12,9 +13,10 @@ import h5py
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
-from joblib import Parallel, delayed
 from matplotlib.colors import LogNorm
 
+import checkpoint
+import parallel_backend
 import pic_information
 from json_functions import read_data_from_json
 from shell_functions import mkdir_p
@@ -87,6 +89,8 @@ def get_cmd_args():
                         help='starting time frame')
     parser.add_argument('--tend', action="store", default='10', type=int,
                         help='ending time frame')
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help='whether to skip the frames done by the last run')
     parser.add_argument('--var_name', action="store", default="vkappa",
                         help='variable name')
     return parser.parse_args()
@@ -109,13 +113,19 @@ def analysis_multi_frames(plot_config, args):
     """
     tframes = range(plot_config["tmin"], plot_config["tmax"] + 1)
     ncores = multiprocessing.cpu_count()
+    ckpt = checkpoint.for_frames('vkappa_spectrum', args)
     if args.time_loop:
-        for tframe in tframes:
-            plot_config["tframe"] = tframe
-            plot_spectrum(plot_config, show_plot=False)
+        with ckpt:
+            for tframe in tframes:
+                if ckpt.is_done(tframe):
+                    continue
+                plot_config["tframe"] = tframe
+                plot_spectrum(plot_config, show_plot=False)
+                ckpt.record(tframe)
     else:
-        Parallel(n_jobs=ncores)(delayed(process_input)(plot_config, args, tframe)
-                                for tframe in tframes)
+        backend = parallel_backend.get_backend(ncores)
+        backend.map(functools.partial(process_input, plot_config, args),
+                    tframes, checkpoint=ckpt)
 
 
 def main():
@@ -0,0 +1,195 @@
+"""
+Binary layouts of the VPIC output files as numpy dtypes
+
+Each layout is declared once here, and a whole header or a whole array of
+records is read with one np.fromfile or np.memmap call. The dump files
+start with the VPIC boilerplate (CHAR_BIT and the sizes of short, int,
+float and double, 0xcafe, 0xdeadbeef, 1.0f and 1.0), which is used to detect the byte order and to
+validate the file. The boilerplate is followed by the v0 header and the
+header of the array.
+
+    v0, pheader, ptl = read_particle_data(fname)
+    ux = ptl['u'][:, 0]
+"""
+import collections
+
+import numpy as np
+
+import instrument
+
+# CHAR_BIT, sizeof(short), sizeof(int), sizeof(float) and sizeof(double), as
+# written by WRITE_HEADER_V0
+TYPE_SIZES = (8, 2, 4, 4, 8)
+BOILERPLATE = np.dtype([('sizes', 'i1', 5), ('cafe', '<u2'),
+                        ('deadbeef', '<u4'), ('float_one', '<f4'),
+                        ('double_one', '<f8')])
+
+V0_FIELDS = ["version", "type", "nt", "nx", "ny", "nz", "dt", "dx", "dy",
+             "dz", "x0", "y0", "z0", "cvac", "eps0", "damp", "rank", "ndom",
+             "spid", "spqm"]
+V0_HEADER = np.dtype([(name, '<i4') for name in V0_FIELDS[:6]] +
+                     [(name, '<f4') for name in V0_FIELDS[6:16]] +
+                     [(name, '<i4') for name in V0_FIELDS[16:19]] +
+                     [('spqm', '<f4')])
+
+# the particle array is 1D, and the hydro and field arrays are 3D
+PARTICLE_ARRAY_HEADER = np.dtype([('size', '<i4'), ('ndim', '<i4'),
+                                  ('dim', '<i4')])
+HYDRO_ARRAY_HEADER = np.dtype([('size', '<i4'), ('ndim', '<i4'),
+                               ('nc', '<i4', 3)])
+
+PARTICLE = np.dtype([('dxyz', '<f4', 3), ('icell', '<i4'),
+                     ('u', '<f4', 3), ('q', '<f4')])
+
+# one record for each fields frame in the j.E files
+JDOTE_FIELDS = ['jcpara_dote', 'jcperp_dote', 'jmag_dote', 'jgrad_dote',
+                'jdiagm_dote', 'jpolar_dote', 'jexb_dote', 'jpara_dote',
+                'jperp_dote', 'jperp1_dote', 'jperp2_dote', 'jqnupara_dote',
+                'jqnuperp_dote', 'jtot_dote', 'jagy_dote', 'jdivu_dote']
+JDOTE_RECORD = np.dtype([(name, '<f4') for name in JDOTE_FIELDS])
+
+# the configuration of the MHD fields for the particle transport code
+MHD_CONFIG = np.dtype([('dgrid', '<f8', 13), ('igrid', '<i4', 14)])
+
+V0Header = collections.namedtuple("v0header", V0_FIELDS)
+ParticleHeader = collections.namedtuple("header_particle",
+                                        ["size", "ndim", "dim"])
+HydroHeader = collections.namedtuple("header_hydro", ["size", "ndim", "nc"])
+
+
+def file_dtype(array_header):
+    """The dtype of the whole header of a dump file
+    """
+    return np.dtype([('boilerplate', BOILERPLATE), ('v0', V0_HEADER),
+                     ('array', array_header)])
+
+
+def check_boilerplate(boilerplate):
+    """Byte order of a file from its boilerplate
+
+    Returns:
+        '<' or '>'
+
+    Raises:
+        ValueError: when the boilerplate is not from VPIC
+    """
+    if tuple(boilerplate['sizes']) != TYPE_SIZES:
+        raise ValueError("wrong type sizes in the boilerplate: %s" %
+                         str(tuple(boilerplate['sizes'])))
+    if boilerplate['cafe'] == 0xcafe:
+        order = '<'
+        boilerplate = np.asarray(boilerplate)
+    elif boilerplate['cafe'] == 0xfeca:
+        order = '>'
+        boilerplate = np.asarray(boilerplate).view(
+            BOILERPLATE.newbyteorder('>'))
+    else:
+        raise ValueError("0xcafe is not found in the boilerplate")
+    if (boilerplate['deadbeef'] != 0xdeadbeef or
+            boilerplate['float_one'] != 1.0 or
+            boilerplate['double_one'] != 1.0):
+        raise ValueError("corrupted boilerplate")
+    return order
+
+
+def read_header(fh, array_header):
+    """Read and validate the header of a dump file
+
+    Args:
+        fh: file name or file handler
+        array_header: PARTICLE_ARRAY_HEADER or HYDRO_ARRAY_HEADER
+
+    Returns:
+        header: the header record in little endian
+        order: the byte order of the file
+        offset: the size of the header
+    """
+    dtype = file_dtype(array_header)
+    header = np.array(np.memmap(fh, dtype=dtype, mode='r', shape=(1, )))
+    order = check_boilerplate(header[0]['boilerplate'])
+    if order != '<':
+        header = header.view(dtype.newbyteorder(order)).astype(dtype)
+    header = header[0]
+    if header['v0']['version'] != 0:
+        raise ValueError("unsupported header version %d" %
+                         header['v0']['version'])
+    return header, order, dtype.itemsize
+
+
+def v0_header(header):
+    """The v0 header as a namedtuple
+    """
+    v0 = header['v0']
+    return V0Header(*[v0[name] for name in V0_FIELDS])
+
+
+def read_particle_header(fh):
+    """Read the header of a particle dump file
+
+    Returns:
+        (v0, pheader, offset), where offset is the start of the particles
+    """
+    header, _, offset = read_header(fh, PARTICLE_ARRAY_HEADER)
+    array = header['array']
+    pheader = ParticleHeader(size=array['size'], ndim=array['ndim'],
+                             dim=array['dim'])
+    return (v0_header(header), pheader, offset)
+
+
+def read_hydro_header(fh):
+    """Read the header of a hydro or fields dump file
+
+    Returns:
+        (v0, hheader, offset), where offset is the start of the data
+    """
+    header, _, offset = read_header(fh, HYDRO_ARRAY_HEADER)
+    array = header['array']
+    hheader = HydroHeader(size=array['size'], ndim=array['ndim'],
+                          nc=array['nc'])
+    return (v0_header(header), hheader, offset)
+
+
+@instrument.stage('read_particle_data')
+def read_particle_data(fname):
+    """Read the headers and all the particles of a particle dump file
+
+    Returns:
+        (v0, pheader, data), where data is a structured array of PARTICLE
+    """
+    header, order, offset = read_header(fname, PARTICLE_ARRAY_HEADER)
+    array = header['array']
+    if array['size'] != PARTICLE.itemsize:
+        raise ValueError("particle size is %d instead of %d" %
+                         (array['size'], PARTICLE.itemsize))
+    with open(fname, 'rb') as fh:
+        fh.seek(offset)
+        data = np.fromfile(fh, dtype=PARTICLE.newbyteorder(order),
+                           count=array['dim'])
+    pheader = ParticleHeader(size=array['size'], ndim=array['ndim'],
+                             dim=array['dim'])
+    instrument.add_bytes('particle', offset + data.nbytes)
+    return (v0_header(header), pheader, data)
+
+
+def read_jdote(fname, ntf):
+    """Read the j.E records of ntf frames
+
+    Returns:
+        a structured array of JDOTE_RECORD with shape (ntf, )
+    """
+    with open(fname, 'rb') as fh:
+        data = np.fromfile(fh, dtype=JDOTE_RECORD, count=ntf)
+    instrument.add_bytes('jdote', data.nbytes)
+    if len(data) < ntf:
+        raise ValueError("%s has %d frames instead of %d" %
+                         (fname, len(data), ntf))
+    return data
+
+
+def write_mhd_config(fname, dgrid, igrid):
+    """Write the configuration of the MHD fields
+    """
+    config = np.zeros(1, dtype=MHD_CONFIG)
+    config['dgrid'] = dgrid
+    config['igrid'] = igrid
+    config.tofile(fname)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+X-point and O-point detector of Ay for all frames
+
+The critical points of Ay (X-points are saddles, O-points are extrema) are
+found with one vectorized pass over blocks of frames of the time-major Ay
+cube in data/Ay.gda. At each grid point, the gradient and the Hessian are
+calculated with central differences, and a Newton step gives the location
+of the critical point. The grid point owns the critical point when the
+location is close to it. The sign of the Hessian determinant
+classifies the point.
+
+The noise of Ay makes pairs of spurious X-points and O-points next to each
+other. So Ay is smoothed by a Gaussian filter of two cells, and an O-point
+and its nearest X-point are dropped when their Ay differ by less than a
+small fraction of the range of Ay in the frame.
+
+For each frame, the dominant X-line position, the reconnected flux and the
+number of islands are saved into one time-series file, whose name has the
+parameters of the detection. It is calculated again when Ay.gda changes.
+
+    series = get_xline_series(pic_run)
+    rate = np.gradient(series["flux"]) / dtf_wpe
+"""
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+
+from json_functions import read_data_from_json
+from lazy_import import lazy_module
+from shell_functions import mkdir_p
+
+ndimage = lazy_module('scipy.ndimage')
+
+XPOINT = 0
+OPOINT_MAX = 1
+OPOINT_MIN = 2
+
+XLINE_COLUMNS = ["tframe", "x", "z", "ay", "flux", "nislands"]
+# the width in cells of the Gaussian filter of Ay
+SMOOTH = 2.0
+# the pairs of critical points whose Ay differ by less than this fraction of
+# the range of Ay are noise
+MIN_FLUX = 1E-3
+
+
+def find_critical_points(ay, dx, dz, periodic_x=False, smooth=SMOOTH):
+    """Find the critical points of Ay in a block of frames
+
+    Args:
+        ay: Ay with shape (nt, nz, nx)
+        dx, dz: grid sizes
+        periodic_x: whether Ay is periodic along x. Otherwise, the points
+            at the x boundaries are skipped.
+        smooth: the width (in cells) of the Gaussian filter applied to each
+            frame to suppress the noise. The points are located on the
+            filtered Ay, but their Ay is from the original Ay, since the
+            filter changes Ay at the X-points.
+
+    Returns:
+        a dictionary of the arrays of all critical points, including it, iz,
+        ix (the grid point), x, z (the location relative to the grid point
+        0, 0), ay, kind (XPOINT, OPOINT_MAX or OPOINT_MIN), and hzz
+    """
+    ay = np.asarray(ay, dtype=np.float64)
+    nt, nz, nx = ay.shape
+    center = ay[:, 1:-1, :] if periodic_x else ay[:, 1:-1, 1:-1]
+    if smooth > 0:
+        mode = ['nearest', 'nearest', 'wrap' if periodic_x else 'nearest']
+        ay = ndimage.gaussian_filter(ay, sigma=(0, smooth, smooth), mode=mode)
+    if periodic_x:
+        ay = np.concatenate([ay[:, :, -1:], ay, ay[:, :, :1]], axis=2)
+    left = ay[:, 1:-1, :-2]
+    right = ay[:, 1:-1, 2:]
+    bottom = ay[:, :-2, 1:-1]
+    top = ay[:, 2:, 1:-1]
+    gx = (right - left) / (2 * dx)
+    gz = (top - bottom) / (2 * dz)
+    hxx = (right - 2 * ay[:, 1:-1, 1:-1] + left) / dx**2
+    hzz = (top - 2 * ay[:, 1:-1, 1:-1] + bottom) / dz**2
+    hxz = (ay[:, 2:, 2:] - ay[:, 2:, :-2] - ay[:, :-2, 2:] +
+           ay[:, :-2, :-2]) / (4 * dx * dz)
+    det = hxx * hzz - hxz**2
+    idet = np.zeros(det.shape)
+    np.divide(1.0, det, out=idet, where=det != 0)
+    shift_x = -(hzz * gx - hxz * gz) * idet
+    shift_z = -(hxx * gz - hxz * gx) * idet
+    # The Newton step is not exact, so a point half way between two grid
+    # points can be missed by both of them. The range is larger than half a
+    # cell, and the duplicates are removed later.
+    crit = ((det != 0) & (np.abs(shift_x) <= 0.75 * dx) &
+            (np.abs(shift_z) <= 0.75 * dz))
+    it, iz, ix = np.where(crit)
+    points = {}
+    points["it"] = it
+    points["iz"] = iz + 1
+    points["ix"] = ix if periodic_x else ix + 1
+    sx = shift_x[crit]
+    sz = shift_z[crit]
+    points["x"] = points["ix"] * dx + sx
+    points["z"] = points["iz"] * dz + sz
+    points["ay"] = center[crit] + 0.5 * (gx[crit] * sx + gz[crit] * sz)
+    kind = np.full(len(it), XPOINT, dtype=np.int32)
+    opoint = det[crit] > 0
+    kind[opoint & (hxx[crit] < 0)] = OPOINT_MAX
+    kind[opoint & (hxx[crit] > 0)] = OPOINT_MIN
+    points["kind"] = kind
+    points["hzz"] = hzz[crit]
+
+    order = np.lexsort((points["x"], kind, it))
+    points = {key: points[key][order] for key in points}
+    dup = ((np.diff(points["it"]) == 0) & (np.diff(points["kind"]) == 0) &
+           (np.abs(np.diff(points["x"])) < dx) &
+           (np.abs(np.diff(points["z"])) < dz))
+    keep = np.concatenate(([True], ~dup))
+    points = {key: points[key][keep] for key in points}
+    return points
+
+
+def drop_noise_pairs(points, min_flux):
+    """Drop the O-points whose Ay is within min_flux of Ay at their
+    nearest X-point, together with these X-points
+
+    Args:
+        points: the critical points of one frame
+        min_flux: the minimum difference of Ay
+    """
+    while True:
+        iop, = np.where(points["kind"] != XPOINT)
+        ixp, = np.where(points["kind"] == XPOINT)
+        if len(iop) == 0 or len(ixp) == 0:
+            return points
+        dist2 = ((points["x"][iop, None] - points["x"][None, ixp])**2 +
+                 (points["z"][iop, None] - points["z"][None, ixp])**2)
+        nearest = ixp[np.argmin(dist2, axis=1)]
+        weak = np.abs(points["ay"][iop] - points["ay"][nearest]) < min_flux
+        if not np.any(weak):
+            return points
+        # the pairs left by the dropped points are checked again
+        keep = np.ones(len(points["kind"]), dtype=bool)
+        keep[iop[weak]] = False
+        keep[nearest[weak]] = False
+        points = {key: points[key][keep] for key in points}
+
+
+def dominant_xpoint(points):
+    """Index of the dominant X-point in the points of one frame
+
+    The X-point that has reconnected the most flux has Ay farthest from
+    the O-points (the island centers), i.e., the lowest Ay when the islands
+    are maxima of Ay and the highest Ay when they are minima. The type of
+    the islands is given by the curvature of Ay across the X-points.
+
+    Args:
+        points: the critical points of one frame
+
+    Returns:
+        the index of the dominant X-point, -1 when there is none
+    """
+    ixp, = np.where(points["kind"] == XPOINT)
+    if len(ixp) == 0:
+        return -1
+    sign = -np.sign(np.mean(points["hzz"][ixp]))
+    return ixp[np.argmin(points["ay"][ixp] * sign)]
+
+
+def xline_series(ay, x, z, tframes, periodic_x=False, smooth=SMOOTH,
+                 min_flux=MIN_FLUX):
+    """The dominant X-line, reconnected flux and island count of frames
+
+    Args:
+        ay: Ay with shape (nt, nz, nx)
+        x, z: the grid coordinates
+        tframes: the time frames of ay
+        periodic_x: whether Ay is periodic along x
+        smooth: the width of the Gaussian filter in cells
+        min_flux: the pairs of X-points and O-points whose Ay differ by less
+            than this fraction of the range of Ay are dropped as noise
+
+    Returns:
+        (nt, len(XLINE_COLUMNS)) array. The X-line is NaN and the flux is
+        max(Ay) - min(Ay) along the midplane when there is no X-point.
+    """
+    dx = x[1] - x[0]
+    dz = z[1] - z[0]
+    points = find_critical_points(ay, dx, dz, periodic_x, smooth)
+    nt, nz, _ = ay.shape
+    series = np.zeros((nt, len(XLINE_COLUMNS)))
+    series[:, 0] = tframes
+    for it in range(nt):
+        cond = points["it"] == it
+        frame = {key: points[key][cond] for key in points}
+        frame = drop_noise_pairs(frame, min_flux * np.ptp(ay[it]))
+        series[it, 5] = np.sum(frame["kind"] != XPOINT)
+        ipoint = dominant_xpoint(frame)
+        if ipoint < 0:
+            series[it, 1:4] = np.nan
+            series[it, 4] = ay[it, nz // 2].max() - ay[it, nz // 2].min()
+            continue
+        ay_x = frame["ay"][ipoint]
+        series[it, 1] = frame["x"][ipoint] + x[0]
+        series[it, 2] = frame["z"][ipoint] + z[0]
+        series[it, 3] = ay_x
+        # the island center is the extremum of Ay on the other side
+        if frame["hzz"][ipoint] < 0:
+            series[it, 4] = ay[it].max() - ay_x
+        else:
+            series[it, 4] = ay_x - ay[it].min()
+    return series
+
+
+def calc_xline_series(pic_info, run_dir, zwidth=None, periodic_x=False,
+                      smooth=SMOOTH, min_flux=MIN_FLUX, mem_budget=2**30):
+    """Calculate the X-line time series of all frames of one run
+
+    Args:
+        pic_info: namedtuple for the PIC simulation information
+        run_dir: the run root directory including data/Ay.gda
+        zwidth: only the band of rows within zwidth (in di) of the midplane
+            are read. The whole box is read when it is None.
+        periodic_x: whether Ay is periodic along x
+        smooth: the width of the Gaussian filter in cells
+        min_flux: the fraction of the range of Ay of the noise
+        mem_budget: memory budget in bytes for one block of frames
+    """
+    nx, nz, ntf = pic_info.nx, pic_info.nz, pic_info.ntf
+    x = np.asarray(pic_info.x_di)
+    z = np.asarray(pic_info.z_di)
+    fname = run_dir + 'data/Ay.gda'
+    ntf = min(ntf, os.path.getsize(fname) // (nx * nz * 4))
+    ay_cube = np.memmap(fname, dtype='float32', mode='r',
+                        shape=(ntf, nz, nx), order='C')
+    if zwidth is None:
+        iz0, iz1 = 0, nz
+    else:
+        zmid = 0.5 * (z[0] + z[-1])
+        iz0, iz1 = np.searchsorted(z, [zmid - zwidth, zmid + zwidth])
+        iz0 = max(iz0 - 1, 0)
+        iz1 = min(iz1 + 1, nz)
+    # about 12 float64 temporary arrays for each frame
+    nt_block = max(1, mem_budget // ((iz1 - iz0) * nx * 8 * 12))
+    series = []
+    for t0 in range(0, ntf, nt_block):
+        t1 = min(t0 + nt_block, ntf)
+        print("Frames %d-%d of %d" % (t0, t1, ntf))
+        ay = np.array(ay_cube[t0:t1, iz0:iz1], dtype=np.float64)
+        series.append(xline_series(ay, x, z[iz0:iz1], np.arange(t0, t1),
+                                   periodic_x, smooth, min_flux))
+    return np.concatenate(series)
+
+
+def xline_series_fname(pic_run, zwidth=None, periodic_x=False, smooth=SMOOTH,
+                       min_flux=MIN_FLUX):
+    """File name of the X-line time series of one run and the parameters
+    """
+    zband = 'all' if zwidth is None else '%g' % zwidth
+    return ('../data/xpoints/xline_%s_z%s_p%d_s%g_f%g.dat' %
+            (pic_run, zband, int(periodic_x), smooth, min_flux))
+
+
+def get_xline_series(pic_run, run_dir=None, **kwargs):
+    """Get the X-line time series, calculating it when it does not exist or
+    Ay.gda is newer
+
+    Args:
+        pic_run: PIC run name
+        run_dir: the run root directory. pic_info.run_dir when None.
+        kwargs: other arguments of calc_xline_series
+
+    Returns:
+        a dictionary of 1D arrays with the keys in XLINE_COLUMNS
+    """
+    fname = xline_series_fname(pic_run, kwargs.get("zwidth"),
+                               kwargs.get("periodic_x", False),
+                               kwargs.get("smooth", SMOOTH),
+                               kwargs.get("min_flux", MIN_FLUX))
+    picinfo_fname = '../data/pic_info/pic_info_' + pic_run + '.json'
+    pic_info = read_data_from_json(picinfo_fname)
+    if run_dir is None:
+        run_dir = pic_info.run_dir
+    ay_fname = run_dir + 'data/Ay.gda'
+    if (not os.path.isfile(fname) or
+            os.path.getmtime(ay_fname) > os.path.getmtime(fname)):
+        series = calc_xline_series(pic_info, run_dir, **kwargs)
+        mkdir_p(os.path.dirname(fname))
+        np.savetxt(fname, series, header=" ".join(XLINE_COLUMNS))
+    series = np.atleast_2d(np.loadtxt(fname))
+    return {key: series[:, icol] for icol, key in enumerate(XLINE_COLUMNS)}
+
+
+def get_cmd_args():
+    """Get command line arguments
+    """
+    default_pic_run = 'mime400_Tb_T0_10_weak'
+    parser = argparse.ArgumentParser(description='X-points and O-points of Ay')
+    parser.add_argument('--pic_run', action="store",
+                        default=default_pic_run, help='PIC run name')
+    parser.add_argument('--pic_run_dir', action="store", default=None,
+                        help='PIC run directory')
+    parser.add_argument('--zwidth', action="store", default=None, type=float,
+                        help='half width (in di) of the band around midplane')
+    parser.add_argument('--periodic_x', action="store_true", default=False,
+                        help='whether the fields are periodic along x')
+    parser.add_argument('--smooth', action="store", default=SMOOTH,
+                        type=float,
+                        help='width of the Gaussian filter in cells')
+    parser.add_argument('--min_flux', action="store", default=MIN_FLUX,
+                        type=float,
+                        help='fraction of the range of Ay of the noise')
+    return parser.parse_args()
+
+
+def main():
+    """business logic for when running this module as the primary one!"""
+    args = get_cmd_args()
+    kwargs = {"zwidth": args.zwidth, "periodic_x": args.periodic_x,
+              "smooth": args.smooth, "min_flux": args.min_flux}
+    fname = xline_series_fname(args.pic_run, **kwargs)
+    if os.path.isfile(fname):
+        os.remove(fname)
+    series = get_xline_series(args.pic_run, args.pic_run_dir, **kwargs)
+    print("Maximum number of islands: %d" % series["nislands"].max())
+
+
+if __name__ == "__main__":
+    main()